@@ -5,6 +5,35 @@ import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
 import numpy as np
+import time
+import collections
+from vtk.util import numpy_support
+from ForcepsDeliveryVRLib import PoseFilter, FILTER_METHODS, FILTER_ONE_EURO
+from ForcepsDeliveryVRLib import EvaluationScheduler, ObserverManager
+from ForcepsDeliveryVRLib.FrameGovernor import FrameGovernor
+from ForcepsDeliveryVRLib import PoseSnapshot, ScoringWorker
+from ForcepsDeliveryVRLib import Scoring
+from ForcepsDeliveryVRLib import SessionDatabase
+from ForcepsDeliveryVRLib.SceneBatch import BatchedSceneUpdate
+from ForcepsDeliveryVRLib.SceneSnapshot import SceneSnapshot
+from ForcepsDeliveryVRLib.TextOverlay import TextOverlay
+from ForcepsDeliveryVRLib.TrajectoryFile import TrajectoryWriter, TrajectoryReader, POSE_LEFT, POSE_RIGHT, POSE_HMD
+from ForcepsDeliveryVRLib import TrajectoryAnalytics
+from ForcepsDeliveryVRLib.PlacementGrid import PlacementGrids, PlacementGridBake
+from ForcepsDeliveryVRLib.TrajectoryMatching import ExpertMatcher
+from ForcepsDeliveryVRLib.TrajectoryPlayback import TrajectoryPlayback
+from ForcepsDeliveryVRLib.GhostForceps import GhostForceps
+from ForcepsDeliveryVRLib import SharedGeometry
+from ForcepsDeliveryVRLib.PoseSource import SocketPoseSource, IGTL_PORT
+from ForcepsDeliveryVRLib.ControllerPoseSource import VRControllerPoseSource
+from ForcepsDeliveryVRLib.AssetSync import AssetServer, AssetClient, ContentStore, cachedAssetPaths, ASSET_PORT
+from ForcepsDeliveryVRLib.Scoring import (
+  PHASE_ARRANGEMENT, PHASE_PRESENTATION,
+  PHASE_INITIAL_PLACEMENT_LEFT, PHASE_FINAL_PLACEMENT_LEFT,
+  PHASE_INITIAL_PLACEMENT_RIGHT, PHASE_FINAL_PLACEMENT_RIGHT, PHASE_ROTATION, PHASE_TRACTION)
+from ForcepsDeliveryVRLib.PelvicAxis import PelvicAxis, carusArc, findOutlet
+from ForcepsDeliveryVRLib.HeadRotation import HeadRotation
+from ForcepsDeliveryVRLib.TissueDeformation import TissueDeformation, meshEdges, BLADE_SEGMENT
 
 #
 # ForcepsDeliveryVR
@@ -31,57 +60,53 @@ See more information in <a href="https://github.com/organization/projectname#For
 This file was developed by Monica Garcia-Sevilla and Abian Hernandez at Universidad de Las Palmas de Gran Canaria.
 """
 
-    # Additional initialization step after application startup is complete
-    slicer.app.connect("startupCompleted()", registerSampleData)
-
 #
-# Register sample data sets in Sample Data module
+# Evaluation phases
+#
+# The phase panels are built from this table: one collapsible button per step, and per
+# phase a group box with the instruction and the Start/Next/Retry/Help buttons. The text
+# model shown in VR during a phase is named after the phase (Resources/Models/Texts).
 #
 
-def registerSampleData():
-  """
-  Add data sets to Sample Data module.
-  """
-  # It is always recommended to provide sample data for users to make it easy to try the module,
-  # but if no sample data is available then this method (and associated startupCompeted signal connection) can be removed.
-
-  import SampleData
-  iconsPath = os.path.join(os.path.dirname(__file__), 'Resources/Icons')
-
-  # To ensure that the source code repository remains small (can be downloaded and installed quickly)
-  # it is recommended to store data sets that are larger than a few MB in a Github release.
-
-  # ForcepsDeliveryVR1
-  SampleData.SampleDataLogic.registerCustomSampleDataSource(
-    # Category and sample name displayed in Sample Data module
-    category='ForcepsDeliveryVR',
-    sampleName='ForcepsDeliveryVR1',
-    # Thumbnail should have size of approximately 260x280 pixels and stored in Resources/Icons folder.
-    # It can be created by Screen Capture module, "Capture all views" option enabled, "Number of images" set to "Single".
-    thumbnailFileName=os.path.join(iconsPath, 'ForcepsDeliveryVR1.png'),
-    # Download URL and target file name
-    uris="https://github.com/Slicer/SlicerTestingData/releases/download/SHA256/998cb522173839c78657f4bc0ea907cea09fd04e44601f17c82ea27927937b95",
-    fileNames='ForcepsDeliveryVR1.nrrd',
-    # Checksum to ensure file integrity. Can be computed by this command:
-    #  import hashlib; print(hashlib.sha256(open(filename, "rb").read()).hexdigest())
-    checksums = 'SHA256:998cb522173839c78657f4bc0ea907cea09fd04e44601f17c82ea27927937b95',
-    # This node name will be used when the data set is loaded
-    nodeNames='ForcepsDeliveryVR1'
-  )
-
-  # ForcepsDeliveryVR2
-  SampleData.SampleDataLogic.registerCustomSampleDataSource(
-    # Category and sample name displayed in Sample Data module
-    category='ForcepsDeliveryVR',
-    sampleName='ForcepsDeliveryVR2',
-    thumbnailFileName=os.path.join(iconsPath, 'ForcepsDeliveryVR2.png'),
-    # Download URL and target file name
-    uris="https://github.com/Slicer/SlicerTestingData/releases/download/SHA256/1a64f3f422eb3d1c9b093d1a18da354b13bcf307907c66317e2463ee530b7a97",
-    fileNames='ForcepsDeliveryVR2.nrrd',
-    checksums = 'SHA256:1a64f3f422eb3d1c9b093d1a18da354b13bcf307907c66317e2463ee530b7a97',
-    # This node name will be used when the data set is loaded
-    nodeNames='ForcepsDeliveryVR2'
-  )
+PHASE_STEPS = [
+  ('STEP 1: Preparation', [
+    (PHASE_ARRANGEMENT, 'Forceps Arrangement', 'Place forceps together'),
+    (PHASE_PRESENTATION, 'Forceps Presentation', 'Present forceps')]),
+  ('STEP 2: Placement Left Forceps', [
+    (PHASE_INITIAL_PLACEMENT_LEFT, 'Initial Placement Left', 'Place left forceps vertically'),
+    (PHASE_FINAL_PLACEMENT_LEFT, 'Final Placement Left', 'Introduce the left forceps')]),
+  ('STEP 3: Placement Right Forceps', [
+    (PHASE_INITIAL_PLACEMENT_RIGHT, 'Initial Placement Right', 'Place right forceps vertically'),
+    (PHASE_FINAL_PLACEMENT_RIGHT, 'Final Placement Right', 'Introduce the right forceps')]),
+  ('STEP 4: Kielland Rotation', [
+    (PHASE_ROTATION, 'Kielland Rotation', 'Lock the forceps and rotate the head')]),
+  ('STEP 5: Traction', [
+    (PHASE_TRACTION, 'Traction', 'Pull along the pelvic axis')]),
+  ]
+
+PHASE_TITLES = {phase: title for stepTitle, phases in PHASE_STEPS for phase, title, instruction in phases}
+
+# shown by the Help button of each phase
+PHASE_HELP = {
+  PHASE_ARRANGEMENT: 'Hold the two forceps closed as they will be applied: the blades crossed, '
+    'with the same orientation, and the handles at the same level.',
+  PHASE_PRESENTATION: 'Present the closed forceps in front of the perineum, in the orientation '
+    'they will have on the fetal head, with the handles horizontal.',
+  PHASE_INITIAL_PLACEMENT_LEFT: 'Hold the left forceps vertically, with the blade aligned with the '
+    'side of the fetal head, and bring the tip close to the head.',
+  PHASE_FINAL_PLACEMENT_LEFT: 'Introduce the left blade along the side of the fetal head, until '
+    'the tip lies on the cheek, between the eye and the ear.',
+  PHASE_INITIAL_PLACEMENT_RIGHT: 'Hold the right forceps vertically, with the blade aligned with the '
+    'side of the fetal head, and bring the tip close to the head.',
+  PHASE_FINAL_PLACEMENT_RIGHT: 'Introduce the right blade along the side of the fetal head, until '
+    'the tip lies on the cheek, between the eye and the ear.',
+  PHASE_ROTATION: 'With both blades placed, lock the forceps and turn the handles a quarter turn '
+    'about the pelvic axis, to bring the occiput anterior. Keep the blades on the cheeks.',
+  PHASE_TRACTION: 'Pull the locked forceps along the pelvic axis, following its curve: the handles '
+    'rise as the head descends.',
+  }
+
+PhaseWidgets = collections.namedtuple('PhaseWidgets', ['groupBox', 'startButton', 'nextButton', 'retryButton', 'helpButton'])
 
 #
 # ForcepsDeliveryVRWidget
@@ -99,8 +124,28 @@ class ForcepsDeliveryVRWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
     ScriptedLoadableModuleWidget.__init__(self, parent)
     VTKObservationMixin.__init__(self)  # needed for parameter node observation
     self.logic = None
-    self.callbackObserverTag = -1
-    self.observerTag = None
+    self.observerManager = ObserverManager()
+    self.phaseSnapshots = {}
+    # Local paths of the resources synchronized from an asset server (None: the module resources)
+    self.assetPaths = None
+    self.expertMatchSampleCount = -1
+    # Maneuver last recognized in free practice (index in Scoring.PHASES)
+    self.freePracticeManeuver = Scoring.MANEUVER_NONE
+    self.freePracticeCodes = None
+    # Evaluate the active phase once per frame, at the HMD refresh rate (Hz)
+    self.evaluationRate = 90
+    self.evaluationScheduler = EvaluationScheduler(self.callbackFunction)
+    self.evaluationTimer = qt.QTimer()
+    self.evaluationTimer.setInterval(int(1000 / self.evaluationRate))
+    self.evaluationTimer.connect('timeout()', self.onEvaluationTimeout)
+    # Evaluation work is reduced when it takes too long for the frame rate
+    self.frameGovernor = FrameGovernor(budget=0.25 / self.evaluationRate)
+    # Replay of recorded trajectories, at display rate (Hz)
+    self.playbackRate = 60
+    self.playbackTimer = qt.QTimer()
+    self.playbackTimer.setInterval(int(1000 / self.playbackRate))
+    self.playbackTimer.connect('timeout()', self.onPlaybackTimeout)
+    self.playbackClock = None
 
   def setup(self):
     """
@@ -108,9 +153,7 @@ class ForcepsDeliveryVRWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
     """
     ScriptedLoadableModuleWidget.setup(self)
 
-    # Widget variables
-    self.logic = ForcepsDeliveryVRLogic()
-    self.vrLogic = slicer.modules.virtualreality.logic()
+    setupStartTime = time.perf_counter()
 
     # System error margin
     self.errorMargin_dist1 = 0
@@ -118,30 +161,19 @@ class ForcepsDeliveryVRWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
     self.errorMargin_angle = 0 # degrees
 
     # CREATE PATHS
+    self.ForcepsDeliveryVR_resourcesPath = slicer.modules.forcepsdeliveryvr.path.replace("ForcepsDeliveryVR.py","") + 'Resources/'
     self.ForcepsDeliveryVR_modelsPath = slicer.modules.forcepsdeliveryvr.path.replace("ForcepsDeliveryVR.py","") + 'Resources/Models/'
     self.ForcepsDeliveryVR_phaseTextsPath = slicer.modules.forcepsdeliveryvr.path.replace("ForcepsDeliveryVR.py","") + 'Resources/Models/Texts/'
     self.ForcepsDeliveryVR_dataPath = slicer.modules.forcepsdeliveryvr.path.replace("ForcepsDeliveryVR.py","") + 'Resources/Data/'
     
     self.ForcepsDeliveryVR_iconsPath = slicer.modules.forcepsdeliveryvr.path.replace("ForcepsDeliveryVR.py","") + 'Resources/Data/Icons/'
-    # ICONS
-    iconPlayPath = os.path.join(self.ForcepsDeliveryVR_iconsPath,'play.png')
-    iconPausePath = os.path.join(self.ForcepsDeliveryVR_iconsPath,'pause.png')
-    iconRetryPath = os.path.join(self.ForcepsDeliveryVR_iconsPath,'retry.png')
-    iconNextPath = os.path.join(self.ForcepsDeliveryVR_iconsPath,'next.png')
-    iconHelpPath = os.path.join(self.ForcepsDeliveryVR_iconsPath,'info.png')
-
-
-    #
-    # Setup view
-    #
+    # ICONS, loaded once and shared by all the buttons
+    self.icons = {}
+    for name in ['play', 'pause', 'retry', 'next', 'info']:
+      self.icons[name] = qt.QIcon(os.path.join(self.ForcepsDeliveryVR_iconsPath, name + '.png'))
 
-    # show 3D View
-    self.layoutManager= slicer.app.layoutManager()
-    self.layoutManager.setLayout(slicer.vtkMRMLLayoutNode.SlicerLayoutOneUp3DView)
-    # quit box and axis
-    view = slicer.util.getNode('View1')
-    view.SetBoxVisible(0)
-    view.SetAxisLabelsVisible(0)
+    # The 3D view layout and the VR logic are set up when VR is activated or the data is loaded,
+    # so that opening the module does not touch the views or the VR module.
 
     # UI definition
 
@@ -172,6 +204,17 @@ class ForcepsDeliveryVRWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
     self.activateVRButton.setText('Activate VR')
     initFormLayout.addRow(self.activateVRButton)
 
+    # Shared session: models taken from another device, or served to the others
+    self.assetServerLineEdit = qt.QLineEdit()
+    self.assetServerLineEdit.setPlaceholderText('local resources')
+    self.assetServerLineEdit.setToolTip('Get the models from the device serving them (host or host:port); they are cached, so only changes are transferred again')
+    initFormLayout.addRow('Asset server:', self.assetServerLineEdit)
+
+    self.shareAssetsCheckBox = qt.QCheckBox('Share assets')
+    self.shareAssetsCheckBox.checked = False
+    self.shareAssetsCheckBox.setToolTip('Serve the models of this module to the devices that join the session (port %d)' % ASSET_PORT)
+    initFormLayout.addRow(self.shareAssetsCheckBox)
+
     # Load models and other data
     self.loadDataButton = qt.QPushButton("Load Data")
     self.loadDataButton.enabled = True
@@ -202,259 +245,167 @@ class ForcepsDeliveryVRWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
     self.controllersVisibilityCheckBox.checked = True
     self.controllersVisibilitySelection.addWidget(self.controllersVisibilityCheckBox)
 
+    # Trainee, used to store the results of each phase
+    self.traineeLineEdit = qt.QLineEdit()
+    self.traineeLineEdit.setPlaceholderText('anonymous')
+    configFormLayout.addRow('Trainee:', self.traineeLineEdit)
+
+    # Expert whose successful recordings of each phase are the references of the trainee's motion
+    self.expertLineEdit = qt.QLineEdit()
+    self.expertLineEdit.setPlaceholderText('none')
+    self.expertLineEdit.setToolTip('Compare the motion with the successful attempts recorded by this trainee')
+    configFormLayout.addRow('Expert:', self.expertLineEdit)
+
+    # Controller pose filtering
+    self.poseFilterComboBox = qt.QComboBox()
+    self.poseFilterComboBox.addItems(FILTER_METHODS)
+    self.poseFilterComboBox.setCurrentText(FILTER_ONE_EURO)
+    self.poseFilterComboBox.setToolTip('Filter applied to the controller poses before checking the maneuvers')
+    configFormLayout.addRow('Pose filter:', self.poseFilterComboBox)
+
+    self.posePredictionSpinBox = qt.QSpinBox()
+    self.posePredictionSpinBox.setRange(0, 50)
+    self.posePredictionSpinBox.setValue(0)
+    self.posePredictionSpinBox.setSuffix(' ms')
+    self.posePredictionSpinBox.setToolTip('Extrapolate the filtered poses ahead to compensate for display latency')
+    configFormLayout.addRow('Pose prediction:', self.posePredictionSpinBox)
+
+    # Source of the forceps and HMD poses
+    self.poseSourceComboBox = qt.QComboBox()
+    self.poseSourceComboBox.addItems(['VR controllers', 'Tracker (OpenIGTLink)'])
+    self.poseSourceComboBox.setToolTip('Read the poses from the VR controllers or from an OpenIGTLink tracker server')
+    configFormLayout.addRow('Pose source:', self.poseSourceComboBox)
+
+    self.trackerAddressLineEdit = qt.QLineEdit()
+    self.trackerAddressLineEdit.setPlaceholderText('127.0.0.1:%d' % IGTL_PORT)
+    self.trackerAddressLineEdit.setToolTip('Tracker server (host:port) sending TRANSFORM messages of ForcepsLeft, ForcepsRight and HMD')
+    self.trackerAddressLineEdit.enabled = False
+    configFormLayout.addRow('Tracker address:', self.trackerAddressLineEdit)
+
+    # Placement checks with precomputed lookup grids (experimental, see PlacementGrid)
+    self.placementGridsCheckBox = qt.QCheckBox('Placement lookup grids (experimental)')
+    self.placementGridsCheckBox.checked = False
+    self.placementGridsCheckBox.setToolTip('Check the placement phases with voxel grids baked in the background from the head landmarks (cached on disk). '
+      'Slower than the analytic checks, and may differ from them within half a voxel of a boundary')
+    configFormLayout.addRow(self.placementGridsCheckBox)
+
+    # Deformation of the mother model around the blades
+    self.tissueDeformationCheckBox = qt.QCheckBox('Deform mother tissue')
+    self.tissueDeformationCheckBox.checked = False
+    self.tissueDeformationCheckBox.setToolTip('Push the surface of the mother model away from the blades during the phases')
+    configFormLayout.addRow(self.tissueDeformationCheckBox)
+
+    # Instrumentation
+    self.instrumentationLabel = qt.QLabel('0 transform observers')
+    configFormLayout.addRow('Evaluation:', self.instrumentationLabel)
+
+    self.expertGhostCheckBox = qt.QCheckBox('Show expert ghost')
+    self.expertGhostCheckBox.checked = False
+    self.expertGhostCheckBox.setToolTip('Show transparent forceps that replay the last successful attempt of the expert')
+    configFormLayout.addRow(self.expertGhostCheckBox)
+
+    self.expertMatchLabel = qt.QLabel('-')
+    configFormLayout.addRow('Expert match:', self.expertMatchLabel)
+
+    self.qualityTierLabel = qt.QLabel(self.frameGovernor.tier.name)
+    self.qualityTierLabel.setToolTip('Evaluation work is reduced in lower tiers to keep the headset frame rate')
+    configFormLayout.addRow('Quality tier:', self.qualityTierLabel)
+
     #
     # EVALUATION
     #
-    self.Step1CollapsibleButton = ctk.ctkCollapsibleButton()
-    self.Step1CollapsibleButton.text = "STEP 1: Preparation"
-    self.Step1CollapsibleButton.collapsed = True
-    self.layout.addWidget(self.Step1CollapsibleButton)
-
-    Step1FormLayout = qt.QFormLayout(self.Step1CollapsibleButton)
-
-    # --- FORCEPS ARRANGEMENT ---
-    self.ArrangementGroupBox = ctk.ctkCollapsibleGroupBox()
-    self.ArrangementGroupBox.setTitle("Forceps Arrangement")
-    self.ArrangementGroupBox.collapsed = True
-    Step1FormLayout.addRow(self.ArrangementGroupBox)
-    ArrangementGroupBox_Layout = qt.QFormLayout(self.ArrangementGroupBox)
-    # self.Step1GroupBox.setStyleSheet("background-color: rgb(176,231,169);")
-
-    self.arrangementText = qt.QLabel('Place forceps together')
-    self.arrangementText.setStyleSheet("font-size: 14px; font-weight: bold;")
-    ArrangementGroupBox_Layout.addRow(self.arrangementText)
-
-    self.arrangementHorizontalLayout = qt.QHBoxLayout()
-    ArrangementGroupBox_Layout.addRow(self.arrangementHorizontalLayout)
-
-    # Start/Stop Real Time
-    self.start_arrangement = qt.QPushButton("Start")
-    self.start_arrangement.enabled = True
-    self.start_arrangement_icon_play = qt.QIcon(iconPlayPath)
-    self.start_arrangement_icon_pause = qt.QIcon(iconPausePath)
-    self.start_arrangement.setIcon(self.start_arrangement_icon_play)
-    self.arrangementHorizontalLayout.addWidget(self.start_arrangement)
-
-    # Next step
-    self.next_arrangement = qt.QPushButton("Next")
-    self.next_arrangement.enabled = False
-    self.next_arrangement_icon = qt.QIcon(iconNextPath)
-    self.next_arrangement.setIcon(self.next_arrangement_icon)
-    self.arrangementHorizontalLayout.addWidget(self.next_arrangement)
-
-    #  Help
-    self.help_arrangement = qt.QPushButton("Help")
-    self.help_arrangement.enabled = True
-    self.help_arrangement_icon = qt.QIcon(iconHelpPath)
-    self.help_arrangement.setIcon(self.help_arrangement_icon)
-    self.arrangementHorizontalLayout.addWidget(self.help_arrangement)
-
-
-    # --- FORCEPS PRESENTATION ---
-    self.PresentationGroupBox = ctk.ctkCollapsibleGroupBox()
-    self.PresentationGroupBox.setTitle("Forceps Presentation")
-    self.PresentationGroupBox.collapsed = True
-    Step1FormLayout.addRow(self.PresentationGroupBox)
-    PresentationGroupBox_Layout = qt.QFormLayout(self.PresentationGroupBox)
-    # self.Step1GroupBox.setStyleSheet("background-color: rgb(176,231,169);")
-
-    self.presentationText = qt.QLabel('Present forceps')
-    self.presentationText.setStyleSheet("font-size: 14px; font-weight: bold;")
-    PresentationGroupBox_Layout.addRow(self.presentationText)
-
-    self.presentationHorizontalLayout = qt.QHBoxLayout()
-    PresentationGroupBox_Layout.addRow(self.presentationHorizontalLayout)
-
-    # Start/Stop Real Time
-    self.start_presentation = qt.QPushButton("Start")
-    self.start_presentation.enabled = True
-    self.start_presentation_icon_play = qt.QIcon(iconPlayPath)
-    self.start_presentation_icon_pause = qt.QIcon(iconPausePath)
-    self.start_presentation.setIcon(self.start_presentation_icon_play)
-    self.presentationHorizontalLayout.addWidget(self.start_presentation)
-
-    # Next step
-    self.next_presentation = qt.QPushButton("Next")
-    self.next_presentation.enabled = False
-    self.next_presentation_icon = qt.QIcon(iconNextPath)
-    self.next_presentation.setIcon(self.next_presentation_icon)
-    self.presentationHorizontalLayout.addWidget(self.next_presentation)
-
-    #  Help
-    self.help_presentation = qt.QPushButton("Help")
-    self.help_presentation.enabled = True
-    self.help_presentation_icon = qt.QIcon(iconHelpPath)
-    self.help_presentation.setIcon(self.help_presentation_icon)
-    self.presentationHorizontalLayout.addWidget(self.help_presentation)
-
-    # STEP 2
-    self.Step2CollapsibleButton = ctk.ctkCollapsibleButton()
-    self.Step2CollapsibleButton.text = "STEP 2: Placement Left Forceps"
-    self.Step2CollapsibleButton.collapsed = True
-    self.layout.addWidget(self.Step2CollapsibleButton)
-
-    Step2FormLayout = qt.QFormLayout(self.Step2CollapsibleButton)
-
-    # --- INITIAL PLACEMENT LEFT ---
-    self.InitialPlacementLeftGroupBox = ctk.ctkCollapsibleGroupBox()
-    self.InitialPlacementLeftGroupBox.setTitle("Initial Placement Left")
-    self.InitialPlacementLeftGroupBox.collapsed = True
-    Step2FormLayout.addRow(self.InitialPlacementLeftGroupBox)
-    InitialPlacementLeftGroupBox_Layout = qt.QFormLayout(self.InitialPlacementLeftGroupBox)
-    # self.Step1GroupBox.setStyleSheet("background-color: rgb(176,231,169);")
-
-    self.initialPlacementLeftText = qt.QLabel('Place left forceps vertically')
-    self.initialPlacementLeftText.setStyleSheet("font-size: 14px; font-weight: bold;")
-    InitialPlacementLeftGroupBox_Layout.addRow(self.initialPlacementLeftText)
-
-    self.initialPlacementLeftHorizontalLayout = qt.QHBoxLayout()
-    InitialPlacementLeftGroupBox_Layout.addRow(self.initialPlacementLeftHorizontalLayout)
-    
-    # Start/Stop Real Time
-    self.start_initialPlacementLeft = qt.QPushButton("Start")
-    self.start_initialPlacementLeft.enabled = True
-    self.start_initialPlacementLeft_icon_play = qt.QIcon(iconPlayPath)
-    self.start_initialPlacementLeft_icon_pause = qt.QIcon(iconPausePath)
-    self.start_initialPlacementLeft.setIcon(self.start_initialPlacementLeft_icon_play)
-    self.initialPlacementLeftHorizontalLayout.addWidget(self.start_initialPlacementLeft)
-
-    # Next step
-    self.next_initialPlacementLeft = qt.QPushButton("Next")
-    self.next_initialPlacementLeft.enabled = False
-    self.next_initialPlacementLeft_icon = qt.QIcon(iconNextPath)
-    self.next_initialPlacementLeft.setIcon(self.next_initialPlacementLeft_icon)
-    self.initialPlacementLeftHorizontalLayout.addWidget(self.next_initialPlacementLeft)
-
-    #  Help
-    self.help_initialPlacementLeft = qt.QPushButton("Help")
-    self.help_initialPlacementLeft.enabled = True
-    self.help_initialPlacementLeft_icon = qt.QIcon(iconHelpPath)
-    self.help_initialPlacementLeft.setIcon(self.help_initialPlacementLeft_icon)
-    self.initialPlacementLeftHorizontalLayout.addWidget(self.help_initialPlacementLeft)
-
-
-    # --- FINAL PLACEMENT LEFT ---
-    self.FinalPlacementLeftGroupBox = ctk.ctkCollapsibleGroupBox()
-    self.FinalPlacementLeftGroupBox.setTitle("Final Placement Left")
-    self.FinalPlacementLeftGroupBox.collapsed = True
-    Step2FormLayout.addRow(self.FinalPlacementLeftGroupBox)
-    FinalPlacementLeftGroupBox_Layout = qt.QFormLayout(self.FinalPlacementLeftGroupBox)
-    # self.Step1GroupBox.setStyleSheet("background-color: rgb(176,231,169);")
-
-    self.finalPlacementLeftText = qt.QLabel('Introduce the left forceps')
-    self.finalPlacementLeftText.setStyleSheet("font-size: 14px; font-weight: bold;")
-    FinalPlacementLeftGroupBox_Layout.addRow(self.finalPlacementLeftText)
-
-    self.finalPlacementLeftHorizontalLayout = qt.QHBoxLayout()
-    FinalPlacementLeftGroupBox_Layout.addRow(self.finalPlacementLeftHorizontalLayout)
-
-    # Start/Stop Real Time
-    self.start_finalPlacementLeft = qt.QPushButton("Start")
-    self.start_finalPlacementLeft.enabled = True
-    self.start_finalPlacementLeft_icon_play = qt.QIcon(iconPlayPath)
-    self.start_finalPlacementLeft_icon_pause = qt.QIcon(iconPausePath)
-    self.start_finalPlacementLeft.setIcon(self.start_finalPlacementLeft_icon_play)
-    self.finalPlacementLeftHorizontalLayout.addWidget(self.start_finalPlacementLeft)
-
-    # Next step
-    self.next_finalPlacementLeft = qt.QPushButton("Next")
-    self.next_finalPlacementLeft.enabled = False
-    self.next_finalPlacementLeft_icon = qt.QIcon(iconNextPath)
-    self.next_finalPlacementLeft.setIcon(self.next_finalPlacementLeft_icon)
-    self.finalPlacementLeftHorizontalLayout.addWidget(self.next_finalPlacementLeft)
-
-    #  Help
-    self.help_finalPlacementLeft = qt.QPushButton("Help")
-    self.help_finalPlacementLeft.enabled = True
-    self.help_finalPlacementLeft_icon = qt.QIcon(iconHelpPath)
-    self.help_finalPlacementLeft.setIcon(self.help_finalPlacementLeft_icon)
-    self.finalPlacementLeftHorizontalLayout.addWidget(self.help_finalPlacementLeft)
-
-    # STEP 3
-    self.Step3CollapsibleButton = ctk.ctkCollapsibleButton()
-    self.Step3CollapsibleButton.text = "STEP 3: Placement Right Forceps"
-    self.Step3CollapsibleButton.collapsed = True
-    self.layout.addWidget(self.Step3CollapsibleButton)
-
-    Step3FormLayout = qt.QFormLayout(self.Step3CollapsibleButton)
-
-
-    # --- INITIAL PLACEMENT LEFT ---
-    self.InitialPlacementRightGroupBox = ctk.ctkCollapsibleGroupBox()
-    self.InitialPlacementRightGroupBox.setTitle("Initial Placement Right")
-    self.InitialPlacementRightGroupBox.collapsed = True
-    Step3FormLayout.addRow(self.InitialPlacementRightGroupBox)
-    InitialPlacementRightGroupBox_Layout = qt.QFormLayout(self.InitialPlacementRightGroupBox)
-    # self.Step1GroupBox.setStyleSheet("background-color: rgb(176,231,169);")
-
-    self.initialPlacementRightText = qt.QLabel('Place right forceps vertically')
-    self.initialPlacementRightText.setStyleSheet("font-size: 14px; font-weight: bold;")
-    InitialPlacementRightGroupBox_Layout.addRow(self.initialPlacementRightText)
-
-    self.initialPlacementRightHorizontalLayout = qt.QHBoxLayout()
-    InitialPlacementRightGroupBox_Layout.addRow(self.initialPlacementRightHorizontalLayout)
-    
-    # Start/Stop Real Time
-    self.start_initialPlacementRight = qt.QPushButton("Start")
-    self.start_initialPlacementRight.enabled = True
-    self.start_initialPlacementRight_icon_play = qt.QIcon(iconPlayPath)
-    self.start_initialPlacementRight_icon_pause = qt.QIcon(iconPausePath)
-    self.start_initialPlacementRight.setIcon(self.start_initialPlacementRight_icon_play)
-    self.initialPlacementRightHorizontalLayout.addWidget(self.start_initialPlacementRight)
-
-    # Next step
-    self.next_initialPlacementRight = qt.QPushButton("Next")
-    self.next_initialPlacementRight.enabled = False
-    self.next_initialPlacementRight_icon = qt.QIcon(iconNextPath)
-    self.next_initialPlacementRight.setIcon(self.next_initialPlacementRight_icon)
-    self.initialPlacementRightHorizontalLayout.addWidget(self.next_initialPlacementRight)
-
-    #  Help
-    self.help_initialPlacementRight = qt.QPushButton("Help")
-    self.help_initialPlacementRight.enabled = True
-    self.help_initialPlacementRight_icon = qt.QIcon(iconHelpPath)
-    self.help_initialPlacementRight.setIcon(self.help_initialPlacementRight_icon)
-    self.initialPlacementRightHorizontalLayout.addWidget(self.help_initialPlacementRight)
-
-
-    # --- FINAL PLACEMENT LEFT ---
-    self.FinalPlacementRightGroupBox = ctk.ctkCollapsibleGroupBox()
-    self.FinalPlacementRightGroupBox.setTitle("Final Placement Right")
-    self.FinalPlacementRightGroupBox.collapsed = True
-    Step3FormLayout.addRow(self.FinalPlacementRightGroupBox)
-    FinalPlacementRightGroupBox_Layout = qt.QFormLayout(self.FinalPlacementRightGroupBox)
-    # self.Step1GroupBox.setStyleSheet("background-color: rgb(176,231,169);")
-
-    self.finalPlacementRightText = qt.QLabel('Introduce the right forceps')
-    self.finalPlacementRightText.setStyleSheet("font-size: 14px; font-weight: bold;")
-    FinalPlacementRightGroupBox_Layout.addRow(self.finalPlacementRightText)
-
-    self.finalPlacementRightHorizontalLayout = qt.QHBoxLayout()
-    FinalPlacementRightGroupBox_Layout.addRow(self.finalPlacementRightHorizontalLayout)
-
-    # Start/Stop Real Time
-    self.start_finalPlacementRight = qt.QPushButton("Start")
-    self.start_finalPlacementRight.enabled = True
-    self.start_finalPlacementRight_icon_play = qt.QIcon(iconPlayPath)
-    self.start_finalPlacementRight_icon_pause = qt.QIcon(iconPausePath)
-    self.start_finalPlacementRight.setIcon(self.start_finalPlacementRight_icon_play)
-    self.finalPlacementRightHorizontalLayout.addWidget(self.start_finalPlacementRight)
-
-    # Next step
-    self.next_finalPlacementRight = qt.QPushButton("Next")
-    self.next_finalPlacementRight.enabled = False
-    self.next_finalPlacementRight_icon = qt.QIcon(iconNextPath)
-    self.next_finalPlacementRight.setIcon(self.next_finalPlacementRight_icon)
-    self.finalPlacementRightHorizontalLayout.addWidget(self.next_finalPlacementRight)
-
-    #  Help
-    self.help_finalPlacementRight = qt.QPushButton("Help")
-    self.help_finalPlacementRight.enabled = True
-    self.help_finalPlacementRight_icon = qt.QIcon(iconHelpPath)
-    self.help_finalPlacementRight.setIcon(self.help_finalPlacementRight_icon)
-    self.finalPlacementRightHorizontalLayout.addWidget(self.help_finalPlacementRight)
+    self.createPhaseWidgets()
 
+    #
+    # FREE PRACTICE
+    #
+    self.freePracticeCollapsibleButton = ctk.ctkCollapsibleButton()
+    self.freePracticeCollapsibleButton.text = "FREE PRACTICE"
+    self.freePracticeCollapsibleButton.collapsed = True
+    self.layout.addWidget(self.freePracticeCollapsibleButton)
+
+    freePracticeFormLayout = qt.QFormLayout(self.freePracticeCollapsibleButton)
+
+    freePracticeLabel = qt.QLabel('Perform any maneuver')
+    freePracticeLabel.setStyleSheet("font-size: 14px; font-weight: bold;")
+    freePracticeFormLayout.addRow(freePracticeLabel)
 
+    self.freePracticeStartButton = qt.QPushButton('Start')
+    self.freePracticeStartButton.setIcon(self.icons['play'])
+    self.freePracticeStartButton.setToolTip('Check all the phases on every frame and show the maneuver being performed')
+    freePracticeFormLayout.addRow(self.freePracticeStartButton)
+
+    self.freePracticeManeuverLabel = qt.QLabel('-')
+    freePracticeFormLayout.addRow('Maneuver:', self.freePracticeManeuverLabel)
+
+    # result of each phase check, updated when it changes
+    self.freePracticePhaseLabels = {}
+    for phase in Scoring.PHASES:
+      self.freePracticePhaseLabels[phase] = qt.QLabel('-')
+      freePracticeFormLayout.addRow(PHASE_TITLES[phase] + ':', self.freePracticePhaseLabels[phase])
+
+    #
+    # PROGRESS
+    #
+    self.progressCollapsibleButton = ctk.ctkCollapsibleButton()
+    self.progressCollapsibleButton.text = "PROGRESS"
+    self.progressCollapsibleButton.collapsed = True
+    self.layout.addWidget(self.progressCollapsibleButton)
+
+    progressFormLayout = qt.QFormLayout(self.progressCollapsibleButton)
+
+    self.progressTable = qt.QTableWidget()
+    self.progressTable.setColumnCount(5)
+    self.progressTable.setHorizontalHeaderLabels(['Phase', 'Attempts', 'Pass rate', 'Cohort pass rate', 'Mean time (s)'])
+    self.progressTable.horizontalHeader().setSectionResizeMode(qt.QHeaderView.ResizeToContents)
+    self.progressTable.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+    progressFormLayout.addRow(self.progressTable)
+
+    self.refreshProgressButton = qt.QPushButton("Refresh")
+    progressFormLayout.addRow(self.refreshProgressButton)
+
+    #
+    # DEBRIEF
+    #
+    self.debriefCollapsibleButton = ctk.ctkCollapsibleButton()
+    self.debriefCollapsibleButton.text = "DEBRIEF"
+    self.debriefCollapsibleButton.collapsed = True
+    self.layout.addWidget(self.debriefCollapsibleButton)
+
+    debriefFormLayout = qt.QFormLayout(self.debriefCollapsibleButton)
+
+    # Recorded phases of the trainee, most recent first
+    self.debriefTrajectoryComboBox = qt.QComboBox()
+    debriefFormLayout.addRow('Recording:', self.debriefTrajectoryComboBox)
+
+    self.debriefTimeSlider = ctk.ctkSliderWidget()
+    self.debriefTimeSlider.singleStep = 0.01
+    self.debriefTimeSlider.decimals = 2
+    self.debriefTimeSlider.minimum = 0
+    self.debriefTimeSlider.maximum = 0
+    self.debriefTimeSlider.suffix = ' s'
+    self.debriefTimeSlider.enabled = False
+    debriefFormLayout.addRow('Time:', self.debriefTimeSlider)
+
+    self.debriefHorizontalLayout = qt.QHBoxLayout()
+    debriefFormLayout.addRow(self.debriefHorizontalLayout)
+    self.debriefPlayButton = qt.QPushButton()
+    self.debriefPlayButton.setText('Play')
+    self.debriefPlayButton.setIcon(self.icons['play'])
+    self.debriefHorizontalLayout.addWidget(self.debriefPlayButton)
+    self.debriefStopButton = qt.QPushButton()
+    self.debriefStopButton.setText('Stop')
+    self.debriefStopButton.setToolTip('Stop the replay and give the forceps back to the controllers')
+    self.debriefStopButton.enabled = False
+    self.debriefHorizontalLayout.addWidget(self.debriefStopButton)
+    self.debriefHeatmapButton = qt.QPushButton()
+    self.debriefHeatmapButton.setText('Dwell map')
+    self.debriefHeatmapButton.setToolTip('Show where the forceps spent time around the baby head')
+    self.debriefHorizontalLayout.addWidget(self.debriefHeatmapButton)
+
+    self.debriefMetricsLabel = qt.QLabel('')
+    self.debriefMetricsLabel.wordWrap = True
+    debriefFormLayout.addRow('Motion:', self.debriefMetricsLabel)
 
     # add here remaining ui objects
     # ...
@@ -464,7 +415,8 @@ class ForcepsDeliveryVRWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
 
 
     # Create logic class. Logic implements all computations that should be possible to run
-    # in batch mode, without a graphical user interface.
+    # in batch mode, without a graphical user interface. It does not access the VR module
+    # until VR is activated or the data is loaded.
     self.logic = ForcepsDeliveryVRLogic()
 
     # Connections
@@ -479,30 +431,93 @@ class ForcepsDeliveryVRWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
     # INITIALIZATION
     self.activateVRButton.connect('clicked(bool)', self.onSwitchVirtualRealityActivation)
     self.loadDataButton.connect('clicked(bool)', self.onLoadDataButtonClicked)
+    self.shareAssetsCheckBox.connect('toggled(bool)', self.onShareAssetsToggled)
 
     # CONFIGURATION
     self.controllersVisibilityCheckBox.connect('clicked(bool)', self.onControllerVisibilityCheckBoxClicked)
     self.resetVRViewButton.connect('clicked(bool)', self.onResetVRViewButtonClicked)
+    self.poseFilterComboBox.connect('currentIndexChanged(int)', self.onPoseFilterChanged)
+    self.placementGridsCheckBox.connect('toggled(bool)', self.onPlacementGridsToggled)
+    self.tissueDeformationCheckBox.connect('toggled(bool)', self.onTissueDeformationToggled)
+    self.poseSourceComboBox.connect('currentIndexChanged(int)', self.onPoseSourceChanged)
+    self.trackerAddressLineEdit.connect('editingFinished()', self.onPoseSourceChanged)
+    self.posePredictionSpinBox.connect('valueChanged(int)', self.onPoseFilterChanged)
+
+    # FREE PRACTICE
+    self.freePracticeStartButton.connect('clicked(bool)', self.onFreePracticeClicked)
+
+    # PROGRESS
+    self.refreshProgressButton.connect('clicked(bool)', self.updateProgressTable)
+    self.progressCollapsibleButton.connect('contentsCollapsed(bool)', self.updateProgressTable)
+
+    # DEBRIEF
+    self.debriefCollapsibleButton.connect('contentsCollapsed(bool)', self.updateDebriefRecordings)
+    self.debriefTrajectoryComboBox.connect('currentIndexChanged(int)', self.onDebriefRecordingChanged)
+    self.debriefPlayButton.connect('clicked(bool)', self.onDebriefPlayClicked)
+    self.debriefStopButton.connect('clicked(bool)', self.onDebriefStopClicked)
+    self.debriefHeatmapButton.connect('clicked(bool)', self.onDebriefHeatmapClicked)
+    self.debriefTimeSlider.connect('valueChanged(double)', self.onDebriefTimeChanged)
  
 
-    # STEP 1: Forceps arrangement and presentation
-    self.start_arrangement.connect('clicked(bool)', self.onStartArrangementClicked)
-    self.start_presentation.connect('clicked(bool)', self.onStartPresentationClicked)
-    self.start_initialPlacementLeft.connect('clicked(bool)', self.onStartInitialPlacementLeftClicked)
-    self.start_finalPlacementLeft.connect('clicked(bool)', self.onStartFinalPlacementLeftClicked)
-    self.start_initialPlacementRight.connect('clicked(bool)', self.onStartInitialPositionRClicked)
-    self.start_finalPlacementRight.connect('clicked(bool)', self.onStartFinalPositionRClicked)
-
-
-
-
-
+    self.setupTime = time.perf_counter() - setupStartTime
+    logging.info('ForcepsDeliveryVR panel set up in %.1f ms' % (1000 * self.setupTime))
 
+  def createPhaseWidgets(self):
+    """
+    Build the step panels and phase group boxes from PHASE_STEPS.
+    """
+    self.stepCollapsibleButtons = []
+    self.phaseWidgets = {}
+    for stepTitle, phases in PHASE_STEPS:
+      stepCollapsibleButton = ctk.ctkCollapsibleButton()
+      stepCollapsibleButton.text = stepTitle
+      stepCollapsibleButton.collapsed = True
+      self.layout.addWidget(stepCollapsibleButton)
+      self.stepCollapsibleButtons.append(stepCollapsibleButton)
+      stepFormLayout = qt.QFormLayout(stepCollapsibleButton)
+
+      for phase, title, instruction in phases:
+        groupBox = ctk.ctkCollapsibleGroupBox()
+        groupBox.setTitle(title)
+        groupBox.collapsed = True
+        stepFormLayout.addRow(groupBox)
+        groupBoxLayout = qt.QFormLayout(groupBox)
+
+        instructionLabel = qt.QLabel(instruction)
+        instructionLabel.setStyleSheet("font-size: 14px; font-weight: bold;")
+        groupBoxLayout.addRow(instructionLabel)
+
+        buttonsLayout = qt.QHBoxLayout()
+        groupBoxLayout.addRow(buttonsLayout)
+        buttons = []
+        for text, icon, enabled in [('Start', 'play', True), ('Next', 'next', False), ('Retry', 'retry', False), ('Help', 'info', True)]:
+          button = qt.QPushButton(text)
+          button.enabled = enabled
+          button.setIcon(self.icons[icon])
+          buttonsLayout.addWidget(button)
+          buttons.append(button)
+        widgets = PhaseWidgets(groupBox, *buttons)
+        self.phaseWidgets[phase] = widgets
+
+        widgets.startButton.connect('clicked(bool)', lambda checked=False, phase=phase: self.onStartPhaseClicked(phase))
+        # Retry restores the scene as it was when the phase was started
+        widgets.retryButton.connect('clicked(bool)', lambda checked=False, phase=phase: self.onRetryPhaseClicked(phase))
+        widgets.helpButton.connect('clicked(bool)', lambda checked=False, phase=phase: self.onHelpPhaseClicked(phase))
 
   def cleanup(self):
     """
     Called when the application closes and the module widget is destroyed.
     """
+    self.evaluationTimer.stop()
+    self.playbackTimer.stop()
+    self.observerManager.removeAllObservers()
+    if self.logic:
+      self.logic.stopTrajectoryPlayback()
+      self.logic.stopGhost()
+      self.logic.stopScoringWorker()
+      self.logic.closePoseSource()
+      self.logic.stopAssetServer()
+      self.logic.closeSessionDatabase()
     self.removeObservers()
 
   # def enter(self):
@@ -542,34 +557,69 @@ class ForcepsDeliveryVRWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
       self.logic.deactivateVirtualReality()
       self.activateVRButton.setText("Activate VR")
     else:
+      self.logic.setupView()
       self.logic.activateVirtualReality()
       self.activateVRButton.setText("Deactivate VR")
       slicer.modules.virtualreality.viewWidget().updateViewFromReferenceViewCamera()
 
 
+  def onShareAssetsToggled(self, enabled):
+    if enabled:
+      self.logic.startAssetServer(self.ForcepsDeliveryVR_resourcesPath)
+    else:
+      self.logic.stopAssetServer()
+
+  def getResourcePath(self, name):
+    """
+    Local path of a resource (e.g. 'Models/MotherModel.stl'): the synchronized copy when
+    the assets come from an asset server.
+    """
+    if self.assetPaths is not None and name in self.assetPaths:
+      return self.assetPaths[name]
+    return self.ForcepsDeliveryVR_resourcesPath + name
+
   def onLoadDataButtonClicked(self):
     logging.debug('Load models')
 
+    self.assetPaths = None
+    assetServer = self.assetServerLineEdit.text.strip()
+    if assetServer:
+      host, _, port = assetServer.partition(':')
+      try:
+        self.assetPaths = self.logic.syncAssets(host, int(port) if port else ASSET_PORT)
+      except (OSError, ValueError) as e:
+        slicer.util.errorDisplay('Failed to get the assets from ' + assetServer + ', using the local resources: ' + str(e))
+
+    # Each blade is loaded from its own mesh; without a right blade mesh, the right blade is
+    # the mirror image of the left one. The mirrored blade and the copies of the blades
+    # (expert ghosts) share the points and cells of the loaded models (see SharedGeometry)
     try:
       self.forcepsLeftModel = slicer.util.getNode('ForcepsLeftModel')
     except:
-      slicer.util.loadModel(self.ForcepsDeliveryVR_modelsPath + 'ForcepsLeftModel.stl')
+      slicer.util.loadModel(self.getResourcePath('Models/ForcepsLeftModel.stl'))
       self.forcepsLeftModel = slicer.util.getNode(pattern="ForcepsLeftModel")
       self.forcepsLeftModelDisplay=self.forcepsLeftModel.GetModelDisplayNode()
       self.forcepsLeftModelDisplay.SetColor([0.8,0.8,0.8])
+      SharedGeometry.prepareSharedPolyData(self.forcepsLeftModel)
 
     try:
       self.forcepsRightModel = slicer.util.getNode('ForcepsRightModel')
     except:
-      slicer.util.loadModel(self.ForcepsDeliveryVR_modelsPath + 'ForcepsRightModel.stl')
-      self.forcepsRightModel = slicer.util.getNode(pattern="ForcepsRightModel")
+      forcepsRightPath = self.getResourcePath('Models/ForcepsRightModel.stl')
+      if os.path.exists(forcepsRightPath):
+        slicer.util.loadModel(forcepsRightPath)
+        self.forcepsRightModel = slicer.util.getNode(pattern="ForcepsRightModel")
+        SharedGeometry.prepareSharedPolyData(self.forcepsRightModel)
+      else:
+        self.forcepsRightModel = SharedGeometry.createInstance(self.forcepsLeftModel, 'ForcepsRightModel', SharedGeometry.MIRROR_X)
       self.forcepsRightModelDisplay=self.forcepsRightModel.GetModelDisplayNode()
       self.forcepsRightModelDisplay.SetColor([0.8,0.8,0.8])
+    logging.info('Forceps geometry: %d kB' % SharedGeometry.geometryMemorySize([self.forcepsLeftModel, self.forcepsRightModel]))
 
     try:
       self.babyBodyModel = slicer.util.getNode('BabyBodyModel')
     except:
-      slicer.util.loadModel(self.ForcepsDeliveryVR_modelsPath + 'BabyBodyModel.stl')
+      slicer.util.loadModel(self.getResourcePath('Models/BabyBodyModel.stl'))
       self.babyBodyModel = slicer.util.getNode(pattern="BabyBodyModel")
       self.babyBodyModelDisplay=self.babyBodyModel.GetModelDisplayNode()
       self.babyBodyModelDisplay.SetColor([1,0.68,0.62])
@@ -577,7 +627,7 @@ class ForcepsDeliveryVRWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
     try:
       self.babyHeadModel = slicer.util.getNode('BabyHeadModel')
     except:
-      slicer.util.loadModel(self.ForcepsDeliveryVR_modelsPath + 'BabyHeadModel.stl')
+      slicer.util.loadModel(self.getResourcePath('Models/BabyHeadModel.stl'))
       self.babyHeadModel = slicer.util.getNode(pattern="BabyHeadModel")
       self.babyHeadModelDisplay=self.babyHeadModel.GetModelDisplayNode()
       self.babyHeadModelDisplay.SetColor([1,0.68,0.62])
@@ -585,71 +635,33 @@ class ForcepsDeliveryVRWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
     try:
       self.motherModel = slicer.util.getNode('MotherModel')
     except:
-      slicer.util.loadModel(self.ForcepsDeliveryVR_modelsPath + 'MotherModel.stl')
+      slicer.util.loadModel(self.getResourcePath('Models/MotherModel.stl'))
       self.motherModel = slicer.util.getNode(pattern="MotherModel")
       self.motherModelDisplay=self.motherModel.GetModelDisplayNode()
       self.motherModelDisplay.SetColor([1,0.68,0.62])
     #self.motherModel.SetSelectable(0)
       # self.motherModelDisplay.SetOpacity(0.5)
 
-    # Load Texts
-    try:
-      self.arrangementModel = slicer.util.getNode('arrangement')
-    except:
-      slicer.util.loadModel(self.ForcepsDeliveryVR_phaseTextsPath + 'arrangement.stl')
-      self.arrangementModel = slicer.util.getNode(pattern="arrangement")
-      self.arrangementModelDisplay=self.arrangementModel.GetModelDisplayNode()
-      self.arrangementModelDisplay.SetVisibility(False)
-    
-    try:
-      self.presentationModel = slicer.util.getNode('presentation')
-    except:
-      slicer.util.loadModel(self.ForcepsDeliveryVR_phaseTextsPath + 'presentation.stl')
-      self.presentationModel = slicer.util.getNode(pattern="presentation")
-      self.presentationModelDisplay=self.presentationModel.GetModelDisplayNode()
-      self.presentationModelDisplay.SetVisibility(False)
-
-    try:
-      self.initialPlacementLeftModel = slicer.util.getNode('initialPlacementLeft')
-    except:
-      slicer.util.loadModel(self.ForcepsDeliveryVR_phaseTextsPath + 'initialPlacementLeft.stl')
-      self.initialPlacementLeftModel = slicer.util.getNode(pattern="initialPlacementLeft")
-      self.initialPlacementLeftModelDisplay=self.initialPlacementLeftModel.GetModelDisplayNode()
-      self.initialPlacementLeftModelDisplay.SetVisibility(False)
-
-    try:
-      self.finalPlacementLeftModel = slicer.util.getNode('finalPlacementLeft')
-    except:
-      slicer.util.loadModel(self.ForcepsDeliveryVR_phaseTextsPath + 'finalPlacementLeft.stl')
-      self.finalPlacementLeftModel = slicer.util.getNode(pattern="finalPlacementLeft")
-      self.finalPlacementLeftModelDisplay=self.finalPlacementLeftModel.GetModelDisplayNode()
-      self.finalPlacementLeftModelDisplay.SetVisibility(False)
-
-    try:
-      self.initialPlacementRightModel = slicer.util.getNode('initialPlacementRight')
-    except:
-      slicer.util.loadModel(self.ForcepsDeliveryVR_phaseTextsPath + 'initialPlacementRight.stl')
-      self.initialPlacementRightModel = slicer.util.getNode(pattern="initialPlacementRight")
-      self.initialPlacementRightModelDisplay=self.initialPlacementRightModel.GetModelDisplayNode()
-      self.initialPlacementRightModelDisplay.SetVisibility(False)
-    
-    try:
-      self.finalPlacementRightModel = slicer.util.getNode('finalPlacementRight')
-    except:
-      slicer.util.loadModel(self.ForcepsDeliveryVR_phaseTextsPath + 'finalPlacementRight.stl')
-      self.finalPlacementRightModel = slicer.util.getNode(pattern="finalPlacementRight")
-      self.finalPlacementRightModelDisplay=self.finalPlacementRightModel.GetModelDisplayNode()
-      self.finalPlacementRightModelDisplay.SetVisibility(False)
-    
+    # Load Texts, hidden until their phase is started (phases without a text model only
+    # show the feedback overlay)
+    for phase in Scoring.PHASES:
+      phaseTextPath = self.getResourcePath('Models/Texts/' + phase + '.stl')
+      if slicer.mrmlScene.GetFirstNodeByName(phase) is None and os.path.exists(phaseTextPath):
+        phaseTextModel = slicer.util.loadModel(phaseTextPath)
+        phaseTextModel.GetModelDisplayNode().SetVisibility(False)
     
+    self.logic.setupView()
+    self.logic.createBabyTransform()
+    self.logic.loadHeadLandmarks()
+    self.logic.createFeedbackOverlay()
     self.logic.applyForcepsTransform()
     self.logic.resetVRView(125)
 
     self.loadDataButton.enabled = False
     self.initCollapsibleButton.collapsed = True
     self.configCollapsibleButton.collapsed = False
-    self.Step1CollapsibleButton.collapsed = False
-    self.ArrangementGroupBox.collapsed = False
+    self.stepCollapsibleButtons[0].collapsed = False
+    self.phaseWidgets[PHASE_ARRANGEMENT].groupBox.collapsed = False
 
 
   def onControllerVisibilityCheckBoxClicked(self):
@@ -664,125 +676,246 @@ class ForcepsDeliveryVRWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
     zoomOut = 100
     self.logic.resetVRView(zoomOut)
 
-
-  def onStartArrangementClicked(self):
-    start_stop = self.start_arrangement.text
-    vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
-    leftControllerTransform = vrViewNode.GetLeftControllerTransformNode()
-    if start_stop == 'Start':
-      self.arrangementModelDisplay.SetVisibility(True)
-      self.addActionObserver(leftControllerTransform)
-      self.start_arrangement.setText('Stop')
-      self.start_arrangement.setIcon(self.start_arrangement_icon_pause)
-      self.next_arrangement.enabled = False
-    else:
-      self.arrangementModelDisplay.SetVisibility(False)
-      self.removeActionObserver(leftControllerTransform)
-      self.start_arrangement.setText('Start')
-      self.start_arrangement.setIcon(self.start_arrangement_icon_play)
-      self.next_arrangement.enabled = True
-
-  def onStartPresentationClicked(self):
-    start_stop = self.start_presentation.text
-    vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
-    leftControllerTransform = vrViewNode.GetLeftControllerTransformNode()
-    if start_stop == 'Start':
-      self.presentationModelDisplay.SetVisibility(True)
-      self.addActionObserver(leftControllerTransform)
-      self.start_presentation.setText('Stop')
-      self.start_presentation.setIcon(self.start_presentation_icon_pause)
-      self.next_presentation.enabled = False
-    else:
-      self.presentationModelDisplay.SetVisibility(False)
-      self.removeActionObserver(leftControllerTransform)
-      self.start_presentation.setText('Start')
-      self.start_presentation.setIcon(self.start_presentation_icon_play)
-      self.next_presentation.enabled = True
-
-  def onStartInitialPlacementLeftClicked(self):
-    start_stop = self.start_initialPlacementLeft.text
-    vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
-    leftControllerTransform = vrViewNode.GetLeftControllerTransformNode()
-    if start_stop == 'Start':
-      self.initialPlacementLeftModelDisplay.SetVisibility(True)
-      self.addActionObserver(leftControllerTransform)
-      self.start_initialPlacementLeft.setText('Stop')
-      self.start_initialPlacementLeft.setIcon(self.start_initialPlacementLeft_icon_pause)
-      self.next_initialPlacementLeft.enabled = False
-    else:
-      self.initialPlacementLeftModelDisplay.SetVisibility(False)
-      self.removeActionObserver(leftControllerTransform)
-      self.start_initialPlacementLeft.setText('Start')
-      self.start_initialPlacementLeft.setIcon(self.start_initialPlacementLeft_icon_play)
-      self.next_initialPlacementLeft.enabled = True
-
-  def onStartFinalPlacementLeftClicked(self):
-    start_stop = self.start_finalPlacementLeft.text
-    vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
-    leftControllerTransform = vrViewNode.GetLeftControllerTransformNode()
-    if start_stop == 'Start':
-      self.finalPlacementLeftModelDisplay.SetVisibility(True)
-      self.addActionObserver(leftControllerTransform)
-      self.start_finalPlacementLeft.setText('Stop')
-      self.start_finalPlacementLeft.setIcon(self.start_finalPlacementLeft_icon_pause)
-      self.next_finalPlacementLeft.enabled = False
-    else:
-      self.finalPlacementLeftModelDisplay.SetVisibility(False)
-      self.removeActionObserver(leftControllerTransform)
-      self.start_finalPlacementLeft.setText('Start')
-      self.start_finalPlacementLeft.setIcon(self.start_finalPlacementLeft_icon_play)
-      self.next_finalPlacementLeft.enabled = True
-
-  def onStartInitialPositionRClicked(self):
-    start_stop = self.start_initialPlacementRight.text
-    vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
-    rightControllerTransform = vrViewNode.GetRightControllerTransformNode()
-    if start_stop == 'Start':
-      self.initialPlacementRightModelDisplay.SetVisibility(True)
-      self.addActionObserver(rightControllerTransform)
-      self.start_initialPlacementRight.setText('Stop')
-      self.start_initialPlacementRight.setIcon(self.start_initialPlacementRight_icon_pause)
-      self.next_initialPlacementRight.enabled = False
-    else:
-      self.initialPlacementRightModelDisplay.SetVisibility(False)
-      self.removeActionObserver(rightControllerTransform)
-      self.start_initialPlacementRight.setText('Start')
-      self.start_initialPlacementRight.setIcon(self.start_initialPlacementRight_icon_play)
-      self.next_initialPlacementRight.enabled = True
-
-  def onStartFinalPositionRClicked(self):
-    start_stop = self.start_finalPlacementRight.text
-    vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
-    rightControllerTransform = vrViewNode.GetRightControllerTransformNode()
-    if start_stop == 'Start':
-      self.finalPlacementRightModelDisplay.SetVisibility(True)
-      self.addActionObserver(rightControllerTransform)
-      self.start_finalPlacementRight.setText('Stop')
-      self.start_finalPlacementRight.setIcon(self.start_finalPlacementRight_icon_pause)
-      self.next_finalPlacementRight.enabled = False
+  def onPoseFilterChanged(self):
+    logging.debug('change pose filter')
+    predictionHorizon = self.posePredictionSpinBox.value / 1000.0
+    self.logic.setPoseFilterParameters(self.poseFilterComboBox.currentText, predictionHorizon)
+
+  def onPoseSourceChanged(self):
+    useTracker = self.poseSourceComboBox.currentIndex == 1
+    self.trackerAddressLineEdit.enabled = useTracker
+    # the observers of a running phase depend on the source
+    activePhase = self.getActivePhase()
+    if activePhase == Scoring.PHASE_FREE_PRACTICE:
+      self.onFreePracticeClicked()
+    elif activePhase is not None:
+      self.onStartPhaseClicked(activePhase)
+    if useTracker:
+      host, _, port = (self.trackerAddressLineEdit.text.strip() or self.trackerAddressLineEdit.placeholderText).rpartition(':')
+      try:
+        self.logic.useTrackerPoseSource(host or '127.0.0.1', int(port))
+      except ValueError:
+        slicer.util.errorDisplay('Invalid tracker address, expected host:port')
+        return
+      self.startEvaluationTimer()
     else:
-      self.finalPlacementRightModelDisplay.SetVisibility(False)
-      self.removeActionObserver(rightControllerTransform)
-      self.start_finalPlacementRight.setText('Start')
-      self.start_finalPlacementRight.setIcon(self.start_finalPlacementRight_icon_play)
-      self.next_finalPlacementRight.enabled = True
+      self.logic.setPoseSource(None)
+      self.evaluationTimer.stop()
 
+  def onPlacementGridsToggled(self, enabled):
+    self.logic.usePlacementGrids = enabled
 
+  def onTissueDeformationToggled(self, enabled):
+    self.logic.setTissueDeformationEnabled(enabled)
 
-  def addActionObserver(self, toolToReference):
-    if self.callbackObserverTag == -1:
-      self.observerClass = slicer.util.VTKObservationMixin()
-      self.observerClass.addObserver(toolToReference, toolToReference.TransformModifiedEvent, self.callbackFunction)
-      logging.info('addObserver')
+  def getTrainee(self):
+    trainee = self.traineeLineEdit.text.strip()
+    return trainee if trainee else 'anonymous'
 
-    
-
-  def removeActionObserver(self, toolToReference):
-    self.observerClass.removeObservers()
+  def updateProgressTable(self):
+    if self.progressCollapsibleButton.collapsed:
+      return
+    trainee = self.getTrainee()
+    database = self.logic.getSessionDatabase()
+    # include the phase that was just stopped
+    database.flush(1.0)
+    traineeSummary = {row['phase']: row for row in database.traineeSummary(trainee)}
+    cohortSummary = {row['phase']: row for row in database.cohortSummary()}
+    self.progressTable.setRowCount(len(Scoring.PHASES))
+    for rowIndex, phase in enumerate(Scoring.PHASES):
+      traineeRow = traineeSummary.get(phase)
+      cohortRow = cohortSummary.get(phase)
+      values = [
+        phase,
+        str(traineeRow['attempts']) if traineeRow else '0',
+        '%.0f %%' % (100 * traineeRow['passRate']) if traineeRow and traineeRow['passRate'] is not None else '-',
+        '%.0f %%' % (100 * cohortRow['passRate']) if cohortRow and cohortRow['passRate'] is not None else '-',
+        '%.1f' % traineeRow['meanDuration'] if traineeRow and traineeRow['meanDuration'] is not None else '-']
+      for columnIndex, value in enumerate(values):
+        self.progressTable.setItem(rowIndex, columnIndex, qt.QTableWidgetItem(value))
+
+
+  def updateDebriefRecordings(self):
+    if self.debriefCollapsibleButton.collapsed:
+      return
+    database = self.logic.getSessionDatabase()
+    database.flush(1.0)
+    self.debriefTrajectoryComboBox.blockSignals(True)
+    self.debriefTrajectoryComboBox.clear()
+    for recording in database.traineeTrajectories(self.getTrainee()):
+      result = '-' if recording['result'] is None else ('passed' if recording['result'] else 'failed')
+      label = '%s  %s  (%s)' % (time.strftime('%Y-%m-%d %H:%M', time.localtime(recording['startTime'])), recording['phase'], result)
+      self.debriefTrajectoryComboBox.addItem(label, recording['path'])
+    self.debriefTrajectoryComboBox.blockSignals(False)
+    self.onDebriefRecordingChanged()
+
+  def onDebriefRecordingChanged(self):
+    # a new recording is loaded the next time Play is clicked
+    self.onDebriefStopClicked()
+    path = self.debriefTrajectoryComboBox.currentData
+    if not path or not os.path.exists(path):
+      self.debriefMetricsLabel.setText('')
+      return
+    metrics = TrajectoryAnalytics.analyzeRecording(path, tipOffset=Scoring.BLADE_TIP)
+    if 'pathLengthLeft' not in metrics:
+      self.debriefMetricsLabel.setText('Recording too short')
+      return
+    self.debriefMetricsLabel.setText(
+      'Path length %.0f / %.0f mm, SPARC %.2f / %.2f, idle %.1f of %.1f s (left / right)' % (
+      metrics['pathLengthLeft'], metrics['pathLengthRight'], metrics['sparcLeft'], metrics['sparcRight'],
+      metrics['idleTime'], metrics['duration']))
+
+  def onDebriefHeatmapClicked(self):
+    path = self.debriefTrajectoryComboBox.currentData
+    if not path or not os.path.exists(path):
+      return
+    if self.logic.computeDwellHeatmap(path) is None:
+      slicer.util.errorDisplay('Load the data to show the dwell map around the baby head.')
+
+  def onDebriefPlayClicked(self):
+    if self.playbackTimer.isActive():
+      self.playbackTimer.stop()
+      self.debriefPlayButton.setText('Play')
+      self.debriefPlayButton.setIcon(self.icons['play'])
+      return
+    if self.logic.trajectoryPlayback is None:
+      path = self.debriefTrajectoryComboBox.currentData
+      if not path or not os.path.exists(path):
+        logging.warning('Recording not found: ' + str(path))
+        return
+      try:
+        playback = self.logic.startTrajectoryPlayback(path)
+      except (slicer.util.MRMLNodeNotFoundException, ValueError) as e:
+        slicer.util.errorDisplay('Cannot replay the recording: ' + str(e))
+        return
+      self.debriefTimeSlider.maximum = playback.duration
+      self.debriefTimeSlider.value = 0
+      self.debriefTimeSlider.enabled = True
+      self.debriefStopButton.enabled = True
+    elif self.debriefTimeSlider.value >= self.debriefTimeSlider.maximum:
+      self.debriefTimeSlider.value = 0
+    self.playbackClock = time.perf_counter()
+    self.playbackTimer.start()
+    self.debriefPlayButton.setText('Pause')
+    self.debriefPlayButton.setIcon(self.icons['pause'])
+
+  def onDebriefStopClicked(self):
+    self.playbackTimer.stop()
+    self.logic.stopTrajectoryPlayback()
+    self.debriefTimeSlider.enabled = False
+    self.debriefStopButton.enabled = False
+    self.debriefPlayButton.setText('Play')
+    self.debriefPlayButton.setIcon(self.icons['play'])
+
+  def onPlaybackTimeout(self):
+    # advance by the elapsed time, so that the replay keeps real time if frames are late
+    now = time.perf_counter()
+    playbackTime = self.debriefTimeSlider.value + now - self.playbackClock
+    self.playbackClock = now
+    if playbackTime >= self.debriefTimeSlider.maximum:
+      playbackTime = self.debriefTimeSlider.maximum
+      self.onDebriefPlayClicked()
+    self.debriefTimeSlider.value = playbackTime
+
+  def onDebriefTimeChanged(self, value):
+    if self.logic.trajectoryPlayback is not None:
+      self.logic.trajectoryPlayback.seek(value)
+
+
+  def onStartPhaseClicked(self, phase):
+    widgets = self.phaseWidgets[phase]
+    # one render for the whole phase switch
+    with self.logic.phaseTransition():
+      if widgets.startButton.text == 'Start':
+        if self.freePracticeStartButton.text == 'Stop':
+          self.onFreePracticeClicked()
+        self.phaseSnapshots[phase] = self.logic.captureSceneSnapshot()
+        widgets.retryButton.enabled = True
+        self.logic.setPhaseTextVisibility(phase, True)
+        self.addActionObserver(phase)
+        widgets.startButton.setText('Stop')
+        widgets.startButton.setIcon(self.icons['pause'])
+        widgets.nextButton.enabled = False
+      else:
+        self.logic.setPhaseTextVisibility(phase, False)
+        self.removeActionObserver(phase)
+        widgets.startButton.setText('Start')
+        widgets.startButton.setIcon(self.icons['play'])
+        widgets.nextButton.enabled = True
+
+  def onHelpPhaseClicked(self, phase):
+    slicer.util.infoDisplay(PHASE_HELP[phase], windowTitle=PHASE_TITLES[phase])
+
+  def onRetryPhaseClicked(self, phase):
+    snapshot = self.phaseSnapshots.get(phase)
+    if snapshot is None:
+      return
+    with self.logic.phaseTransition():
+      if self.phaseWidgets[phase].startButton.text == 'Stop':
+        # stop the current attempt, so that it is recorded
+        self.onStartPhaseClicked(phase)
+      self.logic.restoreSceneSnapshot(snapshot)
+      self.onStartPhaseClicked(phase)
+
+  def onFreePracticeClicked(self):
+    with self.logic.phaseTransition():
+      if self.freePracticeStartButton.text == 'Start':
+        # the phases are also checked in free practice, so a running phase is stopped
+        activePhase = self.getActivePhase()
+        if activePhase is not None:
+          self.onStartPhaseClicked(activePhase)
+        self.freePracticeManeuver = Scoring.MANEUVER_NONE
+        self.freePracticeCodes = None
+        self.addActionObserver(Scoring.PHASE_FREE_PRACTICE)
+        self.freePracticeStartButton.setText('Stop')
+        self.freePracticeStartButton.setIcon(self.icons['pause'])
+      else:
+        self.removeActionObserver(Scoring.PHASE_FREE_PRACTICE)
+        self.freePracticeStartButton.setText('Start')
+        self.freePracticeStartButton.setIcon(self.icons['play'])
+
+  def addActionObserver(self, phase):
+    # Both controllers and the HMD are observed, but the check runs once per frame.
+    # The observer manager keeps a single observer per transform whatever the number of phases started.
+    # A tracker stream has no transforms to observe: it is polled in onEvaluationTimeout.
+    for toolToReference in self.logic.getPoseSource().trackedTransformNodes():
+      self.observerManager.addObserver(toolToReference, toolToReference.TransformModifiedEvent, self.onTrackedTransformModified, phase)
+    logging.info('addObserver')
+    # the forceps must follow the controllers again
+    self.onDebriefStopClicked()
+    self.logic.updateHeadLandmarks()
+    self.logic.startHeadRotation(phase, {placementPhase: self.getPhaseMargin(placementPhase)
+      for placementPhase in [PHASE_FINAL_PLACEMENT_LEFT, PHASE_FINAL_PLACEMENT_RIGHT]})
+    self.logic.preparePlacementGrids(phase, self.getPhaseMargin(phase))
+    self.logic.startPhaseRecord(self.getTrainee(), phase)
+    self.logic.startExpertComparison(phase, self.expertLineEdit.text.strip())
+    if self.expertGhostCheckBox.checked:
+      self.logic.startGhost(phase, self.expertLineEdit.text.strip())
+    self.expertMatchSampleCount = -1
+    self.startEvaluationTimer()
+    self.updateInstrumentation()
+
+  def startEvaluationTimer(self):
+    if not self.evaluationTimer.isActive():
+      self.evaluationScheduler.reset()
+      self.frameGovernor.reset()
+      self.updateQualityTier()
+      self.evaluationTimer.start()
+
+  def removeActionObserver(self, phase):
+    self.observerManager.removeObservers(phase)
+    self.logic.stopGhost()
+    self.logic.endPhaseRecord(phase)
+    self.updateProgressTable()
+    # the timer keeps polling a tracker stream, so that the forceps follow it between phases
+    if self.observerManager.observerCount == 0 and self.logic.getPoseSource().eventDriven:
+      self.evaluationTimer.stop()
+    self.updateInstrumentation()
     forcepsLeftModelDisplay = slicer.util.getNode('ForcepsLeftModel').GetModelDisplayNode()
     forcepsRightModelDisplay = slicer.util.getNode('ForcepsRightModel').GetModelDisplayNode()
     forcepsLeftModelDisplay.SetColor([0.8,0.8,0.8])
     forcepsRightModelDisplay.SetColor([0.8,0.8,0.8])
+    self.logic.showFeedback('')
 
     # self.observerTag = toolToReference.RemoveObserver(self.observerTag)
     # self.callbackObserverTag = -1
@@ -802,95 +935,155 @@ class ForcepsDeliveryVRWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
     #   view.forceRender()
     logging.info('removeObserver')
 
+  def updateInstrumentation(self):
+    self.observerManager.logStatus()
+    self.instrumentationLabel.setText('%d transform observers, %d evaluations / %d transform events' % (
+      self.observerManager.observerCount,
+      self.evaluationScheduler.evaluationCount,
+      self.evaluationScheduler.modifiedEventCount))
+
+  def onTrackedTransformModified(self, transformNode, event = None):
+    self.evaluationScheduler.markModified(transformNode.GetID())
+
+  def onEvaluationTimeout(self):
+    startTime = time.perf_counter()
+    poseSource = self.logic.getPoseSource()
+    if not poseSource.eventDriven and poseSource.update():
+      self.logic.updateTrackerTransforms()
+      self.evaluationScheduler.markModified(poseSource.name)
+    tier = self.frameGovernor.tier
+    # a skipped frame keeps the modified sources, so the next evaluation uses the latest poses
+    if self.frameGovernor.shouldRun(tier.evaluationInterval):
+      self.evaluationScheduler.onFrame()
+    self.processScoringResults()
+    self.updateExpertMatch()
+    if self.frameGovernor.shouldRun(tier.ghostInterval):
+      self.logic.updateGhost()
+    if self.frameGovernor.endFrame(time.perf_counter() - startTime):
+      self.updateQualityTier()
+
+  def updateQualityTier(self):
+    tier = self.frameGovernor.tier
+    self.qualityTierLabel.setText('%s (%.2f ms per frame, %d changes)' % (
+      tier.name, 1000 * self.frameGovernor.meanTime, self.frameGovernor.tierChanges))
+    logging.info('Evaluation quality tier: ' + tier.name)
+
+  def updateExpertMatch(self):
+    matcher = self.logic.expertMatcher
+    if matcher is None:
+      if self.expertMatchSampleCount != -1:
+        self.expertMatchLabel.setText('-')
+        self.expertMatchSampleCount = -1
+      return
+    # the label is only updated when a new sample was compared
+    if matcher.sampleCount == self.expertMatchSampleCount:
+      return
+    self.expertMatchSampleCount = matcher.sampleCount
+    if not matcher.sampleCount:
+      self.expertMatchLabel.setText('%d references' % len(matcher))
+      return
+    self.expertMatchLabel.setText('%.0f %% similar (%.1f mm), %.0f %% of the expert motion' % (
+      100 * matcher.similarity, matcher.distance, 100 * matcher.progress))
 
-  def callbackFunction(self, transformNode, event = None):
-    message = ''
-    forcepsLeftModelDisplay = slicer.util.getNode('ForcepsLeftModel').GetModelDisplayNode()
-    forcepsRightModelDisplay = slicer.util.getNode('ForcepsRightModel').GetModelDisplayNode()
-    if self.start_arrangement.text == 'Stop':
-      margin = [0.2, 5]
-      message, res = self.logic.checkArrangement(margin)
-      if res:
-        # self.displayCornerAnnotation(True, message)
-        print(message)
-        forcepsLeftModelDisplay.SetColor([0,1,0])
-        forcepsRightModelDisplay.SetColor([0,1,0])
-      else:
-        # self.displayCornerAnnotation(False, message)
-        print(message)
-        forcepsLeftModelDisplay.SetColor([1,0,0])
-        forcepsRightModelDisplay.SetColor([1,0,0])
-          
-    elif self.start_presentation.text == 'Stop':
-      # error in degrees
-      margin = 0.3
-      message, res = self.logic.checkPresentation(margin)
-      if res:
-        # self.displayCornerAnnotation(True, message)
-        print('Correct!')
-        forcepsLeftModelDisplay.SetColor([0,1,0])
-        forcepsRightModelDisplay.SetColor([0,1,0])
-      else:
-        # self.displayCornerAnnotation(False, message)
-        print('Incorrect')
-        forcepsLeftModelDisplay.SetColor([1,0,0])
-        forcepsRightModelDisplay.SetColor([1,0,0])
+  def getActivePhase(self):
+    """
+    Name of the phase whose evaluation is running (Scoring.PHASE_FREE_PRACTICE in
+    free practice), or None.
+    """
+    if self.freePracticeStartButton.text == 'Stop':
+      return Scoring.PHASE_FREE_PRACTICE
+    for phase in Scoring.PHASES:
+      if self.phaseWidgets[phase].startButton.text == 'Stop':
+        return phase
+    return None
 
-    elif self.start_initialPlacementLeft.text == 'Stop':
+  def getPhaseMargin(self, phase):
+    if phase == Scoring.PHASE_FREE_PRACTICE:
+      return {phase: self.getPhaseMargin(phase) for phase in Scoring.PHASES}
+    if phase == PHASE_ARRANGEMENT:
+      return [0.2, 5]
+    elif phase == PHASE_PRESENTATION:
+      # error in degrees
+      return 0.3
+    elif phase in [PHASE_INITIAL_PLACEMENT_LEFT, PHASE_INITIAL_PLACEMENT_RIGHT]:
       # margin in degrees
       marginAngle = 10 + self.errorMargin_angle
       # margin in mm
       marginDistance = 10 + self.errorMargin_dist
-      res, message = self.logic.checkInitialPlacementLeft(marginAngle,marginDistance)
-      if res:
-        # self.displayCornerAnnotation(True, message)
-        print('Correct!')
-        forcepsLeftModelDisplay.SetColor([0,1,0])
-      else:
-        # self.displayCornerAnnotation(False, message)
-        print('Incorrect')
-        forcepsLeftModelDisplay.SetColor([1,0,0])
-      
-    elif self.start_finalPlacementLeft.text == 'Stop':
+      return [marginAngle, marginDistance]
+    elif phase == PHASE_ROTATION:
+      # angle to the target rotation in degrees, then the final placement margins
+      return [15 + self.errorMargin_angle, 30 + self.errorMargin_dist, 10 + self.errorMargin_dist]
+    elif phase == PHASE_TRACTION:
+      # angle to the pelvic axis in degrees, distance to it in mm
+      return [15 + self.errorMargin_angle, 15 + self.errorMargin_dist]
+    else:
       marginDistance = 30 + self.errorMargin_dist
       marginDistanceCheek = 10 + self.errorMargin_dist
-      res, message = self.logic.checkFinalPlacementLeft(marginDistance, marginDistanceCheek)
-      if res:
-        # self.displayCornerAnnotation(True, message)
-        print('Correct!')
-        forcepsLeftModelDisplay.SetColor([0,1,0])
-      else:
-        # self.displayCornerAnnotation(False, message)
-        print('Incorrect')
-        forcepsLeftModelDisplay.SetColor([1,0,0])
+      return [marginDistance, marginDistanceCheek]
 
-    elif self.start_initialPlacementRight.text == 'Stop':
-      # margin in degrees
-      marginAngle = 10 + self.errorMargin_angle
-      # margin in mm
-      marginDistance = 10 + self.errorMargin_dist
-      res, message = self.logic.checkInitialPositionR(marginAngle,marginDistance)
-      if res:
-        # self.displayCornerAnnotation(True, message)
-        print('Correct!')
-        forcepsRightModelDisplay.SetColor([0,1,0])
-      else:
-        # self.displayCornerAnnotation(False, message)
-        print('Incorrect')
-        forcepsRightModelDisplay.SetColor([1,0,0])
-    
-    elif self.start_finalPlacementRight.text == 'Stop':
-      marginDistance = 30 + self.errorMargin_dist
-      marginDistanceCheek = 10 + self.errorMargin_dist
-      res, message = self.logic.checkFinalPositionR(marginDistance, marginDistanceCheek)
-      if res:
-        # self.displayCornerAnnotation(True, message)
-        print('Correct!')
-        forcepsRightModelDisplay.SetColor([0,1,0])
+  def callbackFunction(self, timestamp = None):
+    phase = self.getActivePhase()
+    if phase is None:
+      return
+    # filter the poses here and score them in the worker thread
+    self.logic.updateControllerPoses(timestamp)
+    self.logic.updateHeadRotation(timestamp)
+    tier = self.frameGovernor.tier
+    if self.frameGovernor.shouldRun(tier.deformationInterval):
+      self.logic.updateTissueDeformation()
+    self.logic.recordPhaseFrame(phase, timestamp, self.frameGovernor.shouldRun(tier.expertMatchInterval))
+    self.logic.submitPhaseEvaluation(phase, self.getPhaseMargin(phase), timestamp)
+
+  def processScoringResults(self):
+    activePhase = self.getActivePhase()
+    for result in self.logic.takeScoringResults():
+      # results of a phase that was stopped meanwhile are dropped
+      if result.phase != activePhase:
+        continue
+      if result.phase == Scoring.PHASE_FREE_PRACTICE:
+        self.onFreePracticeResult(result.res, result.message, result.timestamp)
       else:
-        # self.displayCornerAnnotation(False, message)
-        print('Incorrect')
-        forcepsRightModelDisplay.SetColor([1,0,0])
+        self.logic.updatePhaseRecord(result.phase, result.res, result.timestamp)
+        self.onScoringResult(result.phase, result.res, result.message)
+
+  def onFreePracticeResult(self, res, codes, timestamp):
+    """
+    Show the maneuver being performed and the result of its check. The maneuver is the
+    most advanced phase whose check passes; when none passes the last one recognized is
+    kept, so that its error messages are shown.
+    """
+    maneuver = int(Scoring.detectManeuver(res))
+    self.logic.updatePhaseRecord(Scoring.PHASE_FREE_PRACTICE, maneuver != Scoring.MANEUVER_NONE, timestamp)
+    if maneuver != Scoring.MANEUVER_NONE:
+      self.freePracticeManeuver = maneuver
+    for index, phase in enumerate(Scoring.PHASES):
+      if self.freePracticeCodes is None or codes[index] != self.freePracticeCodes[index]:
+        self.freePracticePhaseLabels[phase].setText(Scoring.MESSAGES[codes[index]])
+    self.freePracticeCodes = codes
+    if self.freePracticeManeuver == Scoring.MANEUVER_NONE:
+      self.freePracticeManeuverLabel.setText('-')
+      self.logic.showFeedback('NO MANEUVER RECOGNIZED')
+      return
+    phase = Scoring.PHASES[self.freePracticeManeuver]
+    self.freePracticeManeuverLabel.setText(PHASE_TITLES[phase])
+    self.onScoringResult(phase, res[self.freePracticeManeuver],
+      PHASE_TITLES[phase].upper() + '\n' + Scoring.MESSAGES[codes[self.freePracticeManeuver]])
+
+  def onScoringResult(self, phase, res, message):
+    if res:
+      message = message if message else 'CORRECT!'
+      color = [0,1,0]
+    else:
+      message = message if message else 'INCORRECT'
+      color = [1,0,0]
+    if self.frameGovernor.tier.logging:
+      print(message)
+    self.logic.showFeedback(message.strip(), color)
+    if phase not in [PHASE_INITIAL_PLACEMENT_RIGHT, PHASE_FINAL_PLACEMENT_RIGHT]:
+      slicer.util.getNode('ForcepsLeftModel').GetModelDisplayNode().SetColor(color)
+    if phase not in [PHASE_INITIAL_PLACEMENT_LEFT, PHASE_FINAL_PLACEMENT_LEFT]:
+      slicer.util.getNode('ForcepsRightModel').GetModelDisplayNode().SetColor(color)
 
 
 
@@ -914,9 +1107,84 @@ class ForcepsDeliveryVRLogic(ScriptedLoadableModuleLogic):
     """
     ScriptedLoadableModuleLogic.__init__(self)
     self.vrEnabled = False
-    self.threeDView = slicer.app.layoutManager().threeDWidget(0).threeDView()
-    self.vrLogic = slicer.modules.virtualreality.logic()
-
+    self.viewSetUp = False
+    # the VR module logic is only accessed when needed, see vrLogic
+    self._vrLogic = None
+    # Controller poses: raw matrices read from the scene and their filtered version
+    self.controllerNames = ['Left', 'Right']
+    self.poseFilters = {}
+    self.rawControllerPoses = {}
+    for controller in self.controllerNames:
+      self.poseFilters[controller] = PoseFilter(FILTER_ONE_EURO)
+      self.rawControllerPoses[controller] = np.eye(4)
+    self.rawHMDPose = np.eye(4)
+    self._transformMatrix = vtk.vtkMatrix4x4()
+    # Source of the poses: the VR controllers (created when first needed) or a tracker stream,
+    # shown on the forceps through trackerTransformNodes
+    self.poseSource = None
+    self.trackerTransformNodes = []
+    # Background scoring: poses are handed over through a lock-free snapshot
+    self.poseSnapshot = PoseSnapshot(len(self.controllerNames))
+    self.scoringWorker = None
+    # Results of each phase are stored in the trainee session database
+    self.sessionDatabase = None
+    self.sessionId = None
+    self.sessionTrainee = None
+    self.phaseRecords = {}
+    # Fetal head landmarks of the placement checks: read once from the scene (world
+    # coordinates), and in the frame of the controller poses
+    self.worldHeadLandmarks = None
+    self.headLandmarks = None
+    # Kielland rotation of the baby models by the locked forceps (rotation phase only),
+    # applied through babyTransformNode
+    self.headRotation = HeadRotation()
+    self.headRotationActive = False
+    self.babyTransformNode = None
+    self._babyMatrix = vtk.vtkMatrix4x4()
+    # Deformation of MotherModel around the blades (optional), with the blade axes in the
+    # frame of the model
+    self.tissueDeformation = None
+    self.tissueDeformationEnabled = False
+    self._bladeSegments = np.zeros((len(self.controllerNames), 2, 3))
+    self._poseToMotherMatrix = vtk.vtkMatrix4x4()
+    # Lookup grids of the placement checks, in the frame of worldHeadLandmarks, and their
+    # bake in a background thread; the analytic checks are used until it is ready. Off by
+    # default: the grids are experimental
+    self.placementGrids = None
+    self.placementGridBake = None
+    self.usePlacementGrids = False
+    # Recorded trajectory replayed for debriefing
+    self.trajectoryPlayback = None
+    # Streaming comparison of the running phase with expert recordings
+    self.expertMatcher = None
+    self.expertPhase = None
+    # Expert forceps replayed next to the trainee's, from the start of the phase
+    self.ghostForceps = None
+    self.ghostStartTimestamp = 0.0
+    # Feedback text shown in the VR scene
+    self.feedbackOverlay = None
+    # Models served to the other devices of a shared session
+    self.assetServer = None
+
+
+  @property
+  def vrLogic(self):
+    if self._vrLogic is None:
+      self._vrLogic = slicer.modules.virtualreality.logic()
+    return self._vrLogic
+
+  def setupView(self):
+    """
+    Show a single 3D view without box and axis labels. Done once, when VR is activated
+    or the data is loaded.
+    """
+    if self.viewSetUp:
+      return
+    slicer.app.layoutManager().setLayout(slicer.vtkMRMLLayoutNode.SlicerLayoutOneUp3DView)
+    view = slicer.app.layoutManager().threeDWidget(0).mrmlViewNode()
+    view.SetBoxVisible(0)
+    view.SetAxisLabelsVisible(0)
+    self.viewSetUp = True
 
   def activateVirtualReality(self):
     if (self.vrEnabled):
@@ -945,17 +1213,81 @@ class ForcepsDeliveryVRLogic(ScriptedLoadableModuleLogic):
     self.vrLogic.SetVirtualRealityActive(True)
   
 
+  def phaseTransition(self):
+    """
+    Batch the display changes of a phase switch (text models, forceps colors, feedback text)
+    so that they fire one Modified event per node and the views render once.
+    """
+    return BatchedSceneUpdate(slicer.mrmlScene, slicer.util.getNodesByClass('vtkMRMLModelDisplayNode'))
+
+  def captureSceneSnapshot(self):
+    """
+    Capture the scene state needed to retry a phase, with the phase state (see
+    getPhaseState). Controller and HMD transforms are driven by the headset and
+    therefore not captured.
+    """
+    vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
+    trackedTransformIDs = [
+      vrViewNode.GetLeftControllerTransformNodeID(),
+      vrViewNode.GetRightControllerTransformNodeID(),
+      vrViewNode.GetHMDTransformNodeID()]
+    return SceneSnapshot.capture(slicer.mrmlScene, self.getPhaseState(), trackedTransformIDs)
+
+  def restoreSceneSnapshot(self, snapshot):
+    snapshot.restore(slicer.mrmlScene, self.setPhaseState)
+
+  def getPhaseState(self):
+    """
+    State of the logic that a phase changes and the scene nodes do not hold: the
+    deformation of MotherModel (its points are not part of the snapshot).
+    """
+    return {'tissueDeformation': self.tissueDeformation.getState() if self.tissueDeformation is not None else None}
+
+  def setPhaseState(self, phaseState):
+    """
+    Restore a state from getPhaseState. The pose filters start again from the next poses.
+    """
+    if self.tissueDeformation is not None:
+      self.tissueDeformation.setState(phaseState['tissueDeformation'])
+      motherModel = slicer.mrmlScene.GetFirstNodeByName('MotherModel')
+      if motherModel is not None:
+        slicer.util.arrayFromModelPointsModified(motherModel)
+    for controller in self.controllerNames:
+      self.poseFilters[controller].reset()
+
+  def createFeedbackOverlay(self):
+    """
+    Create the textured quad used to show the result messages in the VR scene.
+    The glyph atlas is rendered only once.
+    """
+    if self.feedbackOverlay is None:
+      self.feedbackOverlay = TextOverlay('FeedbackText')
+
+  def setPhaseTextVisibility(self, phase, visible):
+    # the text models are named after their phase
+    phaseTextModel = slicer.mrmlScene.GetFirstNodeByName(phase)
+    if phaseTextModel is not None and phaseTextModel.GetDisplayNode():
+      phaseTextModel.GetDisplayNode().SetVisibility(visible)
+
+  def showFeedback(self, message, color=(1,1,1)):
+    # only redrawn when the message changes; an empty message hides it
+    if self.feedbackOverlay is not None:
+      self.feedbackOverlay.setText(message, color)
+
   def applyForcepsTransform(self):
+    if not self.getPoseSource().eventDriven:
+      self.applyTrackerTransforms()
+      return
     vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
     if not vrViewNode or not vrViewNode.GetControllerTransformsUpdate():
       return
       
     forcepsLeftModel = slicer.util.getNode(pattern="ForcepsLeftModel")
-    forcepsLeftModel.SetAndObserveTransformNodeID(vrViewNode.GetLeftControllerTransformNodeID())
+    SharedGeometry.attachToTransform(forcepsLeftModel, vrViewNode.GetLeftControllerTransformNodeID())
 
     forcepsRightModel = slicer.util.getNode(pattern="ForcepsRightModel")
     tranformNodeID = self.vrLogic.GetVirtualRealityViewNode().GetRightControllerTransformNodeID()
-    forcepsRightModel.SetAndObserveTransformNodeID(tranformNodeID)
+    SharedGeometry.attachToTransform(forcepsRightModel, tranformNodeID)
 
   def changeControllerVisibility(self, display):
     self.vrLogic.SetVirtualRealityConnected(True)    
@@ -1001,320 +1333,546 @@ class ForcepsDeliveryVRLogic(ScriptedLoadableModuleLogic):
     rightControllerTransform.SetAndObserveTransformNodeID(viewControllersTransform.GetID())
 
 
-  def checkArrangement(self,margin):
-    message = ''
-    # get controller transforms
-    vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
-    leftControllerTransform = vrViewNode.GetLeftControllerTransformNode()
-    rightControllerTransform = vrViewNode.GetRightControllerTransformNode()
-    # access diagonal components for rotation
-    rl = [0,0,0]
-    rr = [0,0,0]
-    rl[0] = leftControllerTransform.GetMatrixTransformToParent().GetElement(0,0)
-    rl[1] = leftControllerTransform.GetMatrixTransformToParent().GetElement(1,1)
-    rl[2] = leftControllerTransform.GetMatrixTransformToParent().GetElement(2,2)
-    rr[0] = rightControllerTransform.GetMatrixTransformToParent().GetElement(0,0)
-    rr[1] = rightControllerTransform.GetMatrixTransformToParent().GetElement(1,1)
-    rr[2] = rightControllerTransform.GetMatrixTransformToParent().GetElement(2,2)
-    # get difference
-    diff_r = np.array(rl)-np.array(rr)
-    # print('rotation differences: ' + str(diff_r[0]) + ' ' +  str(diff_r[1]) + ' ' +  str(diff_r[2]))
-    forceps_rotated = np.any(diff_r>margin[0])
-    if forceps_rotated:
-      message = 'FORCEPS NOT CORRECTLY CLOSED'
-      res = False
-      return message, res
-    else:
-      # access translation components
-      tl = [0,0,0]
-      tr = [0,0,0]
-      tl[0] = leftControllerTransform.GetMatrixTransformToParent().GetElement(0,3)
-      tl[1] = leftControllerTransform.GetMatrixTransformToParent().GetElement(1,3)
-      tl[2] = leftControllerTransform.GetMatrixTransformToParent().GetElement(2,3)
-      tr[0] = rightControllerTransform.GetMatrixTransformToParent().GetElement(0,3)+10
-      tr[1] = rightControllerTransform.GetMatrixTransformToParent().GetElement(1,3)
-      tr[2] = rightControllerTransform.GetMatrixTransformToParent().GetElement(2,3)
-      # get difference
-      diff_t = np.array(tl)-np.array(tr)
-      # print('translation differences: ' + str(diff_t[0]) + ' ' +  str(diff_t[1]) + ' ' +  str(diff_t[2]))
-      forceps_translated = np.any(np.abs(diff_t)>margin[1])
-      if forceps_translated:
-        message = 'HANDLES NOT AT THE SAME LEVEL'
-        res = False
-        return message, res
-      else:
-        message = 'CORRECT!'
-        res = True
-        return message, res
+  def loadHeadLandmarks(self):
+    """
+    Read the fetal head landmarks once. The eyes and ears are taken from the control points
+    LeftEye, RightEye, LeftEar and RightEar of a 'BabyHeadLandmarks' markups node if there is
+    one, otherwise they are placed on the head sphere as in Scoring.DEFAULT_HEAD_LANDMARKS.
+    The head sphere is fitted to the bounds of BabyHeadModel. The pelvic axis used by the
+    traction check is computed here too (see computePelvicAxis).
+    """
+    headModel = slicer.mrmlScene.GetFirstNodeByName('BabyHeadModel')
+    if headModel is None:
+      self.worldHeadLandmarks = None
+      return
+    bounds = np.zeros(6)
+    headModel.GetRASBounds(bounds)
+    center = (bounds[0::2] + bounds[1::2]) / 2
+    radius = float(np.mean(bounds[1::2] - bounds[0::2]) / 2)
+    default = Scoring.DEFAULT_HEAD_LANDMARKS
+    onSphere = lambda position: center + radius * (position - default.center) / np.linalg.norm(position - default.center)
+    eyes = {side: onSphere(position) for side, position in default.eyes.items()}
+    ears = {side: onSphere(position) for side, position in default.ears.items()}
+    landmarksNode = slicer.mrmlScene.GetFirstNodeByName('BabyHeadLandmarks')
+    if landmarksNode is not None:
+      points = slicer.util.arrayFromMarkupsControlPoints(landmarksNode, world=True)
+      for index in range(len(points)):
+        label = landmarksNode.GetNthControlPointLabel(index)
+        for side in [Scoring.LEFT, Scoring.RIGHT]:
+          if label == side + 'Eye':
+            eyes[side] = points[index]
+          elif label == side + 'Ear':
+            ears[side] = points[index]
+    self.worldHeadLandmarks = Scoring.HeadLandmarks(center, radius, eyes, ears,
+      pelvicAxis=self.computePelvicAxis(center, radius))
+    self.placementGrids = None
+    self.placementGridBake = None
+
+  def computePelvicAxis(self, headCenter, headRadius):
+    """
+    Pelvic axis (curve of Carus) in world coordinates, from the inlet to the outlet. It goes
+    through the control points of a 'PelvicAxis' markups node if there is one. Otherwise it
+    is an arc ending at the outlet found on MotherModel around the head (see
+    PelvicAxis.findOutlet), bending towards the anterior side (up in the scene). The lookup
+    table is baked here, so that the traction check does not do it during a phase.
+    """
+    axisNode = slicer.mrmlScene.GetFirstNodeByName('PelvicAxis')
+    if axisNode is not None and axisNode.GetNumberOfControlPoints() >= 2:
+      pelvicAxis = PelvicAxis(slicer.util.arrayFromMarkupsControlPoints(axisNode, world=True))
+      pelvicAxis.prepare()
+      return pelvicAxis
+    outlet = None
+    motherModel = slicer.mrmlScene.GetFirstNodeByName('MotherModel')
+    if motherModel is not None:
+      transformFilter = vtk.vtkTransformPolyDataFilter()
+      transformToWorld = vtk.vtkGeneralTransform()
+      slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(motherModel.GetParentTransformNode(), None, transformToWorld)
+      transformFilter.SetTransform(transformToWorld)
+      transformFilter.SetInputData(motherModel.GetPolyData())
+      transformFilter.Update()
+      vertices = numpy_support.vtk_to_numpy(transformFilter.GetOutput().GetPoints().GetData()).astype(float)
+      outlet = findOutlet(vertices, headCenter, headRadius)
+    if outlet is None:
+      # no mother model around the head: outlet on the caudal side (+y) of the head
+      outlet = (headCenter + [0.0, headRadius, 0.0], np.array([0.0, 1.0, 0.0]))
+    pelvicAxis = PelvicAxis(carusArc(outlet[0], outlet[1], anterior=[0.0, 0.0, 1.0]))
+    pelvicAxis.prepare()
+    return pelvicAxis
+
+  def createPlacementGrids(self):
+    """
+    Lookup grids of the placement checks, baked in world coordinates and cached per head
+    and margin. The distance to the head is measured to the same sphere as in the analytic
+    checks, so that the results do not change when the grids become ready.
+    """
+    if self.worldHeadLandmarks is None:
+      return None
+    return PlacementGrids(self.worldHeadLandmarks, os.path.join(self.getDataDirectory(), 'grids'))
 
+  def preparePlacementGrids(self, phase, margin):
+    """
+    Start loading or baking the lookup grids used by a phase (all the placement phases in
+    free practice) in the background. margin: as given to Scoring.evaluatePhase.
+    """
+    if not self.usePlacementGrids:
+      return
+    if self.placementGrids is None:
+      self.placementGrids = self.createPlacementGrids()
+      if self.placementGrids is None:
+        return
+    margins = margin if phase == Scoring.PHASE_FREE_PRACTICE else {phase: margin}
+    margins = {placementPhase: margins[placementPhase] for placementPhase in Scoring.PLACEMENT_PHASES if placementPhase in margins}
+    if not margins:
+      return
+    self.placementGridBake = PlacementGridBake(self.placementGrids, margins)
+    self.placementGridBake.start()
 
-  def checkPresentation(self,margin):
-    vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
-    leftControllerTransform = vrViewNode.GetLeftControllerTransformNode()
-    rightControllerTransform = vrViewNode.GetRightControllerTransformNode()
-    # access first component of rotation
-    rl = leftControllerTransform.GetMatrixTransformToParent().GetElement(0,0)
-    rr = rightControllerTransform.GetMatrixTransformToParent().GetElement(0,0)
-    rl_y = leftControllerTransform.GetMatrixTransformToParent().GetElement(1,1)
-    rr_y = rightControllerTransform.GetMatrixTransformToParent().GetElement(1,1)
-    # compute error
-    el = np.abs(rl + 1)
-    er = np.abs(rr + 1)
-    forceps_rotated = np.any(np.array([el,er, np.abs(rl_y), np.abs(rr_y)])>margin)
-
-    if forceps_rotated:
-      message = 'FORCEPS ROTATED'
-      res = False
-      return message, res
-    else:
-      message = 'CORRECT!'
-      res = True
-      return message, res
-
-
-
-  def checkInitialPlacementLeft(self, marginAngle, marginDistance):
-    message = ''
-    return True, message
-    # # build transform tree to depend on Baby
-    # transformName = 'BabyHeadModelToBabyHead'
-    # if self.buildTransformTree(transformName):
-    #   fiducials1name = 'CheckFiducialsL'
-    #   # Check the angle between the vertical and our fiducials in Forceps
-    #   angle = self.checkVectorsAngle(fiducials1name)
-    #   # print 'Angle to ideal direction: ' + str(angle) + '. Margin is ' + str(marginAngle) + ' degrees'
-    #   fidOutOfMargins = False
-    #   if np.abs(angle)>marginAngle:
-    #     fidOutOfMargins = True
-    #     message = message + 'INCORRECT ANGLE\n'
-    #   # Check the tip of the forceps is in contact with the baby's head
-    #   modelName = 'BabyHeadModel'
-    #   dist = self.getDistancePointToModel(fiducials1name,modelName)
-    #   # print 'Distance to baby: ' + str(dist) + '. Margin is ' + str(marginDistance) + ' mm'
-    #   if dist == None:
-    #     print('Error: No intersections found')
-    #     # fidOutOfMargins = True
-    #   elif dist>marginDistance:
-    #     fidOutOfMargins = True
-    #     message = message + 'TIP TOO FAR FROM FETUS\n'
-    #     # print 'Distance out of margin'
-    #   # else:
-    #   #   print 'Distance within margin'
-    #   if fidOutOfMargins:
-    #     return False, message
-    #   else:
-    #     return True, message
-
-  def checkFinalPlacementLeft(self, marginDistance, marginDistanceCheek):
-    message = ''
-    return True, message
-    # # build transform tree to depend on Baby
-    # transformName = 'BabyHeadModelToBabyHead'
-    # if self.buildTransformTree(transformName):
-    #   fiducials1name = 'CheckFiducialsL'
-    #   # Check the distance between the tip of the forceps and the eye
-    #   dist_eye = self.checkDistanceToEye(fiducials1name, 'left')
-    #   # print 'Distance to eye: ' + str(dist_eye) + '. Margin is ' + str(marginDistance) + ' mm'
-    #   fidOutOfMargins = False
-    #   if not marginDistance<np.abs(dist_eye)<(marginDistance*2):
-    #     fidOutOfMargins = True
-    #     if marginDistance>np.abs(dist_eye):
-    #       message = message + 'TOO CLOSE TO EYE\n'
-    #     else:
-    #       message = message + 'TOO FAR FROM EYE\n'
-    #   # Check the distance between the tip of the forceps and the ear
-    #   dist_ear = self.checkDistanceToEar(fiducials1name, 'left')
-    #   # print 'Distance to ear: ' + str(dist_ear) + '. Margin is ' + str(marginDistance) + ' mm'
-    #   if not marginDistance<np.abs(dist_ear)<(marginDistance*2):
-    #     fidOutOfMargins = True
-    #     if marginDistance>np.abs(dist_ear):
-    #       message = message + 'TOO CLOSE TO EAR\n'
-    #     else:
-    #       message = message + 'TOO FAR FROM EAR\n'
-
-    #   # Check the distance between the tip of the forceps and the cheek
-    #   modelName = 'BabyHeadModel'
-    #   dist = self.getDistancePointToModel(fiducials1name,modelName)
-    #   # print 'Distance to baby: ' + str(dist) + '. Margin is ' + str(marginDistanceCheek) + ' mm'
-    #   if dist == None:
-    #     print('Error: No intersections found')
-    #     # fidOutOfMargins = True
-    #   elif dist>marginDistanceCheek:
-    #     fidOutOfMargins = True
-    #     message = message + 'TOO FAR FROM CHEEKS\n'
-    #     # print 'Distance out of margin'
-    #   # else:
-    #   #   print 'Distance within margin'
-    #   if fidOutOfMargins:
-    #     return False, message
-    #   else:
-    #     return True, message
-
-  def checkInitialPositionR(self,marginAngle, marginDistance):
-    message = ''
-    return True, message
-    # # build transform tree to depend on Baby
-    # transformName = 'BabyHeadModelToBabyHead'
-    # if self.buildTransformTree(transformName):
-    #   fiducials1name = 'CheckFiducialsR'
-    #   # Check the angle between the vertical and our fiducials in Forceps
-    #   angle = self.checkVectorsAngle(fiducials1name)
-    #   # print 'Angle to ideal direction: ' + str(angle) + '. Margin is ' + str(marginAngle) + ' degrees'
-    #   fidOutOfMargins = False
-    #   if np.abs(angle)>marginAngle:
-    #     fidOutOfMargins = True
-    #     message = message + 'INCORRECT ANGLE\n'
-    #   # Check the tip of the forceps is in contact with the baby's head
-    #   modelName = 'BabyHeadModel'
-    #   dist = self.getDistancePointToModel(fiducials1name,modelName)
-    #   # print 'Distance to baby: ' + str(dist) + '. Margin is ' + str(marginDistance) + ' mm'
-    #   if dist == None:
-    #     print('Error: No intersections found')
-    #     # fidOutOfMargins = True
-    #   elif dist>marginDistance:
-    #     fidOutOfMargins = True
-    #     message = message + 'TIP TOO FAR FROM FETUS\n'
-    #   #   print 'Distance out of margin'
-    #   # else:
-    #   #   print 'Distance within margin'
-    #   if fidOutOfMargins:
-    #     return False, message
-    #   else:
-    #     return True, message
-
-  def checkFinalPositionR(self, marginDistance, marginDistanceCheek):
-    message = ''
-    return True, message
-    # # build transform tree to depend on Baby
-    # transformName = 'BabyHeadModelToBabyHead'
-    # if self.buildTransformTree(transformName):
-    #   fiducials1name = 'CheckFiducialsR'
-    #   # Check the distance between the tip of the forceps and the eye
-    #   dist_eye = self.checkDistanceToEye(fiducials1name, 'right')
-    #   # print 'Distance to eye: ' + str(dist_eye) + '. Margin is ' + str(marginDistance) + ' mm'
-    #   fidOutOfMargins = False
-    #   if not marginDistance<np.abs(dist_eye)<(marginDistance*2):
-    #     fidOutOfMargins = True
-    #     if marginDistance>np.abs(dist_eye):
-    #       message = message + 'TOO CLOSE TO EYE\n'
-    #     else:
-    #       message = message + 'TOO FAR FROM EYE\n'
-    #   # Check the distance between the tip of the forceps and the ear
-    #   dist_ear = self.checkDistanceToEar(fiducials1name, 'right')
-    #   # print 'Distance to ear: ' + str(dist_ear) + '. Margin is ' + str(marginDistance) + ' mm'
-    #   if not marginDistance<np.abs(dist_ear)<(marginDistance*2):
-    #     fidOutOfMargins = True
-    #     if marginDistance>np.abs(dist_ear):
-    #       message = message + 'TOO CLOSE TO EAR\n'
-    #     else:
-    #       message = message + 'TOO FAR FROM EAR\n'
-
-    #   # Check the distance between the tip of the forceps and the cheek
-    #   modelName = 'BabyHeadModel'
-    #   dist = self.getDistancePointToModel(fiducials1name,modelName)
-    #   # print 'Distance to baby: ' + str(dist) + '. Margin is ' + str(marginDistanceCheek) + ' mm'
-    #   if dist == None:
-    #     print('Error: No intersections found')
-    #     # fidOutOfMargins = True
-    #   elif dist>marginDistanceCheek:
-    #     fidOutOfMargins = True
-    #     message = message + 'TOO FAR FROM CHEEKS\n'
-    #   #   print 'Distance out of margin'
-    #   # else:
-    #   #   print 'Distance within margin'
-    #   if fidOutOfMargins:
-    #     return False, message
-    #   else:
-    #     return True, message
-
-
-  # def buildTransformTree(self, transformName):
-  #   # get the desired 'root' transform
-  #   rootTransform = slicer.util.getNode(transformName)
-  #   if not rootTransform:
-  #     print('Error when loading ' + transformName)
-  #     return False
-  #   else:
-  #     # get the inverse
-  #     transform_inverted = self.invertTransform(transformName)
-  #     # get all XToTracker transforms except transformName
-  #     vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
-  #     leftControllerTransform = vrViewNode.GetLeftControllerTransformNode()
-  #     if not leftControllerTransform:
-  #       print('leftControllerTransform not found')
-  #       return False
-  #     rightControllerTransform = vrViewNode.GetRightControllerTransformNode()
-  #     if not rightControllerTransform:
-  #       print('rightControllerTransform not found')
-  #       return False
-  #     # babyHeadToTracker = slicer.util.getNode('BabyHeadToTracker')
-  #     # if not babyHeadToTracker:
-  #     #   print 'BabyHeadToTracker not found'
-  #     #   return False
-  #     # babyBodyToTracker = slicer.util.getNode('BabyBodyToTracker')
-  #     # if not babyBodyToTracker:
-  #     #   print 'BabyBodyToTracker not found'
-  #     #   return False
-  #     # motherToTracker = slicer.util.getNode('MotherToTracker')
-  #     # if not motherToTracker:
-  #     #   print 'MotherToTracker not found'
-  #     #   return False
-  #     # get the trackerToTool transform for the ToolModelToTool transform
-  #     fidsName = []
-  #     if transformName == leftControllerTransform.GetName():
-  #       trackerTransformName_inv = transformName + '_inv'
-  #       modelName = ['ForcepsLeftModel']
-  #       fidsName = ['CheckFiducialsL','CheckFiducialsL_plane']
-  #     elif transformName == rightControllerTransform.GetName():
-  #       trackerTransformName_inv = transformName + '_inv'
-  #       modelName = ['ForcepsRightModel']
-  #       fidsName = ['CheckFiducialsR','CheckFiducialsR_plane']
-  #     else:
-  #       print('Input transform for tree not valid')
-  #       return False
-  #     trackerTransform_inv = self.invertTransform(transformName)
-
-  #     # make the models observe the inverse transform from the tracker
-  #     if transformName != leftControllerTransform.GetName():
-  #       leftControllerTransform.SetAndObserveTransformNodeID(trackerTransform_inv.GetID())
-  #     if transformName != rightControllerTransform.GetName():
-  #       rightControllerTransform.SetAndObserveTransformNodeID(trackerTransform_inv.GetID())
-
-  #     # Get models and fiducials of selected transform and take them out of it
-  #     for name in modelName:
-  #       model = slicer.util.getNode(name)
-  #       if model:
-  #         model.SetAndObserveTransformNodeID(None)
-      
-  #     if len(fidsName) > 0:
-  #       num_fids = len(fidsName)
-  #       for i in range(num_fids):
-  #         fids = slicer.util.getNode(fidsName[i])
-  #         fids.SetAndObserveTransformNodeID(None)
-  #     return True
+  def getReadyPlacementGrids(self):
+    """
+    Placement grids for the scoring worker, or None while they are being prepared.
+    """
+    if not self.usePlacementGrids or self.placementGridBake is None or not self.placementGridBake.ready:
+      return None
+    return self.placementGrids
 
+  def createBabyTransform(self):
+    """
+    Transform shared by BabyHeadModel and BabyBodyModel, turned by the head rotation.
+    """
+    self.babyTransformNode = slicer.mrmlScene.GetFirstNodeByName('BabyTransform')
+    if self.babyTransformNode is None:
+      self.babyTransformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode', 'BabyTransform')
+    for modelName in ['BabyHeadModel', 'BabyBodyModel']:
+      model = slicer.mrmlScene.GetFirstNodeByName(modelName)
+      if model is not None:
+        model.SetAndObserveTransformNodeID(self.babyTransformNode.GetID())
+
+  def startHeadRotation(self, phase, margins):
+    """
+    Put the baby models back in their pose in the scene and, in the rotation phase and in
+    free practice (which checks the rotation too), start the head rotation from there.
+    margins: {phase: margin} of the final placement checks that lock the forceps on the head.
+    """
+    head = self.headLandmarks
+    self.headRotationActive = (phase in [PHASE_ROTATION, Scoring.PHASE_FREE_PRACTICE]
+      and head is not None and head.pelvicAxis is not None)
+    if self.headRotationActive:
+      poseToWorld = vtk.vtkMatrix4x4()
+      parentTransform = self.getPoseParentTransform()
+      if parentTransform is not None:
+        parentTransform.GetMatrixTransformToWorld(poseToWorld)
+      self.headRotation.reset(head, slicer.util.arrayFromVTKMatrix(poseToWorld), margins)
+    if self.babyTransformNode is not None:
+      self._babyMatrix.Identity()
+      self.babyTransformNode.SetMatrixTransformToParent(self._babyMatrix)
+
+  def updateHeadRotation(self, timestamp=None):
+    """
+    Turn the baby models with the locked forceps, from the filtered poses (see
+    updateControllerPoses). The transform matrix is updated in place, and the checks get
+    the landmarks of the turned head.
+    """
+    if not self.headRotationActive or self.babyTransformNode is None:
+      return
+    if timestamp is None:
+      timestamp = time.perf_counter()
+    if not self.headRotation.update(self.getControllerPose('Left'), self.getControllerPose('Right'), timestamp):
+      return
+    slicer.util.updateVTKMatrixFromArray(self._babyMatrix, self.headRotation.worldMatrix)
+    self.babyTransformNode.SetMatrixTransformToParent(self._babyMatrix)
+    self.headLandmarks = self.headRotation.rotatedHead()
 
-  def invertTransform(self,transformName):
-    transform = slicer.util.getNode(transformName)
-    transform_matrix = vtk.vtkMatrix4x4()
-    # Obtain matrices from tranformation nodes
-    transform.GetMatrixTransformToParent(transform_matrix)
-    transform_matrix.Invert()
-    # create new transform
-    name = transformName + '_inv'
-    transformationNode = slicer.util.getNode(name)
-    if not transformationNode:
-      transformationNode=slicer.vtkMRMLLinearTransformNode()
-      transformationNode.SetName(name)
-      slicer.mrmlScene.AddNode(transformationNode)
-      transformationNode.SetMatrixTransformToParent(transform_matrix)
-    return transformationNode
+  def setTissueDeformationEnabled(self, enabled):
+    """
+    Deform MotherModel around the blades in updateTissueDeformation. When disabled, the
+    model is put back to rest.
+    """
+    self.tissueDeformationEnabled = enabled
+    motherModel = slicer.mrmlScene.GetFirstNodeByName('MotherModel')
+    if not enabled and self.tissueDeformation is not None and motherModel is not None:
+      self.tissueDeformation.reset()
+      slicer.util.arrayFromModelPointsModified(motherModel)
 
+  def updateTissueDeformation(self):
+    """
+    Push the surface of MotherModel away from the blades, from the filtered poses (see
+    updateControllerPoses). The points of the model are updated in place; the deformation
+    is set up on first use, with the model at rest.
+    """
+    if not self.tissueDeformationEnabled:
+      return
+    motherModel = slicer.mrmlScene.GetFirstNodeByName('MotherModel')
+    if motherModel is None:
+      return
+    if self.tissueDeformation is None:
+      # the STL model is a triangle mesh: (3, a, b, c) per cell
+      triangles = slicer.util.arrayFromModelPolyIds(motherModel).reshape(-1, 4)[:, 1:]
+      self.tissueDeformation = TissueDeformation(slicer.util.arrayFromModelPoints(motherModel), meshEdges(triangles))
+    slicer.vtkMRMLTransformNode.GetMatrixTransformBetweenNodes(self.getPoseParentTransform(),
+      motherModel.GetParentTransformNode(), self._poseToMotherMatrix)
+    poseToMother = slicer.util.arrayFromVTKMatrix(self._poseToMotherMatrix)
+    for index, controller in enumerate(self.controllerNames):
+      bladeToMother = poseToMother.dot(self.getControllerPose(controller))
+      self._bladeSegments[index] = BLADE_SEGMENT.dot(bladeToMother[:3, :3].T) + bladeToMother[:3, 3]
+    if self.tissueDeformation.update(self._bladeSegments):
+      slicer.util.arrayFromModelPointsModified(motherModel)
+
+  def updateHeadLandmarks(self):
+    """
+    Express the head landmarks in the frame of the poses (see getPoseParentTransform).
+    Done when a phase starts, not per frame.
+    """
+    if self.worldHeadLandmarks is None:
+      self.loadHeadLandmarks()
+    if self.worldHeadLandmarks is None:
+      self.headLandmarks = None
+      return
+    parentTransform = self.getPoseParentTransform()
+    if parentTransform is None:
+      self.headLandmarks = self.worldHeadLandmarks
+      return
+    worldToParent = vtk.vtkMatrix4x4()
+    parentTransform.GetMatrixTransformFromWorld(worldToParent)
+    self.headLandmarks = self.worldHeadLandmarks.transformed(slicer.util.arrayFromVTKMatrix(worldToParent))
+
+  def setPoseFilterParameters(self, method, predictionHorizon):
+    # predictionHorizon in seconds
+    for controller in self.controllerNames:
+      self.poseFilters[controller].setMethod(method)
+      self.poseFilters[controller].predictionHorizon = predictionHorizon
+
+  def getPoseSource(self):
+    if self.poseSource is None:
+      self.poseSource = VRControllerPoseSource(self.vrLogic)
+    return self.poseSource
+
+  def setPoseSource(self, poseSource):
+    """
+    Read the poses from poseSource (None: the VR controllers), and make the forceps follow them.
+    """
+    if self.poseSource is not None:
+      self.poseSource.close()
+    self.poseSource = poseSource
+    if slicer.mrmlScene.GetFirstNodeByName('ForcepsLeftModel') is not None:
+      self.applyForcepsTransform()
+
+  def useTrackerPoseSource(self, host='127.0.0.1', port=IGTL_PORT):
+    """
+    Read the poses from OpenIGTLink TRANSFORM messages of a tracker server, expressed in
+    scene coordinates (the tracker is registered to the scene).
+    """
+    self.setPoseSource(SocketPoseSource((host, port)))
+    logging.info('Poses read from the tracker at %s:%d' % (host, port))
 
+  def getPoseParentTransform(self):
+    """
+    Transform node of the frame of the poses (recorded trajectories included), None for the scene.
+    """
+    return self.getPoseSource().parentTransformNode()
+
+  def applyTrackerTransforms(self):
+    # the forceps follow transforms that are updated from the tracker poses
+    if not self.trackerTransformNodes:
+      for controller in self.controllerNames:
+        transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode', 'Tracker' + controller + 'Transform')
+        transformNode.SetHideFromEditors(True)
+        self.trackerTransformNodes.append(transformNode)
+    for controller, transformNode in zip(self.controllerNames, self.trackerTransformNodes):
+      SharedGeometry.attachToTransform(slicer.util.getNode('Forceps' + controller + 'Model'), transformNode.GetID())
+
+  def updateTrackerTransforms(self):
+    """
+    Show the last tracker poses on the forceps (not needed for the VR controllers, whose
+    transforms are updated by the VR module).
+    """
+    poses = self.getPoseSource().poses
+    for transformNode, index in zip(self.trackerTransformNodes, [POSE_LEFT, POSE_RIGHT]):
+      slicer.util.updateVTKMatrixFromArray(self._transformMatrix, poses[index])
+      transformNode.SetMatrixTransformToParent(self._transformMatrix)
 
+  def closePoseSource(self):
+    if self.poseSource is not None:
+      self.poseSource.close()
+      self.poseSource = None
+
+  def updateControllerPoses(self, timestamp=None):
+    """
+    Read the poses from the pose source and run them through the pose filters.
+    Must be called before the check functions, which use the filtered poses.
+    """
+    if timestamp is None:
+      timestamp = time.perf_counter()
+    poseSource = self.getPoseSource()
+    poseSource.update()
+    for controller, index in zip(self.controllerNames, [POSE_LEFT, POSE_RIGHT]):
+      self.rawControllerPoses[controller][:] = poseSource.poses[index]
+      self.poseFilters[controller].update(self.rawControllerPoses[controller], timestamp)
+    self.rawHMDPose[:] = poseSource.poses[POSE_HMD]
+
+  def getControllerPose(self, controller):
+    """
+    Filtered 4x4 pose (relative to its parent transform) of the 'Left' or 'Right' controller.
+    """
+    return self.poseFilters[controller].output
+
+  def submitPhaseEvaluation(self, phase, margin, timestamp=None):
+    """
+    Hand the current filtered poses over to the scoring worker, which evaluates
+    the phase check in the background. Results are collected with takeScoringResults.
+    """
+    if timestamp is None:
+      timestamp = time.perf_counter()
+    if self.scoringWorker is None or not self.scoringWorker.is_alive():
+      self.scoringWorker = ScoringWorker(self.poseSnapshot)
+      self.scoringWorker.start()
+    poses = [self.getControllerPose(controller) for controller in self.controllerNames]
+    # the worker only sees the grids and landmarks of the snapshot, so that they can be
+    # replaced here while it runs
+    self.poseSnapshot.write(poses, timestamp, (phase, margin, self.headLandmarks, self.getReadyPlacementGrids()))
+    self.scoringWorker.notify()
+
+  def takeScoringResults(self):
+    results = []
+    if self.scoringWorker is None:
+      return results
+    while self.scoringWorker.results:
+      results.append(self.scoringWorker.results.popleft())
+    return results
+
+  def stopScoringWorker(self):
+    if self.scoringWorker is not None:
+      self.scoringWorker.stop()
+      self.scoringWorker = None
+
+  def getDataDirectory(self):
+    settingsPath = os.path.dirname(slicer.app.slicerUserSettingsFilePath)
+    return os.path.join(settingsPath, 'ForcepsDeliveryVR')
+
+  def syncAssets(self, host, port=ASSET_PORT):
+    """
+    Get the assets of the asset server at host:port into the local cache, transferring only
+    the chunks that are not cached yet. Returns the local path of each asset by name (relative
+    to Resources). The cached assets of the last session are used if the server cannot be reached.
+    """
+    store = ContentStore(os.path.join(self.getDataDirectory(), 'Assets'))
+    try:
+      paths, statistics = AssetClient((host, port), store).sync()
+    except OSError as e:
+      paths = cachedAssetPaths(store)
+      if paths is None:
+        raise
+      logging.warning('Asset server %s:%d not reachable (%s), using the cached assets' % (host, port, str(e)))
+      return paths
+    logging.info('Assets synchronized from %s:%d: %d/%d chunks transferred (%d kB) in %.0f ms' % (
+      host, port, statistics['missingChunks'], statistics['chunks'], statistics['receivedBytes'] // 1024,
+      1000 * statistics['seconds']))
+    return paths
+
+  def startAssetServer(self, resourcesPath, port=ASSET_PORT):
+    self.stopAssetServer()
+    self.assetServer = AssetServer(resourcesPath, address=('0.0.0.0', port))
+    self.assetServer.start()
+
+  def stopAssetServer(self):
+    if self.assetServer is not None:
+      self.assetServer.stop()
+      self.assetServer = None
+
+  def getSessionDatabase(self):
+    if self.sessionDatabase is None:
+      self.sessionDatabase = SessionDatabase(os.path.join(self.getDataDirectory(), 'sessions.sqlite'))
+    return self.sessionDatabase
+
+  def closeSessionDatabase(self):
+    if self.sessionDatabase is None:
+      return
+    for phase in list(self.phaseRecords.keys()):
+      self.endPhaseRecord(phase)
+    if self.sessionId is not None:
+      self.sessionDatabase.endSession(self.sessionId)
+    self.sessionDatabase.close()
+    self.sessionDatabase = None
+    self.sessionId = None
+
+  def startPhaseRecord(self, trainee, phase):
+    """
+    Start recording a phase attempt. A new session is started when the trainee changes.
+    """
+    database = self.getSessionDatabase()
+    if self.sessionId is None or trainee != self.sessionTrainee:
+      if self.sessionId is not None:
+        database.endSession(self.sessionId)
+      self.sessionId = database.startSession(trainee)
+      self.sessionTrainee = trainee
+    startTime = time.time()
+    phaseId = database.startPhase(self.sessionId, trainee, phase, startTime)
+    trajectoryPath = os.path.join(self.getDataDirectory(), 'trajectories', '%d_%s.fdvt' % (phaseId, phase))
+    self.phaseRecords[phase] = {
+      'id': phaseId,
+      'trajectory': TrajectoryWriter(trajectoryPath),
+      'startTime': startTime,
+      'startTimestamp': time.perf_counter(),
+      'evaluations': 0,
+      'correctEvaluations': 0,
+      'lastResult': None,
+      'timeToFirstCorrect': None}
+
+  def recordPhaseFrame(self, phase, timestamp, matchExpert=True):
+    """
+    Append the raw controller and HMD poses to the trajectory of the phase, and compare
+    them with the expert if matchExpert. Must be called after updateControllerPoses.
+    """
+    record = self.phaseRecords.get(phase)
+    if record is None:
+      return
+    record['trajectory'].append(timestamp - record['startTimestamp'],
+      [self.rawControllerPoses['Left'], self.rawControllerPoses['Right'], self.rawHMDPose])
+    if matchExpert and self.expertMatcher is not None and phase == self.expertPhase:
+      self.expertMatcher.update(timestamp - record['startTimestamp'],
+        self.rawControllerPoses['Left'], self.rawControllerPoses['Right'])
+
+  def getExpertRecordings(self, phase, expert):
+    """
+    Paths of the successful recordings of a phase by expert, most recent first.
+    """
+    if not expert or phase not in Scoring.PHASES:
+      return []
+    recordings = [recording['path'] for recording in self.getSessionDatabase().traineeTrajectories(expert)
+      if recording['phase'] == phase and recording['result'] and os.path.exists(recording['path'])]
+    if not recordings:
+      logging.info('No recording of ' + phase + ' by ' + expert)
+    return recordings
+
+  def startGhost(self, phase, expert):
+    """
+    Show the expert ghost of the phase, replaying the most recent successful recording of expert.
+    """
+    self.stopGhost()
+    recordings = self.getExpertRecordings(phase, expert)
+    if not recordings:
+      return
+    parentTransform = self.getPoseParentTransform()
+    modelNodes = [slicer.util.getNode('ForcepsLeftModel'), slicer.util.getNode('ForcepsRightModel')]
+    self.ghostForceps = GhostForceps(recordings[0], modelNodes, parentTransform.GetID() if parentTransform else None)
+    self.ghostStartTimestamp = time.perf_counter()
+    self.ghostForceps.seek(0)
+
+  def updateGhost(self, timestamp=None):
+    if self.ghostForceps is None:
+      return
+    if timestamp is None:
+      timestamp = time.perf_counter()
+    self.ghostForceps.seek(timestamp - self.ghostStartTimestamp)
+
+  def stopGhost(self):
+    if self.ghostForceps is not None:
+      self.ghostForceps.stop()
+      self.ghostForceps = None
+
+  def startExpertComparison(self, phase, expert, maximumReferences=3):
+    """
+    Compare the motion of the phase with the most recent successful recordings of the
+    phase by expert (no comparison if expert is empty or has no such recording).
+    """
+    self.expertMatcher = None
+    self.expertPhase = None
+    recordings = self.getExpertRecordings(phase, expert)
+    if not recordings:
+      return
+    self.expertMatcher = ExpertMatcher.fromRecordings(recordings[:maximumReferences], tipOffset=Scoring.BLADE_TIP)
+    self.expertPhase = phase
+
+  def updatePhaseRecord(self, phase, res, timestamp):
+    record = self.phaseRecords.get(phase)
+    if record is None:
+      return
+    record['evaluations'] += 1
+    record['lastResult'] = res
+    if res:
+      record['correctEvaluations'] += 1
+      if record['timeToFirstCorrect'] is None:
+        record['timeToFirstCorrect'] = timestamp - record['startTimestamp']
+
+  def endPhaseRecord(self, phase, metrics=None, trajectoryPath=None):
+    """
+    Store the result of a phase attempt: the phase passes if the last evaluation was correct.
+    """
+    record = self.phaseRecords.pop(phase, None)
+    if record is None:
+      return
+    phaseMetrics = {'timeToFirstCorrect': record['timeToFirstCorrect']}
+    if record['evaluations']:
+      phaseMetrics['correctFraction'] = record['correctEvaluations'] / record['evaluations']
+    if metrics:
+      phaseMetrics.update(metrics)
+    if self.expertMatcher is not None and phase == self.expertPhase:
+      if self.expertMatcher.sampleCount:
+        phaseMetrics['expertDistance'] = self.expertMatcher.distance
+        phaseMetrics['expertProgress'] = self.expertMatcher.progress
+      self.expertMatcher = None
+      self.expertPhase = None
+    record['trajectory'].close()
+    if trajectoryPath is None and record['trajectory'].frameCount:
+      trajectoryPath = record['trajectory'].path
+      # motion metrics of the attempt, computed from the recording in one vectorized pass
+      phaseMetrics.update(TrajectoryAnalytics.analyzeRecording(trajectoryPath, tipOffset=Scoring.BLADE_TIP))
+    self.getSessionDatabase().endPhase(record['id'], record['startTime'], record['lastResult'],
+      record['evaluations'], record['correctEvaluations'], phaseMetrics, trajectoryPath)
+
+  def startTrajectoryPlayback(self, path):
+    """
+    Replay a recorded trajectory on the forceps models, in place of the controllers.
+    """
+    self.stopTrajectoryPlayback()
+    parentTransform = self.getPoseParentTransform()
+    modelNodes = [slicer.util.getNode('ForcepsLeftModel'), slicer.util.getNode('ForcepsRightModel')]
+    self.trajectoryPlayback = TrajectoryPlayback(path, modelNodes, parentTransform.GetID() if parentTransform else None)
+    self.trajectoryPlayback.seek(0)
+    return self.trajectoryPlayback
+
+  def stopTrajectoryPlayback(self):
+    if self.trajectoryPlayback is not None:
+      self.trajectoryPlayback.stop()
+      self.trajectoryPlayback = None
+
+  def computeDwellHeatmap(self, path, size=200.0, bins=40):
+    """
+    Time spent by both forceps in the voxels of a cube around the baby head, shown
+    as a volume. Returns the volume node, or None if the head model is not loaded.
+    """
+    headModel = slicer.mrmlScene.GetFirstNodeByName('BabyHeadModel')
+    if headModel is None:
+      return None
+    bounds = [0.0] * 6
+    headModel.GetRASBounds(bounds)
+    center = [(bounds[0] + bounds[1]) / 2, (bounds[2] + bounds[3]) / 2, (bounds[4] + bounds[5]) / 2]
+    reader = TrajectoryReader(path)
+    timestamps, poses = TrajectoryAnalytics.resample(np.asarray(reader.timestamps),
+      reader.frames['poses'][:, [POSE_LEFT, POSE_RIGHT]].astype(float))
+    reader.close()
+    # the recorded controller poses are relative to the parent transform of the controllers
+    parentTransform = self.getPoseParentTransform()
+    if parentTransform:
+      parentToWorld = vtk.vtkMatrix4x4()
+      parentTransform.GetMatrixTransformToWorld(parentToWorld)
+      poses = np.matmul(slicer.util.arrayFromVTKMatrix(parentToWorld), poses)
+    heatmap = TrajectoryAnalytics.dwellHeatmap(TrajectoryAnalytics.tipPositions(poses, Scoring.BLADE_TIP), center, size, bins)
+    # volume arrays are indexed [k,j,i]
+    spacing = size / bins
+    ijkToRAS = np.diag([spacing, spacing, spacing, 1.0])
+    ijkToRAS[:3, 3] = np.array(center) - size / 2.0 + spacing / 2.0
+    volumeNode = slicer.mrmlScene.GetFirstNodeByName('DwellHeatmap')
+    if volumeNode is None:
+      volumeNode = slicer.util.addVolumeFromArray(heatmap.transpose(2, 1, 0).astype(np.float32), ijkToRAS.tolist(), 'DwellHeatmap')
+      volumeRenderingLogic = slicer.modules.volumerendering.logic()
+      volumeRenderingLogic.CreateDefaultVolumeRenderingNodes(volumeNode)
+    else:
+      slicer.util.updateVolumeFromArray(volumeNode, heatmap.transpose(2, 1, 0).astype(np.float32))
+      volumeNode.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(ijkToRAS))
+    volumeNode.GetDisplayNode().SetVisibility(True)
+    return volumeNode
 
 
-  
 def isVRInitialized():
   """Determine if VR has been initialized
   """
@@ -1341,3 +1899,25 @@ def vrCamera():
   return rendererCollection.GetItemAsObject(0).GetActiveCamera()
 
 
+
+def benchmarkModuleSetup(repeats=5, budget=100.0):
+  """
+  Time the construction of the module panel (ForcepsDeliveryVRWidget.setup) in a detached
+  widget, e.g. after adding phases to PHASE_STEPS. From the Python console:
+    import ForcepsDeliveryVR; ForcepsDeliveryVR.benchmarkModuleSetup()
+  Returns the setup times (ms); a warning is logged if the median exceeds budget (ms).
+  """
+  setupTimes = []
+  for _ in range(repeats):
+    widget = ForcepsDeliveryVRWidget()
+    widget.setup()
+    setupTimes.append(1000 * widget.setupTime)
+    widget.cleanup()
+    widget.parent.deleteLater()
+  medianTime = float(np.median(setupTimes))
+  message = 'ForcepsDeliveryVR panel setup: median %.1f ms, min %.1f ms over %d runs' % (medianTime, min(setupTimes), repeats)
+  if medianTime > budget:
+    logging.warning(message + ' (budget %.0f ms)' % budget)
+  else:
+    logging.info(message)
+  return setupTimes
@@ -0,0 +1,363 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+#
+# Asset distribution
+#
+# A device that joins a shared session gets the models (mother, baby, forceps, phase
+# texts) from the device that serves them. Assets are split in fixed-size chunks that are
+# identified by their SHA-256; a client asks for the manifest (assets and chunk digests),
+# then only for the chunks that its local content-addressed store lacks. Chunks are sent
+# and stored zlib-compressed. Assembled assets are kept in the store under their digest,
+# so a device that rejoins only transfers the manifest.
+#
+# Messages (little endian):
+#   request:  'FDVA', operation (uint8), count (uint32), then count chunk digests (32 bytes)
+#   response: 'FDVS', operation (uint8), count (uint32), then
+#             manifest: count bytes of zlib-compressed JSON
+#             chunks: count times digest (32 bytes), size (uint32), size bytes of zlib data
+#
+
+ASSET_PORT = 18960
+ASSET_CHUNK_SIZE = 64 * 1024
+# chunks requested per round trip
+ASSET_BATCH_SIZE = 64
+COMPRESSION_LEVEL = 6
+
+MESSAGE_HEADER = struct.Struct('<4sBI')
+CHUNK_HEADER = struct.Struct('<32sI')
+REQUEST_MAGIC = b'FDVA'
+RESPONSE_MAGIC = b'FDVS'
+OPERATION_MANIFEST = 1
+OPERATION_CHUNKS = 2
+
+# Asset files served from the Resources directory of the module
+ASSET_EXTENSIONS = ('.stl', '.vtk', '.vtp', '.ply', '.obj')
+
+
+def _recvExactly(sock, size):
+  buffer = bytearray(size)
+  view = memoryview(buffer)
+  received = 0
+  while received < size:
+    n = sock.recv_into(view[received:])
+    if n == 0:
+      raise ConnectionError('Connection closed')
+    received += n
+  return buffer
+
+
+def findAssets(root, extensions=ASSET_EXTENSIONS):
+  """
+  Paths (relative to root, with '/' separators) of the asset files under root.
+  """
+  paths = []
+  for directory, _, fileNames in os.walk(root):
+    for fileName in fileNames:
+      if fileName.lower().endswith(extensions):
+        paths.append(os.path.relpath(os.path.join(directory, fileName), root).replace(os.sep, '/'))
+  return sorted(paths)
+
+
+def buildManifest(root, paths, chunkSize=ASSET_CHUNK_SIZE):
+  """
+  Manifest of the assets (paths relative to root), and the location (path, offset, size)
+  of each chunk by digest.
+  """
+  assets = []
+  chunkLocations = {}
+  for path in paths:
+    fileHash = hashlib.sha256()
+    chunks = []
+    size = 0
+    with open(os.path.join(root, path), 'rb') as f:
+      while True:
+        data = f.read(chunkSize)
+        if not data:
+          break
+        fileHash.update(data)
+        digest = hashlib.sha256(data).digest()
+        chunks.append(digest.hex())
+        chunkLocations.setdefault(digest, (path, size, len(data)))
+        size += len(data)
+    assets.append({'name': path, 'size': size, 'sha256': fileHash.hexdigest(), 'chunks': chunks})
+  return {'version': 1, 'chunkSize': chunkSize, 'assets': assets}, chunkLocations
+
+
+class ContentStore:
+  """
+  Local content-addressed cache: compressed chunks under objects/, assembled assets under
+  files/<asset digest>/, and the last manifest received.
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+    os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+    os.makedirs(os.path.join(directory, 'files'), exist_ok=True)
+
+  def _objectPath(self, digest):
+    name = digest.hex()
+    return os.path.join(self.directory, 'objects', name[:2], name)
+
+  def _writeAtomically(self, path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temporaryPath = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+      f.write(data)
+    os.replace(temporaryPath, path)
+
+  def hasChunk(self, digest):
+    return os.path.exists(self._objectPath(digest))
+
+  def writeChunk(self, digest, compressed):
+    """
+    Store a compressed chunk, after checking that its content matches digest.
+    """
+    if hashlib.sha256(zlib.decompress(compressed)).digest() != digest:
+      raise ValueError('Chunk does not match its digest ' + digest.hex())
+    self._writeAtomically(self._objectPath(digest), compressed)
+
+  def readChunk(self, digest):
+    with open(self._objectPath(digest), 'rb') as f:
+      return zlib.decompress(f.read())
+
+  def assetPath(self, asset):
+    return os.path.join(self.directory, 'files', asset['sha256'], os.path.basename(asset['name']))
+
+  def materialize(self, asset):
+    """
+    Assemble an asset from its chunks (once). Returns its path.
+    """
+    path = self.assetPath(asset)
+    if os.path.exists(path):
+      return path
+    data = b''.join(self.readChunk(bytes.fromhex(chunk)) for chunk in asset['chunks'])
+    if hashlib.sha256(data).hexdigest() != asset['sha256']:
+      raise ValueError('Asset ' + asset['name'] + ' does not match its digest')
+    self._writeAtomically(path, data)
+    return path
+
+  def saveManifest(self, manifest):
+    self._writeAtomically(os.path.join(self.directory, 'manifest.json'), json.dumps(manifest).encode('utf-8'))
+
+  def loadManifest(self):
+    path = os.path.join(self.directory, 'manifest.json')
+    if not os.path.exists(path):
+      return None
+    with open(path, 'rb') as f:
+      return json.loads(f.read().decode('utf-8'))
+
+
+class AssetServer:
+  """
+  Serves the assets under root (findAssets by default) to AssetClients. The manifest is
+  built once at start, and each chunk is compressed the first time it is requested.
+  """
+
+  def __init__(self, root, paths=None, address=('0.0.0.0', ASSET_PORT), chunkSize=ASSET_CHUNK_SIZE):
+    self.root = root
+    self.paths = paths
+    self.address = address
+    self.chunkSize = chunkSize
+    self.manifest = None
+    self.sentChunks = 0
+    self.sentBytes = 0
+    self._chunkLocations = {}
+    self._compressedChunks = {}
+    self._lock = threading.Lock()
+    self._listener = None
+    self._thread = None
+    self._running = False
+
+  def start(self):
+    paths = self.paths if self.paths is not None else findAssets(self.root)
+    self.manifest, self._chunkLocations = buildManifest(self.root, paths, self.chunkSize)
+    self._manifestMessage = zlib.compress(json.dumps(self.manifest).encode('utf-8'), COMPRESSION_LEVEL)
+    self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._listener.bind(self.address)
+    # port 0 picks a free port
+    self.address = self._listener.getsockname()
+    self._listener.listen()
+    self._listener.settimeout(0.1)
+    self._running = True
+    self._thread = threading.Thread(target=self._accept, name='ForcepsDeliveryVRAssetServer')
+    self._thread.daemon = True
+    self._thread.start()
+    logging.info('Asset server: %d assets, %d chunks on %s' % (
+      len(self.manifest['assets']), len(self._chunkLocations), str(self.address)))
+
+  def stop(self):
+    self._running = False
+    if self._thread:
+      self._thread.join()
+      self._thread = None
+    if self._listener:
+      self._listener.close()
+      self._listener = None
+
+  def _accept(self):
+    while self._running:
+      try:
+        sock, _ = self._listener.accept()
+      except socket.timeout:
+        continue
+      except OSError:
+        return
+      sock.settimeout(None)
+      handler = threading.Thread(target=self._serve, args=(sock,), name='ForcepsDeliveryVRAssetClient')
+      handler.daemon = True
+      handler.start()
+
+  def _compressedChunk(self, digest):
+    with self._lock:
+      compressed = self._compressedChunks.get(digest)
+    if compressed is None:
+      path, offset, size = self._chunkLocations[digest]
+      with open(os.path.join(self.root, path), 'rb') as f:
+        f.seek(offset)
+        compressed = zlib.compress(f.read(size), COMPRESSION_LEVEL)
+      with self._lock:
+        self._compressedChunks[digest] = compressed
+    return compressed
+
+  def _serve(self, sock):
+    try:
+      while True:
+        magic, operation, count = MESSAGE_HEADER.unpack(_recvExactly(sock, MESSAGE_HEADER.size))
+        if magic != REQUEST_MAGIC:
+          raise ValueError('Invalid asset request')
+        if operation == OPERATION_MANIFEST:
+          sock.sendall(MESSAGE_HEADER.pack(RESPONSE_MAGIC, operation, len(self._manifestMessage)) + self._manifestMessage)
+        elif operation == OPERATION_CHUNKS:
+          digests = _recvExactly(sock, 32 * count)
+          response = [MESSAGE_HEADER.pack(RESPONSE_MAGIC, operation, count)]
+          for i in range(count):
+            digest = bytes(digests[32 * i:32 * (i + 1)])
+            compressed = self._compressedChunk(digest) if digest in self._chunkLocations else b''
+            response += [CHUNK_HEADER.pack(digest, len(compressed)), compressed]
+            self.sentChunks += 1
+            self.sentBytes += len(compressed)
+          sock.sendall(b''.join(response))
+        else:
+          raise ValueError('Invalid asset operation %d' % operation)
+    except (ConnectionError, ValueError, OSError) as e:
+      if not isinstance(e, ConnectionError):
+        logging.error('Asset client disconnected: ' + str(e))
+    finally:
+      sock.close()
+
+
+class AssetClient:
+  """
+  Gets the assets of an AssetServer into a ContentStore.
+  """
+
+  def __init__(self, address, store, timeout=10.0):
+    self.address = address
+    self.store = store
+    self.timeout = timeout
+
+  def _request(self, sock, operation, digests=()):
+    sock.sendall(MESSAGE_HEADER.pack(REQUEST_MAGIC, operation, len(digests)) + b''.join(digests))
+    magic, responseOperation, count = MESSAGE_HEADER.unpack(_recvExactly(sock, MESSAGE_HEADER.size))
+    if magic != RESPONSE_MAGIC or responseOperation != operation:
+      raise ValueError('Invalid asset response')
+    return count
+
+  def sync(self):
+    """
+    Get the manifest and the missing chunks, and assemble the assets. Returns the local
+    path of each asset by name, and the transfer statistics.
+    """
+    start = time.perf_counter()
+    statistics = {'chunks': 0, 'missingChunks': 0, 'receivedBytes': 0}
+    with socket.create_connection(self.address, self.timeout) as sock:
+      size = self._request(sock, OPERATION_MANIFEST)
+      manifestMessage = _recvExactly(sock, size)
+      statistics['receivedBytes'] += size
+      manifest = json.loads(zlib.decompress(manifestMessage).decode('utf-8'))
+      digests = []
+      for asset in manifest['assets']:
+        digests += [bytes.fromhex(chunk) for chunk in asset['chunks'] if not os.path.exists(self.store.assetPath(asset))]
+      digests = list(dict.fromkeys(digests))
+      statistics['chunks'] = len(digests)
+      missing = [digest for digest in digests if not self.store.hasChunk(digest)]
+      statistics['missingChunks'] = len(missing)
+      for batchStart in range(0, len(missing), ASSET_BATCH_SIZE):
+        batch = missing[batchStart:batchStart + ASSET_BATCH_SIZE]
+        count = self._request(sock, OPERATION_CHUNKS, batch)
+        for _ in range(count):
+          digest, size = CHUNK_HEADER.unpack(_recvExactly(sock, CHUNK_HEADER.size))
+          if not size:
+            raise ValueError('Chunk not available on the server: ' + digest.hex())
+          self.store.writeChunk(digest, bytes(_recvExactly(sock, size)))
+          statistics['receivedBytes'] += size
+    self.store.saveManifest(manifest)
+    paths = {asset['name']: self.store.materialize(asset) for asset in manifest['assets']}
+    statistics['seconds'] = time.perf_counter() - start
+    return paths, statistics
+
+
+def cachedAssetPaths(store):
+  """
+  Local paths of the assets of the last manifest received, when the server cannot be
+  reached (None if an asset is missing).
+  """
+  manifest = store.loadManifest()
+  if manifest is None:
+    return None
+  paths = {}
+  for asset in manifest['assets']:
+    path = store.assetPath(asset)
+    if not os.path.exists(path):
+      return None
+    paths[asset['name']] = path
+  return paths
+
+
+def main():
+  parser = argparse.ArgumentParser(description='ForcepsDeliveryVR asset server and client')
+  parser.add_argument('--root', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Resources'),
+                      help='directory of the assets to serve')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=ASSET_PORT)
+  parser.add_argument('--sync', metavar='CACHE', help='get the assets of the server at host:port into this cache directory')
+  parser.add_argument('--loopback', action='store_true', help='serve root and sync it twice into a temporary cache')
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO)
+  if args.sync:
+    paths, statistics = AssetClient((args.host, args.port), ContentStore(args.sync)).sync()
+    print(statistics)
+    return
+  server = AssetServer(args.root, address=(args.host, 0 if args.loopback else args.port))
+  server.start()
+  try:
+    if args.loopback:
+      with tempfile.TemporaryDirectory() as directory:
+        for attempt in ['join', 'rejoin']:
+          paths, statistics = AssetClient(server.address, ContentStore(directory)).sync()
+          print('%-6s %d assets, %d/%d chunks transferred, %d bytes, %.1f ms' % (
+            attempt, len(paths), statistics['missingChunks'], statistics['chunks'],
+            statistics['receivedBytes'], 1000 * statistics['seconds']))
+    else:
+      while True:
+        time.sleep(10)
+        logging.info('%d chunks sent (%d bytes)' % (server.sentChunks, server.sentBytes))
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.stop()
+
+
+if __name__ == '__main__':
+  main()
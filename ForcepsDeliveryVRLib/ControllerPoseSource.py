@@ -0,0 +1,50 @@
+import vtk
+
+from .PoseFilter import updateArrayFromVTKMatrix
+from .PoseSource import PoseSource
+from .TrajectoryFile import POSE_LEFT, POSE_RIGHT, POSE_HMD
+
+#
+# VR controller poses
+#
+
+
+class VRControllerPoseSource(PoseSource):
+  """
+  Pose source of the VR controllers and HMD: the transforms of the virtual reality view
+  node, relative to their parent transform (the physical to scene transform).
+  """
+
+  name = 'VR controllers'
+  eventDriven = True
+
+  def __init__(self, vrLogic):
+    PoseSource.__init__(self)
+    self.vrLogic = vrLogic
+    self._matrix = vtk.vtkMatrix4x4()
+
+  def _transformNodes(self):
+    vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
+    if vrViewNode is None:
+      return None
+    return {
+      POSE_LEFT: vrViewNode.GetLeftControllerTransformNode(),
+      POSE_RIGHT: vrViewNode.GetRightControllerTransformNode(),
+      POSE_HMD: vrViewNode.GetHMDTransformNode()}
+
+  def update(self):
+    transformNodes = self._transformNodes()
+    if transformNodes is None:
+      return False
+    for index, transformNode in transformNodes.items():
+      transformNode.GetMatrixTransformToParent(self._matrix)
+      updateArrayFromVTKMatrix(self._matrix, self.poses[index])
+    return True
+
+  def trackedTransformNodes(self):
+    transformNodes = self._transformNodes()
+    return list(transformNodes.values()) if transformNodes is not None else []
+
+  def parentTransformNode(self):
+    transformNodes = self._transformNodes()
+    return transformNodes[POSE_LEFT].GetParentTransformNode() if transformNodes is not None else None
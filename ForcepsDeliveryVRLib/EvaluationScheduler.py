@@ -0,0 +1,41 @@
+import time
+
+#
+# Frame-synchronous evaluation
+#
+
+class EvaluationScheduler:
+  """
+  Collects modifications of the tracked transforms (both controllers and the HMD)
+  and runs the evaluation at most once per frame, with all poses from the same frame.
+  onFrame is called by the frame clock (a timer at the HMD refresh rate).
+  """
+
+  def __init__(self, evaluate):
+    # evaluate(timestamp) runs the active phase check
+    self.evaluate = evaluate
+    self.modifiedSources = set()
+    self.modifiedEventCount = 0
+    self.evaluationCount = 0
+
+  def reset(self):
+    self.modifiedSources.clear()
+    self.modifiedEventCount = 0
+    self.evaluationCount = 0
+
+  def markModified(self, source):
+    self.modifiedSources.add(source)
+    self.modifiedEventCount += 1
+
+  def onFrame(self, timestamp=None):
+    """
+    Run the evaluation if any source changed since the last frame. Returns True if it ran.
+    """
+    if not self.modifiedSources:
+      return False
+    self.modifiedSources.clear()
+    if timestamp is None:
+      timestamp = time.perf_counter()
+    self.evaluationCount += 1
+    self.evaluate(timestamp)
+    return True
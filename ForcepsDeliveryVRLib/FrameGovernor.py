@@ -0,0 +1,112 @@
+import collections
+
+#
+# Frame budget governor
+#
+# Measures the time the evaluation takes in each frame on the main thread and, when it
+# stays over budget, steps down through tiers that do less work per frame. It steps back
+# up after a longer period with enough headroom, so that the tier does not oscillate.
+#
+# The tiers reduce the optional per-frame work: console output, expert DTW match, ghost,
+# tissue deformation (the only mesh computation of the frame), then the checks themselves.
+# The checks measure distances to the landmarks of the head analytically, at a fixed cost,
+# so there is no mesh distance to replace with cached values.
+#
+
+# interval: the task runs every interval frames (0: not at all)
+QualityTier = collections.namedtuple('QualityTier', ['name', 'evaluationInterval', 'expertMatchInterval',
+  'ghostInterval', 'deformationInterval', 'logging'])
+
+QUALITY_TIERS = [
+  # everything, every frame
+  QualityTier('Full', evaluationInterval=1, expertMatchInterval=1, ghostInterval=1, deformationInterval=1, logging=True),
+  # no per-frame console output, expert match and ghost at a lower rate
+  QualityTier('Reduced', evaluationInterval=1, expertMatchInterval=3, ghostInterval=2, deformationInterval=1,
+    logging=False),
+  # checks every other frame
+  QualityTier('Low', evaluationInterval=2, expertMatchInterval=6, ghostInterval=3, deformationInterval=2, logging=False),
+  # checks every third frame, no expert match, ghost and tissue deformation frozen
+  QualityTier('Minimal', evaluationInterval=3, expertMatchInterval=0, ghostInterval=0, deformationInterval=0,
+    logging=False),
+  ]
+
+# share of the frame (s) left to the evaluation at 90 Hz, the rest is for rendering
+DEFAULT_BUDGET = 0.25 / 90
+# frames over budget before stepping down, and frames with headroom before stepping up;
+# the latter doubles (up to MAX_UP_FRAMES) each time a step up has to be undone
+DOWN_FRAMES = 15
+UP_FRAMES = 270
+MAX_UP_FRAMES = 8 * UP_FRAMES
+HEADROOM = 0.5
+# weight of the last frame in the mean evaluation time
+SMOOTHING = 0.1
+
+
+class FrameGovernor:
+  """
+  Chooses the QualityTier of each frame from the measured evaluation times. endFrame is
+  called at the end of every frame with the time spent, and tasks check shouldRun with
+  their interval in the current tier.
+  """
+
+  def __init__(self, budget=DEFAULT_BUDGET, tiers=QUALITY_TIERS, downFrames=DOWN_FRAMES, upFrames=UP_FRAMES,
+               headroom=HEADROOM):
+    self.budget = budget
+    self.tiers = tiers
+    self.downFrames = downFrames
+    self.upFrames = upFrames
+    self.headroom = headroom
+    self.reset()
+
+  def reset(self):
+    self.tierIndex = 0
+    self.frame = 0
+    self.meanTime = 0.0
+    self.tierChanges = 0
+    self._overBudgetFrames = 0
+    self._headroomFrames = 0
+    self._upFramesRequired = self.upFrames
+    self._steppedUp = False
+
+  @property
+  def tier(self):
+    return self.tiers[self.tierIndex]
+
+  def shouldRun(self, interval):
+    """
+    Whether a task with the given interval of the current tier (e.g. tier.ghostInterval)
+    runs in this frame.
+    """
+    return interval > 0 and self.frame % interval == 0
+
+  def endFrame(self, elapsed):
+    """
+    Account the evaluation time (s) of the frame that ends. Returns True if the tier changed.
+    """
+    self.frame += 1
+    self.meanTime += SMOOTHING * (elapsed - self.meanTime)
+    if self.meanTime > self.budget:
+      self._overBudgetFrames += 1
+      self._headroomFrames = 0
+    elif self.meanTime < self.headroom * self.budget:
+      self._headroomFrames += 1
+      self._overBudgetFrames = 0
+    else:
+      self._overBudgetFrames = 0
+      self._headroomFrames = 0
+    if self._overBudgetFrames >= self.downFrames and self.tierIndex < len(self.tiers) - 1:
+      if self._steppedUp:
+        self._upFramesRequired = min(2 * self._upFramesRequired, MAX_UP_FRAMES)
+      self._steppedUp = False
+      return self._setTier(self.tierIndex + 1)
+    if self._headroomFrames >= self._upFramesRequired and self.tierIndex > 0:
+      self._steppedUp = True
+      return self._setTier(self.tierIndex - 1)
+    return False
+
+  def _setTier(self, tierIndex):
+    self.tierIndex = tierIndex
+    self.tierChanges += 1
+    self._overBudgetFrames = 0
+    self._headroomFrames = 0
+    return True
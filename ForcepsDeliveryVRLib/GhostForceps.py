@@ -0,0 +1,82 @@
+import numpy as np
+import vtk
+import slicer
+
+from .TrajectoryFile import TrajectoryReader, POSE_LEFT, POSE_RIGHT
+from .TrajectoryAnalytics import resamplePoses
+from .SharedGeometry import createInstance, attachToTransform
+
+#
+# Expert ghost
+#
+
+GHOST_RATE = 90.0
+GHOST_COLOR = (0.4, 0.7, 1.0)
+GHOST_OPACITY = 0.35
+
+
+class GhostForceps:
+  """
+  Semi-transparent copies of the forceps that follow a recorded expert trajectory. The
+  ghost models are instances of the real forceps models (the mesh is shared, not copied,
+  see SharedGeometry) and are moved by two transforms that share the parent of the controller
+  transforms. The recording is resampled once into an evenly spaced pose table (SLERP of
+  the rotations), so that showing a time is an array index and one in-place matrix update
+  per forceps.
+  """
+
+  def __init__(self, path, modelNodes, parentTransformID=None, rate=GHOST_RATE):
+    # modelNodes: [left forceps model, right forceps model]
+    reader = TrajectoryReader(path)
+    timestamps = np.array(reader.timestamps, dtype=float)
+    poses = reader.frames['poses'][:, [POSE_LEFT, POSE_RIGHT]].astype(float)
+    reader.close()
+    if len(timestamps) >= 2:
+      _, poses = resamplePoses(timestamps - timestamps[0], poses, rate)
+    # (frames, forceps, 16) table in the order expected by vtkMatrix4x4.DeepCopy
+    self.poseTable = np.ascontiguousarray(poses.reshape(len(poses), len(modelNodes), 16))
+    self.rate = rate
+    self.frameIndex = None
+    self._matrix = vtk.vtkMatrix4x4()
+    self.transformNodes = []
+    self.ghostModelNodes = []
+    for modelNode in modelNodes:
+      name = modelNode.GetName().replace('Model', 'Ghost')
+      transformNode = slicer.mrmlScene.GetFirstNodeByName(name + 'Transform')
+      if transformNode is None:
+        transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode', name + 'Transform')
+        transformNode.SetHideFromEditors(True)
+      transformNode.SetAndObserveTransformNodeID(parentTransformID)
+      self.transformNodes.append(transformNode)
+      ghostModelNode = createInstance(modelNode, name + 'Model')
+      ghostModelNode.SetHideFromEditors(True)
+      displayNode = ghostModelNode.GetDisplayNode()
+      displayNode.SetColor(GHOST_COLOR)
+      displayNode.SetOpacity(GHOST_OPACITY)
+      displayNode.SetVisibility(True)
+      attachToTransform(ghostModelNode, transformNode.GetID())
+      self.ghostModelNodes.append(ghostModelNode)
+
+  @property
+  def duration(self):
+    return (len(self.poseTable) - 1) / self.rate if len(self.poseTable) else 0.0
+
+  def seek(self, time):
+    """
+    Show the expert poses at the given time (s since the start of the phase); the last
+    pose is held at the end of the recording.
+    """
+    if not len(self.poseTable):
+      return
+    frameIndex = min(max(int(time * self.rate), 0), len(self.poseTable) - 1)
+    if frameIndex == self.frameIndex:
+      return
+    self.frameIndex = frameIndex
+    for transformNode, pose in zip(self.transformNodes, self.poseTable[frameIndex]):
+      self._matrix.DeepCopy(pose.tolist())
+      transformNode.SetMatrixTransformToParent(self._matrix)
+
+  def stop(self):
+    # the nodes are kept in the scene for the next phase, hidden
+    for ghostModelNode in self.ghostModelNodes:
+      ghostModelNode.GetDisplayNode().SetVisibility(False)
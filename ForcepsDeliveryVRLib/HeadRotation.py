@@ -0,0 +1,193 @@
+import numpy as np
+
+from . import Scoring
+from .Scoring import BLADE_TIP, PHASE_FINAL_PLACEMENT_LEFT, PHASE_FINAL_PLACEMENT_RIGHT
+
+#
+# Kielland rotation of the fetal head
+#
+# Once both blades are locked on the head (the final placement checks of both pass), the
+# head follows the twist of the forceps about the pelvic axis at the head: the angle of
+# the head tracks the twist since the lock, less the slippage of the blades on the head,
+# limited in speed by the resistance of the tissues and clamped to the rotation range.
+# The lock is released when the blades are pulled apart.
+# The per-frame update writes every vector and matrix into arrays allocated once.
+#
+
+# range (degrees) of the head rotation from its pose in the scene, the target being
+# Scoring.ROTATION_TARGET
+ROTATION_LIMITS = (-30.0, 120.0)
+# share of the forceps twist lost to the slippage of the blades
+ROTATION_SLIPPAGE = 0.15
+# resistance of the tissues: maximum rotation speed of the head (degrees/s)
+MAX_ROTATION_SPEED = 60.0
+# change of the distance between the blade tips (mm) that releases the lock
+LOCK_RELEASE_DISTANCE = 20.0
+
+
+def rotationAbout(point, direction, angle, out=None):
+  """
+  4x4 matrix of the rotation by angle (degrees) about the line through point along the
+  unit vector direction. Written into out if given.
+  """
+  if out is None:
+    out = np.eye(4)
+  skew = np.array([
+    [0.0, -direction[2], direction[1]],
+    [direction[2], 0.0, -direction[0]],
+    [-direction[1], direction[0], 0.0]])
+  radians = np.radians(angle)
+  out[:3, :3] = np.eye(3) + np.sin(radians) * skew + (1 - np.cos(radians)) * skew.dot(skew)
+  out[:3, 3] = point - out[:3, :3].dot(point)
+  return out
+
+
+def rotatedHead(head, angle):
+  """
+  HeadLandmarks rotated by angle (degrees) about the pelvic axis at the head. The pelvic
+  axis belongs to the mother and does not move. The result has rotation set to angle.
+  """
+  arcLength, point, tangent, distance = head.pelvicAxis.project(head.center)
+  rotated = head.transformed(rotationAbout(point, tangent, angle))
+  rotated.pelvicAxis = head.pelvicAxis
+  rotated.rotation = head.rotation + angle
+  return rotated
+
+
+class HeadRotation:
+  """
+  Kinematic rotation of the fetal head by the locked forceps. reset gives the head
+  (HeadLandmarks in the frame of the poses, with its pelvic axis) at the start of the
+  phase, then update is called with the filtered poses of every frame. matrix is the
+  rotation of the head in the frame of the poses, worldMatrix the same in world
+  coordinates (for the transform of the baby models).
+  """
+
+  def __init__(self, limits=ROTATION_LIMITS, slippage=ROTATION_SLIPPAGE, maxSpeed=MAX_ROTATION_SPEED,
+               releaseDistance=LOCK_RELEASE_DISTANCE):
+    self.limits = limits
+    self.slippage = slippage
+    self.maxSpeed = maxSpeed
+    self.releaseDistance = releaseDistance
+    self.head = None
+    self.angle = 0.0
+    self.locked = False
+    self.matrix = np.eye(4)
+    self.worldMatrix = np.eye(4)
+    # rotation axis: point, direction, cross product matrices, and a basis of the
+    # plane orthogonal to it for the twist of the forceps
+    self._point = np.zeros(3)
+    self._skew = np.zeros((3, 3))
+    self._skew2 = np.zeros((3, 3))
+    self._basis = np.zeros((2, 3))
+    self._poseToWorld = np.eye(4)
+    self._worldToPose = np.eye(4)
+    # work arrays of the per-frame update
+    self._identity = np.eye(3)
+    self._term = np.zeros((3, 3))
+    self._leftTip = np.zeros(3)
+    self._rightTip = np.zeros(3)
+    self._tipVector = np.zeros(3)
+    self._rotatedPoint = np.zeros(3)
+    self._product = np.zeros((4, 4))
+    self._twist = np.zeros(2)
+    self._lockTwist = 0.0
+    self._lockAngle = 0.0
+    self._lockSeparation = 0.0
+    self._timestamp = None
+    self._margins = {}
+
+  def reset(self, head, poseToWorld=None, margins=None):
+    """
+    Start from the head in its pose in the scene. poseToWorld: 4x4 matrix from the frame
+    of the poses to world coordinates. margins: {phase: margin} of the final placement
+    checks that lock the forceps (default: Scoring.DEFAULT_MARGINS).
+    """
+    self.head = head
+    self.angle = 0.0
+    self.locked = False
+    self._timestamp = None
+    self._margins = margins if margins is not None else Scoring.DEFAULT_MARGINS
+    self._poseToWorld[:] = np.eye(4) if poseToWorld is None else poseToWorld
+    self._worldToPose[:] = np.linalg.inv(self._poseToWorld)
+    arcLength, point, tangent, distance = head.pelvicAxis.project(head.center)
+    self._point[:] = point
+    rotationAbout(point, tangent, 0.0, out=self.matrix)
+    self._skew[:] = [[0.0, -tangent[2], tangent[1]], [tangent[2], 0.0, -tangent[0]], [-tangent[1], tangent[0], 0.0]]
+    np.dot(self._skew, self._skew, out=self._skew2)
+    # any unit vector orthogonal to the axis, and the one orthogonal to both
+    reference = self._identity[np.argmin(np.abs(tangent))]
+    self._basis[0] = reference - reference.dot(tangent) * tangent
+    self._basis[0] /= np.linalg.norm(self._basis[0])
+    self._basis[1] = np.cross(tangent, self._basis[0])
+    self._updateWorldMatrix()
+
+  def rotatedHead(self):
+    """
+    Head landmarks at the current angle, for the checks. A new object: the previous one
+    may still be in use by the scoring worker.
+    """
+    return rotatedHead(self.head, self.angle)
+
+  def _tips(self, leftPose, rightPose):
+    np.dot(leftPose[:3, :3], BLADE_TIP, out=self._leftTip)
+    self._leftTip += leftPose[:3, 3]
+    np.dot(rightPose[:3, :3], BLADE_TIP, out=self._rightTip)
+    self._rightTip += rightPose[:3, 3]
+    np.subtract(self._leftTip, self._rightTip, out=self._tipVector)
+
+  def _forcepsTwist(self):
+    # angle (degrees) of the line between the blade tips about the axis
+    np.dot(self._basis, self._tipVector, out=self._twist)
+    return np.degrees(np.arctan2(self._twist[1], self._twist[0]))
+
+  def _isLocked(self, leftPose, rightPose):
+    head = self.head if self.angle == 0.0 else self.rotatedHead()
+    return (Scoring.checkFinalPlacementLeft(leftPose, rightPose, self._margins[PHASE_FINAL_PLACEMENT_LEFT], head)[0]
+      and Scoring.checkFinalPlacementRight(leftPose, rightPose, self._margins[PHASE_FINAL_PLACEMENT_RIGHT], head)[0])
+
+  def update(self, leftPose, rightPose, timestamp):
+    """
+    Follow the forceps poses (4x4, frame of the poses) at timestamp (s). Returns True if
+    the head moved.
+    """
+    elapsed = 0.0 if self._timestamp is None else max(0.0, timestamp - self._timestamp)
+    self._timestamp = timestamp
+    if self.head is None:
+      return False
+    self._tips(leftPose, rightPose)
+    if not self.locked:
+      if not self._isLocked(leftPose, rightPose):
+        return False
+      self.locked = True
+      self._lockTwist = self._forcepsTwist()
+      self._lockAngle = self.angle
+      self._lockSeparation = np.linalg.norm(self._tipVector)
+      return False
+    if abs(np.linalg.norm(self._tipVector) - self._lockSeparation) > self.releaseDistance:
+      self.locked = False
+      return False
+    twist = (self._forcepsTwist() - self._lockTwist + 180.0) % 360.0 - 180.0
+    target = min(max(self._lockAngle + (1 - self.slippage) * twist, self.limits[0]), self.limits[1])
+    step = min(max(target - self.angle, -self.maxSpeed * elapsed), self.maxSpeed * elapsed)
+    if step == 0.0:
+      return False
+    self.angle += step
+    self._updateMatrix()
+    return True
+
+  def _updateMatrix(self):
+    # Rodrigues formula, R = I + sin(a) K + (1 - cos(a)) K^2, then t = p - R p
+    radians = np.radians(self.angle)
+    rotation = self.matrix[:3, :3]
+    np.multiply(self._skew, np.sin(radians), out=rotation)
+    np.multiply(self._skew2, 1 - np.cos(radians), out=self._term)
+    rotation += self._term
+    rotation += self._identity
+    np.dot(rotation, self._point, out=self._rotatedPoint)
+    np.subtract(self._point, self._rotatedPoint, out=self.matrix[:3, 3])
+    self._updateWorldMatrix()
+
+  def _updateWorldMatrix(self):
+    np.matmul(self._poseToWorld, self.matrix, out=self._product)
+    np.matmul(self._product, self._worldToPose, out=self.worldMatrix)
@@ -0,0 +1,52 @@
+import logging
+
+#
+# Observer lifecycle
+#
+
+class ObserverManager:
+  """
+  Owns all VTK observations on the tracked transforms. Each (object, event, callback)
+  is observed at most once, however many owners (phases) request it; the VTK observer
+  is removed when its last owner releases it. The number of live observers is
+  available for instrumentation.
+  """
+
+  def __init__(self):
+    # key -> [observedObject, observerTag, set of owners]
+    self._observations = {}
+
+  @property
+  def observerCount(self):
+    return len(self._observations)
+
+  def addObserver(self, observedObject, event, callback, owner=None):
+    key = (observedObject, event, callback)
+    observation = self._observations.get(key)
+    if observation is None:
+      tag = observedObject.AddObserver(event, callback)
+      observation = [observedObject, tag, set()]
+      self._observations[key] = observation
+    observation[2].add(owner)
+
+  def removeObservers(self, owner=None):
+    """
+    Release all observations of owner. Returns the number of VTK observers removed.
+    """
+    removed = 0
+    for key in list(self._observations.keys()):
+      observedObject, tag, owners = self._observations[key]
+      owners.discard(owner)
+      if not owners:
+        observedObject.RemoveObserver(tag)
+        del self._observations[key]
+        removed += 1
+    return removed
+
+  def removeAllObservers(self):
+    for observedObject, tag, owners in self._observations.values():
+      observedObject.RemoveObserver(tag)
+    self._observations.clear()
+
+  def logStatus(self):
+    logging.info('Live transform observers: ' + str(self.observerCount))
@@ -0,0 +1,295 @@
+import copy
+import numpy as np
+
+#
+# Pelvic axis (curve of Carus)
+#
+# The axis of the birth canal runs from the pelvic inlet to the outlet, bending forwards
+# around the pubic symphysis; traction on the fetal head is applied along its tangent at
+# the depth of the head. The curve is tabulated once: samples evenly spaced in arc length
+# (position, unit tangent towards the outlet), and a voxel grid around it that holds the
+# closest sample of each voxel center. Projecting a point is then a grid lookup, a walk
+# along the samples to the one closest to the point itself (a few steps at most, as the
+# point is within half a voxel of the center), and a refinement on the two segments next
+# to that sample.
+#
+
+# spacing (mm) of the samples along the curve
+AXIS_SAMPLE_SPACING = 0.5
+# voxel size (mm) and extent around the curve (mm) of the closest sample grid
+AXIS_VOXEL_SIZE = 2.0
+AXIS_GRID_MARGIN = 60.0
+# Curve of Carus: arc of a circle centered on the pubic symphysis
+CARUS_RADIUS = 60.0
+CARUS_ANGLE = 90.0
+# mother surface used to find the outlet: within this factor of the head radius of its center
+OUTLET_SEARCH_FACTOR = 1.5
+
+
+def catmullRomSpline(points, samplesPerSegment=20):
+  """
+  Dense polyline through the control points (N, 3), centripetal Catmull-Rom spline.
+  """
+  points = np.asarray(points, dtype=float)
+  if len(points) < 3:
+    t = np.linspace(0.0, 1.0, samplesPerSegment * (len(points) - 1) + 1)[:, np.newaxis]
+    return points[0] + t * (points[-1] - points[0])
+  # end points are extended linearly
+  padded = np.concatenate([[2 * points[0] - points[1]], points, [2 * points[-1] - points[-2]]])
+  u = np.linspace(0.0, 1.0, samplesPerSegment, endpoint=False)[:, np.newaxis]
+  segments = []
+  for i in range(1, len(padded) - 2):
+    p0, p1, p2, p3 = padded[i - 1:i + 3]
+    t0 = 0.0
+    t1 = t0 + np.linalg.norm(p1 - p0) ** 0.5
+    t2 = t1 + np.linalg.norm(p2 - p1) ** 0.5
+    t3 = t2 + np.linalg.norm(p3 - p2) ** 0.5
+    t = t1 + u * (t2 - t1)
+    a1 = ((t1 - t) * p0 + (t - t0) * p1) / (t1 - t0)
+    a2 = ((t2 - t) * p1 + (t - t1) * p2) / (t2 - t1)
+    a3 = ((t3 - t) * p2 + (t - t2) * p3) / (t3 - t2)
+    b1 = ((t2 - t) * a1 + (t - t0) * a2) / (t2 - t0)
+    b2 = ((t3 - t) * a2 + (t - t1) * a3) / (t3 - t1)
+    segments.append(((t2 - t) * b1 + (t - t1) * b2) / (t2 - t1))
+  segments.append(points[-1:])
+  return np.concatenate(segments)
+
+
+def resampleByArcLength(polyline, spacing):
+  """
+  Points evenly spaced by spacing (mm) along a polyline, and their arc length.
+  """
+  lengths = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(polyline, axis=0), axis=1))])
+  arcLength = np.linspace(0.0, lengths[-1], max(2, int(np.ceil(lengths[-1] / spacing)) + 1))
+  points = np.stack([np.interp(arcLength, lengths, polyline[:, axis]) for axis in range(3)], axis=1)
+  return points, arcLength
+
+
+def carusArc(outlet, outward, anterior, radius=CARUS_RADIUS, angle=CARUS_ANGLE, count=7):
+  """
+  Control points (count, 3) of the curve of Carus, from the inlet to the outlet: an arc of
+  the given radius (mm) and angle (degrees) whose chord, from the inlet to the outlet, is
+  along outward, and whose center is on the anterior side (the pubic symphysis).
+  """
+  outward = np.asarray(outward, dtype=float) / np.linalg.norm(outward)
+  anterior = np.asarray(anterior, dtype=float)
+  anterior = anterior - anterior.dot(outward) * outward
+  anterior /= np.linalg.norm(anterior)
+  # tangent and normal (towards the center) of the arc at the outlet
+  halfAngle = np.radians(angle) / 2
+  tangent = np.cos(halfAngle) * outward + np.sin(halfAngle) * anterior
+  normal = np.cos(halfAngle) * anterior - np.sin(halfAngle) * outward
+  theta = np.radians(np.linspace(angle, 0.0, count))[:, np.newaxis]
+  return np.asarray(outlet, dtype=float) + radius * ((1 - np.cos(theta)) * normal - np.sin(theta) * tangent)
+
+
+def findOutlet(vertices, headCenter, headRadius, searchFactor=OUTLET_SEARCH_FACTOR):
+  """
+  Center and outward direction of the birth canal outlet, from the vertices (N, 3) of the
+  mother model and the fetal head presented at it: the plane fitted to the mother surface
+  around the head, facing away from the body. The center is the projection of the head
+  center on that plane. Returns None if there is no surface around the head.
+  """
+  headCenter = np.asarray(headCenter, dtype=float)
+  near = vertices[np.linalg.norm(vertices - headCenter, axis=1) < searchFactor * headRadius]
+  if len(near) < 3:
+    return None
+  center = near.mean(axis=0)
+  normal = np.linalg.svd(near - center, full_matrices=False)[2][2]
+  if normal.dot(center - vertices.mean(axis=0)) < 0:
+    normal = -normal
+  return headCenter - (headCenter - center).dot(normal) * normal, normal
+
+
+class _AxisTables:
+  """
+  Tables of a PelvicAxis, shared by its transformed copies.
+  """
+
+  def __init__(self, points, tangents, arcLength):
+    self.points = points
+    self.tangents = tangents
+    self.arcLength = arcLength
+    self.segments = np.diff(points, axis=0)
+    self.segmentLengths2 = np.maximum(np.einsum('ij,ij->i', self.segments, self.segments), 1e-12)
+    # the same as lists, for the single point projection (scalar arithmetic is faster there)
+    self.pointList = points.tolist()
+    self.tangentList = tangents.tolist()
+    self.segmentList = self.segments.tolist()
+    self.segmentLengths2List = self.segmentLengths2.tolist()
+    self.arcLengthList = arcLength.tolist()
+    self.grid = None
+    self.origin = None
+
+
+class PelvicAxis:
+  """
+  Curve of the birth canal from the inlet to the outlet, tabulated by arc length (mm).
+  controlPoints (N, 3) are interpolated with a spline. matrix is the transform from the
+  frame of the control points to the current frame (see transformed).
+  """
+
+  def __init__(self, controlPoints, spacing=AXIS_SAMPLE_SPACING, voxelSize=AXIS_VOXEL_SIZE,
+               gridMargin=AXIS_GRID_MARGIN, matrix=None):
+    points, arcLength = resampleByArcLength(catmullRomSpline(controlPoints), spacing)
+    tangents = np.gradient(points, axis=0)
+    tangents /= np.linalg.norm(tangents, axis=1)[:, np.newaxis]
+    self._tables = _AxisTables(points, tangents, arcLength)
+    self.spacing = spacing
+    self.voxelSize = voxelSize
+    self.gridMargin = gridMargin
+    self.matrix = np.eye(4) if matrix is None else np.asarray(matrix, dtype=float)
+    self._inverse = np.linalg.inv(self.matrix)
+
+  @property
+  def length(self):
+    return self._tables.arcLength[-1]
+
+  def pointAt(self, arcLength):
+    """
+    Point and unit tangent (towards the outlet) of the curve at an arc length (mm) from the inlet.
+    """
+    tables = self._tables
+    point = np.array([np.interp(arcLength, tables.arcLength, tables.points[:, axis]) for axis in range(3)])
+    tangent = np.array([np.interp(arcLength, tables.arcLength, tables.tangents[:, axis]) for axis in range(3)])
+    return (self.matrix[:3, :3].dot(point) + self.matrix[:3, 3],
+            self.matrix[:3, :3].dot(tangent) / np.linalg.norm(tangent))
+
+  def transformed(self, matrix):
+    """
+    Axis in another frame, given the 4x4 matrix from the current frame to that frame.
+    The tables are shared, not copied.
+    """
+    axis = copy.copy(self)
+    axis.matrix = np.asarray(matrix, dtype=float).dot(self.matrix)
+    axis._inverse = np.linalg.inv(axis.matrix)
+    return axis
+
+  def prepare(self):
+    """
+    Bake the closest sample grid (once for the axis and its transformed copies).
+    """
+    tables = self._tables
+    if tables.grid is not None:
+      return
+    lower = tables.points.min(axis=0) - self.gridMargin
+    shape = np.ceil((tables.points.max(axis=0) + self.gridMargin - lower) / self.voxelSize).astype(int)
+    centers = np.stack(np.meshgrid(*[lower[axis] + (np.arange(shape[axis]) + 0.5) * self.voxelSize
+      for axis in range(3)], indexing='ij'), axis=-1).reshape(-1, 3)
+    squaredNorms = np.einsum('ij,ij->i', tables.points, tables.points)
+    closest = np.empty(len(centers), dtype=np.int32)
+    chunkSize = max(1, 4000000 // len(tables.points))
+    for start in range(0, len(centers), chunkSize):
+      chunk = centers[start:start + chunkSize]
+      closest[start:start + chunkSize] = np.argmin(squaredNorms - 2 * chunk.dot(tables.points.T), axis=1)
+    tables.origin = lower
+    tables.originList = lower.tolist()
+    tables.grid = closest.reshape(shape)
+
+  def _closestSamples(self, local):
+    # local: (N, 3) points in the frame of the tables
+    tables = self._tables
+    voxels = np.floor((local - tables.origin) / self.voxelSize).astype(np.intp)
+    inside = np.all((voxels >= 0) & (voxels < tables.grid.shape), axis=1)
+    samples = np.empty(len(local), dtype=np.intp)
+    samples[inside] = tables.grid[tuple(voxels[inside].T)]
+    if not np.all(inside):
+      outside = local[~inside]
+      samples[~inside] = np.argmin(np.linalg.norm(outside[:, np.newaxis] - tables.points, axis=2), axis=1)
+    # the sample of a voxel is the closest to its center: move to a neighbour while it is
+    # closer to the point
+    lastSample = len(tables.points) - 1
+    distances = np.sum((local - tables.points[samples]) ** 2, axis=1)
+    active = np.arange(len(local))
+    while len(active):
+      current = samples[active]
+      best = distances[active]
+      moved = np.zeros(len(active), dtype=bool)
+      for step in [-1, 1]:
+        candidates = np.clip(current + step, 0, lastSample)
+        candidateDistances = np.sum((local[active] - tables.points[candidates]) ** 2, axis=1)
+        closer = candidateDistances < best
+        current = np.where(closer, candidates, current)
+        best = np.where(closer, candidateDistances, best)
+        moved |= closer
+      samples[active] = current
+      distances[active] = best
+      active = active[moved]
+    return samples
+
+  def projectBatch(self, positions):
+    """
+    Project points (N, 3) of the current frame on the curve. Returns the arc length (N,)
+    from the inlet, the closest points (N, 3), the unit tangents (N, 3) towards the outlet
+    and the distances (N,) to the curve.
+    """
+    self.prepare()
+    tables = self._tables
+    positions = np.asarray(positions, dtype=float)
+    local = positions.dot(self._inverse[:3, :3].T) + self._inverse[:3, 3]
+    samples = self._closestSamples(local)
+    # refinement on the segments before and after the closest sample
+    lastSegment = len(tables.segments) - 1
+    best = None
+    for segment in [np.clip(samples - 1, 0, lastSegment), np.clip(samples, 0, lastSegment)]:
+      u = np.clip(np.einsum('ij,ij->i', local - tables.points[segment], tables.segments[segment])
+        / tables.segmentLengths2[segment], 0.0, 1.0)
+      points = tables.points[segment] + u[:, np.newaxis] * tables.segments[segment]
+      distances = np.linalg.norm(local - points, axis=1)
+      if best is None:
+        best = [segment, u, points, distances]
+      else:
+        closer = distances < best[3]
+        for values, candidate in zip(best, [segment, u, points, distances]):
+          values[closer] = candidate[closer]
+    segment, u, points, distances = best
+    arcLength = tables.arcLength[segment] + u * (tables.arcLength[segment + 1] - tables.arcLength[segment])
+    tangents = (1 - u[:, np.newaxis]) * tables.tangents[segment] + u[:, np.newaxis] * tables.tangents[segment + 1]
+    tangents /= np.linalg.norm(tangents, axis=1)[:, np.newaxis]
+    return (arcLength, points.dot(self.matrix[:3, :3].T) + self.matrix[:3, 3], tangents.dot(self.matrix[:3, :3].T),
+            distances)
+
+  def project(self, position):
+    """
+    projectBatch for one point: (arc length, closest point, tangent, distance).
+    """
+    self.prepare()
+    tables = self._tables
+    x, y, z = (self._inverse[:3, :3].dot(position) + self._inverse[:3, 3]).tolist()
+    origin, shape = tables.originList, tables.grid.shape
+    i = int((x - origin[0]) // self.voxelSize)
+    j = int((y - origin[1]) // self.voxelSize)
+    k = int((z - origin[2]) // self.voxelSize)
+    if 0 <= i < shape[0] and 0 <= j < shape[1] and 0 <= k < shape[2]:
+      sample = int(tables.grid[i, j, k])
+      # move to the sample closest to the point (see _closestSamples)
+      pointList = tables.pointList
+      px, py, pz = pointList[sample]
+      best = (x - px) ** 2 + (y - py) ** 2 + (z - pz) ** 2
+      for step in [-1, 1]:
+        while 0 <= sample + step < len(pointList):
+          px, py, pz = pointList[sample + step]
+          distance2 = (x - px) ** 2 + (y - py) ** 2 + (z - pz) ** 2
+          if distance2 >= best:
+            break
+          sample += step
+          best = distance2
+    else:
+      sample = int(self._closestSamples(np.array([[x, y, z]]))[0])
+    # refinement on the segments before and after the closest sample
+    best = None
+    for segment in {max(sample - 1, 0), min(sample, len(tables.segmentList) - 1)}:
+      px, py, pz = tables.pointList[segment]
+      sx, sy, sz = tables.segmentList[segment]
+      u = min(max(((x - px) * sx + (y - py) * sy + (z - pz) * sz) / tables.segmentLengths2List[segment], 0.0), 1.0)
+      dx, dy, dz = x - px - u * sx, y - py - u * sy, z - pz - u * sz
+      distance2 = dx * dx + dy * dy + dz * dz
+      if best is None or distance2 < best[0]:
+        best = (distance2, segment, u)
+    distance2, segment, u = best
+    point = np.array(tables.pointList[segment]) + u * tables.segments[segment]
+    tangent = (1 - u) * tables.tangents[segment] + u * tables.tangents[segment + 1]
+    tangent = self.matrix[:3, :3].dot(tangent) / np.linalg.norm(tangent)
+    arcLengths = tables.arcLengthList
+    arcLength = arcLengths[segment] + u * (arcLengths[segment + 1] - arcLengths[segment])
+    return arcLength, self.matrix[:3, :3].dot(point) + self.matrix[:3, 3], tangent, distance2 ** 0.5
@@ -0,0 +1,334 @@
+import math
+import numpy as np
+
+#
+# Pose filtering for the VR controllers
+#
+# All filters keep their state in NumPy buffers allocated once in the constructor
+# and update them in place, so running them on every transform event does not
+# create new arrays.
+#
+
+FILTER_NONE = 'None'
+FILTER_ONE_EURO = 'One Euro'
+FILTER_KALMAN = 'Kalman'
+FILTER_METHODS = [FILTER_NONE, FILTER_ONE_EURO, FILTER_KALMAN]
+
+
+def updateArrayFromVTKMatrix(vtkMatrix, out):
+  """
+  Copy the elements of a vtkMatrix4x4 into an existing 4x4 NumPy array.
+  """
+  for i in range(4):
+    for j in range(4):
+      out[i, j] = vtkMatrix.GetElement(i, j)
+  return out
+
+
+def _smoothingFactor(dt, cutoff):
+  tau = 1.0 / (2.0 * math.pi * cutoff)
+  return 1.0 / (1.0 + tau / dt)
+
+
+class OneEuroFilter:
+  """
+  One Euro filter (Casiez et al., CHI 2012) on a fixed-size vector.
+  The cutoff frequency adapts to the speed: low jitter at rest, low lag when moving.
+  """
+
+  def __init__(self, size=3, minCutoff=1.0, beta=0.01, derivativeCutoff=1.0):
+    self.minCutoff = minCutoff
+    self.beta = beta
+    self.derivativeCutoff = derivativeCutoff
+    self.value = np.zeros(size)
+    self.velocity = np.zeros(size)
+    self._scratch = np.zeros(size)
+    self.initialized = False
+
+  def reset(self):
+    self.value[:] = 0
+    self.velocity[:] = 0
+    self.initialized = False
+
+  def update(self, measurement, dt):
+    if not self.initialized or dt <= 0:
+      self.value[:] = measurement
+      self.velocity[:] = 0
+      self.initialized = True
+      return self.value
+    # filtered derivative
+    np.subtract(measurement, self.value, out=self._scratch)
+    self._scratch /= dt
+    self._scratch -= self.velocity
+    self._scratch *= _smoothingFactor(dt, self.derivativeCutoff)
+    self.velocity += self._scratch
+    # speed-dependent cutoff
+    cutoff = self.minCutoff + self.beta * math.sqrt(self.velocity.dot(self.velocity))
+    np.subtract(measurement, self.value, out=self._scratch)
+    self._scratch *= _smoothingFactor(dt, cutoff)
+    self.value += self._scratch
+    return self.value
+
+
+class KalmanFilter:
+  """
+  Constant-velocity Kalman filter on a fixed-size vector.
+  All axes share the same noise model, so a single 2x2 covariance is kept.
+  """
+
+  def __init__(self, size=3, processNoise=5000.0, measurementNoise=0.25):
+    # processNoise: white acceleration spectral density (mm^2/s^3)
+    # measurementNoise: position measurement variance (mm^2)
+    self.processNoise = processNoise
+    self.measurementNoise = measurementNoise
+    self.value = np.zeros(size)
+    self.velocity = np.zeros(size)
+    self._scratch = np.zeros(size)
+    self._gain = np.zeros(size)
+    self.initialized = False
+    self._resetCovariance()
+
+  def _resetCovariance(self):
+    self.p00 = self.measurementNoise
+    self.p01 = 0.0
+    self.p11 = 1e6
+
+  def reset(self):
+    self.value[:] = 0
+    self.velocity[:] = 0
+    self.initialized = False
+    self._resetCovariance()
+
+  def update(self, measurement, dt):
+    if not self.initialized or dt <= 0:
+      self.value[:] = measurement
+      self.velocity[:] = 0
+      self.initialized = True
+      self._resetCovariance()
+      return self.value
+    # predict
+    np.multiply(self.velocity, dt, out=self._scratch)
+    self.value += self._scratch
+    q = self.processNoise
+    p00 = self.p00 + dt * (2 * self.p01 + dt * self.p11) + q * dt ** 3 / 3
+    p01 = self.p01 + dt * self.p11 + q * dt ** 2 / 2
+    p11 = self.p11 + q * dt
+    # correct
+    s = p00 + self.measurementNoise
+    k0 = p00 / s
+    k1 = p01 / s
+    np.subtract(measurement, self.value, out=self._scratch)
+    np.multiply(self._scratch, k1, out=self._gain)
+    self.velocity += self._gain
+    np.multiply(self._scratch, k0, out=self._scratch)
+    self.value += self._scratch
+    self.p00 = (1 - k0) * p00
+    self.p01 = (1 - k0) * p01
+    self.p11 = p11 - k1 * p01
+    return self.value
+
+
+#
+# Quaternion helpers (w, x, y, z), operating in place on 4-element arrays
+#
+
+def quaternionFromRotation(r, out):
+  """
+  Write the unit quaternion of the orthonormal 3x3 rotation r into out.
+  """
+  trace = r[0, 0] + r[1, 1] + r[2, 2]
+  if trace > 0:
+    s = 2.0 * math.sqrt(trace + 1.0)
+    out[0] = 0.25 * s
+    out[1] = (r[2, 1] - r[1, 2]) / s
+    out[2] = (r[0, 2] - r[2, 0]) / s
+    out[3] = (r[1, 0] - r[0, 1]) / s
+  elif r[0, 0] > r[1, 1] and r[0, 0] > r[2, 2]:
+    s = 2.0 * math.sqrt(1.0 + r[0, 0] - r[1, 1] - r[2, 2])
+    out[0] = (r[2, 1] - r[1, 2]) / s
+    out[1] = 0.25 * s
+    out[2] = (r[0, 1] + r[1, 0]) / s
+    out[3] = (r[0, 2] + r[2, 0]) / s
+  elif r[1, 1] > r[2, 2]:
+    s = 2.0 * math.sqrt(1.0 + r[1, 1] - r[0, 0] - r[2, 2])
+    out[0] = (r[0, 2] - r[2, 0]) / s
+    out[1] = (r[0, 1] + r[1, 0]) / s
+    out[2] = 0.25 * s
+    out[3] = (r[1, 2] + r[2, 1]) / s
+  else:
+    s = 2.0 * math.sqrt(1.0 + r[2, 2] - r[0, 0] - r[1, 1])
+    out[0] = (r[1, 0] - r[0, 1]) / s
+    out[1] = (r[0, 2] + r[2, 0]) / s
+    out[2] = (r[1, 2] + r[2, 1]) / s
+    out[3] = 0.25 * s
+  return out
+
+
+def rotationFromQuaternion(q, out):
+  """
+  Write the 3x3 rotation of the unit quaternion q into out (may be a view of a 4x4 matrix).
+  """
+  w, x, y, z = q[0], q[1], q[2], q[3]
+  out[0, 0] = 1 - 2 * (y * y + z * z)
+  out[0, 1] = 2 * (x * y - z * w)
+  out[0, 2] = 2 * (x * z + y * w)
+  out[1, 0] = 2 * (x * y + z * w)
+  out[1, 1] = 1 - 2 * (x * x + z * z)
+  out[1, 2] = 2 * (y * z - x * w)
+  out[2, 0] = 2 * (x * z - y * w)
+  out[2, 1] = 2 * (y * z + x * w)
+  out[2, 2] = 1 - 2 * (x * x + y * y)
+  return out
+
+
+def quaternionSlerp(q0, q1, t, out):
+  """
+  Spherical linear interpolation from q0 to q1, taking the shortest arc. out may alias q0.
+  """
+  dot = q0[0] * q1[0] + q0[1] * q1[1] + q0[2] * q1[2] + q0[3] * q1[3]
+  sign = 1.0
+  if dot < 0:
+    dot = -dot
+    sign = -1.0
+  if dot > 0.9995:
+    # nearly parallel: normalized linear interpolation
+    w0 = 1.0 - t
+    w1 = sign * t
+  else:
+    theta = math.acos(dot)
+    sinTheta = math.sin(theta)
+    w0 = math.sin((1.0 - t) * theta) / sinTheta
+    w1 = sign * math.sin(t * theta) / sinTheta
+  a0, a1, a2, a3 = q0[0], q0[1], q0[2], q0[3]
+  out[0] = w0 * a0 + w1 * q1[0]
+  out[1] = w0 * a1 + w1 * q1[1]
+  out[2] = w0 * a2 + w1 * q1[2]
+  out[3] = w0 * a3 + w1 * q1[3]
+  norm = math.sqrt(out[0] ** 2 + out[1] ** 2 + out[2] ** 2 + out[3] ** 2)
+  out /= norm
+  return out
+
+
+class PoseFilter:
+  """
+  Smooths a stream of 4x4 rigid poses: translation through a One Euro or Kalman
+  filter, rotation through adaptive SLERP smoothing, and optionally extrapolates
+  the result a short time ahead to compensate for motion-to-photon latency.
+  The filtered pose is always written to the same array (self.output).
+  """
+
+  def __init__(self, method=FILTER_ONE_EURO, predictionHorizon=0.0,
+               minCutoff=1.0, beta=0.01, rotationMinCutoff=1.0, rotationBeta=0.3):
+    self.method = method
+    # seconds to extrapolate ahead
+    self.predictionHorizon = predictionHorizon
+    self.rotationMinCutoff = rotationMinCutoff
+    self.rotationBeta = rotationBeta
+    self.oneEuroFilter = OneEuroFilter(3, minCutoff, beta)
+    self.kalmanFilter = KalmanFilter(3)
+    self.output = np.eye(4)
+    self._rotation = np.zeros((3, 3))
+    self._scale = np.ones(3)
+    self._measuredQuaternion = np.zeros(4)
+    self._quaternion = np.array([1.0, 0.0, 0.0, 0.0])
+    self._previousQuaternion = np.array([1.0, 0.0, 0.0, 0.0])
+    self._predictedQuaternion = np.zeros(4)
+    # angular velocity (rad/s) in the world frame
+    self._angularVelocity = np.zeros(3)
+    self._lastTimestamp = None
+
+  def reset(self):
+    self.oneEuroFilter.reset()
+    self.kalmanFilter.reset()
+    self._angularVelocity[:] = 0
+    self._lastTimestamp = None
+
+  def setMethod(self, method):
+    if method not in FILTER_METHODS:
+      raise ValueError('Unknown pose filter method: ' + str(method))
+    if method != self.method:
+      self.method = method
+      self.reset()
+
+  def update(self, matrix, timestamp):
+    """
+    Filter a new 4x4 pose measured at timestamp (seconds). Returns self.output.
+    """
+    dt = 0.0 if self._lastTimestamp is None else timestamp - self._lastTimestamp
+    self._lastTimestamp = timestamp
+    output = self.output
+    if self.method == FILTER_NONE:
+      output[:] = matrix
+      return output
+
+    # split rotation and scale (the controller transforms may include the world scale)
+    for j in range(3):
+      column = matrix[:3, j]
+      self._scale[j] = math.sqrt(column.dot(column))
+    np.divide(matrix[:3, :3], self._scale, out=self._rotation)
+    quaternionFromRotation(self._rotation, self._measuredQuaternion)
+
+    # translation
+    if self.method == FILTER_KALMAN:
+      translationFilter = self.kalmanFilter
+    else:
+      translationFilter = self.oneEuroFilter
+    translationFilter.update(matrix[:3, 3], dt)
+    output[:3, 3] = translationFilter.value
+
+    # rotation
+    q = self._quaternion
+    qPrevious = self._previousQuaternion
+    qPrevious[:] = q
+    if dt <= 0:
+      q[:] = self._measuredQuaternion
+      self._angularVelocity[:] = 0
+    else:
+      # adaptive SLERP factor driven by the angular speed, as in the One Euro filter
+      speed = math.sqrt(self._angularVelocity.dot(self._angularVelocity))
+      alpha = _smoothingFactor(dt, self.rotationMinCutoff + self.rotationBeta * speed)
+      quaternionSlerp(q, self._measuredQuaternion, alpha, q)
+      self._updateAngularVelocity(qPrevious, q, dt)
+
+    if self.predictionHorizon > 0:
+      output[:3, 3] += translationFilter.velocity * self.predictionHorizon
+      self._predict(q, self.predictionHorizon, self._predictedQuaternion)
+      rotationFromQuaternion(self._predictedQuaternion, output)
+    else:
+      rotationFromQuaternion(q, output)
+    output[:3, :3] *= self._scale
+    return output
+
+  def _updateAngularVelocity(self, q0, q1, dt):
+    # relative rotation q1 * conj(q0), expressed as axis-angle
+    w = q1[0] * q0[0] + q1[1] * q0[1] + q1[2] * q0[2] + q1[3] * q0[3]
+    x = -q1[0] * q0[1] + q1[1] * q0[0] - q1[2] * q0[3] + q1[3] * q0[2]
+    y = -q1[0] * q0[2] + q1[1] * q0[3] + q1[2] * q0[0] - q1[3] * q0[1]
+    z = -q1[0] * q0[3] - q1[1] * q0[2] + q1[2] * q0[1] + q1[3] * q0[0]
+    if w < 0:
+      w, x, y, z = -w, -x, -y, -z
+    sinHalf = math.sqrt(x * x + y * y + z * z)
+    if sinHalf < 1e-12:
+      self._angularVelocity[:] = 0
+      return
+    angle = 2.0 * math.atan2(sinHalf, w)
+    factor = angle / (sinHalf * dt)
+    self._angularVelocity[0] = x * factor
+    self._angularVelocity[1] = y * factor
+    self._angularVelocity[2] = z * factor
+
+  def _predict(self, q, horizon, out):
+    # out = exp(omega * horizon / 2) * q
+    wx, wy, wz = self._angularVelocity[0], self._angularVelocity[1], self._angularVelocity[2]
+    angle = math.sqrt(wx * wx + wy * wy + wz * wz) * horizon
+    if angle < 1e-12:
+      out[:] = q
+      return out
+    s = math.sin(angle / 2) / (angle / horizon)
+    dw = math.cos(angle / 2)
+    dx, dy, dz = wx * s, wy * s, wz * s
+    out[0] = dw * q[0] - dx * q[1] - dy * q[2] - dz * q[3]
+    out[1] = dw * q[1] + dx * q[0] + dy * q[3] - dz * q[2]
+    out[2] = dw * q[2] - dx * q[3] + dy * q[0] + dz * q[1]
+    out[3] = dw * q[3] + dx * q[2] - dy * q[1] + dz * q[0]
+    return out
@@ -0,0 +1,401 @@
+import argparse
+import errno
+import logging
+import socket
+import struct
+import threading
+import time
+import numpy as np
+
+from .TrajectoryFile import POSE_LEFT, POSE_RIGHT, POSE_HMD
+
+#
+# Pose sources
+#
+# The scoring reads the left forceps, right forceps and HMD poses from a pose source:
+# the VR controllers (see ControllerPoseSource), or an external tracker that streams
+# OpenIGTLink TRANSFORM messages over TCP, e.g. an electromagnetic tracker of physical
+# simulators behind a PLUS server, or TrackerSimulator standing in for one.
+#
+# OpenIGTLink messages (big endian): a 58 byte header
+#   version (uint16), type (12 chars), device name (20 chars), timestamp (uint64, seconds
+#   in the upper 32 bits and fraction in the lower ones), body size (uint64), CRC64 of the body,
+# followed by the body. TRANSFORM bodies are 12 float32: the rotation column by column,
+# then the translation (mm). Version 2 bodies start with an extended header that is skipped.
+#
+
+IGTL_PORT = 18944
+IGTL_HEADER = struct.Struct('>H12s20sQQQ')
+IGTL_EXTENDED_HEADER = struct.Struct('>HHII')
+TRANSFORM_TYPE = b'TRANSFORM'.ljust(12, b'\0')
+TRANSFORM_BODY_SIZE = 12 * 4
+TRANSFORM_MESSAGE_SIZE = IGTL_HEADER.size + TRANSFORM_BODY_SIZE
+
+# Device names of the poses, in the order of PoseSource.poses (POSE_LEFT, POSE_RIGHT, POSE_HMD)
+DEVICE_NAMES = ('ForcepsLeft', 'ForcepsRight', 'HMD')
+
+# s between connection attempts of a SocketPoseSource
+RECONNECT_INTERVAL = 1.0
+
+_CRC64_POLYNOMIAL = 0x42F0E1EBA9EA3693
+_CRC64_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def _crc64Table():
+  table = []
+  for i in range(256):
+    crc = i << 56
+    for _ in range(8):
+      crc = ((crc << 1) ^ _CRC64_POLYNOMIAL) if crc & (1 << 63) else (crc << 1)
+    table.append(crc & _CRC64_MASK)
+  return table
+
+_CRC64_TABLE = _crc64Table()
+
+
+def crc64(data, crc=0):
+  """
+  CRC64 (ECMA-182) of the message body, as in the OpenIGTLink header.
+  """
+  for byte in data:
+    crc = _CRC64_TABLE[((crc >> 56) ^ byte) & 0xFF] ^ ((crc << 8) & _CRC64_MASK)
+  return crc
+
+
+def igtlTimestamp(seconds):
+  return (int(seconds) << 32) | int((seconds % 1.0) * 4294967296.0)
+
+
+def packTransformMessage(deviceName, timestamp, pose, out=None, offset=0):
+  """
+  Encode a TRANSFORM message (version 1) of the 4x4 pose into out at offset (a bytearray
+  with TRANSFORM_MESSAGE_SIZE bytes from offset), or a new buffer. timestamp in s.
+  """
+  if out is None:
+    out = bytearray(TRANSFORM_MESSAGE_SIZE)
+  body = np.frombuffer(out, dtype='>f4', count=12, offset=offset + IGTL_HEADER.size)
+  body[:9] = pose[:3, :3].T.ravel()
+  body[9:] = pose[:3, 3]
+  bodyBytes = memoryview(out)[offset + IGTL_HEADER.size:offset + TRANSFORM_MESSAGE_SIZE]
+  IGTL_HEADER.pack_into(out, offset, 1, TRANSFORM_TYPE, deviceName.encode('ascii'), igtlTimestamp(timestamp),
+                        TRANSFORM_BODY_SIZE, crc64(bodyBytes))
+  return out
+
+
+class PoseSource:
+  """
+  Provides the left forceps, right forceps and HMD poses: poses (3, 4, 4), indexed by
+  POSE_LEFT, POSE_RIGHT and POSE_HMD, in the frame of parentTransformNode() (the scene
+  if None). The array is updated in place.
+  """
+
+  name = ''
+  # True if changes are signaled by TransformModifiedEvent of trackedTransformNodes(),
+  # False if they are found by calling update every frame
+  eventDriven = False
+
+  def __init__(self):
+    self.poses = np.tile(np.eye(4), (3, 1, 1))
+
+  def update(self):
+    """
+    Refresh poses. Returns True if any pose changed since the last call. A source without
+    new data keeps the last poses.
+    """
+    return False
+
+  def trackedTransformNodes(self):
+    return []
+
+  def parentTransformNode(self):
+    return None
+
+  def close(self):
+    pass
+
+
+class SocketPoseSource(PoseSource):
+  """
+  Pose source that receives OpenIGTLink TRANSFORM messages from a tracker server over
+  TCP. update never blocks: it reads what the socket has into a preallocated buffer,
+  and only the last message of each device is decoded, from the buffer into poses
+  (without intermediate copies). The connection is made, and remade after a failure,
+  from update.
+  """
+
+  name = 'Tracker'
+  eventDriven = False
+
+  def __init__(self, address=('127.0.0.1', IGTL_PORT), deviceNames=DEVICE_NAMES, bufferSize=65536, verifyCRC=False):
+    PoseSource.__init__(self)
+    self.address = address
+    self.deviceIndices = {deviceName.encode('ascii'): index for index, deviceName in enumerate(deviceNames)}
+    self.verifyCRC = verifyCRC
+    self.sock = None
+    self.connected = False
+    self._buffer = bytearray(bufferSize)
+    self._view = memoryview(self._buffer)
+    self._size = 0
+    # bytes of a message that does not fit in the buffer, still to be discarded
+    self._skip = 0
+    self._lastConnectTime = -np.inf
+    # last decoded message of each device (message offsets of the current parse)
+    self._latest = [-1] * len(deviceNames)
+    # tracker time (s) of the last message, and counters
+    self.trackerTimestamp = None
+    self.messageCount = 0
+    self.supersededMessageCount = 0
+    self.invalidMessageCount = 0
+
+  def _connect(self):
+    now = time.perf_counter()
+    if now - self._lastConnectTime < RECONNECT_INTERVAL:
+      return
+    self._lastConnectTime = now
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.sock.setblocking(False)
+    error = self.sock.connect_ex(self.address)
+    if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+      self._disconnect()
+      return
+    self._size = 0
+    self._skip = 0
+
+  def _disconnect(self):
+    if self.sock is not None:
+      self.sock.close()
+      self.sock = None
+    if self.connected:
+      logging.info('Tracker disconnected from ' + str(self.address))
+    self.connected = False
+
+  def update(self):
+    if self.sock is None:
+      self._connect()
+      if self.sock is None:
+        return False
+    updated = False
+    while True:
+      try:
+        n = self.sock.recv_into(self._view[self._size:])
+      except BlockingIOError:
+        break
+      except OSError:
+        self._disconnect()
+        break
+      if n == 0:
+        self._disconnect()
+        break
+      if not self.connected:
+        self.connected = True
+        logging.info('Tracker connected to ' + str(self.address))
+      self._size += n
+      updated |= self._parse()
+    return updated
+
+  def _parse(self):
+    """
+    Decode the complete messages in the buffer and keep the incomplete one.
+    """
+    buffer = self._buffer
+    offset = 0
+    if self._skip:
+      offset = min(self._skip, self._size)
+      self._skip -= offset
+    latest = self._latest
+    for index in range(len(latest)):
+      latest[index] = -1
+    while self._size - offset >= IGTL_HEADER.size:
+      version, messageType, deviceName, timestamp, bodySize, crc = IGTL_HEADER.unpack_from(buffer, offset)
+      messageSize = IGTL_HEADER.size + bodySize
+      if messageSize > len(buffer):
+        # too large for the buffer (not a transform): discard it as it arrives
+        self._skip = messageSize - (self._size - offset)
+        offset = self._size
+        break
+      if self._size - offset < messageSize:
+        break
+      if messageType == TRANSFORM_TYPE:
+        index = self.deviceIndices.get(deviceName.rstrip(b'\0'))
+        if index is not None:
+          if latest[index] >= 0:
+            self.supersededMessageCount += 1
+          latest[index] = offset
+          self.trackerTimestamp = (timestamp >> 32) + (timestamp & 0xFFFFFFFF) / 4294967296.0
+        self.messageCount += 1
+      offset += messageSize
+    updated = False
+    for index, messageOffset in enumerate(latest):
+      if messageOffset >= 0:
+        updated |= self._decodeTransform(messageOffset, index)
+    # move the incomplete message to the start of the buffer
+    remaining = self._size - offset
+    if remaining and offset:
+      buffer[:remaining] = buffer[offset:self._size]
+    self._size = remaining
+    return updated
+
+  def _decodeTransform(self, offset, index):
+    version, messageType, deviceName, timestamp, bodySize, crc = IGTL_HEADER.unpack_from(self._buffer, offset)
+    bodyOffset = offset + IGTL_HEADER.size
+    if self.verifyCRC and crc64(self._view[bodyOffset:bodyOffset + bodySize]) != crc:
+      self.invalidMessageCount += 1
+      return False
+    if version >= 2:
+      bodyOffset += IGTL_EXTENDED_HEADER.unpack_from(self._buffer, bodyOffset)[0]
+    if bodyOffset + TRANSFORM_BODY_SIZE > offset + IGTL_HEADER.size + bodySize:
+      self.invalidMessageCount += 1
+      return False
+    body = np.frombuffer(self._buffer, dtype='>f4', count=12, offset=bodyOffset)
+    pose = self.poses[index]
+    pose[:3, :3] = body[:9].reshape(3, 3).T
+    pose[:3, 3] = body[9:]
+    return True
+
+  def close(self):
+    self._disconnect()
+
+
+class TrackerSimulator:
+  """
+  Stands in for a tracker server: accepts OpenIGTLink clients and streams the poses of
+  poseFunction(t) -> (left, right, hmd) to them as TRANSFORM messages at the given rate.
+  The three messages of a frame are sent in one write.
+  """
+
+  def __init__(self, poseFunction, address=('127.0.0.1', IGTL_PORT), rate=300.0, deviceNames=DEVICE_NAMES):
+    self.poseFunction = poseFunction
+    self.address = address
+    self.rate = rate
+    self.deviceNames = deviceNames
+    self.frameCount = 0
+    self._clients = []
+    self._clientsLock = threading.Lock()
+    self._listener = None
+    self._threads = []
+    self._running = False
+
+  def start(self):
+    self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._listener.bind(self.address)
+    # port 0 picks a free port
+    self.address = self._listener.getsockname()
+    self._listener.listen()
+    self._listener.settimeout(0.1)
+    self._running = True
+    self._threads = [threading.Thread(target=self._accept, name='ForcepsDeliveryVRTrackerAccept'),
+                     threading.Thread(target=self._stream, name='ForcepsDeliveryVRTrackerStream')]
+    for thread in self._threads:
+      thread.daemon = True
+      thread.start()
+    logging.info('Tracker simulator streaming on %s at %.0f Hz' % (str(self.address), self.rate))
+
+  def stop(self):
+    self._running = False
+    for thread in self._threads:
+      thread.join()
+    self._threads = []
+    self._listener.close()
+    with self._clientsLock:
+      for client in self._clients:
+        client.close()
+      self._clients = []
+
+  def _accept(self):
+    while self._running:
+      try:
+        client, _ = self._listener.accept()
+      except socket.timeout:
+        continue
+      except OSError:
+        return
+      client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      with self._clientsLock:
+        self._clients.append(client)
+
+  def _stream(self):
+    message = bytearray(len(self.deviceNames) * TRANSFORM_MESSAGE_SIZE)
+    start = time.perf_counter()
+    while self._running:
+      t = time.perf_counter() - start
+      now = time.time()
+      for index, pose in enumerate(self.poseFunction(t)):
+        packTransformMessage(self.deviceNames[index], now, pose, message, index * TRANSFORM_MESSAGE_SIZE)
+      with self._clientsLock:
+        for client in list(self._clients):
+          try:
+            client.sendall(message)
+          except OSError:
+            client.close()
+            self._clients.remove(client)
+      self.frameCount += 1
+      time.sleep(max(0.0, start + self.frameCount / self.rate - time.perf_counter()))
+
+
+def generatedPoseFunction(rate=300.0, seed=0):
+  """
+  poseFunction of TrackerSimulator that loops over synthetic attempts of all the phases.
+  """
+  from .TrajectoryGenerator import generatePhaseTrajectory
+  from .Scoring import PHASES
+  trajectories = [generatePhaseTrajectory(phase, frames=int(10 * rate), rate=rate, seed=seed + index)
+                  for index, phase in enumerate(PHASES)]
+  poses = np.stack([np.concatenate([trajectory[name] for trajectory in trajectories])
+                    for name in ['left', 'right', 'hmd']], axis=1)
+
+  def poseFunction(t):
+    return poses[int(t * rate) % len(poses)]
+  return poseFunction
+
+
+def measureSocketPoseSource(address, duration=5.0, pollRate=90.0):
+  """
+  Poll a SocketPoseSource at pollRate (the frame rate of the module) for duration s.
+  Returns the update time (s) per poll, messages per second, and the age of the poses (s)
+  when read, from the timestamps of the sender (same host).
+  """
+  from .ScoringServer import LatencyStatistics
+  source = SocketPoseSource(address)
+  updateTimes = LatencyStatistics()
+  ages = LatencyStatistics()
+  start = time.perf_counter()
+  polls = 0
+  while time.perf_counter() - start < duration:
+    updateStart = time.perf_counter()
+    updated = source.update()
+    updateTimes.add(time.perf_counter() - updateStart)
+    if updated:
+      ages.add(time.time() - source.trackerTimestamp)
+    polls += 1
+    time.sleep(max(0.0, start + polls / pollRate - time.perf_counter()))
+  source.close()
+  return {'update': updateTimes.summary(), 'messagesPerSecond': source.messageCount / duration,
+          'superseded': source.supersededMessageCount, 'age': ages.summary()}
+
+
+def main():
+  parser = argparse.ArgumentParser(description='ForcepsDeliveryVR tracker simulator (OpenIGTLink TRANSFORM messages)')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=IGTL_PORT)
+  parser.add_argument('--rate', type=float, default=300.0, help='tracker rate (Hz)')
+  parser.add_argument('--measure', type=float, default=0.0, help='receive for this many s and print the statistics')
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO)
+  simulator = TrackerSimulator(generatedPoseFunction(args.rate), (args.host, args.port), args.rate)
+  simulator.start()
+  try:
+    if args.measure:
+      print(measureSocketPoseSource(simulator.address, args.measure))
+    else:
+      while True:
+        time.sleep(10)
+        logging.info('%d frames sent' % simulator.frameCount)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    simulator.stop()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,50 @@
+import slicer
+
+#
+# Batched scene updates
+#
+
+class BatchedSceneUpdate:
+  """
+  Context manager that groups a set of MRML changes so that views render once:
+  rendering of the application views is paused until the end of the block, the
+  given nodes only fire their Modified event once (StartModify/EndModify), and
+  optionally the scene is put in batch processing state (for bulk changes such as
+  restoring a snapshot). Blocks can be nested.
+  """
+
+  def __init__(self, scene=None, nodes=(), batchProcess=False):
+    self.scene = scene if scene else slicer.mrmlScene
+    self.nodes = list(nodes)
+    self.batchProcess = batchProcess
+    self._batchStarted = False
+    self._modifyStates = []
+
+  def __enter__(self):
+    slicer.app.pauseRender()
+    self._batchStarted = False
+    self._modifyStates = []
+    try:
+      if self.batchProcess:
+        self.scene.StartState(self.scene.BatchProcessState)
+        self._batchStarted = True
+      for node in self.nodes:
+        self._modifyStates.append(node.StartModify())
+    except:
+      # __exit__ is not called: undo what was started, so that rendering is not left paused
+      self._end()
+      raise
+    return self
+
+  def __exit__(self, exceptionType, exceptionValue, traceback):
+    self._end()
+    return False
+
+  def _end(self):
+    try:
+      for node, wasModifying in reversed(list(zip(self.nodes, self._modifyStates))):
+        node.EndModify(wasModifying)
+      if self._batchStarted:
+        self.scene.EndState(self.scene.BatchProcessState)
+    finally:
+      slicer.app.resumeRender()
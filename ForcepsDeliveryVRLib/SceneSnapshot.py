@@ -0,0 +1,67 @@
+import numpy as np
+import slicer
+
+from .SceneBatch import BatchedSceneUpdate
+
+#
+# Scene snapshots
+#
+
+class SceneSnapshot:
+  """
+  Compact in-memory copy of the state needed to retry a phase: the matrices of the
+  linear transforms, the color, opacity and visibility of the model display nodes,
+  and an opaque phase state provided by the caller, given back to it on restore.
+  Transforms driven by the VR hardware (controllers, HMD) are not captured.
+  """
+
+  def __init__(self, transformIDs, matrices, displayNodeIDs, colors, opacities, visibilities, phaseState):
+    self.transformIDs = transformIDs
+    self.matrices = matrices
+    self.displayNodeIDs = displayNodeIDs
+    self.colors = colors
+    self.opacities = opacities
+    self.visibilities = visibilities
+    self.phaseState = phaseState
+
+  @classmethod
+  def capture(cls, scene, phaseState=None, excludedNodeIDs=()):
+    transformNodes = [node for node in slicer.util.getNodesByClass('vtkMRMLLinearTransformNode', scene)
+                      if node.GetID() not in excludedNodeIDs]
+    matrices = np.zeros((len(transformNodes), 4, 4))
+    for index, transformNode in enumerate(transformNodes):
+      matrices[index] = slicer.util.arrayFromTransformMatrix(transformNode)
+    displayNodes = slicer.util.getNodesByClass('vtkMRMLModelDisplayNode', scene)
+    colors = np.zeros((len(displayNodes), 3))
+    opacities = np.zeros(len(displayNodes))
+    visibilities = np.zeros(len(displayNodes), dtype=bool)
+    for index, displayNode in enumerate(displayNodes):
+      colors[index] = displayNode.GetColor()
+      opacities[index] = displayNode.GetOpacity()
+      visibilities[index] = displayNode.GetVisibility()
+    return cls([node.GetID() for node in transformNodes], matrices,
+               [node.GetID() for node in displayNodes], colors, opacities, visibilities, phaseState)
+
+  def restore(self, scene, restorePhaseState=None):
+    """
+    Write the captured state back in a single batch, so that observers and views
+    are only updated once at the end. Nodes removed since the capture are skipped.
+    restorePhaseState(phaseState) is called within the batch, so that the scene
+    changes of the phase state are part of it.
+    """
+    with BatchedSceneUpdate(scene, batchProcess=True):
+      if restorePhaseState is not None:
+        restorePhaseState(self.phaseState)
+      for transformID, matrix in zip(self.transformIDs, self.matrices):
+        transformNode = scene.GetNodeByID(transformID)
+        if transformNode:
+          slicer.util.updateTransformMatrixFromArray(transformNode, matrix)
+      for index, displayNodeID in enumerate(self.displayNodeIDs):
+        displayNode = scene.GetNodeByID(displayNodeID)
+        if not displayNode:
+          continue
+        wasModifying = displayNode.StartModify()
+        displayNode.SetColor(self.colors[index])
+        displayNode.SetOpacity(self.opacities[index])
+        displayNode.SetVisibility(bool(self.visibilities[index]))
+        displayNode.EndModify(wasModifying)
@@ -0,0 +1,499 @@
+import numpy as np
+
+from .PelvicAxis import PelvicAxis, carusArc
+
+#
+# Maneuver checks on plain 4x4 pose arrays
+#
+# These functions do not access the MRML scene, so they can run in a worker
+# thread or outside Slicer. Every check returns (res, message).
+#
+
+PHASE_ARRANGEMENT = 'arrangement'
+PHASE_PRESENTATION = 'presentation'
+PHASE_INITIAL_PLACEMENT_LEFT = 'initialPlacementLeft'
+PHASE_FINAL_PLACEMENT_LEFT = 'finalPlacementLeft'
+PHASE_INITIAL_PLACEMENT_RIGHT = 'initialPlacementRight'
+PHASE_FINAL_PLACEMENT_RIGHT = 'finalPlacementRight'
+PHASE_ROTATION = 'rotation'
+PHASE_TRACTION = 'traction'
+
+PHASES = [
+  PHASE_ARRANGEMENT,
+  PHASE_PRESENTATION,
+  PHASE_INITIAL_PLACEMENT_LEFT,
+  PHASE_FINAL_PLACEMENT_LEFT,
+  PHASE_INITIAL_PLACEMENT_RIGHT,
+  PHASE_FINAL_PLACEMENT_RIGHT,
+  PHASE_ROTATION,
+  PHASE_TRACTION,
+  ]
+
+
+def checkArrangement(leftPose, rightPose, margin):
+  # margin: [rotation difference, translation difference (mm)]
+  # access diagonal components for rotation
+  rl = [leftPose[0,0], leftPose[1,1], leftPose[2,2]]
+  rr = [rightPose[0,0], rightPose[1,1], rightPose[2,2]]
+  diff_r = np.array(rl)-np.array(rr)
+  forceps_rotated = np.any(diff_r>margin[0])
+  if forceps_rotated:
+    return False, 'FORCEPS NOT CORRECTLY CLOSED'
+  # access translation components
+  tl = [leftPose[0,3], leftPose[1,3], leftPose[2,3]]
+  tr = [rightPose[0,3]+10, rightPose[1,3], rightPose[2,3]]
+  diff_t = np.array(tl)-np.array(tr)
+  forceps_translated = np.any(np.abs(diff_t)>margin[1])
+  if forceps_translated:
+    return False, 'HANDLES NOT AT THE SAME LEVEL'
+  return True, 'CORRECT!'
+
+
+def checkPresentation(leftPose, rightPose, margin):
+  # access first component of rotation
+  rl = leftPose[0,0]
+  rr = rightPose[0,0]
+  rl_y = leftPose[1,1]
+  rr_y = rightPose[1,1]
+  # compute error
+  el = np.abs(rl + 1)
+  er = np.abs(rr + 1)
+  forceps_rotated = np.any(np.array([el,er, np.abs(rl_y), np.abs(rr_y)])>margin)
+  if forceps_rotated:
+    return False, 'FORCEPS ROTATED'
+  return True, 'CORRECT!'
+
+
+#
+# Placement checks
+#
+# The blade tip and handle axis of each forceps are constant in the local frame of its
+# controller. Their position in the frame of the poses is obtained with one matrix
+# product per frame: pose.dot(FORCEPS_GEOMETRY[side]) gives the two as columns (the tip
+# is a point, the axis a direction). The checks do not depend on the orientation of the
+# blade plane, so it is not part of the geometry.
+# The fetal head is described by landmarks in the same frame as the poses.
+#
+
+LEFT = 'Left'
+RIGHT = 'Right'
+
+# With the identity pose the forceps is vertical: handle up, blade tip BLADE_LENGTH mm below
+# the controller origin.
+BLADE_LENGTH = 100.0
+BLADE_TIP = np.array([0.0, 0.0, -BLADE_LENGTH])
+HANDLE_AXIS = np.array([0.0, 0.0, 1.0])
+
+
+def _forcepsGeometry():
+  geometry = np.zeros((4, 2))
+  geometry[:3, 0] = BLADE_TIP
+  geometry[3, 0] = 1.0
+  geometry[:3, 1] = HANDLE_AXIS
+  return geometry
+
+FORCEPS_GEOMETRY = {LEFT: _forcepsGeometry(), RIGHT: _forcepsGeometry()}
+GEOMETRY_TIP = 0
+GEOMETRY_HANDLE_AXIS = 1
+
+
+def forcepsGeometry(pose, side):
+  """
+  Blade tip and handle axis (columns of a 4x2 array) of a forceps pose, or of (N,4,4)
+  poses as a (N,4,2) array.
+  """
+  return np.matmul(pose, FORCEPS_GEOMETRY[side])
+
+
+class HeadLandmarks:
+  """
+  Fetal head approximated by a sphere (center, radius), with the eyes and ears used by the
+  final placement checks, the vertical direction used for the blade angle and the pelvic
+  axis (PelvicAxis) used by the traction check. All in the frame of the controller poses
+  (mm). matrix is the transform from the frame where the landmarks were defined (the baby
+  head frame) to their current frame. rotation is the angle (degrees) the head was turned
+  about the pelvic axis by the forceps (see HeadRotation).
+  """
+
+  def __init__(self, center, radius, eyes, ears, vertical=(0.0, 0.0, 1.0), matrix=None, pelvicAxis=None,
+               rotation=0.0):
+    # eyes, ears: {LEFT: position, RIGHT: position}
+    self.center = np.asarray(center, dtype=float)
+    self.radius = float(radius)
+    self.eyes = {side: np.asarray(position, dtype=float) for side, position in eyes.items()}
+    self.ears = {side: np.asarray(position, dtype=float) for side, position in ears.items()}
+    self.vertical = np.asarray(vertical, dtype=float) / np.linalg.norm(vertical)
+    self.matrix = np.eye(4) if matrix is None else np.asarray(matrix, dtype=float)
+    self.pelvicAxis = pelvicAxis
+    self.rotation = float(rotation)
+
+  def transformed(self, matrix):
+    """
+    Landmarks in another frame, given the 4x4 matrix from the current frame to that frame.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    point = lambda position: matrix[:3, :3].dot(position) + matrix[:3, 3]
+    return HeadLandmarks(point(self.center), self.radius,
+      {side: point(position) for side, position in self.eyes.items()},
+      {side: point(position) for side, position in self.ears.items()},
+      matrix[:3, :3].dot(self.vertical), matrix.dot(self.matrix),
+      self.pelvicAxis.transformed(matrix) if self.pelvicAxis is not None else None, self.rotation)
+
+# Default head, in the frame of the synthetic trajectories (TrajectoryGenerator), in a
+# canal whose outlet is above it (the handles point out of the mother)
+DEFAULT_PELVIC_AXIS = PelvicAxis(carusArc(outlet=[0.0, 0.0, -20.0], outward=[0.0, 0.0, 1.0], anterior=[0.0, -1.0, 0.0]))
+DEFAULT_HEAD_LANDMARKS = HeadLandmarks(
+  center=[0.0, 0.0, -80.0], radius=50.0,
+  eyes={LEFT: [25.0, 40.0, -70.0], RIGHT: [-25.0, 40.0, -70.0]},
+  ears={LEFT: [45.0, -30.0, -75.0], RIGHT: [-45.0, -30.0, -75.0]},
+  pelvicAxis=DEFAULT_PELVIC_AXIS)
+
+
+def _bladeAngle(geometry, head):
+  # angle (degrees) between the handle axis and the vertical
+  cosine = np.clip(np.dot(geometry[..., :3, GEOMETRY_HANDLE_AXIS], head.vertical), -1.0, 1.0)
+  return np.degrees(np.arccos(cosine))
+
+
+def _headDistance(tip, head):
+  # distance from the tip to the head surface (negative inside)
+  return np.linalg.norm(tip - head.center, axis=-1) - head.radius
+
+
+def _checkInitialPlacement(geometry, margin, head):
+  # geometry: forcepsGeometry of the pose
+  # margin: [angle (degrees), distance to the head (mm)]
+  if np.abs(_bladeAngle(geometry, head)) > margin[0]:
+    return False, 'INCORRECT ANGLE'
+  if _headDistance(geometry[:3, GEOMETRY_TIP], head) > margin[1]:
+    return False, 'TIP TOO FAR FROM FETUS'
+  return True, 'CORRECT!'
+
+
+def _checkFinalPlacement(geometry, side, margin, head):
+  # margin: [distance (mm), distance to the cheek (mm)]
+  # the tip must be between margin[0] and 2*margin[0] from the eye and the ear
+  tip = geometry[:3, GEOMETRY_TIP]
+  eyeDistance = np.linalg.norm(tip - head.eyes[side])
+  if eyeDistance <= margin[0]:
+    return False, 'TOO CLOSE TO EYE'
+  if eyeDistance >= 2 * margin[0]:
+    return False, 'TOO FAR FROM EYE'
+  earDistance = np.linalg.norm(tip - head.ears[side])
+  if earDistance <= margin[0]:
+    return False, 'TOO CLOSE TO EAR'
+  if earDistance >= 2 * margin[0]:
+    return False, 'TOO FAR FROM EAR'
+  if _headDistance(tip, head) > margin[1]:
+    return False, 'TOO FAR FROM CHEEKS'
+  return True, 'CORRECT!'
+
+
+# Kielland rotation: from occiput transverse, the head is turned by a quarter turn to
+# occiput anterior (degrees)
+ROTATION_TARGET = 90.0
+
+
+def _checkRotation(left, right, margin, head):
+  # margin: [angle to the target rotation (degrees), final placement margin (distance to the
+  # eye and ear, to the cheek)]; the blades must stay locked on the head while it turns
+  for geometry, side in [(left, LEFT), (right, RIGHT)]:
+    res, message = _checkFinalPlacement(geometry, side, margin[1:], head)
+    if not res:
+      return res, message
+  if abs(head.rotation - ROTATION_TARGET) > margin[0]:
+    return False, 'HEAD NOT ROTATED'
+  return True, 'CORRECT!'
+
+
+def _tractionDirection(left, right):
+  # tips midpoint and mean handle axis of the locked forceps (geometry (...,4,2) of each blade)
+  tips = 0.5 * (left[..., :3, GEOMETRY_TIP] + right[..., :3, GEOMETRY_TIP])
+  handles = left[..., :3, GEOMETRY_HANDLE_AXIS] + right[..., :3, GEOMETRY_HANDLE_AXIS]
+  return tips, handles / np.maximum(np.linalg.norm(handles, axis=-1, keepdims=True), 1e-12)
+
+
+def _checkTraction(left, right, margin, head):
+  # margin: [angle to the pelvic axis (degrees), distance to the pelvic axis (mm)]
+  # the forceps pull along the tangent of the axis at the depth of the blade tips
+  tips, handles = _tractionDirection(left, right)
+  arcLength, point, tangent, distance = head.pelvicAxis.project(tips)
+  if distance > margin[1]:
+    return False, 'FORCEPS OFF THE PELVIC AXIS'
+  if np.degrees(np.arccos(np.clip(handles.dot(tangent), -1.0, 1.0))) > margin[0]:
+    return False, 'TRACTION NOT ALONG PELVIC AXIS'
+  return True, 'CORRECT!'
+
+
+def checkInitialPlacementLeft(leftPose, rightPose, margin, head=DEFAULT_HEAD_LANDMARKS):
+  return _checkInitialPlacement(forcepsGeometry(leftPose, LEFT), margin, head)
+
+
+def checkFinalPlacementLeft(leftPose, rightPose, margin, head=DEFAULT_HEAD_LANDMARKS):
+  return _checkFinalPlacement(forcepsGeometry(leftPose, LEFT), LEFT, margin, head)
+
+
+def checkInitialPlacementRight(leftPose, rightPose, margin, head=DEFAULT_HEAD_LANDMARKS):
+  return _checkInitialPlacement(forcepsGeometry(rightPose, RIGHT), margin, head)
+
+
+def checkFinalPlacementRight(leftPose, rightPose, margin, head=DEFAULT_HEAD_LANDMARKS):
+  return _checkFinalPlacement(forcepsGeometry(rightPose, RIGHT), RIGHT, margin, head)
+
+
+def checkRotation(leftPose, rightPose, margin, head=DEFAULT_HEAD_LANDMARKS):
+  return _checkRotation(forcepsGeometry(leftPose, LEFT), forcepsGeometry(rightPose, RIGHT), margin, head)
+
+
+def checkTraction(leftPose, rightPose, margin, head=DEFAULT_HEAD_LANDMARKS):
+  return _checkTraction(forcepsGeometry(leftPose, LEFT), forcepsGeometry(rightPose, RIGHT), margin, head)
+
+
+PHASE_CHECKS = {
+  PHASE_ARRANGEMENT: checkArrangement,
+  PHASE_PRESENTATION: checkPresentation,
+  PHASE_INITIAL_PLACEMENT_LEFT: checkInitialPlacementLeft,
+  PHASE_FINAL_PLACEMENT_LEFT: checkFinalPlacementLeft,
+  PHASE_INITIAL_PLACEMENT_RIGHT: checkInitialPlacementRight,
+  PHASE_FINAL_PLACEMENT_RIGHT: checkFinalPlacementRight,
+  PHASE_ROTATION: checkRotation,
+  PHASE_TRACTION: checkTraction,
+  }
+
+# Margins used by the module when the system error margins are zero
+DEFAULT_MARGINS = {
+  PHASE_ARRANGEMENT: [0.2, 5],
+  PHASE_PRESENTATION: 0.3,
+  PHASE_INITIAL_PLACEMENT_LEFT: [10, 10],
+  PHASE_FINAL_PLACEMENT_LEFT: [30, 10],
+  PHASE_INITIAL_PLACEMENT_RIGHT: [10, 10],
+  PHASE_FINAL_PLACEMENT_RIGHT: [30, 10],
+  PHASE_ROTATION: [15, 30, 10],
+  PHASE_TRACTION: [15, 15],
+  }
+
+
+PLACEMENT_PHASES = [
+  PHASE_INITIAL_PLACEMENT_LEFT, PHASE_FINAL_PLACEMENT_LEFT,
+  PHASE_INITIAL_PLACEMENT_RIGHT, PHASE_FINAL_PLACEMENT_RIGHT]
+# phases whose checks use the head landmarks
+HEAD_PHASES = PLACEMENT_PHASES + [PHASE_ROTATION, PHASE_TRACTION]
+
+
+def evaluatePhase(phase, leftPose, rightPose, margin, head=None):
+  """
+  Run the check of the given phase. Returns (res, message).
+  head: HeadLandmarks used by the placement and traction checks (default: DEFAULT_HEAD_LANDMARKS).
+  With PHASE_FREE_PRACTICE all the phases are checked (see evaluateAllPhases): margin is
+  then {phase: margin}, and (res, code) arrays are returned.
+  """
+  if phase == PHASE_FREE_PRACTICE:
+    return evaluateAllPhases(leftPose, rightPose, margin, head)
+  if phase in HEAD_PHASES:
+    return PHASE_CHECKS[phase](leftPose, rightPose, margin, head if head is not None else DEFAULT_HEAD_LANDMARKS)
+  return PHASE_CHECKS[phase](leftPose, rightPose, margin)
+
+
+#
+# Vectorized checks on (N,4,4) pose arrays
+#
+# Same rules as above, evaluated for N frames at once. They return (res, code):
+# boolean and message code arrays of length N, where MESSAGES[code] is the message
+# the per-frame check would give.
+#
+
+MESSAGES = ['', 'CORRECT!', 'FORCEPS NOT CORRECTLY CLOSED', 'HANDLES NOT AT THE SAME LEVEL', 'FORCEPS ROTATED',
+  'INCORRECT ANGLE', 'TIP TOO FAR FROM FETUS', 'TOO CLOSE TO EYE', 'TOO FAR FROM EYE',
+  'TOO CLOSE TO EAR', 'TOO FAR FROM EAR', 'TOO FAR FROM CHEEKS', 'FORCEPS OFF THE PELVIC AXIS',
+  'TRACTION NOT ALONG PELVIC AXIS', 'HEAD NOT ROTATED']
+MESSAGE_NONE = 0
+MESSAGE_CORRECT = 1
+MESSAGE_NOT_CLOSED = 2
+MESSAGE_NOT_SAME_LEVEL = 3
+MESSAGE_ROTATED = 4
+MESSAGE_INCORRECT_ANGLE = 5
+MESSAGE_TIP_TOO_FAR = 6
+MESSAGE_TOO_CLOSE_TO_EYE = 7
+MESSAGE_TOO_FAR_FROM_EYE = 8
+MESSAGE_TOO_CLOSE_TO_EAR = 9
+MESSAGE_TOO_FAR_FROM_EAR = 10
+MESSAGE_TOO_FAR_FROM_CHEEKS = 11
+MESSAGE_OFF_PELVIC_AXIS = 12
+MESSAGE_NOT_ALONG_PELVIC_AXIS = 13
+MESSAGE_HEAD_NOT_ROTATED = 14
+
+
+def checkArrangementBatch(leftPoses, rightPoses, margin):
+  diff_r = np.diagonal(leftPoses[:, :3, :3], axis1=1, axis2=2) - np.diagonal(rightPoses[:, :3, :3], axis1=1, axis2=2)
+  rotated = np.any(diff_r > margin[0], axis=1)
+  diff_t = leftPoses[:, :3, 3] - rightPoses[:, :3, 3]
+  diff_t[:, 0] -= 10
+  translated = np.any(np.abs(diff_t) > margin[1], axis=1)
+  code = np.full(len(leftPoses), MESSAGE_CORRECT, dtype=np.uint8)
+  code[translated] = MESSAGE_NOT_SAME_LEVEL
+  code[rotated] = MESSAGE_NOT_CLOSED
+  return ~(rotated | translated), code
+
+
+def checkPresentationBatch(leftPoses, rightPoses, margin):
+  errors = np.stack([
+    np.abs(leftPoses[:, 0, 0] + 1), np.abs(rightPoses[:, 0, 0] + 1),
+    np.abs(leftPoses[:, 1, 1]), np.abs(rightPoses[:, 1, 1])], axis=1)
+  rotated = np.any(errors > margin, axis=1)
+  code = np.where(rotated, MESSAGE_ROTATED, MESSAGE_CORRECT).astype(np.uint8)
+  return ~rotated, code
+
+
+def _failureCodes(failures):
+  # failures: list of (condition array, message code) in the order of the per-frame check;
+  # the first failing condition of each frame gives its code
+  code = np.full(len(failures[0][0]), MESSAGE_CORRECT, dtype=np.uint8)
+  failed = np.zeros(len(code), dtype=bool)
+  for condition, failureCode in failures:
+    code[condition & ~failed] = failureCode
+    failed |= condition
+  return ~failed, code
+
+
+def _initialPlacementFailures(geometry, margin, head):
+  return [
+    (np.abs(_bladeAngle(geometry, head)) > margin[0], MESSAGE_INCORRECT_ANGLE),
+    (_headDistance(geometry[:, :3, GEOMETRY_TIP], head) > margin[1], MESSAGE_TIP_TOO_FAR)]
+
+
+def _finalPlacementFailures(geometry, side, margin, head):
+  tip = geometry[:, :3, GEOMETRY_TIP]
+  eyeDistance = np.linalg.norm(tip - head.eyes[side], axis=1)
+  earDistance = np.linalg.norm(tip - head.ears[side], axis=1)
+  return [
+    (eyeDistance <= margin[0], MESSAGE_TOO_CLOSE_TO_EYE),
+    (eyeDistance >= 2 * margin[0], MESSAGE_TOO_FAR_FROM_EYE),
+    (earDistance <= margin[0], MESSAGE_TOO_CLOSE_TO_EAR),
+    (earDistance >= 2 * margin[0], MESSAGE_TOO_FAR_FROM_EAR),
+    (_headDistance(tip, head) > margin[1], MESSAGE_TOO_FAR_FROM_CHEEKS)]
+
+
+def _rotationFailures(left, right, margin, head):
+  return (_finalPlacementFailures(left, LEFT, margin[1:], head) + _finalPlacementFailures(right, RIGHT, margin[1:], head)
+    + [(np.full(len(left), abs(head.rotation - ROTATION_TARGET) > margin[0]), MESSAGE_HEAD_NOT_ROTATED)])
+
+
+def _tractionFailures(left, right, margin, head):
+  tips, handles = _tractionDirection(left, right)
+  arcLength, points, tangents, distances = head.pelvicAxis.projectBatch(tips)
+  cosines = np.clip(np.einsum('ij,ij->i', handles, tangents), -1.0, 1.0)
+  return [
+    (distances > margin[1], MESSAGE_OFF_PELVIC_AXIS),
+    (np.degrees(np.arccos(cosines)) > margin[0], MESSAGE_NOT_ALONG_PELVIC_AXIS)]
+
+
+def _checkInitialPlacementBatch(poses, side, margin, head):
+  return _failureCodes(_initialPlacementFailures(forcepsGeometry(poses, side), margin, head))
+
+
+def _checkFinalPlacementBatch(poses, side, margin, head):
+  return _failureCodes(_finalPlacementFailures(forcepsGeometry(poses, side), side, margin, head))
+
+
+PHASE_BATCH_CHECKS = {
+  PHASE_ARRANGEMENT: checkArrangementBatch,
+  PHASE_PRESENTATION: checkPresentationBatch,
+  PHASE_INITIAL_PLACEMENT_LEFT: lambda leftPoses, rightPoses, margin, head: _checkInitialPlacementBatch(leftPoses, LEFT, margin, head),
+  PHASE_FINAL_PLACEMENT_LEFT: lambda leftPoses, rightPoses, margin, head: _checkFinalPlacementBatch(leftPoses, LEFT, margin, head),
+  PHASE_INITIAL_PLACEMENT_RIGHT: lambda leftPoses, rightPoses, margin, head: _checkInitialPlacementBatch(rightPoses, RIGHT, margin, head),
+  PHASE_FINAL_PLACEMENT_RIGHT: lambda leftPoses, rightPoses, margin, head: _checkFinalPlacementBatch(rightPoses, RIGHT, margin, head),
+  PHASE_ROTATION: lambda leftPoses, rightPoses, margin, head: _failureCodes(_rotationFailures(
+    forcepsGeometry(leftPoses, LEFT), forcepsGeometry(rightPoses, RIGHT), margin, head)),
+  PHASE_TRACTION: lambda leftPoses, rightPoses, margin, head: _failureCodes(_tractionFailures(
+    forcepsGeometry(leftPoses, LEFT), forcepsGeometry(rightPoses, RIGHT), margin, head)),
+  }
+
+
+def evaluatePhaseBatch(phase, leftPoses, rightPoses, margin, head=None):
+  """
+  Run the check of the given phase on N frames. Returns (res, code) arrays.
+  """
+  if phase in HEAD_PHASES:
+    return PHASE_BATCH_CHECKS[phase](leftPoses, rightPoses, margin, head if head is not None else DEFAULT_HEAD_LANDMARKS)
+  return PHASE_BATCH_CHECKS[phase](leftPoses, rightPoses, margin)
+
+
+#
+# Free practice
+#
+# All the phases are evaluated on every frame, so that the system can tell which maneuver
+# the trainee is performing. The forceps geometry of each side is computed once and shared
+# by the placement checks of that side.
+#
+
+PHASE_FREE_PRACTICE = 'freePractice'
+MANEUVER_NONE = -1
+MESSAGE_CODES = {message: code for code, message in enumerate(MESSAGES)}
+_FORCEPS_GEOMETRY_PAIR = np.stack([FORCEPS_GEOMETRY[LEFT], FORCEPS_GEOMETRY[RIGHT]])
+
+
+def evaluateAllPhasesBatch(leftPoses, rightPoses, margins=None, head=None):
+  """
+  Run the checks of all the phases on N frames. margins: {phase: margin} (default:
+  DEFAULT_MARGINS). Returns (res, code) arrays of shape (N, len(PHASES)), columns in
+  PHASES order.
+  """
+  if margins is None:
+    margins = DEFAULT_MARGINS
+  if head is None:
+    head = DEFAULT_HEAD_LANDMARKS
+  geometry = {LEFT: forcepsGeometry(leftPoses, LEFT), RIGHT: forcepsGeometry(rightPoses, RIGHT)}
+  failures = {
+    PHASE_INITIAL_PLACEMENT_LEFT: lambda margin: _initialPlacementFailures(geometry[LEFT], margin, head),
+    PHASE_FINAL_PLACEMENT_LEFT: lambda margin: _finalPlacementFailures(geometry[LEFT], LEFT, margin, head),
+    PHASE_INITIAL_PLACEMENT_RIGHT: lambda margin: _initialPlacementFailures(geometry[RIGHT], margin, head),
+    PHASE_FINAL_PLACEMENT_RIGHT: lambda margin: _finalPlacementFailures(geometry[RIGHT], RIGHT, margin, head),
+    PHASE_ROTATION: lambda margin: _rotationFailures(geometry[LEFT], geometry[RIGHT], margin, head),
+    PHASE_TRACTION: lambda margin: _tractionFailures(geometry[LEFT], geometry[RIGHT], margin, head),
+    }
+  res = np.empty((len(leftPoses), len(PHASES)), dtype=bool)
+  code = np.empty((len(leftPoses), len(PHASES)), dtype=np.uint8)
+  for index, phase in enumerate(PHASES):
+    if phase in failures:
+      res[:, index], code[:, index] = _failureCodes(failures[phase](margins[phase]))
+    else:
+      res[:, index], code[:, index] = PHASE_BATCH_CHECKS[phase](leftPoses, rightPoses, margins[phase])
+  return res, code
+
+
+def evaluateAllPhases(leftPose, rightPose, margins=None, head=None):
+  """
+  Run the checks of all the phases on one frame. Returns (res, code) arrays with one
+  value per phase, in PHASES order.
+  """
+  # For a single frame the per-call overhead of the array operations dominates, so the
+  # per-frame rules are run on the geometry of both forceps, computed in one product.
+  if margins is None:
+    margins = DEFAULT_MARGINS
+  if head is None:
+    head = DEFAULT_HEAD_LANDMARKS
+  left, right = np.matmul(np.stack([leftPose, rightPose]), _FORCEPS_GEOMETRY_PAIR)
+  results = [
+    checkArrangement(leftPose, rightPose, margins[PHASE_ARRANGEMENT]),
+    checkPresentation(leftPose, rightPose, margins[PHASE_PRESENTATION]),
+    _checkInitialPlacement(left, margins[PHASE_INITIAL_PLACEMENT_LEFT], head),
+    _checkFinalPlacement(left, LEFT, margins[PHASE_FINAL_PLACEMENT_LEFT], head),
+    _checkInitialPlacement(right, margins[PHASE_INITIAL_PLACEMENT_RIGHT], head),
+    _checkFinalPlacement(right, RIGHT, margins[PHASE_FINAL_PLACEMENT_RIGHT], head),
+    _checkRotation(left, right, margins[PHASE_ROTATION], head),
+    _checkTraction(left, right, margins[PHASE_TRACTION], head),
+    ]
+  res = np.array([result[0] for result in results], dtype=bool)
+  code = np.array([MESSAGE_CODES[result[1]] for result in results], dtype=np.uint8)
+  return res, code
+
+
+def detectManeuver(res):
+  """
+  Index in PHASES of the maneuver being performed, given the check results of all the
+  phases (..., len(PHASES)): the most advanced phase of the procedure whose check passes,
+  or MANEUVER_NONE if none does.
+  """
+  res = np.asarray(res, dtype=bool)
+  lastPassing = res.shape[-1] - 1 - np.argmax(res[..., ::-1], axis=-1)
+  return np.where(np.any(res, axis=-1), lastPassing, MANEUVER_NONE)
@@ -0,0 +1,126 @@
+import collections
+import logging
+import threading
+import time
+import numpy as np
+
+from .Scoring import evaluatePhase
+
+#
+# Background scoring
+#
+# The main thread writes the filtered poses of each frame into a PoseSnapshot and
+# wakes the ScoringWorker, which evaluates the active phase in its own thread.
+#
+
+ScoringResult = collections.namedtuple('ScoringResult', ['phase', 'res', 'message', 'timestamp', 'latency'])
+
+
+def evaluateSnapshot(phase, leftPose, rightPose, margin, head=None, grids=None):
+  """
+  Check of a phase, through the placement lookup grids (PlacementGrids) if given.
+  """
+  if grids is not None:
+    return grids.evaluate(phase, leftPose, rightPose, margin, head)
+  return evaluatePhase(phase, leftPose, rightPose, margin, head)
+
+
+class PoseSnapshot:
+  """
+  Double-buffered pose snapshot shared between one writer and one reader without locks.
+  The writer fills the slot that is not published and then publishes it; each slot has
+  a sequence number (odd while being written) so the reader can detect and retry a
+  read that overlapped a write.
+  """
+
+  def __init__(self, numberOfPoses=2):
+    self.numberOfPoses = numberOfPoses
+    self._poses = np.zeros((2, numberOfPoses, 4, 4))
+    self._poses[:] = np.eye(4)
+    self._timestamps = [0.0, 0.0]
+    self._parameters = [None, None]
+    self._sequence = [0, 0]
+    self._published = -1
+    # total number of published snapshots
+    self.version = 0
+
+  def write(self, poses, timestamp, parameters=None):
+    slot = 1 - self._published if self._published >= 0 else 0
+    self._sequence[slot] += 1
+    for i in range(self.numberOfPoses):
+      self._poses[slot, i] = poses[i]
+    self._timestamps[slot] = timestamp
+    self._parameters[slot] = parameters
+    self._sequence[slot] += 1
+    self._published = slot
+    self.version += 1
+
+  def read(self, out):
+    """
+    Copy the latest published poses into out (numberOfPoses x 4 x 4).
+    Returns (version, timestamp, parameters), or None if nothing was published yet.
+    """
+    while True:
+      version = self.version
+      slot = self._published
+      if slot < 0:
+        return None
+      sequence = self._sequence[slot]
+      if sequence % 2:
+        continue
+      out[:] = self._poses[slot]
+      timestamp = self._timestamps[slot]
+      parameters = self._parameters[slot]
+      if self._sequence[slot] == sequence:
+        return version, timestamp, parameters
+
+
+class ScoringWorker(threading.Thread):
+  """
+  Evaluates the phase checks on the latest pose snapshot in a background thread.
+  Snapshot parameters are (phase, margin, head landmarks, placement grids or None), passed
+  to evaluate (default: evaluateSnapshot) with the poses. Results are appended to self.results,
+  a thread-safe deque that the main thread drains. In free practice (Scoring.PHASE_FREE_PRACTICE)
+  res and message are the result and message code arrays of all the phases.
+  """
+
+  def __init__(self, snapshot, evaluate=evaluateSnapshot):
+    threading.Thread.__init__(self, name='ForcepsDeliveryVRScoring')
+    self.daemon = True
+    self.snapshot = snapshot
+    self.evaluate = evaluate
+    self.results = collections.deque(maxlen=64)
+    self._poses = np.zeros((snapshot.numberOfPoses, 4, 4))
+    self._wakeUp = threading.Event()
+    self._stopRequested = False
+    self._lastVersion = 0
+
+  def notify(self):
+    self._wakeUp.set()
+
+  def stop(self):
+    self._stopRequested = True
+    self._wakeUp.set()
+    if self.is_alive():
+      self.join()
+
+  def run(self):
+    while not self._stopRequested:
+      self._wakeUp.wait()
+      self._wakeUp.clear()
+      if self._stopRequested:
+        break
+      snapshot = self.snapshot.read(self._poses)
+      if snapshot is None:
+        continue
+      version, timestamp, parameters = snapshot
+      if version == self._lastVersion or parameters is None:
+        continue
+      self._lastVersion = version
+      phase, margin, head, grids = parameters
+      try:
+        res, message = self.evaluate(phase, self._poses[0], self._poses[1], margin, head, grids)
+      except Exception as e:
+        logging.error('Scoring of phase ' + str(phase) + ' failed: ' + str(e))
+        continue
+      self.results.append(ScoringResult(phase, res, message, timestamp, time.perf_counter() - timestamp))
@@ -0,0 +1,432 @@
+import argparse
+import concurrent.futures
+import logging
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+import numpy as np
+
+from .PoseFilter import PoseFilter, FILTER_ONE_EURO
+from .Scoring import PHASES, DEFAULT_MARGINS, evaluatePhase
+
+#
+# Scoring server
+#
+# Scores several training stations from one process. Each station streams its
+# controller and HMD poses over a local socket (TCP on localhost or a Unix domain
+# socket); the server evaluates the active phase of each station in a shared
+# thread pool and answers with the result.
+#
+# Messages (little endian):
+#   pose:   'FDVP', station id (uint32), sequence (uint32), phase index (int32, -1: none),
+#           timestamp (float64), then left, right and HMD 4x4 matrices (float64, row major)
+#   result: 'FDVR', station id (uint32), sequence (uint32), phase index (int32),
+#           timestamp (float64, echoed), result (uint8), message (47 bytes, ASCII)
+#
+
+POSE_HEADER = struct.Struct('<4sIIid')
+POSE_MESSAGE_SIZE = POSE_HEADER.size + 3 * 16 * 8
+RESULT_MESSAGE = struct.Struct('<4sIIidB47s')
+POSE_MAGIC = b'FDVP'
+RESULT_MAGIC = b'FDVR'
+# a station that does not read its results for this long (s) is disconnected, so that it
+# cannot hold a worker of the pool
+SEND_TIMEOUT = 0.1
+
+
+def packPoseMessage(stationId, sequence, phase, timestamp, leftPose, rightPose, hmdPose, out=None):
+  """
+  Encode a pose message into out (a bytearray of POSE_MESSAGE_SIZE), or a new buffer.
+  """
+  if out is None:
+    out = bytearray(POSE_MESSAGE_SIZE)
+  phaseIndex = PHASES.index(phase) if phase is not None else -1
+  POSE_HEADER.pack_into(out, 0, POSE_MAGIC, stationId, sequence, phaseIndex, timestamp)
+  matrices = np.frombuffer(out, dtype='<f8', offset=POSE_HEADER.size).reshape(3, 4, 4)
+  matrices[0] = leftPose
+  matrices[1] = rightPose
+  matrices[2] = hmdPose
+  return out
+
+
+def unpackResultMessage(data):
+  magic, stationId, sequence, phaseIndex, timestamp, res, message = RESULT_MESSAGE.unpack(data)
+  if magic != RESULT_MAGIC:
+    raise ValueError('Invalid result message')
+  phase = PHASES[phaseIndex] if phaseIndex >= 0 else None
+  return stationId, sequence, phase, timestamp, bool(res), message.rstrip(b'\0').decode('ascii')
+
+
+class LatencyStatistics:
+  """
+  Latency samples (seconds) of the last maxSamples events.
+  """
+
+  def __init__(self, maxSamples=4096):
+    self.samples = np.zeros(maxSamples)
+    self.count = 0
+
+  def add(self, latency):
+    self.samples[self.count % len(self.samples)] = latency
+    self.count += 1
+
+  def summary(self):
+    if self.count == 0:
+      return {'count': 0}
+    samples = self.samples[:min(self.count, len(self.samples))]
+    return {
+      'count': self.count,
+      'mean': float(samples.mean()),
+      'p50': float(np.percentile(samples, 50)),
+      'p95': float(np.percentile(samples, 95)),
+      'max': float(samples.max())}
+
+
+def _recvExactly(sock, view):
+  received = 0
+  while received < len(view):
+    n = sock.recv_into(view[received:])
+    if n == 0:
+      return False
+    received += n
+  return True
+
+
+class _Station:
+  """
+  Server-side state of one training station.
+  """
+
+  def __init__(self, stationId, filterMethod):
+    self.stationId = stationId
+    self.poseFilters = [PoseFilter(filterMethod), PoseFilter(filterMethod)]
+    self.latency = LatencyStatistics()
+    self.evaluations = 0
+    self.droppedFrames = 0
+    # latest frame not yet evaluated, and whether an evaluation is in flight
+    self.pending = None
+    self.busy = False
+    self.lock = threading.Lock()
+
+
+class _Connection:
+
+  def __init__(self, sock):
+    self.sock = sock
+    self.buffer = bytearray(POSE_MESSAGE_SIZE)
+    self.view = memoryview(self.buffer)
+    self.received = 0
+    self.sendLock = threading.Lock()
+    self.closed = False
+
+  def send(self, data):
+    with self.sendLock:
+      if self.closed:
+        return
+      try:
+        self.sock.sendall(data)
+      except OSError:
+        # timed out or reset: part of the message may have been sent, so the stream is
+        # lost. The server thread closes the connection.
+        self.closed = True
+
+
+class ScoringServer:
+  """
+  Multi-station scoring server. address is a (host, port) tuple for TCP or a path for
+  a Unix domain socket. Each station has at most one evaluation in flight; frames that
+  arrive meanwhile replace each other so that a slow station never builds a backlog.
+  head: HeadLandmarks of the placement checks, in the frame of the received poses.
+  """
+
+  def __init__(self, address=('127.0.0.1', 18950), workers=None, filterMethod=FILTER_ONE_EURO, margins=None, head=None):
+    self.address = address
+    self.filterMethod = filterMethod
+    self.margins = dict(DEFAULT_MARGINS)
+    if margins:
+      self.margins.update(margins)
+    self.head = head
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ForcepsDeliveryVRScoring')
+    self.stations = {}
+    self._stationsLock = threading.Lock()
+    self._selector = selectors.DefaultSelector()
+    self._listener = None
+    self._thread = None
+    self._running = False
+
+  def start(self):
+    if isinstance(self.address, str):
+      if os.path.exists(self.address):
+        os.remove(self.address)
+      self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+      self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._listener.bind(self.address)
+    if not isinstance(self.address, str):
+      # port 0 picks a free port
+      self.address = self._listener.getsockname()
+    self._listener.listen()
+    self._listener.setblocking(False)
+    self._selector.register(self._listener, selectors.EVENT_READ, None)
+    self._running = True
+    self._thread = threading.Thread(target=self._serve, name='ForcepsDeliveryVRScoringServer')
+    self._thread.daemon = True
+    self._thread.start()
+    logging.info('Scoring server listening on ' + str(self.address))
+
+  def stop(self):
+    self._running = False
+    if self._thread:
+      self._thread.join()
+      self._thread = None
+    for key in list(self._selector.get_map().values()):
+      self._selector.unregister(key.fileobj)
+      key.fileobj.close()
+    self.executor.shutdown(wait=True)
+    if isinstance(self.address, str) and os.path.exists(self.address):
+      os.remove(self.address)
+
+  def statistics(self):
+    """
+    Per-station evaluation count, dropped (coalesced) frames and server latency
+    from frame arrival to result sent.
+    """
+    with self._stationsLock:
+      stations = list(self.stations.values())
+    return {station.stationId: dict(station.latency.summary(), evaluations=station.evaluations,
+                                    droppedFrames=station.droppedFrames) for station in stations}
+
+  def _serve(self):
+    while self._running:
+      for key, events in self._selector.select(timeout=0.1):
+        if key.data is None:
+          self._accept()
+        else:
+          self._read(key.data)
+      for key in list(self._selector.get_map().values()):
+        if key.data is not None and key.data.closed:
+          self._close(key.data)
+
+  def _accept(self):
+    sock, _ = self._listener.accept()
+    # reads only happen when the socket is readable; sends from the pool time out
+    sock.settimeout(SEND_TIMEOUT)
+    if sock.family == socket.AF_INET:
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self._selector.register(sock, selectors.EVENT_READ, _Connection(sock))
+
+  def _read(self, connection):
+    # the socket is readable, so recv does not block
+    try:
+      n = connection.sock.recv_into(connection.view[connection.received:])
+    except OSError:
+      n = 0
+    if n == 0:
+      self._close(connection)
+      return
+    connection.received += n
+    if connection.received < POSE_MESSAGE_SIZE:
+      return
+    connection.received = 0
+    arrival = time.perf_counter()
+    magic, stationId, sequence, phaseIndex, timestamp = POSE_HEADER.unpack_from(connection.buffer, 0)
+    if magic != POSE_MAGIC or not -1 <= phaseIndex < len(PHASES):
+      logging.error('Invalid pose message, closing connection')
+      self._close(connection)
+      return
+    poses = np.frombuffer(connection.buffer, dtype='<f8', offset=POSE_HEADER.size).reshape(3, 4, 4).copy()
+    frame = (connection, sequence, phaseIndex, timestamp, poses, arrival)
+    station = self._getStation(stationId)
+    with station.lock:
+      if station.busy:
+        if station.pending is not None:
+          station.droppedFrames += 1
+        station.pending = frame
+        return
+      station.busy = True
+    self.executor.submit(self._evaluate, station, frame)
+
+  def _close(self, connection):
+    with connection.sendLock:
+      connection.closed = True
+    self._selector.unregister(connection.sock)
+    connection.sock.close()
+
+  def _getStation(self, stationId):
+    with self._stationsLock:
+      station = self.stations.get(stationId)
+      if station is None:
+        station = _Station(stationId, self.filterMethod)
+        self.stations[stationId] = station
+      return station
+
+  def _evaluate(self, station, frame):
+    # the station stays busy until its last pending frame is done, whatever happens to it
+    while frame is not None:
+      try:
+        self._evaluateFrame(station, frame)
+      except Exception as e:
+        logging.error('Scoring of station ' + str(station.stationId) + ' failed: ' + str(e))
+      finally:
+        with station.lock:
+          frame = station.pending
+          station.pending = None
+          if frame is None:
+            station.busy = False
+
+  def _evaluateFrame(self, station, frame):
+    connection, sequence, phaseIndex, timestamp, poses, arrival = frame
+    leftPose = station.poseFilters[0].update(poses[0], timestamp)
+    rightPose = station.poseFilters[1].update(poses[1], timestamp)
+    res, message = False, ''
+    if phaseIndex >= 0:
+      phase = PHASES[phaseIndex]
+      try:
+        res, message = evaluatePhase(phase, leftPose, rightPose, self.margins[phase], self.head)
+      except Exception as e:
+        logging.error('Scoring of station ' + str(station.stationId) + ' failed: ' + str(e))
+        message = 'ERROR'
+    result = RESULT_MESSAGE.pack(RESULT_MAGIC, station.stationId, sequence, phaseIndex, timestamp,
+                                 int(bool(res)), message.encode('ascii', 'replace')[:47])
+    connection.send(result)
+    station.evaluations += 1
+    station.latency.add(time.perf_counter() - arrival)
+
+
+class StationSimulator:
+  """
+  Simulated training station: streams poses from poseFunction(t) -> (left, right, hmd)
+  at the given rate and measures the round-trip latency of the results. With keepResults,
+  resultLog lists the results as (sequence, phase, t, res, message), t being the time
+  given to poseFunction for the poses of that frame.
+  """
+
+  def __init__(self, address, stationId, poseFunction, phase=PHASES[0], rate=90.0, keepResults=False):
+    self.address = address
+    self.stationId = stationId
+    self.poseFunction = poseFunction
+    self.phase = phase
+    self.rate = rate
+    self.latency = LatencyStatistics()
+    self.sent = 0
+    self.results = 0
+    self.lastResult = None
+    self.resultLog = [] if keepResults else None
+    self._sendTimes = {}
+    self._startTime = 0.0
+
+  def run(self, duration):
+    family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(self.address)
+    if family == socket.AF_INET:
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    receiver = threading.Thread(target=self._receive, args=(sock,))
+    receiver.daemon = True
+    receiver.start()
+    message = bytearray(POSE_MESSAGE_SIZE)
+    start = self._startTime = time.perf_counter()
+    sequence = 0
+    while True:
+      now = time.perf_counter()
+      t = now - start
+      if t >= duration:
+        break
+      leftPose, rightPose, hmdPose = self.poseFunction(t)
+      self._sendTimes[sequence] = now
+      packPoseMessage(self.stationId, sequence, self.phase, now, leftPose, rightPose, hmdPose, message)
+      sock.sendall(message)
+      sequence += 1
+      self.sent = sequence
+      time.sleep(max(0.0, start + sequence / self.rate - time.perf_counter()))
+    # let the last results arrive
+    time.sleep(0.1)
+    sock.shutdown(socket.SHUT_RDWR)
+    sock.close()
+    receiver.join(1.0)
+    return dict(self.latency.summary(), sent=self.sent, results=self.results)
+
+  def _receive(self, sock):
+    buffer = bytearray(RESULT_MESSAGE.size)
+    view = memoryview(buffer)
+    while True:
+      try:
+        if not _recvExactly(sock, view):
+          return
+      except OSError:
+        return
+      stationId, sequence, phase, timestamp, res, message = unpackResultMessage(buffer)
+      sendTime = self._sendTimes.pop(sequence, None)
+      if sendTime is not None:
+        self.latency.add(time.perf_counter() - sendTime)
+      self.results += 1
+      self.lastResult = (res, message)
+      if self.resultLog is not None:
+        # the timestamp of the frame is echoed: the time of its poses
+        self.resultLog.append((sequence, phase, timestamp - self._startTime, res, message))
+
+
+def simulateStations(server, poseFunction, numberOfStations=4, duration=5.0, rate=90.0, phase=PHASES[0],
+                     keepResults=False):
+  """
+  Run numberOfStations simulated stations against a started server, in parallel.
+  Returns the round-trip latency summary of each station, with the number of frames
+  sent and of results received (and the resultLog of the station with keepResults).
+  """
+  simulators = [StationSimulator(server.address, stationId, poseFunction, phase, rate, keepResults)
+                for stationId in range(numberOfStations)]
+  summaries = {}
+  threads = []
+  for simulator in simulators:
+    thread = threading.Thread(target=lambda s=simulator: summaries.__setitem__(s.stationId, s.run(duration)))
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
+  if keepResults:
+    for simulator in simulators:
+      summaries[simulator.stationId]['resultLog'] = simulator.resultLog
+  return summaries
+
+
+def _staticPoses(t):
+  leftPose = np.eye(4)
+  rightPose = np.eye(4)
+  rightPose[0, 3] = -10
+  return leftPose, rightPose, np.eye(4)
+
+
+def main():
+  parser = argparse.ArgumentParser(description='ForcepsDeliveryVR multi-station scoring server')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=18950)
+  parser.add_argument('--unix-socket', help='listen on this Unix domain socket instead of TCP')
+  parser.add_argument('--workers', type=int, default=None)
+  parser.add_argument('--simulate', type=int, default=0, help='number of simulated stations to run against the server')
+  parser.add_argument('--duration', type=float, default=5.0)
+  parser.add_argument('--rate', type=float, default=90.0)
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO)
+  server = ScoringServer(args.unix_socket if args.unix_socket else (args.host, args.port), args.workers)
+  server.start()
+  try:
+    if args.simulate:
+      roundTrip = simulateStations(server, _staticPoses, args.simulate, args.duration, args.rate)
+      for stationId, serverStatistics in sorted(server.statistics().items()):
+        print('station %d: round trip %s, server %s' % (stationId, roundTrip.get(stationId), serverStatistics))
+    else:
+      while True:
+        time.sleep(10)
+        logging.info(str(server.statistics()))
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.stop()
+
+
+if __name__ == '__main__':
+  main()
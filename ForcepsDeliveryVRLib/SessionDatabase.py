@@ -0,0 +1,260 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+#
+# Trainee session database
+#
+# Local SQLite store of training sessions, the phases performed in each session,
+# per-phase metrics and the files where their trajectories were recorded.
+# Updates are queued and executed by a background thread so that recording never
+# blocks the frame loop; queries, and the inserts of new sessions and phases (whose ids
+# are needed right away), run on the calling thread through their own connection.
+# Those inserts are committed synchronously: while the background thread commits a
+# transaction they wait for it (up to the 30 s timeout of the connection), so a call
+# from the UI thread can block it for the duration of that commit.
+#
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+  id INTEGER PRIMARY KEY,
+  trainee TEXT NOT NULL,
+  startTime REAL NOT NULL,
+  endTime REAL
+);
+CREATE TABLE IF NOT EXISTS phases (
+  id INTEGER PRIMARY KEY,
+  sessionId INTEGER NOT NULL REFERENCES sessions(id),
+  trainee TEXT NOT NULL,
+  phase TEXT NOT NULL,
+  startTime REAL NOT NULL,
+  endTime REAL,
+  duration REAL,
+  result INTEGER,
+  evaluations INTEGER DEFAULT 0,
+  correctEvaluations INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS metrics (
+  phaseId INTEGER NOT NULL REFERENCES phases(id),
+  name TEXT NOT NULL,
+  value REAL,
+  PRIMARY KEY (phaseId, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS trajectories (
+  phaseId INTEGER NOT NULL REFERENCES phases(id),
+  path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessionsTraineeTime ON sessions (trainee, startTime);
+CREATE INDEX IF NOT EXISTS sessionsTime ON sessions (startTime);
+-- the phase indexes hold every column read by the summaries and learning curves
+CREATE INDEX IF NOT EXISTS phasesTraineePhaseCovering ON phases (trainee, phase, startTime, endTime, result, duration);
+CREATE INDEX IF NOT EXISTS phasesPhaseCovering ON phases (phase, startTime, trainee, endTime, result, duration);
+CREATE INDEX IF NOT EXISTS phasesSession ON phases (sessionId);
+CREATE INDEX IF NOT EXISTS trajectoriesPhase ON trajectories (phaseId);
+"""
+
+
+class SessionDatabase:
+  """
+  Trainee session store. Sessions and phases are inserted on the calling thread, which
+  gets their id from SQLite; the updates that follow are asynchronous.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+      os.makedirs(directory)
+    self._connection = self._connect()
+    self._connection.executescript(SCHEMA)
+    self._connection.commit()
+    self._writeQueue = queue.Queue()
+    self._writer = threading.Thread(target=self._writeLoop, name='ForcepsDeliveryVRSessionDatabase')
+    self._writer.daemon = True
+    self._writer.start()
+
+  def _connect(self):
+    connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+  #
+  # Asynchronous writes
+  #
+
+  def _writeLoop(self):
+    connection = self._connect()
+    # transactions and savepoints are issued explicitly
+    connection.isolation_level = None
+    while True:
+      statements = [self._writeQueue.get()]
+      # execute everything already queued in the same transaction
+      while True:
+        try:
+          statements.append(self._writeQueue.get_nowait())
+        except queue.Empty:
+          break
+      stop = None in statements
+      try:
+        connection.execute('BEGIN')
+        for statement in statements:
+          if statement is None or isinstance(statement, threading.Event):
+            continue
+          # a failing statement is undone alone, the rest of the batch is kept
+          connection.execute('SAVEPOINT statement')
+          try:
+            connection.execute(*statement)
+          except sqlite3.Error as e:
+            logging.error('Session database write failed: ' + str(e))
+            connection.execute('ROLLBACK TO statement')
+          connection.execute('RELEASE statement')
+        connection.execute('COMMIT')
+      except sqlite3.Error as e:
+        logging.error('Session database commit failed: ' + str(e))
+        if connection.in_transaction:
+          connection.execute('ROLLBACK')
+      for statement in statements:
+        if isinstance(statement, threading.Event):
+          statement.set()
+        self._writeQueue.task_done()
+      if stop:
+        connection.close()
+        return
+
+  def _write(self, sql, parameters=()):
+    self._writeQueue.put((sql, parameters))
+
+  def flush(self, timeout=None):
+    """
+    Wait until all queued writes are committed.
+    """
+    done = threading.Event()
+    self._writeQueue.put(done)
+    return done.wait(timeout)
+
+  def close(self):
+    if self._writer.is_alive():
+      self._writeQueue.put(None)
+      self._writer.join()
+    self._connection.close()
+
+  def _insert(self, sql, parameters):
+    # id of a new row, inserted and committed on the calling thread: waits for the lock
+    # of the database if the background thread holds it
+    with self._connection:
+      return self._connection.execute(sql, parameters).lastrowid
+
+  def startSession(self, trainee, startTime=None):
+    return self._insert('INSERT INTO sessions (trainee, startTime) VALUES (?, ?)',
+      (trainee, time.time() if startTime is None else startTime))
+
+  def endSession(self, sessionId, endTime=None):
+    self._write('UPDATE sessions SET endTime = ? WHERE id = ?',
+      (time.time() if endTime is None else endTime, sessionId))
+
+  def startPhase(self, sessionId, trainee, phase, startTime=None):
+    return self._insert('INSERT INTO phases (sessionId, trainee, phase, startTime) VALUES (?, ?, ?, ?)',
+      (sessionId, trainee, phase, time.time() if startTime is None else startTime))
+
+  def endPhase(self, phaseId, startTime, result, evaluations=0, correctEvaluations=0, metrics=None,
+               trajectoryPath=None, endTime=None):
+    if endTime is None:
+      endTime = time.time()
+    self._write('UPDATE phases SET endTime = ?, duration = ?, result = ?, evaluations = ?, correctEvaluations = ? WHERE id = ?',
+      (endTime, endTime - startTime, None if result is None else int(bool(result)), evaluations, correctEvaluations, phaseId))
+    if metrics:
+      self.addMetrics(phaseId, metrics)
+    if trajectoryPath:
+      self.addTrajectory(phaseId, trajectoryPath)
+
+  def addMetrics(self, phaseId, metrics):
+    for name, value in metrics.items():
+      self._write('INSERT OR REPLACE INTO metrics (phaseId, name, value) VALUES (?, ?, ?)',
+        (phaseId, name, None if value is None else float(value)))
+
+  def addTrajectory(self, phaseId, path):
+    self._write('INSERT INTO trajectories (phaseId, path) VALUES (?, ?)', (phaseId, path))
+
+  #
+  # Queries
+  #
+
+  def _query(self, sql, parameters=()):
+    return self._connection.execute(sql, parameters).fetchall()
+
+  @staticmethod
+  def _timeRange(since, until, column='startTime'):
+    conditions = []
+    parameters = []
+    if since is not None:
+      conditions.append(column + ' >= ?')
+      parameters.append(since)
+    if until is not None:
+      conditions.append(column + ' < ?')
+      parameters.append(until)
+    return conditions, parameters
+
+  def trainees(self):
+    return [row[0] for row in self._query('SELECT DISTINCT trainee FROM sessions ORDER BY trainee')]
+
+  def cohortSummary(self, phase=None, since=None, until=None):
+    """
+    Aggregates per phase over all trainees: dicts with phase, trainees, attempts,
+    passRate and meanDuration (s). Completed phases only.
+    """
+    conditions, parameters = self._timeRange(since, until)
+    conditions.append('endTime IS NOT NULL')
+    if phase is not None:
+      conditions.append('phase = ?')
+      parameters.append(phase)
+    rows = self._query(
+      'SELECT phase, COUNT(DISTINCT trainee), COUNT(*), AVG(result), AVG(duration) FROM phases'
+      ' WHERE ' + ' AND '.join(conditions) + ' GROUP BY phase', parameters)
+    return [dict(phase=row[0], trainees=row[1], attempts=row[2], passRate=row[3], meanDuration=row[4]) for row in rows]
+
+  def traineeSummary(self, trainee, phase=None, since=None, until=None):
+    """
+    Same aggregates as cohortSummary, restricted to one trainee.
+    """
+    conditions, parameters = self._timeRange(since, until)
+    conditions = ['trainee = ?', 'endTime IS NOT NULL'] + conditions
+    parameters = [trainee] + parameters
+    if phase is not None:
+      conditions.append('phase = ?')
+      parameters.append(phase)
+    rows = self._query(
+      'SELECT phase, COUNT(*), AVG(result), AVG(duration) FROM phases'
+      ' WHERE ' + ' AND '.join(conditions) + ' GROUP BY phase', parameters)
+    return [dict(phase=row[0], trainees=1, attempts=row[1], passRate=row[2], meanDuration=row[3]) for row in rows]
+
+  def traineeProgress(self, trainee, phase, binSize=86400.0):
+    """
+    Learning curve of a trainee in one phase: one dict per time bin (default: day)
+    with binStart, attempts, passRate and meanDuration.
+    """
+    rows = self._query(
+      'SELECT CAST(startTime / ? AS INTEGER), COUNT(*), AVG(result), AVG(duration) FROM phases'
+      ' WHERE trainee = ? AND phase = ? AND endTime IS NOT NULL'
+      ' GROUP BY 1 ORDER BY 1', (binSize, trainee, phase))
+    return [dict(binStart=row[0] * binSize, attempts=row[1], passRate=row[2], meanDuration=row[3]) for row in rows]
+
+  def phaseMetrics(self, phaseId):
+    return dict(self._query('SELECT name, value FROM metrics WHERE phaseId = ?', (phaseId,)))
+
+  def phaseTrajectories(self, phaseId):
+    return [row[0] for row in self._query('SELECT path FROM trajectories WHERE phaseId = ?', (phaseId,))]
+
+  def traineeTrajectories(self, trainee, limit=100):
+    """
+    Most recent recorded trajectories of a trainee: dicts with phaseId, phase,
+    startTime, result and path.
+    """
+    rows = self._query(
+      'SELECT phases.id, phases.phase, phases.startTime, phases.result, trajectories.path'
+      ' FROM phases JOIN trajectories ON trajectories.phaseId = phases.id'
+      ' WHERE phases.trainee = ? ORDER BY phases.startTime DESC LIMIT ?', (trainee, limit))
+    return [dict(phaseId=row[0], phase=row[1], startTime=row[2], result=row[3], path=row[4]) for row in rows]
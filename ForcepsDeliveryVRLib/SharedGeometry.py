@@ -0,0 +1,117 @@
+import numpy as np
+import vtk
+import slicer
+
+#
+# Shared model geometry
+#
+# Instances of a mesh (the expert ghosts of the blades, the mirrored blade) are model nodes
+# that observe the same vtkPolyData, so that the points, cells and normals are stored once,
+# and the rendering uploads them once (VTK shares the vertex buffers of a data array). Each
+# instance can have a fixed local transform, e.g. a mirroring, between the model and the
+# transform that moves it: the model observes its local transform node, and
+# attachToTransform sets the parent of that node instead of the model's.
+#
+
+LOCAL_TRANSFORM_ATTRIBUTE = 'ForcepsDeliveryVR.LocalTransformID'
+
+# Reflection through the x=0 plane of the forceps models: the right blade is shown as the
+# mirror image of the left one when there is no right blade mesh
+MIRROR_X = np.diag([-1.0, 1.0, 1.0, 1.0])
+
+
+def prepareSharedPolyData(modelNode):
+  """
+  Compute the point normals of a model once, so that its instances do not recompute them.
+  Normals are transformed with the instances, so that they stay outwards when mirrored.
+  """
+  polyData = modelNode.GetPolyData()
+  if polyData is None or polyData.GetPointData().GetNormals() is not None:
+    return
+  normals = vtk.vtkPolyDataNormals()
+  normals.SetInputData(polyData)
+  normals.SplittingOff()
+  normals.ConsistencyOn()
+  normals.Update()
+  modelNode.SetAndObservePolyData(normals.GetOutput())
+
+
+def getLocalTransformNode(modelNode):
+  transformID = modelNode.GetAttribute(LOCAL_TRANSFORM_ATTRIBUTE)
+  return slicer.mrmlScene.GetNodeByID(transformID) if transformID else None
+
+
+def getLocalMatrix(modelNode):
+  """
+  Fixed local transform of a model instance (4x4 array), identity if it has none.
+  """
+  localTransformNode = getLocalTransformNode(modelNode)
+  if localTransformNode is None:
+    return np.eye(4)
+  matrix = vtk.vtkMatrix4x4()
+  localTransformNode.GetMatrixTransformToParent(matrix)
+  return slicer.util.arrayFromVTKMatrix(matrix)
+
+
+def createInstance(sourceModelNode, name, localMatrix=None):
+  """
+  Model node named name that shows the polydata of sourceModelNode (shared, not copied),
+  with the local transform localMatrix (default: the one of the source). An existing
+  node with that name is reused. Returns the model node.
+  """
+  if localMatrix is None:
+    localMatrix = getLocalMatrix(sourceModelNode)
+  localMatrix = np.asarray(localMatrix, dtype=float)
+  modelNode = slicer.mrmlScene.GetFirstNodeByName(name)
+  if modelNode is None:
+    modelNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLModelNode', name)
+    modelNode.CreateDefaultDisplayNodes()
+    modelNode.GetDisplayNode().SetColor(sourceModelNode.GetDisplayNode().GetColor())
+  modelNode.SetAndObservePolyData(sourceModelNode.GetPolyData())
+  localTransformNode = getLocalTransformNode(modelNode)
+  if localTransformNode is None and np.allclose(localMatrix, np.eye(4)):
+    return modelNode
+  if localTransformNode is None:
+    localTransformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode', name + 'LocalTransform')
+    localTransformNode.SetHideFromEditors(True)
+    localTransformNode.SetAndObserveTransformNodeID(modelNode.GetTransformNodeID())
+    modelNode.SetAndObserveTransformNodeID(localTransformNode.GetID())
+    modelNode.SetAttribute(LOCAL_TRANSFORM_ATTRIBUTE, localTransformNode.GetID())
+  localTransformNode.SetMatrixTransformToParent(slicer.util.vtkMatrixFromArray(localMatrix))
+  if np.linalg.det(localMatrix[:3, :3]) < 0:
+    # a reflection reverses the orientation of the triangles: show both faces
+    modelNode.GetDisplayNode().SetBackfaceCulling(False)
+  return modelNode
+
+
+def attachToTransform(modelNode, transformNodeID):
+  """
+  Make a model follow a transform, keeping its local transform if it has one.
+  """
+  localTransformNode = getLocalTransformNode(modelNode)
+  if localTransformNode is not None:
+    localTransformNode.SetAndObserveTransformNodeID(transformNodeID)
+  else:
+    modelNode.SetAndObserveTransformNodeID(transformNodeID)
+
+
+def getAttachedTransformID(modelNode):
+  """
+  ID of the transform that moves a model (the parent of its local transform if it has one).
+  """
+  localTransformNode = getLocalTransformNode(modelNode)
+  if localTransformNode is not None:
+    return localTransformNode.GetTransformNodeID()
+  return modelNode.GetTransformNodeID()
+
+
+def geometryMemorySize(modelNodes):
+  """
+  Memory (kB) used by the polydata of the models, counting shared polydata once.
+  """
+  polyDatas = {}
+  for modelNode in modelNodes:
+    polyData = modelNode.GetPolyData()
+    if polyData is not None:
+      polyDatas[polyData.GetAddressAsString('vtkPolyData')] = polyData
+  return sum(polyData.GetActualMemorySize() for polyData in polyDatas.values())
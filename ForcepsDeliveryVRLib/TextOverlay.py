@@ -0,0 +1,134 @@
+import numpy as np
+import vtk
+import slicer
+from vtk.util import numpy_support
+
+#
+# In-VR text overlay
+#
+# Messages are drawn into the texture of a single quad model from a glyph atlas that
+# is rendered once, so changing the feedback text does not load or build any mesh.
+#
+
+ATLAS_CHARACTERS = ''.join(chr(code) for code in range(32, 127))
+
+
+class GlyphAtlas:
+  """
+  Printable ASCII characters rendered once with a monospace font.
+  self.coverage[i] is the (cellHeight, cellWidth) coverage of character i, in [0, 1],
+  with row 0 at the bottom (VTK image order).
+  """
+
+  def __init__(self, fontSize=48, bold=True):
+    textProperty = vtk.vtkTextProperty()
+    textProperty.SetFontFamilyToCourier()
+    textProperty.SetFontSize(fontSize)
+    textProperty.SetBold(bold)
+    textProperty.SetColor(1, 1, 1)
+    textProperty.SetBackgroundOpacity(0)
+    # all characters on a single line: monospace cells share the same baseline
+    image = vtk.vtkImageData()
+    textDims = [0, 0]
+    textRenderer = vtk.vtkTextRenderer()
+    if not textRenderer.RenderString(textProperty, ATLAS_CHARACTERS, image, textDims, 72):
+      raise RuntimeError('Failed to render the glyph atlas')
+    dims = image.GetDimensions()
+    pixels = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(dims[1], dims[0], -1)
+    alpha = pixels[:textDims[1], :textDims[0], -1].astype(np.float32) / 255.0
+    self.cellHeight = textDims[1]
+    self.cellWidth = textDims[0] // len(ATLAS_CHARACTERS)
+    self.coverage = np.zeros((len(ATLAS_CHARACTERS), self.cellHeight, self.cellWidth), dtype=np.float32)
+    for index in range(len(ATLAS_CHARACTERS)):
+      start = int(round(index * textDims[0] / len(ATLAS_CHARACTERS)))
+      self.coverage[index] = alpha[:, start:start + self.cellWidth]
+    self._indices = {character: index for index, character in enumerate(ATLAS_CHARACTERS)}
+
+  def glyph(self, character):
+    return self.coverage[self._indices.get(character, self._indices['?'])]
+
+
+class TextOverlay:
+  """
+  Single textured quad showing up to lines x columns characters, visible in the
+  desktop and VR views. The texture is only rewritten when the message or its color changes.
+  """
+
+  def __init__(self, name='FeedbackText', columns=32, lines=2, width=200.0,
+               center=(0.0, 80.0, 80.0), atlas=None, backgroundColor=(0.1, 0.1, 0.1)):
+    self.atlas = atlas if atlas else GlyphAtlas()
+    self.columns = columns
+    self.lines = lines
+    self.backgroundColor = np.array(backgroundColor, dtype=np.float32) * 255
+    self.text = None
+    self.color = None
+
+    # texture, updated in place
+    self.image = vtk.vtkImageData()
+    self.image.SetDimensions(columns * self.atlas.cellWidth, lines * self.atlas.cellHeight, 1)
+    self.image.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 3)
+    dims = self.image.GetDimensions()
+    self.pixels = numpy_support.vtk_to_numpy(self.image.GetPointData().GetScalars()).reshape(dims[1], dims[0], 3)
+    self.pixels[:] = self.backgroundColor
+    self.imageProducer = vtk.vtkTrivialProducer()
+    self.imageProducer.SetOutput(self.image)
+
+    # quad in the plane of the phase texts (x: left to right, z: up), same aspect as the texture
+    height = width * dims[1] / dims[0]
+    plane = vtk.vtkPlaneSource()
+    plane.SetOrigin(center[0] - width / 2, center[1], center[2] - height / 2)
+    plane.SetPoint1(center[0] + width / 2, center[1], center[2] - height / 2)
+    plane.SetPoint2(center[0] - width / 2, center[1], center[2] + height / 2)
+    plane.Update()
+
+    self.modelNode = slicer.mrmlScene.GetFirstNodeByName(name)
+    if not self.modelNode:
+      self.modelNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLModelNode', name)
+      self.modelNode.CreateDefaultDisplayNodes()
+    self.modelNode.SetAndObservePolyData(plane.GetOutput())
+    displayNode = self.modelNode.GetDisplayNode()
+    displayNode.SetTextureImageDataConnection(self.imageProducer.GetOutputPort())
+    displayNode.SetColor(1, 1, 1)
+    displayNode.SetAmbient(1.0)
+    displayNode.SetDiffuse(0.0)
+    displayNode.SetSpecular(0.0)
+    displayNode.SetBackfaceCulling(False)
+    displayNode.SetVisibility(False)
+
+  def setText(self, text, color=(1.0, 1.0, 1.0)):
+    """
+    Show text (lines separated by newlines) in the given color. Does nothing if unchanged.
+    """
+    color = tuple(color)
+    if text == self.text and color == self.color:
+      return
+    self.text = text
+    self.color = color
+    displayNode = self.modelNode.GetDisplayNode()
+    if not text:
+      displayNode.SetVisibility(False)
+      return
+    pixels = self.pixels
+    pixels[:] = self.backgroundColor
+    foreground = np.array(color, dtype=np.float32) * 255
+    cellWidth = self.atlas.cellWidth
+    cellHeight = self.atlas.cellHeight
+    lines = text.split('\n')[:self.lines]
+    # center the lines horizontally and the block vertically
+    firstLine = (self.lines - len(lines)) // 2
+    for lineIndex, line in enumerate(lines):
+      line = line[:self.columns]
+      # image rows go bottom-up
+      row = (self.lines - 1 - firstLine - lineIndex) * cellHeight
+      column = (self.columns - len(line)) * cellWidth // 2
+      for character in line:
+        if character != ' ':
+          coverage = self.atlas.glyph(character)[:, :, np.newaxis]
+          cell = pixels[row:row + cellHeight, column:column + cellWidth]
+          cell[:] = self.backgroundColor * (1 - coverage) + foreground * coverage
+        column += cellWidth
+    self.image.Modified()
+    displayNode.SetVisibility(True)
+
+  def clear(self):
+    self.setText('')
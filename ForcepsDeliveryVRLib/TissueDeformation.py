@@ -0,0 +1,221 @@
+import numpy as np
+
+from .Scoring import BLADE_LENGTH
+
+#
+# Soft tissue deformation of the mother model around the blades
+#
+# Position based dynamics on a local region of the mesh: the vertices near the blades,
+# found with a uniform grid built once over the rest positions, and those that are not
+# back to rest yet. Each iteration keeps the edge lengths, pulls the vertices towards
+# their rest position and pushes them out of the blades (capsules around a segment). The
+# constraints are solved Jacobi style on whole arrays. The region is capped, so that a
+# frame takes a bounded time, and the result is written into the points array of the
+# model in place.
+#
+
+# vertices within this distance (mm) of a blade are simulated
+DEFORMATION_RADIUS = 30.0
+# blade capsule: segment in the controller frame, from the tip along the handle (mm), and radius
+BLADE_SEGMENT = np.array([[0.0, 0.0, -BLADE_LENGTH], [0.0, 0.0, -BLADE_LENGTH + 60.0]])
+BLADE_RADIUS = 8.0
+DEFORMATION_ITERATIONS = 6
+# share of the constraint error corrected per iteration
+EDGE_STIFFNESS = 0.8
+REST_STIFFNESS = 0.1
+# vertices closer than this to their rest position (mm) leave the region
+REST_TOLERANCE = 0.05
+MAX_REGION_VERTICES = 3000
+
+
+def meshEdges(triangles):
+  """
+  Unique edges (E, 2) of a triangle mesh (T, 3).
+  """
+  edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+  return np.unique(np.sort(edges, axis=1), axis=0)
+
+
+class SpatialGrid:
+  """
+  Uniform grid over fixed points (N, 3): the point indices sorted by cell, so that the
+  points of a cell are a slice.
+  """
+
+  def __init__(self, points, cellSize):
+    self.cellSize = float(cellSize)
+    self.origin = points.min(axis=0)
+    self.shape = np.floor((points.max(axis=0) - self.origin) / self.cellSize).astype(np.intp) + 1
+    keys = self._keys(np.floor((points - self.origin) / self.cellSize).astype(np.intp))
+    self.order = np.argsort(keys, kind='stable')
+    self.sortedKeys = keys[self.order]
+
+  def _keys(self, cells):
+    return (cells[..., 0] * self.shape[1] + cells[..., 1]) * self.shape[2] + cells[..., 2]
+
+  def query(self, lower, upper):
+    """
+    Indices of the points in the cells that overlap the box [lower, upper].
+    """
+    first = np.maximum(np.floor((lower - self.origin) / self.cellSize).astype(np.intp), 0)
+    last = np.minimum(np.floor((upper - self.origin) / self.cellSize).astype(np.intp), self.shape - 1)
+    if np.any(last < first):
+      return np.zeros(0, dtype=np.intp)
+    # the cells of a box row along z are consecutive keys
+    xs, ys = np.meshgrid(np.arange(first[0], last[0] + 1), np.arange(first[1], last[1] + 1), indexing='ij')
+    rowKeys = self._keys(np.stack([xs.ravel(), ys.ravel(), np.full(xs.size, first[2])], axis=1))
+    starts = np.searchsorted(self.sortedKeys, rowKeys, 'left')
+    ends = np.searchsorted(self.sortedKeys, rowKeys + (last[2] - first[2]), 'right')
+    counts = ends - starts
+    if not counts.sum():
+      return np.zeros(0, dtype=np.intp)
+    # concatenation of the ranges [start, end)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    return self.order[offsets]
+
+
+def _segmentDistances(points, segments):
+  # closest points (B, n, 3) of the segments (B, 2, 3) to points (n, 3), and their distances (B, n)
+  direction = segments[:, 1] - segments[:, 0]
+  t = np.einsum('bnk,bk->bn', points - segments[:, np.newaxis, 0], direction) / np.maximum(
+    np.einsum('bk,bk->b', direction, direction), 1e-12)[:, np.newaxis]
+  closest = segments[:, np.newaxis, 0] + np.clip(t, 0.0, 1.0)[..., np.newaxis] * direction[:, np.newaxis]
+  return closest, np.linalg.norm(points - closest, axis=2)
+
+
+class TissueDeformation:
+  """
+  Deformation of a mesh around the blades. points (N, 3) is the points array of the mesh,
+  deformed in place; its contents when created are the rest positions. edges (E, 2) are
+  the mesh edges (see meshEdges).
+  """
+
+  def __init__(self, points, edges, radius=DEFORMATION_RADIUS, bladeRadius=BLADE_RADIUS,
+               iterations=DEFORMATION_ITERATIONS, maxVertices=MAX_REGION_VERTICES):
+    self.points = points
+    self.restPoints = np.array(points, dtype=float)
+    self.edges = np.asarray(edges, dtype=np.intp)
+    self.restLengths = np.linalg.norm(self.restPoints[self.edges[:, 1]] - self.restPoints[self.edges[:, 0]], axis=1)
+    self.radius = radius
+    self.bladeRadius = bladeRadius
+    self.iterations = iterations
+    self.maxVertices = maxVertices
+    self.grid = SpatialGrid(self.restPoints, radius)
+    # edges of each vertex (compressed rows)
+    incidentVertices = self.edges.ravel()
+    self._incidentEdges = np.argsort(incidentVertices, kind='stable') // 2
+    self._incidentStarts = np.concatenate([[0], np.cumsum(np.bincount(incidentVertices, minlength=len(points)))])
+    # markers of the region vertices and edges, cleared after use: cheaper than set operations
+    self._vertexMarks = np.zeros(len(points), dtype=bool)
+    self._edgeMarks = np.zeros(len(self.edges), dtype=bool)
+    # local index of the vertices of the region, -1 elsewhere
+    self._localIndex = np.full(len(points), -1, dtype=np.intp)
+    # vertices not at rest after the last update
+    self.displaced = np.zeros(0, dtype=np.intp)
+
+  def reset(self):
+    """
+    Put the displaced vertices back to rest.
+    """
+    self.points[self.displaced] = self.restPoints[self.displaced]
+    self.displaced = np.zeros(0, dtype=np.intp)
+
+  def getState(self):
+    """
+    Copy of the deformation: the displaced vertices and their positions.
+    """
+    return self.displaced.copy(), self.points[self.displaced].copy()
+
+  def setState(self, state):
+    """
+    Deform the mesh as in a state from getState (None: at rest).
+    """
+    self.reset()
+    if state is not None:
+      self.displaced, positions = state[0].copy(), state[1]
+      self.points[self.displaced] = positions
+
+  def _marked(self, marks, indices):
+    # sorted unique indices, through the marker array
+    marks[indices] = True
+    unique = np.flatnonzero(marks)
+    marks[unique] = False
+    return unique
+
+  def _region(self, segments):
+    # vertices near the blades (closest first when over maxVertices) and the displaced ones
+    candidates = self.grid.query(segments.min(axis=(0, 1)) - self.radius, segments.max(axis=(0, 1)) + self.radius)
+    distances = _segmentDistances(self.restPoints[candidates], segments)[1].min(axis=0)
+    near = distances < self.radius
+    candidates, distances = candidates[near], distances[near]
+    if len(candidates) > self.maxVertices:
+      closest = np.argpartition(distances, self.maxVertices)[:self.maxVertices]
+      candidates = candidates[closest]
+    self._vertexMarks[candidates] = True
+    released = self.displaced[~self._vertexMarks[self.displaced]]
+    self._vertexMarks[candidates] = False
+    # the displaced vertices that do not fit go back to rest
+    keep = max(0, self.maxVertices - len(candidates))
+    self.points[released[keep:]] = self.restPoints[released[keep:]]
+    return self._marked(self._vertexMarks, np.concatenate([candidates, released[:keep]]))
+
+  def update(self, segments):
+    """
+    Deform the mesh around the blades, segments (B, 2, 3) in the frame of the points
+    (start and end of each blade axis). Returns True if points was modified.
+    """
+    segments = np.asarray(segments, dtype=float)
+    region = self._region(segments)
+    if not len(region):
+      return False
+    # edges of the region; their vertices outside of it are fixed
+    counts = self._incidentStarts[region + 1] - self._incidentStarts[region]
+    offsets = np.repeat(self._incidentStarts[region] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    edgeIndices = self._marked(self._edgeMarks, self._incidentEdges[offsets])
+    edges = self.edges[edgeIndices]
+    self._vertexMarks[region] = True
+    endpoints = edges.ravel()
+    outside = endpoints[~self._vertexMarks[endpoints]]
+    self._vertexMarks[region] = False
+    fixed = self._marked(self._vertexMarks, outside)
+    vertices = np.concatenate([region, fixed])
+    self._localIndex[vertices] = np.arange(len(vertices))
+    first = self._localIndex[edges[:, 0]]
+    second = self._localIndex[edges[:, 1]]
+    self._localIndex[vertices] = -1
+    movable = np.zeros(len(vertices))
+    movable[:len(region)] = 1.0
+    x = self.points[vertices].astype(float)
+    rest = self.restPoints[vertices]
+    restLengths = self.restLengths[edgeIndices]
+    # Jacobi averaging: each vertex moves by the mean of its corrections. The corrections of
+    # both ends of all the edges are summed per vertex and axis with a single bincount.
+    share = movable[first] / np.maximum(movable[first] + movable[second], 1.0)
+    counts = np.maximum(np.bincount(np.concatenate([first, second]), minlength=len(vertices)), 1)
+    correctionScale = np.concatenate([share / counts[first], -(1 - share) * movable[second] / counts[second]])
+    correctionBins = (3 * np.concatenate([first, second])[:, np.newaxis] + np.arange(3)).ravel()
+    # only the vertices near the blades can be pushed by them
+    contact = np.flatnonzero(_segmentDistances(x[:len(region)], segments)[1].min(axis=0) < 2 * self.bladeRadius)
+    restPull = REST_STIFFNESS * movable[:, np.newaxis]
+    for iteration in range(self.iterations):
+      delta = x[second] - x[first]
+      lengths = np.maximum(np.sqrt(np.einsum('ij,ij->i', delta, delta)), 1e-9)
+      delta *= (EDGE_STIFFNESS * (lengths - restLengths) / lengths)[:, np.newaxis]
+      corrections = np.concatenate([delta, delta]) * correctionScale[:, np.newaxis]
+      x += np.bincount(correctionBins, weights=corrections.ravel(), minlength=3 * len(x)).reshape(-1, 3)
+      x += restPull * (rest - x)
+      # blades last: they are a hard constraint
+      if len(contact):
+        closest, distances = _segmentDistances(x[contact], segments)
+        for blade in range(len(segments)):
+          inside = distances[blade] < self.bladeRadius
+          if np.any(inside):
+            outward = x[contact[inside]] - closest[blade, inside]
+            x[contact[inside]] = closest[blade, inside] + outward * (self.bladeRadius / np.maximum(
+              distances[blade, inside], 1e-9))[:, np.newaxis]
+    self.points[region] = x[:len(region)]
+    displacement = np.linalg.norm(x[:len(region)] - rest[:len(region)], axis=1)
+    atRest = displacement < REST_TOLERANCE
+    self.points[region[atRest]] = self.restPoints[region[atRest]]
+    self.displaced = region[~atRest]
+    return True
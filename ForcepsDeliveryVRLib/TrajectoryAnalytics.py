@@ -0,0 +1,253 @@
+import argparse
+import time
+import numpy as np
+
+from .TrajectoryFile import TrajectoryReader, POSE_LEFT, POSE_RIGHT
+
+#
+# Motion metrics of recorded trajectories
+#
+# Recordings are sampled when the tracked transforms change, so they are first
+# resampled on a uniform time grid. All metrics are then computed on whole arrays,
+# for all the instruments of the recording at once: positions have shape (N,P,3)
+# with P the number of instruments. Distances in mm, times in s.
+#
+
+DEFAULT_RATE = 90.0
+# Instruments slower than this are considered idle (mm/s)
+IDLE_SPEED = 20.0
+# SPARC parameters (Balasubramanian et al. 2015)
+SPARC_CUTOFF = 10.0
+SPARC_AMPLITUDE_THRESHOLD = 0.05
+SPARC_PADDING = 4
+
+
+def resample(timestamps, values, rate=DEFAULT_RATE):
+  """
+  Linear interpolation of values (N,...) sampled at increasing timestamps (N,) on a
+  uniform grid at the given rate. Returns (uniformTimestamps, uniformValues).
+  """
+  uniformTimestamps = np.arange(timestamps[0], timestamps[-1], 1.0 / rate)
+  if len(uniformTimestamps) < 2:
+    return timestamps.astype(float), values.astype(float)
+  upper = np.clip(np.searchsorted(timestamps, uniformTimestamps, side='right'), 1, len(timestamps) - 1)
+  lower = upper - 1
+  span = timestamps[upper] - timestamps[lower]
+  weights = np.where(span > 0, (uniformTimestamps - timestamps[lower]) / np.where(span > 0, span, 1), 0.0)
+  weights = weights.reshape((-1,) + (1,) * (values.ndim - 1))
+  return uniformTimestamps, values[lower] * (1 - weights) + values[upper] * weights
+
+
+def matricesToQuaternions(rotations):
+  """
+  Unit quaternions (...,4) as (w,x,y,z) of rotation matrices (...,3,3).
+  """
+  m = rotations
+  trace = m[..., 0, 0] + m[..., 1, 1] + m[..., 2, 2]
+  # the largest of 4w^2, 4x^2, 4y^2, 4z^2 gives a well-conditioned formula
+  candidates = np.stack([
+    1 + trace, 1 + m[..., 0, 0] - m[..., 1, 1] - m[..., 2, 2],
+    1 - m[..., 0, 0] + m[..., 1, 1] - m[..., 2, 2], 1 - m[..., 0, 0] - m[..., 1, 1] + m[..., 2, 2]], axis=-1)
+  largest = np.argmax(candidates, axis=-1)
+  quaternions = np.stack([
+    np.stack([1 + trace, m[..., 2, 1] - m[..., 1, 2], m[..., 0, 2] - m[..., 2, 0], m[..., 1, 0] - m[..., 0, 1]], axis=-1),
+    np.stack([m[..., 2, 1] - m[..., 1, 2], candidates[..., 1], m[..., 0, 1] + m[..., 1, 0], m[..., 0, 2] + m[..., 2, 0]], axis=-1),
+    np.stack([m[..., 0, 2] - m[..., 2, 0], m[..., 0, 1] + m[..., 1, 0], candidates[..., 2], m[..., 1, 2] + m[..., 2, 1]], axis=-1),
+    np.stack([m[..., 1, 0] - m[..., 0, 1], m[..., 0, 2] + m[..., 2, 0], m[..., 1, 2] + m[..., 2, 1], candidates[..., 3]], axis=-1)],
+    axis=-2)
+  quaternions = np.take_along_axis(quaternions, largest[..., np.newaxis, np.newaxis], axis=-2)[..., 0, :]
+  return quaternions / np.linalg.norm(quaternions, axis=-1, keepdims=True)
+
+
+def quaternionsToMatrices(quaternions):
+  """
+  Rotation matrices (...,3,3) of unit quaternions (...,4) as (w,x,y,z).
+  """
+  w, x, y, z = np.moveaxis(quaternions, -1, 0)
+  return np.stack([
+    np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)], axis=-1),
+    np.stack([2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)], axis=-1),
+    np.stack([2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)], axis=-1)], axis=-2)
+
+
+def resamplePoses(timestamps, poses, rate=DEFAULT_RATE):
+  """
+  Poses (N,...,4,4) sampled at increasing timestamps (N,) resampled on a uniform grid at
+  the given rate: linear interpolation of the translations and SLERP of the rotations.
+  Returns (uniformTimestamps, uniformPoses).
+  """
+  uniformTimestamps = np.arange(timestamps[0], timestamps[-1], 1.0 / rate)
+  if len(uniformTimestamps) < 2:
+    return timestamps.astype(float), poses.astype(float)
+  upper = np.clip(np.searchsorted(timestamps, uniformTimestamps, side='right'), 1, len(timestamps) - 1)
+  lower = upper - 1
+  span = timestamps[upper] - timestamps[lower]
+  weights = np.where(span > 0, (uniformTimestamps - timestamps[lower]) / np.where(span > 0, span, 1), 0.0)
+  weights = weights.reshape((-1,) + (1,) * (poses.ndim - 3))
+  quaternions = matricesToQuaternions(poses[..., :3, :3].astype(float))
+  q0, q1 = quaternions[lower], quaternions[upper]
+  # shortest arc
+  cosine = np.sum(q0 * q1, axis=-1)
+  q1 = np.where(cosine[..., np.newaxis] < 0, -q1, q1)
+  cosine = np.abs(cosine)
+  angle = np.arccos(np.clip(cosine, -1.0, 1.0))
+  sine = np.sin(angle)
+  # nearly identical rotations are interpolated linearly
+  small = sine < 1e-6
+  safeSine = np.where(small, 1.0, sine)
+  w0 = np.where(small, 1 - weights, np.sin((1 - weights) * angle) / safeSine)
+  w1 = np.where(small, weights, np.sin(weights * angle) / safeSine)
+  interpolated = w0[..., np.newaxis] * q0 + w1[..., np.newaxis] * q1
+  interpolated /= np.linalg.norm(interpolated, axis=-1, keepdims=True)
+  uniformPoses = np.zeros(interpolated.shape[:-1] + (4, 4))
+  uniformPoses[..., :3, :3] = quaternionsToMatrices(interpolated)
+  translations = poses[..., :3, 3].astype(float)
+  uniformPoses[..., :3, 3] = translations[lower] * (1 - weights[..., np.newaxis]) + translations[upper] * weights[..., np.newaxis]
+  uniformPoses[..., 3, 3] = 1.0
+  return uniformTimestamps, uniformPoses
+
+
+def tipPositions(poses, tipOffset=(0.0, 0.0, 0.0)):
+  """
+  Positions (N,P,3) of a point given in the local frame of each pose (N,P,4,4),
+  for example the blade tip. The default is the origin of the pose.
+  """
+  return np.einsum('npij,j->npi', poses[..., :3, :3], np.asarray(tipOffset, dtype=float)) + poses[..., :3, 3]
+
+
+def pathLength(positions):
+  """
+  Length of the path of each instrument: (P,) from positions (N,P,3).
+  """
+  return np.linalg.norm(np.diff(positions, axis=0), axis=-1).sum(axis=0)
+
+
+def pathEfficiency(positions):
+  """
+  Ratio between the straight distance from start to end and the path length (1: straight line).
+  """
+  length = pathLength(positions)
+  straight = np.linalg.norm(positions[-1] - positions[0], axis=-1)
+  return np.where(length > 0, straight / np.where(length > 0, length, 1), 1.0)
+
+
+def speeds(positions, rate=DEFAULT_RATE):
+  return np.linalg.norm(np.gradient(positions, 1.0 / rate, axis=0), axis=-1)
+
+
+def sparc(speed, rate=DEFAULT_RATE, cutoff=SPARC_CUTOFF, amplitudeThreshold=SPARC_AMPLITUDE_THRESHOLD,
+          padding=SPARC_PADDING):
+  """
+  Spectral arc length of each speed profile (N,P): the length of the normalized
+  magnitude spectrum up to the frequency where it last exceeds amplitudeThreshold
+  (at most cutoff Hz). Values closer to 0 are smoother.
+  """
+  n = int(2 ** (np.ceil(np.log2(len(speed))) + padding))
+  frequencies = np.arange(n // 2 + 1) * rate / n
+  magnitude = np.abs(np.fft.rfft(speed, n, axis=0))
+  magnitude /= np.maximum(magnitude.max(axis=0), 1e-12)
+  magnitude = magnitude[frequencies <= cutoff]
+  frequencies = frequencies[frequencies <= cutoff]
+  # adaptive cutoff: last frequency above the amplitude threshold, per instrument
+  above = magnitude >= amplitudeThreshold
+  last = len(frequencies) - 1 - np.argmax(above[::-1], axis=0)
+  # frequency axis normalized by the cutoff of each instrument
+  normalizedSteps = np.diff(frequencies)[:, np.newaxis] / np.maximum(frequencies[last], 1e-12)[np.newaxis, :]
+  segments = np.sqrt(normalizedSteps ** 2 + np.diff(magnitude, axis=0) ** 2)
+  inside = np.arange(len(frequencies) - 1)[:, np.newaxis] < last[np.newaxis, :]
+  return -(segments * inside).sum(axis=0)
+
+
+def logDimensionlessJerk(positions, rate=DEFAULT_RATE):
+  """
+  Log dimensionless jerk of each instrument (P,). Values closer to 0 are smoother.
+  """
+  dt = 1.0 / rate
+  velocity = np.gradient(positions, dt, axis=0)
+  jerk = np.gradient(np.gradient(velocity, dt, axis=0), dt, axis=0)
+  duration = (len(positions) - 1) * dt
+  peakSpeed = np.linalg.norm(velocity, axis=-1).max(axis=0)
+  jerkIntegral = (np.linalg.norm(jerk, axis=-1) ** 2).sum(axis=0) * dt
+  return -np.log(np.maximum(duration ** 3 / np.maximum(peakSpeed, 1e-12) ** 2 * jerkIntegral, 1e-12))
+
+
+def idleTime(speed, rate=DEFAULT_RATE, threshold=IDLE_SPEED):
+  """
+  Time each instrument (P,) and all instruments together (scalar) move slower than threshold.
+  """
+  idle = speed < threshold
+  return idle.sum(axis=0) / rate, np.all(idle, axis=1).sum() / rate
+
+
+def dwellHeatmap(positions, center, size=200.0, bins=40, rate=DEFAULT_RATE):
+  """
+  Time (s) spent by the points (N,P,3) in each voxel of a cube of the given size (mm)
+  around center, as a (bins,bins,bins) array indexed [x,y,z]. Points outside are ignored.
+  """
+  points = positions.reshape(-1, 3)
+  voxels = np.floor((points - (np.asarray(center, dtype=float) - size / 2.0)) * (bins / size)).astype(np.int64)
+  inside = np.all((voxels >= 0) & (voxels < bins), axis=1)
+  voxels = voxels[inside]
+  flatIndices = (voxels[:, 0] * bins + voxels[:, 1]) * bins + voxels[:, 2]
+  return np.bincount(flatIndices, minlength=bins ** 3).reshape(bins, bins, bins) / rate
+
+
+def analyzeTrajectory(timestamps, poses, rate=DEFAULT_RATE, tipOffset=(0.0, 0.0, 0.0), names=('Left', 'Right')):
+  """
+  Motion metrics of a trajectory: poses (N,P,4,4), of which the first len(names)
+  instruments are analyzed. Returns a flat dict of metric name to value, e.g.
+  pathLengthLeft, sparcRight, idleTime, that can be stored with the phase results.
+  """
+  metrics = {'duration': float(timestamps[-1] - timestamps[0]) if len(timestamps) else 0.0}
+  if len(timestamps) < 4:
+    return metrics
+  uniformTimestamps, uniformPoses = resample(timestamps, poses[:, :len(names)].astype(float), rate)
+  positions = tipPositions(uniformPoses, tipOffset)
+  speed = speeds(positions, rate)
+  values = {
+    'pathLength': pathLength(positions),
+    'pathEfficiency': pathEfficiency(positions),
+    'meanSpeed': speed.mean(axis=0),
+    'sparc': sparc(speed, rate),
+    'logDimensionlessJerk': logDimensionlessJerk(positions, rate)}
+  values['idleTime'], metrics['idleTime'] = idleTime(speed, rate)
+  for metric, perInstrument in values.items():
+    for name, value in zip(names, perInstrument):
+      metrics[metric + name] = float(value)
+  metrics['idleTime'] = float(metrics['idleTime'])
+  return metrics
+
+
+def analyzeRecording(path, rate=DEFAULT_RATE, tipOffset=(0.0, 0.0, 0.0)):
+  reader = TrajectoryReader(path)
+  metrics = analyzeTrajectory(np.asarray(reader.timestamps), reader.frames['poses'][:, [POSE_LEFT, POSE_RIGHT]],
+    rate, tipOffset)
+  reader.close()
+  return metrics
+
+
+def analyzeArchive(paths, rate=DEFAULT_RATE, tipOffset=(0.0, 0.0, 0.0)):
+  """
+  Metrics of many recordings: dict of metric name to an array with one value per
+  recording (NaN where a metric is missing).
+  """
+  results = [analyzeRecording(path, rate, tipOffset) for path in paths]
+  names = sorted(set(name for metrics in results for name in metrics))
+  return {name: np.array([metrics.get(name, np.nan) for metrics in results]) for name in names}
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Motion metrics of recorded ForcepsDeliveryVR trajectories')
+  parser.add_argument('paths', nargs='+', help='trajectory files (.fdvt)')
+  parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='resampling rate (Hz)')
+  args = parser.parse_args()
+  start = time.perf_counter()
+  archive = analyzeArchive(args.paths, args.rate)
+  elapsed = time.perf_counter() - start
+  for name, values in archive.items():
+    print('%-28s mean %10.3f  sd %10.3f' % (name, np.nanmean(values), np.nanstd(values)))
+  print('Analyzed %d recordings in %.3f s' % (len(args.paths), elapsed))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,157 @@
+import os
+import struct
+
+import numpy as np
+
+#
+# Recorded trajectory files
+#
+# Fixed-stride binary format: a 16-byte header followed by one record per frame,
+# a float64 timestamp (s) and POSES_PER_FRAME float32 4x4 matrices (left controller,
+# right controller, HMD). Timestamps are increasing, so they are the time index of
+# the file: a frame is found by binary search on the memory-mapped timestamp column
+# without reading the rest of the file.
+#
+
+MAGIC = b'FDVT'
+VERSION = 1
+POSES_PER_FRAME = 3
+HEADER = struct.Struct('<4sHHII')
+HEADER_SIZE = 16
+POSE_LEFT = 0
+POSE_RIGHT = 1
+POSE_HMD = 2
+
+
+def frameDtype(posesPerFrame=POSES_PER_FRAME):
+  return np.dtype([('timestamp', '<f8'), ('poses', '<f4', (posesPerFrame, 4, 4))])
+
+
+def _header(posesPerFrame):
+  return HEADER.pack(MAGIC, VERSION, posesPerFrame, frameDtype(posesPerFrame).itemsize, 0)
+
+
+def writeTrajectory(path, timestamps, poses):
+  """
+  Write a whole trajectory at once: timestamps (N,) and poses (N,POSES_PER_FRAME,4,4).
+  """
+  frames = np.empty(len(timestamps), dtype=frameDtype(poses.shape[1]))
+  frames['timestamp'] = timestamps
+  frames['poses'] = poses
+  with open(path, 'wb') as file:
+    file.write(_header(poses.shape[1]))
+    frames.tofile(file)
+
+
+class TrajectoryWriter:
+  """
+  Appends frames while a phase is recorded. Frames are buffered and written in blocks,
+  so that appending costs a copy into a preallocated record array. Since the number of
+  frames follows from the file size, a file cut short by a crash stays readable.
+  """
+
+  def __init__(self, path, posesPerFrame=POSES_PER_FRAME, bufferFrames=256):
+    self.path = path
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+      os.makedirs(directory)
+    self.frameCount = 0
+    self._buffer = np.zeros(bufferFrames, dtype=frameDtype(posesPerFrame))
+    self._buffered = 0
+    self._file = open(path, 'wb')
+    self._file.write(_header(posesPerFrame))
+
+  def append(self, timestamp, poses):
+    """
+    Add a frame. poses: sequence of POSES_PER_FRAME 4x4 arrays.
+    """
+    frame = self._buffer[self._buffered]
+    frame['timestamp'] = timestamp
+    for index, pose in enumerate(poses):
+      frame['poses'][index] = pose
+    self._buffered += 1
+    self.frameCount += 1
+    if self._buffered == len(self._buffer):
+      self.flush()
+
+  def flush(self):
+    if self._buffered:
+      self._buffer[:self._buffered].tofile(self._file)
+      self._buffered = 0
+    self._file.flush()
+
+  def close(self):
+    if self._file.closed:
+      return
+    self.flush()
+    self._file.close()
+
+
+class TrajectoryReader:
+  """
+  Random access to a recorded trajectory through numpy.memmap. Only the pages that are
+  actually read are loaded, so seeking in a long session is O(log n) whatever its size.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    with open(path, 'rb') as file:
+      header = file.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+      raise ValueError('Not a trajectory file: ' + path)
+    magic, version, posesPerFrame, frameSize, _ = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError('Not a trajectory file: ' + path)
+    dtype = frameDtype(posesPerFrame)
+    if frameSize != dtype.itemsize:
+      raise ValueError('Unexpected frame size in ' + path)
+    self.posesPerFrame = posesPerFrame
+    # an incomplete last frame (interrupted recording) is ignored
+    frameCount = (os.path.getsize(path) - HEADER_SIZE) // frameSize
+    if frameCount:
+      self.frames = np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(frameCount,))
+    else:
+      self.frames = np.zeros(0, dtype=dtype)
+    self.timestamps = self.frames['timestamp']
+
+  def __len__(self):
+    return len(self.frames)
+
+  @property
+  def startTime(self):
+    return float(self.timestamps[0]) if len(self) else 0.0
+
+  @property
+  def endTime(self):
+    return float(self.timestamps[-1]) if len(self) else 0.0
+
+  @property
+  def duration(self):
+    return self.endTime - self.startTime
+
+  def frameIndex(self, timestamp):
+    """
+    Index of the last frame recorded at or before timestamp (clamped to the recording).
+    """
+    index = int(np.searchsorted(self.timestamps, timestamp, side='right')) - 1
+    return min(max(index, 0), len(self) - 1)
+
+  def poses(self, index):
+    """
+    (POSES_PER_FRAME,4,4) float32 view of the poses of a frame.
+    """
+    return self.frames['poses'][index]
+
+  def posesAt(self, timestamp):
+    return self.poses(self.frameIndex(timestamp))
+
+  def close(self):
+    """
+    Release the file mapping. The views returned by poses() and the frames and
+    timestamps arrays read before must not be used after this.
+    """
+    mapping = getattr(self.frames, '_mmap', None)
+    self.frames = np.zeros(0, dtype=self.frames.dtype)
+    self.timestamps = self.frames['timestamp']
+    if mapping is not None:
+      mapping.close()
@@ -0,0 +1,345 @@
+import argparse
+import time
+import numpy as np
+
+from . import Scoring
+from .Scoring import (
+  PHASES, DEFAULT_MARGINS,
+  PHASE_ARRANGEMENT, PHASE_PRESENTATION,
+  PHASE_INITIAL_PLACEMENT_LEFT, PHASE_FINAL_PLACEMENT_LEFT,
+  PHASE_INITIAL_PLACEMENT_RIGHT, PHASE_FINAL_PLACEMENT_RIGHT, PHASE_ROTATION, PHASE_TRACTION,
+  DEFAULT_HEAD_LANDMARKS, DEFAULT_PELVIC_AXIS, BLADE_TIP, ROTATION_TARGET)
+from .HeadRotation import rotationAbout, rotatedHead
+
+#
+# Synthetic controller and HMD trajectories
+#
+# Each trajectory is an approach with a minimum-jerk profile from a random start pose
+# to the target pose of the phase, followed by a hold with physiological tremor, plus
+# tracking noise. Everything is computed on whole (N,...) arrays.
+#
+
+SCENARIO_CORRECT = 'correct'
+SCENARIO_ROTATED_BLADES = 'rotatedBlades'
+SCENARIO_MISALIGNED_HANDLES = 'misalignedHandles'
+SCENARIO_TIP_TOO_FAR = 'tipTooFar'
+SCENARIO_NOT_ROTATED = 'notRotated'
+
+# scenarios that make sense for each phase
+PHASE_SCENARIOS = {
+  PHASE_ARRANGEMENT: [SCENARIO_CORRECT, SCENARIO_ROTATED_BLADES, SCENARIO_MISALIGNED_HANDLES],
+  PHASE_PRESENTATION: [SCENARIO_CORRECT, SCENARIO_ROTATED_BLADES],
+  PHASE_INITIAL_PLACEMENT_LEFT: [SCENARIO_CORRECT, SCENARIO_ROTATED_BLADES, SCENARIO_TIP_TOO_FAR],
+  PHASE_FINAL_PLACEMENT_LEFT: [SCENARIO_CORRECT, SCENARIO_TIP_TOO_FAR],
+  PHASE_INITIAL_PLACEMENT_RIGHT: [SCENARIO_CORRECT, SCENARIO_ROTATED_BLADES, SCENARIO_TIP_TOO_FAR],
+  PHASE_FINAL_PLACEMENT_RIGHT: [SCENARIO_CORRECT, SCENARIO_TIP_TOO_FAR],
+  PHASE_ROTATION: [SCENARIO_CORRECT, SCENARIO_NOT_ROTATED, SCENARIO_TIP_TOO_FAR],
+  PHASE_TRACTION: [SCENARIO_CORRECT, SCENARIO_ROTATED_BLADES, SCENARIO_TIP_TOO_FAR],
+  }
+
+# Target controller positions (mm) for the placement phases, in scene coordinates.
+# With vertical blades they put the blade tip on Scoring.DEFAULT_HEAD_LANDMARKS.
+PLACEMENT_TARGETS = {
+  PHASE_INITIAL_PLACEMENT_LEFT: [30.0, 0.0, 60.0],
+  PHASE_FINAL_PLACEMENT_LEFT: [40.0, 10.0, 40.0],
+  PHASE_INITIAL_PLACEMENT_RIGHT: [-30.0, 0.0, 60.0],
+  PHASE_FINAL_PLACEMENT_RIGHT: [-40.0, 10.0, 40.0],
+  }
+
+# Traction: distance (mm) between the blade tips of the locked forceps, and range of depth
+# of the tips along Scoring.DEFAULT_PELVIC_AXIS (fraction of its length)
+TRACTION_TIP_SEPARATION = 80.0
+TRACTION_DEPTHS = (0.3, 0.7)
+
+# Rotation of the presentation pose: blades pointing to -x, handles along -z
+PRESENTATION_ROTATION = np.array([
+  [-1.0, 0.0, 0.0],
+  [0.0, 0.0, -1.0],
+  [0.0, -1.0, 0.0]])
+
+# Position of the observer's head
+HMD_POSITION = [0.0, -400.0, 250.0]
+
+
+def rotationMatrices(rotationVectors):
+  """
+  Rotation matrices (N,3,3) from rotation vectors (N,3) (axis times angle in radians), Rodrigues formula.
+  """
+  angles = np.linalg.norm(rotationVectors, axis=1)
+  axes = rotationVectors / np.maximum(angles, 1e-12)[:, np.newaxis]
+  x, y, z = axes[:, 0], axes[:, 1], axes[:, 2]
+  c = np.cos(angles)
+  s = np.sin(angles)
+  t = 1 - c
+  r = np.empty((len(angles), 3, 3))
+  r[:, 0, 0] = t * x * x + c
+  r[:, 0, 1] = t * x * y - s * z
+  r[:, 0, 2] = t * x * z + s * y
+  r[:, 1, 0] = t * x * y + s * z
+  r[:, 1, 1] = t * y * y + c
+  r[:, 1, 2] = t * y * z - s * x
+  r[:, 2, 0] = t * x * z - s * y
+  r[:, 2, 1] = t * y * z + s * x
+  r[:, 2, 2] = t * z * z + c
+  return r
+
+
+def _axisRotation(direction):
+  # rotation that maps +z to direction, keeping +x in the plane orthogonal to it
+  z = direction / np.linalg.norm(direction)
+  x = np.array([1.0, 0.0, 0.0]) - z[0] * z
+  x /= np.linalg.norm(x)
+  return np.stack([x, np.cross(z, x), z], axis=1)
+
+
+def _randomUnitVector(rng):
+  v = rng.normal(size=3)
+  return v / np.linalg.norm(v)
+
+
+def _minimumJerk(tau):
+  tau = np.clip(tau, 0, 1)
+  return tau ** 3 * (10 - 15 * tau + 6 * tau ** 2)
+
+
+def _trajectory(rng, targetRotation, targetPosition, frames, rate, approachFraction, noise, rotationNoise,
+                startDistance=150.0, startAngle=np.radians(60)):
+  """
+  Poses (N,4,4) going from a random start pose to the target pose and holding it.
+  """
+  t = np.arange(frames) / rate
+  s = _minimumJerk(np.arange(frames) / max(1, approachFraction * frames))[:, np.newaxis]
+  # start pose: random offset from the target
+  startPosition = np.asarray(targetPosition) + startDistance * _randomUnitVector(rng)
+  startRotationVector = startAngle * _randomUnitVector(rng)
+  poses = np.zeros((frames, 4, 4))
+  poses[:, 3, 3] = 1
+  # rotation: target * exp((1 - s) * start offset), plus tremor and noise
+  tremorFrequency = rng.uniform(8, 12)
+  tremor = np.radians(0.3) * np.sin(2 * np.pi * tremorFrequency * t)[:, np.newaxis] * _randomUnitVector(rng)
+  rotationVectors = (1 - s) * startRotationVector + tremor + rng.normal(scale=np.radians(rotationNoise), size=(frames, 3))
+  poses[:, :3, :3] = np.matmul(targetRotation, rotationMatrices(rotationVectors))
+  # translation
+  tremor = 0.3 * np.sin(2 * np.pi * tremorFrequency * t + 1.0)[:, np.newaxis] * _randomUnitVector(rng)
+  poses[:, :3, 3] = (1 - s) * startPosition + s * np.asarray(targetPosition) + tremor + rng.normal(scale=noise, size=(frames, 3))
+  return poses
+
+
+def _hmdTrajectory(rng, frames, rate):
+  t = np.arange(frames) / rate
+  poses = np.zeros((frames, 4, 4))
+  poses[:, 3, 3] = 1
+  # slow head sway, looking towards +y
+  sway = np.radians(3) * np.sin(2 * np.pi * 0.2 * t)[:, np.newaxis] * np.array([0.0, 0.0, 1.0])
+  poses[:, :3, :3] = rotationMatrices(sway + np.array([np.pi / 2, 0.0, 0.0]))
+  poses[:, :3, 3] = np.asarray(HMD_POSITION) + 20 * np.sin(2 * np.pi * 0.1 * t)[:, np.newaxis] * np.array([1.0, 0.0, 0.0])
+  return poses
+
+
+def generatePhaseTrajectory(phase, scenario=SCENARIO_CORRECT, frames=900, rate=90.0, noise=0.5, rotationNoise=0.5,
+                            approachFraction=0.5, seed=None):
+  """
+  Synthetic recording of one phase attempt. Returns a dict with:
+    timestamps (N,), left, right, hmd (N,4,4) poses,
+    expected (N,) expected result of the phase check,
+    labeled (N,) True for the frames where expected applies (hold part, after the approach),
+    head: HeadLandmarks of the checks (None for Scoring.DEFAULT_HEAD_LANDMARKS).
+  noise is the tracking noise in mm, rotationNoise in degrees.
+  """
+  if scenario not in PHASE_SCENARIOS[phase]:
+    raise ValueError('Scenario ' + scenario + ' is not defined for phase ' + phase)
+  rng = np.random.default_rng(seed)
+  # common orientation of both blades, facing the mother with a small random heading
+  # (the arrangement check compares the rotation diagonals, which assumes this orientation)
+  heading = np.radians(rng.uniform(-15, 15))
+  leftRotation = rotationMatrices(np.array([[0.0, 0.0, heading]]))[0]
+  if phase == PHASE_PRESENTATION:
+    leftRotation = PRESENTATION_ROTATION.copy()
+  elif phase in PLACEMENT_TARGETS or phase == PHASE_ROTATION:
+    # blades vertical
+    leftRotation = np.eye(3)
+  elif phase == PHASE_TRACTION:
+    # locked forceps with the handles along the pelvic axis at the depth of the tips
+    tractionPoint, tangent = DEFAULT_PELVIC_AXIS.pointAt(rng.uniform(*TRACTION_DEPTHS) * DEFAULT_PELVIC_AXIS.length)
+    leftRotation = _axisRotation(tangent)
+  rightRotation = leftRotation.copy()
+  leftPosition = np.array([0.0, 0.0, 100.0])
+  rightPosition = leftPosition - [10.0, 0.0, 0.0]
+  if phase in [PHASE_INITIAL_PLACEMENT_LEFT, PHASE_FINAL_PLACEMENT_LEFT]:
+    leftPosition = np.array(PLACEMENT_TARGETS[phase])
+    rightPosition = np.array([-150.0, -100.0, 0.0])
+  elif phase in [PHASE_INITIAL_PLACEMENT_RIGHT, PHASE_FINAL_PLACEMENT_RIGHT]:
+    rightPosition = np.array(PLACEMENT_TARGETS[phase])
+    leftPosition = np.array(PLACEMENT_TARGETS[PHASE_FINAL_PLACEMENT_LEFT])
+  elif phase == PHASE_ROTATION:
+    leftPosition = np.array(PLACEMENT_TARGETS[PHASE_FINAL_PLACEMENT_LEFT])
+    rightPosition = np.array(PLACEMENT_TARGETS[PHASE_FINAL_PLACEMENT_RIGHT])
+  head = None
+
+  # blade of the phase, for the errors that affect a single blade
+  errorOnLeft = phase in [PHASE_INITIAL_PLACEMENT_LEFT, PHASE_FINAL_PLACEMENT_LEFT]
+  if phase == PHASE_TRACTION:
+    # both blades are locked: pulling tilted, or with the tips away from the axis
+    if scenario == SCENARIO_ROTATED_BLADES:
+      error = rotationMatrices((rng.choice([-1, 1]) * np.radians(rng.uniform(60, 90)) * np.array([[1.0, 0.0, 0.0]])))[0]
+      rightRotation = leftRotation.dot(error)
+    elif scenario == SCENARIO_TIP_TOO_FAR:
+      tractionPoint = tractionPoint + rng.choice([-1, 1]) * rng.uniform(30, 50) * leftRotation[:, 0]
+    # blade tips on each side of the traction point
+    tipOffset = TRACTION_TIP_SEPARATION / 2 * leftRotation[:, 0]
+    leftRotation = rightRotation
+    leftPosition = tractionPoint + tipOffset - leftRotation.dot(BLADE_TIP)
+    rightPosition = tractionPoint - tipOffset - rightRotation.dot(BLADE_TIP)
+  elif phase == PHASE_ROTATION:
+    # forceps locked on the head, turned with it by the target angle or only part of it
+    angle = ROTATION_TARGET if scenario != SCENARIO_NOT_ROTATED else rng.uniform(0.0, 0.5) * ROTATION_TARGET
+    if scenario == SCENARIO_TIP_TOO_FAR:
+      rightPosition = rightPosition + [-rng.uniform(30, 50), 0.0, rng.uniform(10, 20)]
+    head = rotatedHead(DEFAULT_HEAD_LANDMARKS, angle)
+    arcLength, point, tangent, distance = DEFAULT_PELVIC_AXIS.project(DEFAULT_HEAD_LANDMARKS.center)
+    rotation = rotationAbout(point, tangent, angle)
+    leftRotation, rightRotation = rotation[:3, :3].dot(leftRotation), rotation[:3, :3].dot(rightRotation)
+    leftPosition = rotation[:3, :3].dot(leftPosition) + rotation[:3, 3]
+    rightPosition = rotation[:3, :3].dot(rightPosition) + rotation[:3, 3]
+  elif scenario == SCENARIO_ROTATED_BLADES:
+    # well beyond the margins: rotation about the blade axis, or tilt of a placed blade
+    angle = rng.choice([-1, 1]) * np.radians(rng.uniform(60, 90))
+    axis = np.array([1.0, 0.0, 0.0]) if phase in PLACEMENT_TARGETS else np.array([0.0, 0.0, 1.0])
+    error = rotationMatrices((angle * axis)[np.newaxis])[0]
+    if errorOnLeft:
+      leftRotation = leftRotation.dot(error)
+    else:
+      rightRotation = rightRotation.dot(error)
+  elif scenario == SCENARIO_MISALIGNED_HANDLES:
+    rightPosition = rightPosition + rng.uniform(15, 30) * np.eye(3)[rng.integers(3)] * rng.choice([-1, 1])
+  elif scenario == SCENARIO_TIP_TOO_FAR:
+    offset = np.array([rng.uniform(30, 50), 0.0, rng.uniform(10, 20)])
+    if errorOnLeft:
+      leftPosition = leftPosition + offset
+    else:
+      rightPosition = rightPosition + offset * [-1, 1, 1]
+
+  result = {
+    'phase': phase,
+    'scenario': scenario,
+    'timestamps': np.arange(frames) / rate,
+    'left': _trajectory(rng, leftRotation, leftPosition, frames, rate, approachFraction, noise, rotationNoise),
+    'right': _trajectory(rng, rightRotation, rightPosition, frames, rate, approachFraction, noise, rotationNoise),
+    'hmd': _hmdTrajectory(rng, frames, rate),
+    'expected': np.full(frames, scenario == SCENARIO_CORRECT),
+    'head': head,
+    }
+  # labels apply once the approach is finished (with a margin for the tremor)
+  labeled = np.zeros(frames, dtype=bool)
+  labeled[int(min(1.0, approachFraction * 1.1) * frames):] = True
+  result['labeled'] = labeled
+  return result
+
+
+def generateDataset(framesPerTrajectory=900, trajectoriesPerScenario=10, rate=90.0, noise=0.5, seed=0, phases=PHASES):
+  """
+  All the scenarios of the given phases, trajectoriesPerScenario times each.
+  Returns a list of trajectories (see generatePhaseTrajectory).
+  """
+  rng = np.random.default_rng(seed)
+  dataset = []
+  for phase in phases:
+    for scenario in PHASE_SCENARIOS[phase]:
+      for index in range(trajectoriesPerScenario):
+        dataset.append(generatePhaseTrajectory(phase, scenario, framesPerTrajectory, rate, noise,
+                                               seed=int(rng.integers(2 ** 31))))
+  return dataset
+
+
+def benchmarkScoring(dataset, margins=None, perFrameSample=2000):
+  """
+  Score a generated dataset with the vectorized checks and, on a sample of frames,
+  with the per-frame checks used in the module. Returns one dict per (phase, scenario)
+  with the agreement with the expected results and the scoring throughput (frames/s).
+  """
+  if margins is None:
+    margins = DEFAULT_MARGINS
+  report = {}
+  for trajectory in dataset:
+    phase = trajectory['phase']
+    key = (phase, trajectory['scenario'])
+    entry = report.setdefault(key, {'frames': 0, 'agreeing': 0, 'batchTime': 0.0, 'perFrameFrames': 0, 'perFrameTime': 0.0})
+    labeled = trajectory['labeled']
+    start = time.perf_counter()
+    res, code = Scoring.evaluatePhaseBatch(phase, trajectory['left'], trajectory['right'], margins[phase], trajectory['head'])
+    entry['batchTime'] += time.perf_counter() - start
+    entry['frames'] += int(labeled.sum())
+    entry['agreeing'] += int((res[labeled] == trajectory['expected'][labeled]).sum())
+    # per-frame path, on a sample
+    count = min(perFrameSample, len(res))
+    start = time.perf_counter()
+    for index in range(count):
+      frameRes, message = Scoring.evaluatePhase(phase, trajectory['left'][index], trajectory['right'][index], margins[phase],
+                                                trajectory['head'])
+      if frameRes != res[index] or message != Scoring.MESSAGES[code[index]]:
+        raise AssertionError('Vectorized and per-frame checks disagree for ' + phase + ' at frame ' + str(index))
+    entry['perFrameTime'] += time.perf_counter() - start
+    entry['perFrameFrames'] += count
+  summary = []
+  for (phase, scenario), entry in report.items():
+    totalFrames = entry['frames'] / max(1e-12, labeledFraction(dataset, phase, scenario))
+    summary.append({
+      'phase': phase,
+      'scenario': scenario,
+      'agreement': entry['agreeing'] / max(1, entry['frames']),
+      'batchFramesPerSecond': totalFrames / max(1e-12, entry['batchTime']),
+      'perFrameFramesPerSecond': entry['perFrameFrames'] / max(1e-12, entry['perFrameTime'])})
+  return summary
+
+
+def benchmarkFreePractice(dataset, margins=None, perFrameSample=2000):
+  """
+  Throughput (frames/s) of the free practice evaluation, all the phases on every frame:
+  (vectorized, per-frame).
+  """
+  batchFrames, batchTime, perFrameFrames, perFrameTime = 0, 0.0, 0, 0.0
+  for trajectory in dataset:
+    start = time.perf_counter()
+    Scoring.evaluateAllPhasesBatch(trajectory['left'], trajectory['right'], margins, trajectory['head'])
+    batchTime += time.perf_counter() - start
+    batchFrames += len(trajectory['left'])
+    count = min(perFrameSample, len(trajectory['left']))
+    start = time.perf_counter()
+    for index in range(count):
+      Scoring.evaluateAllPhases(trajectory['left'][index], trajectory['right'][index], margins, trajectory['head'])
+    perFrameTime += time.perf_counter() - start
+    perFrameFrames += count
+  return batchFrames / max(1e-12, batchTime), perFrameFrames / max(1e-12, perFrameTime)
+
+
+def labeledFraction(dataset, phase, scenario):
+  labeled = [trajectory['labeled'] for trajectory in dataset if trajectory['phase'] == phase and trajectory['scenario'] == scenario]
+  return sum(l.sum() for l in labeled) / max(1, sum(len(l) for l in labeled))
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the ForcepsDeliveryVR scoring with synthetic trajectories')
+  parser.add_argument('--frames', type=int, default=9000, help='frames per trajectory')
+  parser.add_argument('--trajectories', type=int, default=10, help='trajectories per phase and scenario')
+  parser.add_argument('--noise', type=float, default=0.5, help='tracking noise (mm)')
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+  start = time.perf_counter()
+  dataset = generateDataset(args.frames, args.trajectories, noise=args.noise, seed=args.seed)
+  generationTime = time.perf_counter() - start
+  frames = sum(len(trajectory['timestamps']) for trajectory in dataset)
+  print('Generated %d frames in %.2f s (%.0f frames/s)' % (frames, generationTime, frames / generationTime))
+  # the pelvic axis table is baked when the data is loaded in the module, not while scoring
+  start = time.perf_counter()
+  DEFAULT_PELVIC_AXIS.prepare()
+  print('Baked the pelvic axis table in %.2f s' % (time.perf_counter() - start))
+  for entry in benchmarkScoring(dataset):
+    print('%-22s %-18s agreement %6.1f %%  vectorized %10.0f frames/s  per-frame %8.0f frames/s' % (
+      entry['phase'], entry['scenario'], 100 * entry['agreement'],
+      entry['batchFramesPerSecond'], entry['perFrameFramesPerSecond']))
+  batchRate, perFrameRate = benchmarkFreePractice(dataset)
+  print('%-41s vectorized %10.0f frames/s  per-frame %8.0f frames/s' % ('free practice (all phases)', batchRate, perFrameRate))
+
+
+if __name__ == '__main__':
+  main()
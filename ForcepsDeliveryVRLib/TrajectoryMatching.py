@@ -0,0 +1,161 @@
+import numpy as np
+
+from .TrajectoryFile import TrajectoryReader, POSE_LEFT, POSE_RIGHT
+from .TrajectoryAnalytics import resample, tipPositions
+
+#
+# Streaming comparison with expert trajectories
+#
+# The live motion is compared with expert recordings of the same phase by dynamic time
+# warping, one sample at a time. The warping path is restricted to a Sakoe-Chiba band
+# of +-band samples around the time-aligned reference sample, so each new sample only
+# updates one band-wide row of the cost matrix: O(band) work and memory per sample.
+# Features are the blade tip positions of both forceps (mm), sampled at MATCHING_RATE.
+#
+
+MATCHING_RATE = 30.0
+# half width of the band (s)
+MATCHING_BAND = 2.0
+# mean tip distance (mm) at which the similarity is 0.5
+SIMILARITY_SCALE = 20.0
+
+
+def trajectoryFeatures(poses, tipOffset):
+  """
+  Features (N, 6) of poses (N, 2, 4, 4): the left and right blade tip positions.
+  """
+  return tipPositions(poses, tipOffset).reshape(len(poses), -1)
+
+
+class StreamingDTW:
+  """
+  Open-end dynamic time warping of a growing query against a fixed reference (M, D).
+  Row i of the accumulated cost is only kept for the reference samples j with
+  |i - j| <= band.
+  """
+
+  def __init__(self, reference, band):
+    self.reference = np.asarray(reference, dtype=float)
+    self.band = int(band)
+    self._offsets = np.arange(-self.band, self.band + 1)
+    self.reset()
+
+  def reset(self):
+    self.index = -1
+    # accumulated cost of the last row, indexed by j - index + band, with a virtual row -1
+    # whose only finite cell is the start (j = -1)
+    self._row = np.full(2 * self.band + 2, np.inf)
+    self._row[self.band] = 0.0
+    # best open-end alignment so far: (mean distance, reference index)
+    self.distance = np.inf
+    self.referenceIndex = 0
+
+  @property
+  def finished(self):
+    # the band has passed the end of the reference
+    return self.index - self.band >= len(self.reference) - 1
+
+  def update(self, feature):
+    """
+    Add a query sample. Returns the mean distance along the best path that ends at this
+    sample (the last finite one once the query is longer than the reference allows).
+    """
+    if self.finished:
+      return self.distance
+    self.index += 1
+    j = self.index + self._offsets
+    valid = (j >= 0) & (j < len(self.reference))
+    cost = np.full(len(j), np.inf)
+    cost[valid] = np.linalg.norm(self.reference[j[valid]] - feature, axis=1)
+    # D[i,j] = cost[j] + min(D[i-1,j-1], D[i-1,j], D[i,j-1]); the dependency along the row
+    # is solved with a prefix sum: D[i,j] = C[j] + min over k <= j of (a[k] - C[k-1])
+    previous = np.where(valid, np.minimum(self._row[:-1], self._row[1:]), np.inf)
+    cumulative = np.cumsum(np.where(valid, cost, 0.0))
+    shifted = np.concatenate([[0.0], cumulative[:-1]])
+    row = cumulative + np.minimum.accumulate(previous - shifted)
+    row[~valid] = np.inf
+    self._row[:-1] = row
+    # normalized by the length of the path (about i + j + 2 steps)
+    normalized = np.where(valid, row / np.maximum(self.index + j + 2, 1), np.inf)
+    best = int(np.argmin(normalized))
+    if np.isfinite(normalized[best]):
+      self.distance = float(normalized[best])
+      self.referenceIndex = int(j[best])
+    return self.distance
+
+
+class ExpertMatcher:
+  """
+  Matches the live motion of a phase against one or more expert recordings. update is
+  called with every frame; the poses are sampled at rate with sample and hold.
+  """
+
+  def __init__(self, references, rate=MATCHING_RATE, band=MATCHING_BAND, tipOffset=(0.0, 0.0, 0.0)):
+    # references: list of feature arrays (M, 6) sampled at rate
+    self.rate = rate
+    self.tipOffset = np.asarray(tipOffset, dtype=float)
+    self.matchers = [StreamingDTW(reference, int(round(band * rate))) for reference in references]
+    self._nextTime = 0.0
+    self._poses = np.zeros((1, 2, 4, 4))
+    self.sampleCount = 0
+
+  @classmethod
+  def fromRecordings(cls, paths, rate=MATCHING_RATE, band=MATCHING_BAND, tipOffset=(0.0, 0.0, 0.0)):
+    references = []
+    for path in paths:
+      reader = TrajectoryReader(path)
+      if len(reader) >= 2:
+        timestamps = np.asarray(reader.timestamps)
+        _, poses = resample(timestamps - timestamps[0], reader.frames['poses'][:, [POSE_LEFT, POSE_RIGHT]].astype(float), rate)
+        references.append(trajectoryFeatures(poses, tipOffset))
+      reader.close()
+    return cls(references, rate, band, tipOffset)
+
+  def __len__(self):
+    return len(self.matchers)
+
+  def update(self, time, leftPose, rightPose):
+    """
+    time: s since the start of the phase. Returns True if a sample was added.
+    """
+    if not self.matchers or time < self._nextTime:
+      return False
+    self._poses[0, 0] = leftPose
+    self._poses[0, 1] = rightPose
+    feature = trajectoryFeatures(self._poses, self.tipOffset)[0]
+    # a late frame stands for all the samples it covers
+    while self._nextTime <= time:
+      for matcher in self.matchers:
+        matcher.update(feature)
+      self._nextTime += 1.0 / self.rate
+      self.sampleCount += 1
+    return True
+
+  @property
+  def bestMatcher(self):
+    return min(self.matchers, key=lambda matcher: matcher.distance) if self.matchers else None
+
+  @property
+  def distance(self):
+    """
+    Mean blade tip distance (mm) to the closest expert along the warping path.
+    """
+    matcher = self.bestMatcher
+    return matcher.distance if matcher is not None else np.inf
+
+  @property
+  def similarity(self):
+    """
+    Similarity to the closest expert, from 1 (same motion) towards 0.
+    """
+    return SIMILARITY_SCALE / (SIMILARITY_SCALE + self.distance)
+
+  @property
+  def progress(self):
+    """
+    Fraction of the closest expert trajectory that the trainee has gone through.
+    """
+    matcher = self.bestMatcher
+    if matcher is None or not len(matcher.reference):
+      return 0.0
+    return (matcher.referenceIndex + 1) / len(matcher.reference)
@@ -0,0 +1,67 @@
+import vtk
+import slicer
+
+from .TrajectoryFile import TrajectoryReader, POSE_LEFT, POSE_RIGHT
+from .SharedGeometry import attachToTransform, getAttachedTransformID
+
+#
+# Trajectory playback
+#
+
+class TrajectoryPlayback:
+  """
+  Replays a recorded trajectory on the forceps models for debriefing. The models are
+  moved to two playback transforms that share the parent of the controller transforms,
+  so that the recorded controller poses end up at the same place in the scene. Seeking
+  only updates the matrices of these transforms in place.
+  """
+
+  def __init__(self, path, modelNodes, parentTransformID=None):
+    # modelNodes: [left forceps model, right forceps model]
+    self.reader = TrajectoryReader(path)
+    self.modelNodes = modelNodes
+    self.frameIndex = None
+    self._matrix = vtk.vtkMatrix4x4()
+    self._previousTransformIDs = [getAttachedTransformID(modelNode) for modelNode in modelNodes]
+    self.transformNodes = []
+    for name in ['ForcepsLeftPlaybackTransform', 'ForcepsRightPlaybackTransform']:
+      transformNode = slicer.mrmlScene.GetFirstNodeByName(name)
+      if transformNode is None:
+        transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode', name)
+        transformNode.SetHideFromEditors(True)
+      transformNode.SetAndObserveTransformNodeID(parentTransformID)
+      self.transformNodes.append(transformNode)
+    for modelNode, transformNode in zip(self.modelNodes, self.transformNodes):
+      attachToTransform(modelNode, transformNode.GetID())
+
+  @property
+  def startTime(self):
+    return self.reader.startTime
+
+  @property
+  def duration(self):
+    return self.reader.duration
+
+  def seek(self, time):
+    """
+    Show the frame recorded at the given time (s since the start of the recording).
+    Nothing is modified if that frame is already shown.
+    """
+    if not len(self.reader):
+      return
+    frameIndex = self.reader.frameIndex(self.reader.startTime + time)
+    if frameIndex == self.frameIndex:
+      return
+    self.frameIndex = frameIndex
+    poses = self.reader.poses(frameIndex)
+    for poseIndex, transformNode in zip([POSE_LEFT, POSE_RIGHT], self.transformNodes):
+      self._matrix.DeepCopy(poses[poseIndex].ravel().tolist())
+      transformNode.SetMatrixTransformToParent(self._matrix)
+
+  def stop(self):
+    """
+    Give the forceps models back to the transforms they had before the playback.
+    """
+    for modelNode, transformID in zip(self.modelNodes, self._previousTransformIDs):
+      attachToTransform(modelNode, transformID)
+    self.reader.close()
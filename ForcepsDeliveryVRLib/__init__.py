@@ -0,0 +1,33 @@
+# Modules that need the Slicer/VTK runtime (e.g. TextOverlay, TrajectoryPlayback) are not
+# imported here, so that the scoring code can also be used outside Slicer.
+
+import importlib
+
+from .PoseFilter import (
+  FILTER_NONE, FILTER_ONE_EURO, FILTER_KALMAN, FILTER_METHODS,
+  OneEuroFilter, KalmanFilter, PoseFilter, updateArrayFromVTKMatrix)
+from .EvaluationScheduler import EvaluationScheduler
+from .ScoringPipeline import PoseSnapshot, ScoringResult, ScoringWorker
+from .ObserverManager import ObserverManager
+from .SessionDatabase import SessionDatabase
+from .TrajectoryFile import TrajectoryWriter, TrajectoryReader, writeTrajectory
+
+# Tools that the Slicer module does not need at startup (server, benchmarks, offline
+# analytics) are imported on first access to one of their names.
+_LAZY_EXPORTS = {
+  'ScoringServer': ['ScoringServer', 'StationSimulator', 'LatencyStatistics', 'simulateStations'],
+  'TrajectoryGenerator': ['generatePhaseTrajectory', 'generateDataset', 'benchmarkScoring', 'benchmarkFreePractice'],
+  'TrajectoryAnalytics': ['analyzeTrajectory', 'analyzeRecording', 'analyzeArchive', 'dwellHeatmap'],
+  'PoseSource': ['PoseSource', 'SocketPoseSource', 'TrackerSimulator', 'measureSocketPoseSource'],
+  'AssetSync': ['AssetServer', 'AssetClient', 'ContentStore'],
+  }
+_LAZY_MODULES = {name: module for module, names in _LAZY_EXPORTS.items() for name in names}
+
+
+def __getattr__(name):
+  module = _LAZY_MODULES.get(name)
+  if module is None:
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+  value = getattr(importlib.import_module('.' + module, __name__), name)
+  globals()[name] = value
+  return value
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+import numpy as np
+
+from ForcepsDeliveryVRLib.AssetSync import AssetServer, AssetClient, ContentStore, cachedAssetPaths
+
+#
+# Asset distribution on the loopback interface
+#
+# A server shares a few generated files, split in small chunks (some of them shared by
+# two files), and clients sync them into temporary content stores.
+#
+
+CHUNK_SIZE = 4096
+
+
+class AssetSyncTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.root = os.path.join(self.directory, 'Resources')
+    rng = np.random.default_rng(0)
+    shared = rng.bytes(3 * CHUNK_SIZE)
+    self.assets = {
+      'Models/MotherModel.stl': rng.bytes(5 * CHUNK_SIZE + 123),
+      'Models/BabyHeadModel.stl': shared + rng.bytes(1000),
+      'Models/Texts/arrangement.stl': shared + rng.bytes(2 * CHUNK_SIZE),
+      'Models/Empty.stl': b'',
+      }
+    for name, data in self.assets.items():
+      path = os.path.join(self.root, name)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      with open(path, 'wb') as f:
+        f.write(data)
+    self.server = AssetServer(self.root, address=('127.0.0.1', 0), chunkSize=CHUNK_SIZE)
+    self.server.start()
+
+  def tearDown(self):
+    self.server.stop()
+    shutil.rmtree(self.directory)
+
+  def sync(self, store):
+    return AssetClient(self.server.address, store).sync()
+
+  def assertAssets(self, paths):
+    self.assertEqual(sorted(paths), sorted(self.assets))
+    for name, path in paths.items():
+      with open(path, 'rb') as f:
+        self.assertEqual(f.read(), self.assets[name], name)
+
+  def test_syncAndRejoin(self):
+    store = ContentStore(os.path.join(self.directory, 'cache'))
+    paths, statistics = self.sync(store)
+    self.assertAssets(paths)
+    # the shared chunks are transferred once
+    uniqueChunks = len({hashlib.sha256(data[offset:offset + CHUNK_SIZE]).digest()
+      for data in self.assets.values() for offset in range(0, len(data), CHUNK_SIZE)})
+    self.assertEqual(statistics['missingChunks'], uniqueChunks)
+    self.assertEqual(self.server.sentChunks, uniqueChunks)
+    # a rejoining device only gets the manifest
+    paths, statistics = self.sync(ContentStore(store.directory))
+    self.assertAssets(paths)
+    self.assertEqual(statistics['missingChunks'], 0)
+    self.assertEqual(self.server.sentChunks, uniqueChunks)
+    self.assertAssets(cachedAssetPaths(ContentStore(store.directory)))
+
+  def test_rejoinWithChunksOnly(self):
+    # the assembled files are gone, but not the chunks: no chunk is transferred
+    store = ContentStore(os.path.join(self.directory, 'cache'))
+    self.sync(store)
+    sentChunks = self.server.sentChunks
+    shutil.rmtree(os.path.join(store.directory, 'files'))
+    paths, statistics = self.sync(ContentStore(store.directory))
+    self.assertAssets(paths)
+    self.assertGreater(statistics['chunks'], 0)
+    self.assertEqual(statistics['missingChunks'], 0)
+    self.assertEqual(self.server.sentChunks, sentChunks)
+
+  def test_corruptedChunk(self):
+    store = ContentStore(os.path.join(self.directory, 'cache'))
+    data = self.assets['Models/MotherModel.stl'][:CHUNK_SIZE]
+    digest = hashlib.sha256(data).digest()
+    corrupted = bytearray(data)
+    corrupted[0] ^= 0xff
+    with self.assertRaises(ValueError):
+      store.writeChunk(digest, zlib.compress(bytes(corrupted)))
+    self.assertFalse(store.hasChunk(digest))
+    store.writeChunk(digest, zlib.compress(data))
+    self.assertEqual(store.readChunk(digest), data)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+from ForcepsDeliveryVRLib.FrameGovernor import FrameGovernor, QUALITY_TIERS, DOWN_FRAMES, UP_FRAMES, MAX_UP_FRAMES
+
+#
+# Frame budget governor
+#
+# Evaluation times over the budget and well under its headroom are fed frame by frame,
+# and the frames until the tier changes are counted. The mean time follows them within
+# about ten frames.
+#
+
+BUDGET = 0.001
+SLOW = 2 * BUDGET
+FAST = 0.1 * BUDGET
+
+
+def framesUntilChange(governor, elapsed, limit=10 * MAX_UP_FRAMES):
+  # frames of the given evaluation time until the tier changes (None if it does not)
+  for frame in range(1, limit + 1):
+    if governor.endFrame(elapsed):
+      return frame
+  return None
+
+
+class FrameGovernorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.governor = FrameGovernor(budget=BUDGET)
+
+  def test_stepsDownWhenOverBudget(self):
+    for tierIndex in range(1, len(QUALITY_TIERS)):
+      frames = framesUntilChange(self.governor, SLOW)
+      # the mean time needs a few frames to go over the budget at first
+      self.assertLessEqual(frames, DOWN_FRAMES + 10)
+      self.assertGreaterEqual(frames, DOWN_FRAMES)
+      self.assertEqual(self.governor.tierIndex, tierIndex)
+    # no tier below the last one
+    self.assertIsNone(framesUntilChange(self.governor, SLOW, limit=10 * DOWN_FRAMES))
+    self.assertIs(self.governor.tier, QUALITY_TIERS[-1])
+    self.assertEqual(self.governor.tierChanges, len(QUALITY_TIERS) - 1)
+
+  def test_noChangeWithinTheBudget(self):
+    # between the headroom and the budget, nothing changes
+    self.assertIsNone(framesUntilChange(self.governor, 0.8 * BUDGET, limit=2 * UP_FRAMES))
+    self.governor.tierIndex = 2
+    self.assertIsNone(framesUntilChange(self.governor, 0.8 * BUDGET, limit=2 * UP_FRAMES))
+    # with headroom, the top tier stays
+    self.governor.reset()
+    self.assertIsNone(framesUntilChange(self.governor, FAST, limit=2 * UP_FRAMES))
+
+  def test_stepsUpWithHeadroom(self):
+    framesUntilChange(self.governor, SLOW)
+    frames = framesUntilChange(self.governor, FAST)
+    # the mean time needs a few frames to go under the headroom
+    self.assertLessEqual(frames, UP_FRAMES + 20)
+    self.assertGreaterEqual(frames, UP_FRAMES)
+    self.assertEqual(self.governor.tierIndex, 0)
+
+  def test_undoneStepUpDoublesTheWait(self):
+    framesUntilChange(self.governor, SLOW)
+    waits = []
+    for attempt in range(5):
+      waits.append(framesUntilChange(self.governor, FAST))
+      # the step up is too much: back down
+      framesUntilChange(self.governor, SLOW)
+    expected = [min(UP_FRAMES * 2 ** attempt, MAX_UP_FRAMES) for attempt in range(5)]
+    for wait, required in zip(waits, expected):
+      self.assertGreaterEqual(wait, required)
+      self.assertLessEqual(wait, required + 40)
+    self.assertEqual(expected[-1], MAX_UP_FRAMES)
+
+  def test_shouldRun(self):
+    runs = {interval: [] for interval in [0, 1, 2, 3]}
+    for frame in range(12):
+      for interval in runs:
+        runs[interval].append(self.governor.shouldRun(interval))
+      self.governor.endFrame(FAST)
+    self.assertEqual(runs[0], [False] * 12)
+    self.assertEqual(runs[1], [True] * 12)
+    self.assertEqual(runs[2], [True, False] * 6)
+    self.assertEqual(runs[3], [True, False, False] * 4)
+
+  def test_reset(self):
+    framesUntilChange(self.governor, SLOW)
+    framesUntilChange(self.governor, FAST)
+    framesUntilChange(self.governor, SLOW)
+    self.governor.reset()
+    self.assertEqual((self.governor.tierIndex, self.governor.frame, self.governor.tierChanges), (0, 0, 0))
+    self.assertEqual(self.governor.meanTime, 0.0)
+    # the wait to step up is back to its initial length
+    framesUntilChange(self.governor, SLOW)
+    self.assertLessEqual(framesUntilChange(self.governor, FAST), UP_FRAMES + 20)
+
+
+if __name__ == '__main__':
+  unittest.main()
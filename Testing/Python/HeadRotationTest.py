@@ -0,0 +1,143 @@
+import unittest
+import numpy as np
+
+from ForcepsDeliveryVRLib import Scoring
+from ForcepsDeliveryVRLib.HeadRotation import (
+  HeadRotation, rotationAbout, rotatedHead, ROTATION_LIMITS, ROTATION_SLIPPAGE, MAX_ROTATION_SPEED,
+  LOCK_RELEASE_DISTANCE)
+from ForcepsDeliveryVRLib.TrajectoryGenerator import PLACEMENT_TARGETS
+
+#
+# Kielland rotation of the fetal head
+#
+# The forceps are locked in their final placement on the default head, then turned
+# together about the pelvic axis at the head, as in the rotation phase of the synthetic
+# trajectories.
+#
+
+HEAD = Scoring.DEFAULT_HEAD_LANDMARKS
+
+
+def placedPose(phase, rotation=None):
+  # blade vertical at the target of the final placement phase, turned by rotation (4x4)
+  pose = np.eye(4)
+  pose[:3, 3] = PLACEMENT_TARGETS[phase]
+  return pose if rotation is None else rotation.dot(pose)
+
+
+class HeadRotationTest(unittest.TestCase):
+
+  def setUp(self):
+    arcLength, self.point, self.tangent, distance = HEAD.pelvicAxis.project(HEAD.center)
+    self.headRotation = HeadRotation()
+    self.headRotation.reset(HEAD)
+
+  def lockedPoses(self, twist=0.0):
+    # poses of both blades locked on the head, turned by twist (degrees) about the axis
+    rotation = rotationAbout(self.point, self.tangent, twist)
+    return (placedPose(Scoring.PHASE_FINAL_PLACEMENT_LEFT, rotation),
+            placedPose(Scoring.PHASE_FINAL_PLACEMENT_RIGHT, rotation))
+
+  def lock(self):
+    self.assertFalse(self.headRotation.update(*self.lockedPoses(), timestamp=0.0))
+    self.assertTrue(self.headRotation.locked)
+
+  def test_rotationAbout(self):
+    rng = np.random.default_rng(0)
+    for index in range(20):
+      point = rng.uniform(-100.0, 100.0, 3)
+      direction = rng.normal(size=3)
+      direction /= np.linalg.norm(direction)
+      angle = rng.uniform(-180.0, 180.0)
+      matrix = rotationAbout(point, direction, angle)
+      rotation = matrix[:3, :3]
+      np.testing.assert_allclose(rotation.dot(rotation.T), np.eye(3), atol=1e-12)
+      self.assertAlmostEqual(np.linalg.det(rotation), 1.0)
+      # the axis does not move
+      np.testing.assert_allclose(matrix.dot(np.append(point + 10.0 * direction, 1.0))[:3], point + 10.0 * direction,
+        atol=1e-9)
+      # a vector orthogonal to it turns by the angle, counterclockwise about the direction
+      orthogonal = np.cross(direction, rng.normal(size=3))
+      orthogonal /= np.linalg.norm(orthogonal)
+      turned = rotation.dot(orthogonal)
+      self.assertAlmostEqual(np.degrees(np.arctan2(np.cross(orthogonal, turned).dot(direction), orthogonal.dot(turned))),
+        angle)
+    out = np.eye(4)
+    self.assertIs(rotationAbout(point, direction, angle, out=out), out)
+    np.testing.assert_allclose(out, matrix)
+
+  def test_rotatedHead(self):
+    rotated = rotatedHead(HEAD, 40.0)
+    self.assertEqual(rotated.rotation, HEAD.rotation + 40.0)
+    # the pelvic axis belongs to the mother
+    self.assertIs(rotated.pelvicAxis, HEAD.pelvicAxis)
+    matrix = rotationAbout(self.point, self.tangent, 40.0)
+    for side in [Scoring.LEFT, Scoring.RIGHT]:
+      np.testing.assert_allclose(rotated.eyes[side], matrix[:3, :3].dot(HEAD.eyes[side]) + matrix[:3, 3], atol=1e-9)
+    self.assertEqual(rotatedHead(rotated, -40.0).rotation, 0.0)
+
+  def test_noRotationWithoutLock(self):
+    # the right blade is not placed: the forceps are not locked and do not turn the head
+    leftPose, rightPose = self.lockedPoses()
+    rightPose[:3, 3] = [-150.0, -100.0, 0.0]
+    for frame in range(10):
+      self.assertFalse(self.headRotation.update(leftPose, rightPose, frame / 90.0))
+    self.assertFalse(self.headRotation.locked)
+    self.lock()
+    # once locked the head follows, without the lock it does not
+    self.headRotation.reset(HEAD)
+    self.assertFalse(self.headRotation.update(*self.lockedPoses(20.0), timestamp=0.0))
+    self.assertFalse(self.headRotation.update(*self.lockedPoses(40.0), timestamp=1.0))
+    self.assertEqual(self.headRotation.angle, 0.0)
+
+  def test_rotationFollowsTheTwist(self):
+    poseToWorld = np.eye(4)
+    poseToWorld[:3, :3] = [[0.0, -1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]]
+    poseToWorld[:3, 3] = [10.0, 20.0, 30.0]
+    self.headRotation.reset(HEAD, poseToWorld)
+    self.lock()
+    self.assertTrue(self.headRotation.update(*self.lockedPoses(20.0), timestamp=1.0))
+    angle = (1 - ROTATION_SLIPPAGE) * 20.0
+    self.assertAlmostEqual(self.headRotation.angle, angle)
+    matrix = rotationAbout(self.point, self.tangent, angle)
+    np.testing.assert_allclose(self.headRotation.matrix, matrix, atol=1e-12)
+    np.testing.assert_allclose(self.headRotation.worldMatrix, poseToWorld.dot(matrix).dot(np.linalg.inv(poseToWorld)),
+      atol=1e-9)
+    self.assertEqual(self.headRotation.rotatedHead().rotation, angle)
+    # no change of the twist, no motion
+    self.assertFalse(self.headRotation.update(*self.lockedPoses(20.0), timestamp=2.0))
+    # and back
+    self.assertTrue(self.headRotation.update(*self.lockedPoses(0.0), timestamp=3.0))
+    self.assertAlmostEqual(self.headRotation.angle, 0.0)
+
+  def test_speedIsLimited(self):
+    self.lock()
+    self.headRotation.update(*self.lockedPoses(90.0), timestamp=0.1)
+    self.assertAlmostEqual(self.headRotation.angle, 0.1 * MAX_ROTATION_SPEED)
+    self.headRotation.update(*self.lockedPoses(90.0), timestamp=0.2)
+    self.assertAlmostEqual(self.headRotation.angle, 0.2 * MAX_ROTATION_SPEED)
+    # frames going back in time do not move the head
+    self.assertFalse(self.headRotation.update(*self.lockedPoses(90.0), timestamp=0.1))
+
+  def test_rotationIsClamped(self):
+    self.lock()
+    self.headRotation.update(*self.lockedPoses(170.0), timestamp=10.0)
+    self.assertAlmostEqual(self.headRotation.angle, ROTATION_LIMITS[1])
+    self.headRotation.update(*self.lockedPoses(-60.0), timestamp=20.0)
+    self.assertAlmostEqual(self.headRotation.angle, ROTATION_LIMITS[0])
+
+  def test_releasedWhenPulledApart(self):
+    self.lock()
+    self.headRotation.update(*self.lockedPoses(20.0), timestamp=1.0)
+    angle = self.headRotation.angle
+    leftPose, rightPose = self.lockedPoses(40.0)
+    # the right blade moves away from the left one, along the line between the tips
+    tips = leftPose[:3, :3].dot(Scoring.BLADE_TIP) + leftPose[:3, 3] - rightPose[:3, :3].dot(Scoring.BLADE_TIP) - rightPose[:3, 3]
+    rightPose[:3, 3] -= 1.5 * LOCK_RELEASE_DISTANCE * tips / np.linalg.norm(tips)
+    self.assertFalse(self.headRotation.update(leftPose, rightPose, timestamp=2.0))
+    self.assertFalse(self.headRotation.locked)
+    self.assertEqual(self.headRotation.angle, angle)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import numpy as np
+
+from ForcepsDeliveryVRLib.PelvicAxis import PelvicAxis, carusArc, findOutlet, CARUS_RADIUS, CARUS_ANGLE
+
+#
+# Pelvic axis lookup table
+#
+# The axis is the curve of Carus, an arc of a circle. Projections through the closest
+# sample grid are compared with the projection on the arc itself and with the brute-force
+# projection on the tabulated polyline, in the frame of the axis and in a transformed frame.
+#
+
+OUTLET = np.array([0.0, 0.0, -20.0])
+OUTWARD = np.array([0.0, 0.0, 1.0])
+ANTERIOR = np.array([0.0, -1.0, 0.0])
+
+
+def bruteForceProjection(axis, positions):
+  # arc length and distance of the closest point of every segment of the axis polyline to
+  # each position (N, 3)
+  points, arcLength = axis._tables.points, axis._tables.arcLength
+  segments = np.diff(points, axis=0)
+  u = np.clip(np.einsum('nmk,mk->nm', positions[:, np.newaxis] - points[:-1], segments)
+    / np.einsum('mk,mk->m', segments, segments), 0.0, 1.0)
+  closest = points[:-1] + u[..., np.newaxis] * segments
+  distances = np.linalg.norm(positions[:, np.newaxis] - closest, axis=2)
+  best = np.argmin(distances, axis=1)
+  index = np.arange(len(positions))
+  return arcLength[best] + u[index, best] * np.diff(arcLength)[best], distances[index, best]
+
+
+class PelvicAxisTest(unittest.TestCase):
+
+  def setUp(self):
+    self.controlPoints = carusArc(OUTLET, OUTWARD, ANTERIOR)
+    self.axis = PelvicAxis(self.controlPoints)
+    self.axis.prepare()
+    # center of the arc: the control points are at CARUS_RADIUS from it
+    halfAngle = np.radians(CARUS_ANGLE) / 2
+    self.center = OUTLET + CARUS_RADIUS * (np.cos(halfAngle) * ANTERIOR - np.sin(halfAngle) * OUTWARD)
+
+  def test_carusArc(self):
+    np.testing.assert_allclose(self.controlPoints[-1], OUTLET)
+    np.testing.assert_allclose(np.linalg.norm(self.controlPoints - self.center, axis=1), CARUS_RADIUS)
+    # the chord goes outwards, from the inlet to the outlet
+    chord = self.controlPoints[-1] - self.controlPoints[0]
+    np.testing.assert_allclose(chord / np.linalg.norm(chord), OUTWARD, atol=1e-12)
+    self.assertAlmostEqual(self.axis.length, CARUS_RADIUS * np.radians(CARUS_ANGLE), delta=0.5)
+
+  def test_pointsOfTheArc(self):
+    # points of the arc and points moved off it, towards its center
+    arcLength = np.linspace(5.0, self.axis.length - 5.0, 20)
+    for offset in [0.0, 10.0]:
+      with self.subTest(offset=offset):
+        for length in arcLength:
+          point, tangent = self.axis.pointAt(length)
+          self.assertAlmostEqual(np.linalg.norm(tangent), 1.0)
+          position = point + offset * (self.center - point) / np.linalg.norm(self.center - point)
+          projectedLength, projected, projectedTangent, distance = self.axis.project(position)
+          expectedLength, expectedDistance = bruteForceProjection(self.axis, position[np.newaxis])
+          self.assertAlmostEqual(projectedLength, expectedLength[0])
+          self.assertAlmostEqual(distance, expectedDistance[0])
+          # inside the arc the spline bends slightly more than the circle: the closest point
+          # is less sharply defined there
+          self.assertAlmostEqual(projectedLength, length, delta=0.05 if offset == 0.0 else 1.0)
+          self.assertAlmostEqual(distance, offset, delta=0.05)
+          np.testing.assert_allclose(projectedTangent, tangent, atol=0.01)
+
+  def test_tangentsGoOutwards(self):
+    arcLength, point, tangent, distance = self.axis.project(OUTLET)
+    self.assertAlmostEqual(arcLength, self.axis.length, delta=0.05)
+    self.assertGreater(tangent.dot(OUTWARD), 0.0)
+
+  def test_batchMatchesBruteForce(self):
+    rng = np.random.default_rng(0)
+    # inside the grid, and far away from the axis (outside of it)
+    positions = np.concatenate([
+      self.center + rng.uniform(-80.0, 80.0, (2000, 3)),
+      self.center + rng.uniform(-400.0, 400.0, (200, 3))])
+    arcLength, points, tangents, distances = self.axis.projectBatch(positions)
+    expectedLength, expectedDistances = bruteForceProjection(self.axis, positions)
+    np.testing.assert_allclose(np.linalg.norm(positions - points, axis=1), distances, atol=1e-9)
+    # beyond the center, both ends of the arc are about as close: the voxel of a point decides
+    # between them, which is off by its diagonal at most
+    self.assertTrue(np.all(distances >= expectedDistances - 1e-9))
+    np.testing.assert_allclose(distances, expectedDistances, atol=self.axis.voxelSize * np.sqrt(3))
+    # away from the ends, and closer to the arc than to its center, the closest point is unique
+    unique = ((expectedLength > 1.0) & (expectedLength < self.axis.length - 1.0)
+      & (expectedDistances < np.linalg.norm(positions - self.center, axis=1)))
+    self.assertGreater(np.count_nonzero(unique), 100)
+    np.testing.assert_allclose(distances[unique], expectedDistances[unique], atol=1e-9)
+    np.testing.assert_allclose(arcLength[unique], expectedLength[unique], atol=1e-9)
+    for index in range(0, len(positions), 50):
+      single = self.axis.project(positions[index])
+      self.assertAlmostEqual(single[0], arcLength[index])
+      np.testing.assert_allclose(single[1], points[index], atol=1e-9)
+      np.testing.assert_allclose(single[2], tangents[index], atol=1e-9)
+      self.assertAlmostEqual(single[3], distances[index])
+
+  def test_transformed(self):
+    # a rigid transform moves the projections with the points and keeps the arc lengths
+    rotation = np.array([[0.0, -1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]])
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation
+    matrix[:3, 3] = [100.0, -50.0, 25.0]
+    transformedAxis = self.axis.transformed(matrix)
+    rng = np.random.default_rng(1)
+    positions = self.center + rng.uniform(-60.0, 60.0, (100, 3))
+    arcLength, points, tangents, distances = self.axis.projectBatch(positions)
+    moved = transformedAxis.projectBatch(positions.dot(rotation.T) + matrix[:3, 3])
+    np.testing.assert_allclose(moved[0], arcLength, atol=1e-9)
+    np.testing.assert_allclose(moved[1], points.dot(rotation.T) + matrix[:3, 3], atol=1e-9)
+    np.testing.assert_allclose(moved[2], tangents.dot(rotation.T), atol=1e-9)
+    np.testing.assert_allclose(moved[3], distances, atol=1e-9)
+
+  def test_findOutlet(self):
+    # a plane of vertices at z = 0 and a body below it: the outlet faces +z
+    x, y = np.meshgrid(np.linspace(-100.0, 100.0, 41), np.linspace(-100.0, 100.0, 41))
+    surface = np.stack([x.ravel(), y.ravel(), np.zeros(x.size)], axis=1)
+    body = np.array([[0.0, 0.0, -300.0]] * 100)
+    center, normal = findOutlet(np.concatenate([surface, body]), [10.0, 5.0, -20.0], 40.0)
+    np.testing.assert_allclose(normal, [0.0, 0.0, 1.0], atol=1e-9)
+    np.testing.assert_allclose(center, [10.0, 5.0, 0.0], atol=1e-9)
+    self.assertIsNone(findOutlet(surface, [0.0, 0.0, 500.0], 40.0))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from ForcepsDeliveryVRLib import Scoring
+from ForcepsDeliveryVRLib.PlacementGrid import PlacementGrids, PlacementGridBake, PHASE_SIDES
+from ForcepsDeliveryVRLib.TrajectoryGenerator import generatePhaseTrajectory, PHASE_SCENARIOS
+
+#
+# Placement lookup grids against the analytic checks
+#
+# The grids are baked with the distance to the head sphere, as in the module, so that they
+# can replace the analytic checks (and the analytic checks can stand in for them while
+# they are baked) without changing the results. Grids are decided at voxel centers.
+#
+
+VOXEL_SIZE = 2.0
+
+
+class PlacementGridTest(unittest.TestCase):
+
+  def setUp(self):
+    self.head = Scoring.DEFAULT_HEAD_LANDMARKS
+    self.margins = Scoring.DEFAULT_MARGINS
+    self.grids = PlacementGrids(self.head, voxelSize=VOXEL_SIZE)
+    for phase in Scoring.PLACEMENT_PHASES:
+      self.grids.prepare(phase, self.margins[phase])
+
+  def analyticCode(self, phase, leftPose, rightPose):
+    res, message = Scoring.evaluatePhase(phase, leftPose, rightPose, self.margins[phase], self.head)
+    return Scoring.MESSAGE_CODES[message]
+
+  def test_voxelCenters(self):
+    # vertical blades with the tip at random voxel centers: the same code as the analytic check
+    rng = np.random.default_rng(0)
+    for phase in Scoring.PLACEMENT_PHASES:
+      grid = self.grids.grids[phase]
+      side = PHASE_SIDES[phase]
+      codes = set()
+      with self.subTest(phase=phase):
+        for voxel in rng.integers(0, grid.shape, size=(500, 3)):
+          pose = np.eye(4)
+          pose[:3, 3] = grid.origin + (voxel + 0.5) * grid.voxelSize - Scoring.FORCEPS_GEOMETRY[side][:3, Scoring.GEOMETRY_TIP]
+          res, code = self.grids.check(phase, pose, pose, self.margins[phase], self.head)
+          self.assertEqual(code, self.analyticCode(phase, pose, pose))
+          self.assertEqual(res, code == Scoring.MESSAGE_CORRECT)
+          codes.add(code)
+        # the sample crosses the boundaries of the check
+        self.assertGreater(len(codes), 1)
+
+  def test_generatedTrajectories(self):
+    # frames that disagree have their tip within half a voxel of a boundary: they agree
+    # once the tip is moved to the center of its voxel
+    for phase in Scoring.PLACEMENT_PHASES:
+      grid = self.grids.grids[phase]
+      side = PHASE_SIDES[phase]
+      for scenario in PHASE_SCENARIOS[phase]:
+        with self.subTest(phase=phase, scenario=scenario):
+          trajectory = generatePhaseTrajectory(phase, scenario, frames=180, seed=0)
+          agreeing = 0
+          for leftPose, rightPose in zip(trajectory['left'], trajectory['right']):
+            res, message = self.grids.evaluate(phase, leftPose, rightPose, self.margins[phase], self.head)
+            code = Scoring.MESSAGE_CODES[message]
+            if code == self.analyticCode(phase, leftPose, rightPose):
+              agreeing += 1
+              continue
+            poses = {Scoring.LEFT: leftPose.copy(), Scoring.RIGHT: rightPose.copy()}
+            tip = Scoring.forcepsGeometry(poses[side], side)[:3, Scoring.GEOMETRY_TIP]
+            center = grid.origin + (np.floor((tip - grid.origin) / grid.voxelSize) + 0.5) * grid.voxelSize
+            poses[side][:3, 3] += center - tip
+            self.assertEqual(code, self.analyticCode(phase, poses[Scoring.LEFT], poses[Scoring.RIGHT]))
+          self.assertGreater(agreeing / len(trajectory['left']), 0.9)
+
+  def test_otherMarginUsesAnalyticChecks(self):
+    phase = Scoring.PHASE_INITIAL_PLACEMENT_LEFT
+    margin = [5, 5]
+    pose = np.eye(4)
+    self.assertIsNone(self.grids.check(phase, pose, pose, margin, self.head))
+    self.assertEqual(self.grids.evaluate(phase, pose, pose, margin, self.head),
+      Scoring.evaluatePhase(phase, pose, pose, margin, self.head))
+
+  def test_backgroundBake(self):
+    directory = tempfile.mkdtemp()
+    try:
+      margins = {phase: self.margins[phase] for phase in Scoring.PLACEMENT_PHASES}
+      bake = PlacementGridBake(PlacementGrids(self.head, directory, VOXEL_SIZE), margins)
+      self.assertFalse(bake.ready)
+      bake.start()
+      bake.join()
+      self.assertTrue(bake.ready)
+      self.assertGreater(bake.bakeTime, 0.0)
+      self.assertEqual(sorted(bake.placementGrids.grids), sorted(margins))
+      self.assertEqual(len(os.listdir(directory)), len(margins))
+      # the second bake loads the cached grids
+      cached = PlacementGridBake(PlacementGrids(self.head, directory, VOXEL_SIZE), margins)
+      cached.start()
+      cached.join()
+      self.assertTrue(cached.ready)
+      for phase in margins:
+        np.testing.assert_array_equal(cached.placementGrids.grids[phase].planes, bake.placementGrids.grids[phase].planes)
+    finally:
+      shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+  unittest.main()
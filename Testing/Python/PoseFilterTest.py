@@ -0,0 +1,119 @@
+import unittest
+import numpy as np
+
+from ForcepsDeliveryVRLib.PoseFilter import (
+  PoseFilter, OneEuroFilter, KalmanFilter, FILTER_NONE, FILTER_ONE_EURO, FILTER_KALMAN,
+  quaternionFromRotation, rotationFromQuaternion)
+
+#
+# Pose filtering of the controller poses
+#
+# Poses are sampled at 90 Hz, as from the headset: a static pose with jitter, a
+# translation at constant velocity and a rotation that comes to rest.
+#
+
+RATE = 90.0
+FRAMES = 270
+
+
+def rotationZ(angle):
+  # 3x3 rotation by angle (radians) about z
+  c, s = np.cos(angle), np.sin(angle)
+  return np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]])
+
+
+class PoseFilterTest(unittest.TestCase):
+
+  def test_noFilter(self):
+    poseFilter = PoseFilter(FILTER_NONE)
+    pose = np.eye(4)
+    pose[:3, 3] = [1.0, 2.0, 3.0]
+    np.testing.assert_array_equal(poseFilter.update(pose, 0.0), pose)
+
+  def test_jitterIsReduced(self):
+    rng = np.random.default_rng(0)
+    for method in [FILTER_ONE_EURO, FILTER_KALMAN]:
+      with self.subTest(method=method):
+        poseFilter = PoseFilter(method)
+        measured = []
+        filtered = []
+        for frame in range(FRAMES):
+          pose = np.eye(4)
+          pose[:3, 3] = [10.0, 20.0, 30.0] + rng.normal(0.0, 0.5, 3)
+          measured.append(pose[:3, 3])
+          filtered.append(poseFilter.update(pose, frame / RATE)[:3, 3].copy())
+        # after the first second
+        measured = np.array(measured[int(RATE):])
+        filtered = np.array(filtered[int(RATE):])
+        self.assertTrue(np.all(filtered.std(axis=0) < 0.8 * measured.std(axis=0)))
+        np.testing.assert_allclose(filtered.mean(axis=0), [10.0, 20.0, 30.0], atol=0.2)
+
+  def test_kalmanTracksConstantVelocity(self):
+    kalmanFilter = KalmanFilter(3)
+    velocity = np.array([100.0, -50.0, 20.0])
+    for frame in range(FRAMES):
+      value = kalmanFilter.update(velocity * frame / RATE, 1.0 / RATE)
+    np.testing.assert_allclose(value, velocity * (FRAMES - 1) / RATE, atol=0.05)
+    np.testing.assert_allclose(kalmanFilter.velocity, velocity, rtol=0.01)
+
+  def test_oneEuroFollowsAStep(self):
+    oneEuroFilter = OneEuroFilter(3)
+    oneEuroFilter.update(np.zeros(3), 1.0 / RATE)
+    for frame in range(FRAMES):
+      value = oneEuroFilter.update(np.full(3, 10.0), 1.0 / RATE)
+    np.testing.assert_allclose(value, 10.0, atol=0.01)
+
+  def test_predictionOfALinearMotion(self):
+    # with a constant velocity the prediction is ahead of the measurement by velocity * horizon
+    horizon = 0.02
+    velocity = np.array([0.0, 0.0, 200.0])
+    poseFilter = PoseFilter(FILTER_KALMAN, predictionHorizon=horizon)
+    for frame in range(FRAMES):
+      pose = np.eye(4)
+      pose[:3, 3] = velocity * frame / RATE
+      output = poseFilter.update(pose, frame / RATE)
+    np.testing.assert_allclose(output[:3, 3], pose[:3, 3] + velocity * horizon, atol=0.1)
+
+  def test_rotation(self):
+    # the filtered rotation stays orthonormal, keeps the scale of the pose and converges
+    # to a constant rotation
+    scale = 2.0
+    for method in [FILTER_ONE_EURO, FILTER_KALMAN]:
+      with self.subTest(method=method):
+        poseFilter = PoseFilter(method)
+        for frame in range(FRAMES):
+          pose = np.eye(4)
+          pose[:3, :3] = scale * rotationZ(min(frame, RATE) / RATE)
+          output = poseFilter.update(pose, frame / RATE)
+        rotation = output[:3, :3] / scale
+        np.testing.assert_allclose(rotation.dot(rotation.T), np.eye(3), atol=1e-9)
+        np.testing.assert_allclose(output[:3, :3], pose[:3, :3], atol=1e-3)
+
+  def test_outputIsUpdatedInPlace(self):
+    poseFilter = PoseFilter(FILTER_ONE_EURO)
+    output = poseFilter.output
+    self.assertIs(poseFilter.update(np.eye(4), 0.0), output)
+    self.assertIs(poseFilter.update(np.eye(4), 1.0 / RATE), output)
+
+  def test_quaternionRoundTrip(self):
+    rng = np.random.default_rng(0)
+    for index in range(100):
+      # random rotation from the QR decomposition of a random matrix
+      q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+      rotation = q * np.sign(np.diag(r))
+      if np.linalg.det(rotation) < 0:
+        rotation[:, 0] = -rotation[:, 0]
+      quaternion = quaternionFromRotation(rotation, np.zeros(4))
+      self.assertAlmostEqual(np.linalg.norm(quaternion), 1.0)
+      np.testing.assert_allclose(rotationFromQuaternion(quaternion, np.zeros((3, 3))), rotation, atol=1e-9)
+
+  def test_setMethod(self):
+    poseFilter = PoseFilter(FILTER_ONE_EURO)
+    poseFilter.setMethod(FILTER_KALMAN)
+    self.assertEqual(poseFilter.method, FILTER_KALMAN)
+    with self.assertRaises(ValueError):
+      poseFilter.setMethod('Unknown')
+
+
+if __name__ == '__main__':
+  unittest.main()
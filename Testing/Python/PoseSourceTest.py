@@ -0,0 +1,155 @@
+import socket
+import time
+import unittest
+import numpy as np
+
+from ForcepsDeliveryVRLib.PoseSource import (
+  SocketPoseSource, packTransformMessage, crc64, igtlTimestamp, IGTL_HEADER, IGTL_EXTENDED_HEADER, DEVICE_NAMES)
+from ForcepsDeliveryVRLib.TrajectoryFile import POSE_LEFT, POSE_RIGHT, POSE_HMD
+
+#
+# OpenIGTLink pose source
+#
+# A SocketPoseSource connects to a local server socket of the test, which writes TRANSFORM
+# messages, and other messages, in pieces of any size. The source is polled as the module
+# does every frame.
+#
+
+TIMEOUT = 5.0
+BUFFER_SIZE = 1024
+
+
+def randomPose(rng):
+  # rigid pose with a random rotation (from the QR decomposition of a random matrix)
+  q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+  pose = np.eye(4)
+  pose[:3, :3] = q * np.sign(np.diag(r))
+  pose[:3, 3] = rng.uniform(-200.0, 200.0, 3)
+  return pose
+
+
+def otherMessage(messageType, bodySize):
+  # message of another type, with a body of bodySize bytes
+  body = bytes(bodySize)
+  return IGTL_HEADER.pack(1, messageType.ljust(12, b'\0'), b'Image', igtlTimestamp(0.0), bodySize, crc64(body)) + body
+
+
+class PoseSourceTest(unittest.TestCase):
+
+  def setUp(self):
+    self.listener = socket.create_server(('127.0.0.1', 0))
+    self.listener.settimeout(TIMEOUT)
+    self.source = SocketPoseSource(self.listener.getsockname(), bufferSize=BUFFER_SIZE, verifyCRC=True)
+    # the source connects from update
+    self.source.update()
+    self.server, _ = self.listener.accept()
+    self.rng = np.random.default_rng(0)
+
+  def tearDown(self):
+    self.source.close()
+    self.server.close()
+    self.listener.close()
+
+  def poll(self, condition):
+    # update the source until condition() holds; returns whether any update changed the poses
+    updated = False
+    deadline = time.perf_counter() + TIMEOUT
+    while not condition():
+      self.assertLess(time.perf_counter(), deadline)
+      updated |= self.source.update()
+      time.sleep(0.001)
+    return updated
+
+  def send(self, data, messageCount):
+    # send data and wait until the source has counted messageCount transforms in total
+    self.server.sendall(data)
+    return self.poll(lambda: self.source.messageCount == messageCount)
+
+  def test_frame(self):
+    poses = [randomPose(self.rng) for deviceName in DEVICE_NAMES]
+    message = b''.join(bytes(packTransformMessage(deviceName, 1234.5, pose))
+      for deviceName, pose in zip(DEVICE_NAMES, poses))
+    self.assertTrue(self.send(message, 3))
+    self.assertTrue(self.source.connected)
+    for index in [POSE_LEFT, POSE_RIGHT, POSE_HMD]:
+      np.testing.assert_allclose(self.source.poses[index], poses[index], atol=1e-4)
+    self.assertAlmostEqual(self.source.trackerTimestamp, 1234.5)
+    self.assertEqual((self.source.supersededMessageCount, self.source.invalidMessageCount), (0, 0))
+
+  def test_partialMessages(self):
+    message = bytes(packTransformMessage(DEVICE_NAMES[POSE_LEFT], 0.0, randomPose(self.rng)))
+    # a header cut in two, then the body cut in two: no pose until the message is complete
+    cuts = [0, 20, IGTL_HEADER.size, IGTL_HEADER.size + 10]
+    for start, end in zip(cuts[:-1], cuts[1:]):
+      self.server.sendall(message[start:end])
+      self.poll(lambda: self.source.connected)
+      time.sleep(0.01)
+      self.assertFalse(self.source.update())
+      np.testing.assert_array_equal(self.source.poses[POSE_LEFT], np.eye(4))
+    self.assertTrue(self.send(message[cuts[-1]:], 1))
+    # messages in pieces of any size: the last pose of each device is kept
+    poses = [randomPose(self.rng) for index in range(30)]
+    stream = b''.join(bytes(packTransformMessage(DEVICE_NAMES[index % 3], index, pose))
+      for index, pose in enumerate(poses))
+    cuts = np.sort(self.rng.choice(np.arange(1, len(stream)), 20, replace=False))
+    for piece in np.split(np.frombuffer(stream, dtype=np.uint8), cuts):
+      self.server.sendall(piece.tobytes())
+      time.sleep(0.001)
+      self.source.update()
+    self.poll(lambda: self.source.messageCount == 31)
+    for index in [POSE_LEFT, POSE_RIGHT, POSE_HMD]:
+      np.testing.assert_allclose(self.source.poses[index], poses[27 + index], atol=1e-4)
+    self.assertEqual(self.source.invalidMessageCount, 0)
+
+  def test_supersededMessages(self):
+    poses = [randomPose(self.rng) for index in range(3)]
+    message = b''.join(bytes(packTransformMessage(DEVICE_NAMES[POSE_RIGHT], index, pose))
+      for index, pose in enumerate(poses))
+    self.assertTrue(self.send(message, 3))
+    np.testing.assert_allclose(self.source.poses[POSE_RIGHT], poses[-1], atol=1e-4)
+    self.assertEqual(self.source.supersededMessageCount, 2)
+
+  def test_oversizedMessage(self):
+    # a message larger than the buffer is discarded as it arrives, in several reads
+    pose = randomPose(self.rng)
+    stream = (otherMessage(b'IMAGE', 5 * BUFFER_SIZE) + otherMessage(b'STATUS', 30)
+      + bytes(packTransformMessage(DEVICE_NAMES[POSE_HMD], 0.0, pose)))
+    for start in range(0, len(stream), 700):
+      self.server.sendall(stream[start:start + 700])
+      time.sleep(0.001)
+      self.source.update()
+    self.poll(lambda: self.source.messageCount == 1)
+    np.testing.assert_allclose(self.source.poses[POSE_HMD], pose, atol=1e-4)
+    self.assertEqual(self.source.invalidMessageCount, 0)
+
+  def test_otherDevicesAndInvalidMessages(self):
+    pose = randomPose(self.rng)
+    unknown = bytes(packTransformMessage('Stylus', 0.0, pose))
+    corrupted = bytearray(packTransformMessage(DEVICE_NAMES[POSE_LEFT], 0.0, pose))
+    corrupted[-1] ^= 0xFF
+    self.send(unknown + bytes(corrupted), 2)
+    self.assertEqual(self.source.invalidMessageCount, 1)
+    np.testing.assert_array_equal(self.source.poses, np.tile(np.eye(4), (3, 1, 1)))
+    # version 2: the body starts with an extended header
+    extendedHeader = IGTL_EXTENDED_HEADER.pack(IGTL_EXTENDED_HEADER.size, 0, 0, 0)
+    transform = bytes(packTransformMessage(DEVICE_NAMES[POSE_LEFT], 0.0, pose))[IGTL_HEADER.size:]
+    body = extendedHeader + transform
+    header = IGTL_HEADER.pack(2, b'TRANSFORM'.ljust(12, b'\0'), DEVICE_NAMES[POSE_LEFT].encode('ascii'),
+      igtlTimestamp(0.0), len(body), crc64(body))
+    self.assertTrue(self.send(header + body, 3))
+    np.testing.assert_allclose(self.source.poses[POSE_LEFT], pose, atol=1e-4)
+
+  def test_reconnects(self):
+    self.server.close()
+    self.poll(lambda: self.source.sock is None)
+    self.assertFalse(self.source.connected)
+    # the next attempt waits for RECONNECT_INTERVAL
+    self.poll(lambda: self.source.sock is not None)
+    self.server, _ = self.listener.accept()
+    pose = randomPose(self.rng)
+    self.assertTrue(self.send(bytes(packTransformMessage(DEVICE_NAMES[POSE_LEFT], 0.0, pose)), 1))
+    np.testing.assert_allclose(self.source.poses[POSE_LEFT], pose, atol=1e-4)
+
+
+if __name__ == '__main__':
+  unittest.main()
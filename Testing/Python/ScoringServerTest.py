@@ -0,0 +1,122 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+import numpy as np
+
+from ForcepsDeliveryVRLib import Scoring
+from ForcepsDeliveryVRLib.PoseFilter import FILTER_NONE
+from ForcepsDeliveryVRLib.ScoringServer import (
+  ScoringServer, simulateStations, packPoseMessage, unpackResultMessage, POSE_HEADER, RESULT_MESSAGE)
+from ForcepsDeliveryVRLib.TrajectoryGenerator import generatePhaseTrajectory, SCENARIO_CORRECT
+
+#
+# Scoring server on the loopback interface
+#
+# Simulated stations stream a generated placement trajectory (the approach fails the
+# check, the hold passes it) to a server without pose filtering, so that every result
+# can be compared with a direct Scoring.evaluatePhase call on the poses of its frame.
+#
+
+PHASE = Scoring.PHASE_FINAL_PLACEMENT_LEFT
+STATIONS = 3
+RATE = 60.0
+DURATION = 1.5
+
+
+class ScoringServerTest(unittest.TestCase):
+
+  def setUp(self):
+    trajectory = generatePhaseTrajectory(PHASE, SCENARIO_CORRECT, frames=int(RATE * DURATION), rate=RATE, seed=0)
+    self.poses = np.stack([trajectory['left'], trajectory['right'], trajectory['hmd']], axis=1)
+    self.server = ScoringServer(('127.0.0.1', 0), workers=2, filterMethod=FILTER_NONE)
+    self.server.start()
+
+  def tearDown(self):
+    self.server.stop()
+
+  def poseFunction(self, t):
+    return self.poses[min(int(t * RATE), len(self.poses) - 1)]
+
+  def test_simulateStations(self):
+    summaries = simulateStations(self.server, self.poseFunction, STATIONS, DURATION, RATE, PHASE, keepResults=True)
+    statistics = self.server.statistics()
+    self.assertEqual(sorted(summaries), list(range(STATIONS)))
+    self.assertEqual(sorted(statistics), list(range(STATIONS)))
+    for stationId, summary in summaries.items():
+      with self.subTest(station=stationId):
+        # every frame is evaluated and answered
+        self.assertGreater(summary['sent'], 0)
+        self.assertEqual(summary['results'], summary['sent'])
+        self.assertEqual(statistics[stationId]['droppedFrames'], 0)
+        self.assertEqual(statistics[stationId]['evaluations'], summary['sent'])
+        self.assertEqual(sorted(entry[0] for entry in summary['resultLog']), list(range(summary['sent'])))
+        # the same results as the checks called directly
+        results = set()
+        for sequence, phase, t, res, message in summary['resultLog']:
+          self.assertEqual(phase, PHASE)
+          left, right, hmd = self.poseFunction(t)
+          expectedRes, expectedMessage = Scoring.evaluatePhase(PHASE, left, right, Scoring.DEFAULT_MARGINS[PHASE])
+          self.assertEqual((res, message), (bool(expectedRes), expectedMessage))
+          results.add(res)
+        # the trajectory gives both results
+        self.assertEqual(results, {False, True})
+
+  def connect(self):
+    sock = socket.create_connection(self.server.address, timeout=2.0)
+    self.addCleanup(sock.close)
+    return sock
+
+  def receiveResult(self, sock):
+    data = b''
+    while len(data) < RESULT_MESSAGE.size:
+      chunk = sock.recv(RESULT_MESSAGE.size - len(data))
+      if not chunk:
+        return None
+      data += chunk
+    return unpackResultMessage(data)
+
+  def test_invalidPhaseIndex(self):
+    # a frame with an unknown phase closes its connection, and the station is still scored
+    left, right, hmd = self.poses[0]
+    message = packPoseMessage(0, 0, PHASE, 0.0, left, right, hmd)
+    POSE_HEADER.pack_into(message, 0, b'FDVP', 0, 0, len(Scoring.PHASES), 0.0)
+    sock = self.connect()
+    sock.sendall(message)
+    self.assertEqual(sock.recv(RESULT_MESSAGE.size), b'')
+    sock = self.connect()
+    sock.sendall(packPoseMessage(0, 1, PHASE, 0.0, left, right, hmd))
+    stationId, sequence, phase, timestamp, res, text = self.receiveResult(sock)
+    self.assertEqual((stationId, sequence, phase), (0, 1, PHASE))
+    self.assertEqual((res, text), Scoring.evaluatePhase(PHASE, left, right, Scoring.DEFAULT_MARGINS[PHASE]))
+
+  def test_stationThatDoesNotRead(self):
+    # a station that never reads its results is disconnected instead of holding a worker.
+    # On a Unix domain socket the results fill the buffers of the station after a few
+    # hundred frames, whatever the state of the other direction.
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    server = ScoringServer(os.path.join(directory, 'scoring'), workers=1, filterMethod=FILTER_NONE)
+    server.start()
+    self.addCleanup(server.stop)
+    left, right, hmd = self.poses[0]
+    stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.addCleanup(stalled.close)
+    stalled.settimeout(2.0)
+    stalled.connect(server.address)
+    message = packPoseMessage(0, 0, PHASE, 0.0, left, right, hmd)
+    with self.assertRaises(OSError):
+      for sequence in range(100000):
+        POSE_HEADER.pack_into(message, 0, b'FDVP', 0, sequence, Scoring.PHASES.index(PHASE), 0.0)
+        stalled.sendall(message)
+    # the only worker is free for the other stations
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.addCleanup(sock.close)
+    sock.settimeout(2.0)
+    sock.connect(server.address)
+    sock.sendall(packPoseMessage(1, 0, PHASE, 0.0, left, right, hmd))
+    self.assertEqual(self.receiveResult(sock)[:2], (1, 0))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import numpy as np
+
+from ForcepsDeliveryVRLib import Scoring
+from ForcepsDeliveryVRLib.TrajectoryGenerator import (
+  generatePhaseTrajectory, PHASE_SCENARIOS, SCENARIO_CORRECT, SCENARIO_ROTATED_BLADES,
+  SCENARIO_MISALIGNED_HANDLES, SCENARIO_TIP_TOO_FAR, SCENARIO_NOT_ROTATED)
+
+#
+# Scoring of synthetic trajectories
+#
+# Each scenario of each phase is generated with fixed seeds. On the labeled frames (the
+# hold after the approach) the check of the phase in Scoring.evaluateAllPhases must give
+# the expected result and message code.
+#
+
+FINAL_PLACEMENT_TOO_FAR = {Scoring.MESSAGE_TOO_FAR_FROM_EYE, Scoring.MESSAGE_TOO_FAR_FROM_CHEEKS}
+
+# message codes of the faulty scenarios, per phase
+EXPECTED_CODES = {
+  (Scoring.PHASE_ARRANGEMENT, SCENARIO_ROTATED_BLADES): {Scoring.MESSAGE_NOT_CLOSED},
+  (Scoring.PHASE_ARRANGEMENT, SCENARIO_MISALIGNED_HANDLES): {Scoring.MESSAGE_NOT_SAME_LEVEL},
+  (Scoring.PHASE_PRESENTATION, SCENARIO_ROTATED_BLADES): {Scoring.MESSAGE_ROTATED},
+  (Scoring.PHASE_INITIAL_PLACEMENT_LEFT, SCENARIO_ROTATED_BLADES): {Scoring.MESSAGE_INCORRECT_ANGLE},
+  (Scoring.PHASE_INITIAL_PLACEMENT_LEFT, SCENARIO_TIP_TOO_FAR): {Scoring.MESSAGE_TIP_TOO_FAR},
+  (Scoring.PHASE_FINAL_PLACEMENT_LEFT, SCENARIO_TIP_TOO_FAR): FINAL_PLACEMENT_TOO_FAR,
+  (Scoring.PHASE_INITIAL_PLACEMENT_RIGHT, SCENARIO_ROTATED_BLADES): {Scoring.MESSAGE_INCORRECT_ANGLE},
+  (Scoring.PHASE_INITIAL_PLACEMENT_RIGHT, SCENARIO_TIP_TOO_FAR): {Scoring.MESSAGE_TIP_TOO_FAR},
+  (Scoring.PHASE_FINAL_PLACEMENT_RIGHT, SCENARIO_TIP_TOO_FAR): FINAL_PLACEMENT_TOO_FAR,
+  (Scoring.PHASE_ROTATION, SCENARIO_NOT_ROTATED): {Scoring.MESSAGE_HEAD_NOT_ROTATED},
+  (Scoring.PHASE_ROTATION, SCENARIO_TIP_TOO_FAR): FINAL_PLACEMENT_TOO_FAR,
+  (Scoring.PHASE_TRACTION, SCENARIO_ROTATED_BLADES): {Scoring.MESSAGE_NOT_ALONG_PELVIC_AXIS},
+  (Scoring.PHASE_TRACTION, SCENARIO_TIP_TOO_FAR): {Scoring.MESSAGE_OFF_PELVIC_AXIS},
+  }
+
+SEEDS = [0, 1, 2]
+FRAMES = 180
+# every FRAME_STEP-th labeled frame is scored per frame
+FRAME_STEP = 5
+
+
+class ScoringTest(unittest.TestCase):
+
+  def setUp(self):
+    Scoring.DEFAULT_PELVIC_AXIS.prepare()
+
+  def scoreTrajectory(self, trajectory):
+    # (res, code) of the labeled frames, (frames, len(PHASES)) arrays
+    frames = np.flatnonzero(trajectory['labeled'])[::FRAME_STEP]
+    results = [Scoring.evaluateAllPhases(trajectory['left'][index], trajectory['right'][index], head=trajectory['head'])
+      for index in frames]
+    return np.array([result[0] for result in results]), np.array([result[1] for result in results])
+
+  def test_everyScenarioHasExpectedCodes(self):
+    for phase in Scoring.PHASES:
+      for scenario in PHASE_SCENARIOS[phase]:
+        if scenario != SCENARIO_CORRECT:
+          self.assertIn((phase, scenario), EXPECTED_CODES)
+
+  def test_correctTrajectories(self):
+    for phase in Scoring.PHASES:
+      index = Scoring.PHASES.index(phase)
+      for seed in SEEDS:
+        with self.subTest(phase=phase, seed=seed):
+          res, code = self.scoreTrajectory(generatePhaseTrajectory(phase, SCENARIO_CORRECT, FRAMES, seed=seed))
+          self.assertTrue(res[:, index].all())
+          self.assertTrue((code[:, index] == Scoring.MESSAGE_CORRECT).all())
+
+  def test_faultyTrajectories(self):
+    for (phase, scenario), expectedCodes in EXPECTED_CODES.items():
+      index = Scoring.PHASES.index(phase)
+      for seed in SEEDS:
+        with self.subTest(phase=phase, scenario=scenario, seed=seed):
+          res, code = self.scoreTrajectory(generatePhaseTrajectory(phase, scenario, FRAMES, seed=seed))
+          self.assertFalse(res[:, index].any())
+          self.assertTrue(set(code[:, index].tolist()) <= expectedCodes,
+            [Scoring.MESSAGES[c] for c in set(code[:, index].tolist()) - expectedCodes])
+
+  def test_resultsMatchCodes(self):
+    trajectory = generatePhaseTrajectory(Scoring.PHASE_ROTATION, SCENARIO_CORRECT, FRAMES, seed=0)
+    res, code = self.scoreTrajectory(trajectory)
+    np.testing.assert_array_equal(res, code == Scoring.MESSAGE_CORRECT)
+
+  def test_batchMatchesPerFrame(self):
+    for phase in Scoring.PHASES:
+      for scenario in PHASE_SCENARIOS[phase]:
+        with self.subTest(phase=phase, scenario=scenario):
+          trajectory = generatePhaseTrajectory(phase, scenario, FRAMES, seed=0)
+          res, code = Scoring.evaluateAllPhasesBatch(trajectory['left'], trajectory['right'], head=trajectory['head'])
+          frames = np.flatnonzero(trajectory['labeled'])[::FRAME_STEP]
+          frameRes, frameCode = self.scoreTrajectory(trajectory)
+          np.testing.assert_array_equal(res[frames], frameRes)
+          np.testing.assert_array_equal(code[frames], frameCode)
+
+  def test_detectManeuver(self):
+    # the rotation of the head requires both blades placed: the rotation is detected
+    trajectory = generatePhaseTrajectory(Scoring.PHASE_ROTATION, SCENARIO_CORRECT, FRAMES, seed=0)
+    res, code = self.scoreTrajectory(trajectory)
+    np.testing.assert_array_equal(Scoring.detectManeuver(res), Scoring.PHASES.index(Scoring.PHASE_ROTATION))
+    self.assertEqual(Scoring.detectManeuver(np.zeros(len(Scoring.PHASES), dtype=bool)), Scoring.MANEUVER_NONE)
+
+
+if __name__ == '__main__':
+  unittest.main()
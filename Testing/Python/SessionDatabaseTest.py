@@ -0,0 +1,114 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from ForcepsDeliveryVRLib.SessionDatabase import SessionDatabase
+
+#
+# Trainee session database
+#
+# Sessions and phases are written through the asynchronous queue, flushed, and read back
+# through the summary queries.
+#
+
+DAY = 86400.0
+
+
+class SessionDatabaseTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.database = SessionDatabase(os.path.join(self.directory, 'sessions', 'sessions.db'))
+
+  def tearDown(self):
+    self.database.close()
+    shutil.rmtree(self.directory)
+
+  def addPhase(self, sessionId, trainee, phase, startTime, duration, result, **kwargs):
+    phaseId = self.database.startPhase(sessionId, trainee, phase, startTime)
+    self.database.endPhase(phaseId, startTime, result, endTime=startTime + duration, **kwargs)
+    return phaseId
+
+  def test_roundTrip(self):
+    sessionId = self.database.startSession('alice', 0.0)
+    phaseId = self.addPhase(sessionId, 'alice', 'arrangement', 10.0, 5.0, True, evaluations=20, correctEvaluations=15,
+      metrics={'pathLength': 120.5, 'jerk': None}, trajectoryPath='alice/arrangement.fdvt')
+    self.addPhase(sessionId, 'alice', 'arrangement', 20.0, 15.0, False)
+    self.addPhase(sessionId, 'alice', 'presentation', 40.0, 8.0, True)
+    self.database.endSession(sessionId, 50.0)
+    self.assertTrue(self.database.flush(5.0))
+    self.assertEqual(self.database.trainees(), ['alice'])
+    summary = {row['phase']: row for row in self.database.traineeSummary('alice')}
+    self.assertEqual(summary['arrangement']['attempts'], 2)
+    self.assertAlmostEqual(summary['arrangement']['passRate'], 0.5)
+    self.assertAlmostEqual(summary['arrangement']['meanDuration'], 10.0)
+    self.assertEqual(summary['presentation']['attempts'], 1)
+    self.assertEqual(self.database.phaseMetrics(phaseId), {'pathLength': 120.5, 'jerk': None})
+    self.assertEqual(self.database.phaseTrajectories(phaseId), ['alice/arrangement.fdvt'])
+    trajectories = self.database.traineeTrajectories('alice')
+    self.assertEqual([(row['phaseId'], row['result'], row['path']) for row in trajectories],
+      [(phaseId, 1, 'alice/arrangement.fdvt')])
+
+  def test_cohortAndProgress(self):
+    for index, trainee in enumerate(['alice', 'bob', 'carol']):
+      sessionId = self.database.startSession(trainee, 0.0)
+      for day in range(3):
+        # one more passing attempt out of three each day
+        for attempt in range(3):
+          self.addPhase(sessionId, trainee, 'traction', day * DAY + attempt * 60.0, 30.0 + index, attempt <= day)
+    # a phase that is not completed is not counted
+    self.database.startPhase(sessionId, 'carol', 'traction', 4 * DAY)
+    self.assertTrue(self.database.flush(5.0))
+    cohort, = self.database.cohortSummary('traction')
+    self.assertEqual((cohort['trainees'], cohort['attempts']), (3, 27))
+    self.assertAlmostEqual(cohort['passRate'], 2.0 / 3)
+    self.assertAlmostEqual(cohort['meanDuration'], 31.0)
+    recent, = self.database.cohortSummary('traction', since=2 * DAY)
+    self.assertEqual(recent['attempts'], 9)
+    self.assertAlmostEqual(recent['passRate'], 1.0)
+    progress = self.database.traineeProgress('bob', 'traction')
+    self.assertEqual([row['binStart'] for row in progress], [0.0, DAY, 2 * DAY])
+    for day, row in enumerate(progress):
+      self.assertEqual(row['attempts'], 3)
+      self.assertAlmostEqual(row['passRate'], (day + 1) / 3.0)
+
+  def test_failingWriteKeepsTheBatch(self):
+    # a statement that fails is undone alone, the other writes of its batch are committed
+    sessionId = self.database.startSession('alice', 0.0)
+    phaseId = self.database.startPhase(sessionId, 'alice', 'rotation', 0.0)
+    # the path of a trajectory cannot be NULL
+    self.database.addTrajectory(phaseId, None)
+    self.database.endPhase(phaseId, 0.0, True, endTime=12.0)
+    self.assertTrue(self.database.flush(5.0))
+    summary, = self.database.traineeSummary('alice', 'rotation')
+    self.assertEqual(summary['attempts'], 1)
+    self.assertAlmostEqual(summary['meanDuration'], 12.0)
+    self.assertEqual(self.database.phaseTrajectories(phaseId), [])
+
+  def test_idsAreAllocatedBySQLite(self):
+    # two databases on the same file get distinct ids
+    other = SessionDatabase(self.database.path)
+    try:
+      ids = [self.database.startSession('alice'), other.startSession('bob'), self.database.startSession('carol')]
+    finally:
+      other.close()
+    self.assertEqual(len(set(ids)), 3)
+
+  def test_summaryQueriesUseCoveringIndexes(self):
+    connection = sqlite3.connect(self.database.path)
+    try:
+      for sql in [
+        'SELECT phase, COUNT(*), AVG(result), AVG(duration) FROM phases'
+        ' WHERE trainee = ? AND endTime IS NOT NULL AND phase = ? GROUP BY phase',
+        'SELECT phase, COUNT(DISTINCT trainee), COUNT(*), AVG(result), AVG(duration) FROM phases'
+        ' WHERE startTime >= ? AND endTime IS NOT NULL AND phase = ? GROUP BY phase']:
+        plan = ' '.join(row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + sql, ('alice', 'traction')))
+        self.assertIn('COVERING INDEX', plan)
+    finally:
+      connection.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
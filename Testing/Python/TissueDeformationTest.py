@@ -0,0 +1,124 @@
+import unittest
+import numpy as np
+
+from ForcepsDeliveryVRLib.TissueDeformation import TissueDeformation, SpatialGrid, meshEdges, BLADE_RADIUS
+
+#
+# Soft tissue deformation around the blades
+#
+# The tissue is a flat square of the plane z = 0, triangulated on a 2 mm grid, and a blade
+# goes through it near its center.
+#
+
+SIZE = 61
+SPACING = 2.0
+# blade axis across the plane, slightly off a vertex
+BLADE = np.array([[[0.5, 0.3, -30.0], [0.5, 0.3, 30.0]]])
+AWAY = BLADE + [0.0, 0.0, 500.0]
+
+
+def planeMesh(size=SIZE, spacing=SPACING):
+  # points (size * size, 3) centered on the origin, and triangles (T, 3)
+  x, y = np.meshgrid(np.arange(size), np.arange(size), indexing='ij')
+  points = np.stack([x.ravel(), y.ravel(), np.zeros(x.size)], axis=1) * spacing
+  points[:, :2] -= (size - 1) * spacing / 2
+  corners = (x[:-1, :-1] * size + y[:-1, :-1]).ravel()
+  triangles = np.concatenate([
+    np.stack([corners, corners + size, corners + size + 1], axis=1),
+    np.stack([corners, corners + size + 1, corners + 1], axis=1)])
+  return points, triangles
+
+
+def bladeDistances(points, segment):
+  # distances of points (N, 3) to the segment (2, 3)
+  direction = segment[1] - segment[0]
+  t = np.clip((points - segment[0]).dot(direction) / direction.dot(direction), 0.0, 1.0)
+  return np.linalg.norm(points - segment[0] - t[:, np.newaxis] * direction, axis=1)
+
+
+class TissueDeformationTest(unittest.TestCase):
+
+  def setUp(self):
+    self.points, triangles = planeMesh()
+    self.edges = meshEdges(triangles)
+    self.deformation = TissueDeformation(self.points, self.edges)
+
+  def test_meshEdges(self):
+    # two triangles sharing an edge, in both orientations
+    edges = meshEdges(np.array([[0, 1, 2], [2, 1, 3]]))
+    np.testing.assert_array_equal(edges, [[0, 1], [0, 2], [1, 2], [1, 3], [2, 3]])
+    # in the plane: the grid edges and one diagonal per square
+    self.assertEqual(len(self.edges), 2 * SIZE * (SIZE - 1) + (SIZE - 1) ** 2)
+
+  def test_spatialGridQuery(self):
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-50.0, 50.0, (2000, 3))
+    cellSize = 7.0
+    grid = SpatialGrid(points, cellSize)
+    for index in range(50):
+      lower = rng.uniform(-70.0, 50.0, 3)
+      upper = lower + rng.uniform(0.0, 40.0, 3)
+      found = grid.query(lower, upper)
+      self.assertEqual(len(found), len(np.unique(found)))
+      # every point of the box, and only points of the cells that overlap it
+      inBox = np.flatnonzero(np.all((points >= lower) & (points <= upper), axis=1))
+      self.assertTrue(np.all(np.isin(inBox, found)))
+      self.assertTrue(np.all((points[found] >= lower - cellSize) & (points[found] <= upper + cellSize)))
+    self.assertEqual(len(grid.query(np.full(3, 100.0), np.full(3, 120.0))), 0)
+
+  def test_bladePushesTheTissue(self):
+    self.assertTrue(self.deformation.update(BLADE))
+    # no vertex inside the blade, the ones far from it at rest
+    distances = bladeDistances(self.points, BLADE[0])
+    self.assertGreaterEqual(distances.min(), BLADE_RADIUS - 1e-9)
+    restDistances = bladeDistances(self.deformation.restPoints, BLADE[0])
+    far = restDistances > self.deformation.radius
+    np.testing.assert_array_equal(self.points[far], self.deformation.restPoints[far])
+    # the vertices that were inside the blade moved, and are displaced
+    inside = np.flatnonzero(restDistances < BLADE_RADIUS)
+    self.assertTrue(np.all(np.isin(inside, self.deformation.displaced)))
+    # the points array is updated in place
+    self.assertIs(self.deformation.points, self.points)
+
+  def test_backToRestWhenTheBladeLeaves(self):
+    self.deformation.update(BLADE)
+    for frame in range(100):
+      self.deformation.update(AWAY)
+      if not len(self.deformation.displaced):
+        break
+    self.assertEqual(len(self.deformation.displaced), 0)
+    np.testing.assert_array_equal(self.points, self.deformation.restPoints)
+    self.assertFalse(self.deformation.update(AWAY))
+
+  def test_regionIsCapped(self):
+    deformation = TissueDeformation(self.points, self.edges, maxVertices=50)
+    deformation.update(BLADE)
+    self.assertLessEqual(len(deformation.displaced), 50)
+    moved = np.flatnonzero(np.any(self.points != deformation.restPoints, axis=1))
+    self.assertLessEqual(len(moved), 50)
+    # the region is made of the vertices closest to the blade
+    restDistances = bladeDistances(deformation.restPoints, BLADE[0])
+    self.assertLess(restDistances[moved].max(), np.sort(restDistances)[50] + 1e-9)
+
+  def test_reset(self):
+    self.deformation.update(BLADE)
+    self.deformation.reset()
+    self.assertEqual(len(self.deformation.displaced), 0)
+    np.testing.assert_array_equal(self.points, self.deformation.restPoints)
+
+  def test_stateRoundTrip(self):
+    self.deformation.update(BLADE)
+    state = self.deformation.getState()
+    deformed = self.points.copy()
+    # the state is a copy, not changed by the next updates
+    self.deformation.update(BLADE + [5.0, 0.0, 0.0])
+    self.deformation.setState(state)
+    np.testing.assert_array_equal(self.points, deformed)
+    np.testing.assert_array_equal(self.deformation.displaced, state[0])
+    self.deformation.setState(None)
+    self.assertEqual(len(self.deformation.displaced), 0)
+    np.testing.assert_array_equal(self.points, self.deformation.restPoints)
+
+
+if __name__ == '__main__':
+  unittest.main()
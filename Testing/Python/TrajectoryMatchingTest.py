@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from ForcepsDeliveryVRLib.TrajectoryFile import writeTrajectory, POSES_PER_FRAME, POSE_LEFT, POSE_RIGHT
+from ForcepsDeliveryVRLib.TrajectoryMatching import StreamingDTW, ExpertMatcher, trajectoryFeatures
+
+#
+# Streaming comparison with expert trajectories
+#
+# StreamingDTW is compared with the banded dynamic time warping computed on the whole
+# cost matrix; ExpertMatcher with expert motions replayed as they were recorded,
+# slowed down, and with another motion.
+#
+
+RATE = 30.0
+
+
+def bruteForceDTW(reference, query, band):
+  # accumulated cost (N, M) of the open-end DTW restricted to |i - j| <= band (inf outside)
+  accumulated = np.full((len(query), len(reference)), np.inf)
+  for i in range(len(query)):
+    for j in range(max(0, i - band), min(len(reference), i + band + 1)):
+      cost = np.linalg.norm(reference[j] - query[i])
+      if i == 0 and j == 0:
+        accumulated[i, j] = cost
+        continue
+      candidates = []
+      if i > 0:
+        candidates.append(accumulated[i - 1, j])
+        if j > 0:
+          candidates.append(accumulated[i - 1, j - 1])
+      if j > 0:
+        candidates.append(accumulated[i, j - 1])
+      accumulated[i, j] = cost + min(candidates)
+  return accumulated
+
+
+def expertPoses(duration, rate=RATE, speed=1.0):
+  # (N, 2, 4, 4) poses of both forceps along a smooth path, traversed at the given speed
+  t = np.arange(int(duration * rate)) / rate * speed
+  poses = np.tile(np.eye(4), (len(t), 2, 1, 1))
+  poses[:, 0, :3, 3] = np.stack([40.0 * np.sin(t), 20.0 * t, 10.0 * np.cos(2 * t)], axis=1)
+  poses[:, 1, :3, 3] = poses[:, 0, :3, 3] + [-10.0, 0.0, 0.0]
+  return poses
+
+
+class TrajectoryMatchingTest(unittest.TestCase):
+
+  def test_streamingMatchesBruteForce(self):
+    rng = np.random.default_rng(0)
+    for length, queryLength, band in [(40, 40, 5), (30, 50, 4), (50, 25, 8), (20, 20, 0)]:
+      with self.subTest(length=length, queryLength=queryLength, band=band):
+        reference = np.cumsum(rng.normal(size=(length, 3)), axis=0)
+        query = np.cumsum(rng.normal(size=(queryLength, 3)), axis=0)
+        accumulated = bruteForceDTW(reference, query, band)
+        dtw = StreamingDTW(reference, band)
+        for i in range(queryLength):
+          if dtw.finished:
+            # the band is past the end of the reference: no cell of this row is in it
+            self.assertTrue(np.isinf(accumulated[i]).all())
+            continue
+          distance = dtw.update(query[i])
+          normalized = accumulated[i] / (i + np.arange(length) + 2)
+          self.assertAlmostEqual(distance, normalized.min())
+          self.assertEqual(dtw.referenceIndex, int(np.argmin(normalized)))
+
+  def test_reset(self):
+    reference = np.arange(30.0).reshape(10, 3)
+    dtw = StreamingDTW(reference, 3)
+    for feature in reference[::-1]:
+      dtw.update(feature)
+    dtw.reset()
+    for feature in reference:
+      distance = dtw.update(feature)
+    self.assertEqual(distance, 0.0)
+    self.assertEqual(dtw.referenceIndex, len(reference) - 1)
+
+  def test_expertMatcher(self):
+    expert = trajectoryFeatures(expertPoses(4.0), (0.0, 0.0, 0.0))
+    other = expert + [0.0, 0.0, 30.0, 0.0, 0.0, 30.0]
+    matcher = ExpertMatcher([other, expert])
+    self.assertEqual(len(matcher), 2)
+    # the trainee repeats the expert motion at 90 Hz, 30 % slower
+    poses = expertPoses(4.0 / 0.7, rate=90.0, speed=0.7)
+    for frame, (leftPose, rightPose) in enumerate(poses):
+      matcher.update(frame / 90.0, leftPose, rightPose)
+    self.assertIs(matcher.bestMatcher, matcher.matchers[1])
+    self.assertLess(matcher.distance, 1.0)
+    self.assertGreater(matcher.similarity, 0.9)
+    self.assertGreater(matcher.progress, 0.95)
+    self.assertGreater(matcher.matchers[0].distance, 10 * matcher.distance)
+
+  def test_lateFramesStandForTheSkippedSamples(self):
+    expert = trajectoryFeatures(expertPoses(2.0), (0.0, 0.0, 0.0))
+    matcher = ExpertMatcher([expert])
+    poses = expertPoses(2.0)
+    self.assertTrue(matcher.update(0.0, poses[0, 0], poses[0, 1]))
+    self.assertFalse(matcher.update(0.5 / RATE, poses[0, 0], poses[0, 1]))
+    # a frame 0.2 s late adds the 6 samples it covers
+    self.assertTrue(matcher.update(6 / RATE, poses[6, 0], poses[6, 1]))
+    self.assertEqual(matcher.sampleCount, 7)
+
+  def test_fromRecordings(self):
+    directory = tempfile.mkdtemp()
+    try:
+      poses = np.tile(np.eye(4), (int(3 * RATE), POSES_PER_FRAME, 1, 1))
+      poses[:, [POSE_LEFT, POSE_RIGHT]] = expertPoses(3.0)
+      timestamps = 100.0 + np.arange(len(poses)) / RATE
+      paths = [os.path.join(directory, 'expert.fdvt'), os.path.join(directory, 'short.fdvt')]
+      writeTrajectory(paths[0], timestamps, poses)
+      # a recording with less than two frames is skipped
+      writeTrajectory(paths[1], timestamps[:1], poses[:1])
+      matcher = ExpertMatcher.fromRecordings(paths)
+      self.assertEqual(len(matcher), 1)
+      np.testing.assert_allclose(matcher.matchers[0].reference,
+        trajectoryFeatures(poses[:, [POSE_LEFT, POSE_RIGHT]], (0.0, 0.0, 0.0)), atol=1e-9)
+    finally:
+      shutil.rmtree(directory)
+
+  def test_noReferences(self):
+    matcher = ExpertMatcher([])
+    self.assertFalse(matcher.update(0.0, np.eye(4), np.eye(4)))
+    self.assertEqual(matcher.distance, np.inf)
+    self.assertEqual(matcher.progress, 0.0)
+
+
+if __name__ == '__main__':
+  unittest.main()